@@ -1,9 +1,8 @@
-import json
+import time
 import asyncio
 import logging
-import re
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Awaitable
 
 import openai
 import anthropic
@@ -11,12 +10,27 @@ from zep_cloud.client import AsyncZep
 from zep_cloud.types import Message
 
 from .config import (
-    INSTRUCTION_FILE, OPENAI_API_KEY, ANTHROPIC_API_KEY, OPENAI_MODEL,
+    OPENAI_API_KEY, ANTHROPIC_API_KEY, OPENAI_MODEL,
     ANTHROPIC_MODEL, ZEP_API_KEY, VOICE_ENABLED, TELEGRAM_BOT_TOKEN,
-    SEARCH_LIMIT
+    SEARCH_LIMIT, CONTEXT_BUDGET_SECONDS, KB_SEARCH_TIMEOUT, ZEP_FETCH_TIMEOUT,
+    OPENAI_EMBEDDING_MODEL, ANSWER_CACHE_ENABLED, ANSWER_CACHE_MIN_CHARS, ANSWER_CACHE_EMBED_TIMEOUT,
+    KB_CONTEXT_MAX_TOKENS, SINGLE_FLIGHT_SCOPE, LLM_PROVIDER_ORDER, LLM_REQUEST_TIMEOUT,
+    OPENAI_BASE_URL, ANTHROPIC_BASE_URL, ZEP_BASE_URL
 )
 from .validators import validate_response
-from .services.message_logger import log_message
+from .services.post_processing import get_post_processor, PostJob
+from .services.session_memory import get_session_memory_cache, SessionMemoryEntry
+from .services.local_session_store import get_local_session_store
+from .services.answer_cache import get_answer_cache
+from .services.embedding_cache import get_embedding_cache
+from .services.kb_version import get_kb_version
+from .services.query_features import analyze_query
+from .services.single_flight import SingleFlight, normalize_query, fingerprint
+from .services.llm_router import LLMRouter, OpenAIProvider, AnthropicProvider
+from .services.prompt_builder import build_messages, messages_length
+from .services.instruction_store import get_instruction_store
+from .monitoring.prompt_cache_monitor import get_prompt_cache_metrics
+from .monitoring.tracing import span, set_trace_message_id, current_trace, start_trace, finish_trace
 
 # Опциональный импорт голосового сервиса
 try:
@@ -49,7 +63,7 @@ class TextilProAgent:
             print(f"🔍 Префикс: {OPENAI_API_KEY[:15]}...")
             try:
                 print("🔄 Пытаемся создать AsyncOpenAI клиент...")
-                self.openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+                self.openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
                 print("✅ OpenAI клиент инициализирован")
                 logger.info("✅ OpenAI клиент инициализирован успешно")
             except Exception as e:
@@ -66,7 +80,7 @@ class TextilProAgent:
         # Инициализируем Anthropic клиент если API ключ доступен
         if ANTHROPIC_API_KEY:
             try:
-                self.anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+                self.anthropic_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL)
                 print("✅ Anthropic клиент инициализирован")
             except Exception as e:
                 print(f"❌ Ошибка инициализации Anthropic: {e}")
@@ -78,11 +92,22 @@ class TextilProAgent:
         # Проверяем что хотя бы один LLM доступен
         if not self.openai_client and not self.anthropic_client:
             print("⚠️ Ни один LLM не доступен, используется упрощенный режим")
+
+        # Роутер LLM провайдеров в порядке приоритета LLM_PROVIDER_ORDER
+        available_providers = {}
+        if self.openai_client:
+            available_providers["openai"] = OpenAIProvider(self.openai_client, OPENAI_MODEL)
+        if self.anthropic_client:
+            available_providers["anthropic"] = AnthropicProvider(self.anthropic_client, ANTHROPIC_MODEL)
+        self.llm_router = LLMRouter([
+            available_providers[name] for name in LLM_PROVIDER_ORDER if name in available_providers
+        ])
+        print(f"🔀 LLM роутер: {[p.name for p in self.llm_router.providers]}")
         
         # Инициализируем Zep клиент если API ключ доступен
         if ZEP_API_KEY and ZEP_API_KEY != "test_key":
             try:
-                self.zep_client = AsyncZep(api_key=ZEP_API_KEY)
+                self.zep_client = AsyncZep(api_key=ZEP_API_KEY, base_url=ZEP_BASE_URL)
                 print(f"✅ Zep клиент инициализирован с ключом длиной {len(ZEP_API_KEY)} символов")
                 print(f"🔑 Zep API Key начинается с: {ZEP_API_KEY[:8]}...")
             except Exception as e:
@@ -114,41 +139,27 @@ class TextilProAgent:
             elif not TELEGRAM_BOT_TOKEN:
                 print("⚠️ TELEGRAM_BOT_TOKEN отсутствует - голосовые сообщения недоступны")
         
-        self.instruction = self._load_instruction()
-        self.user_sessions = {}  # Резервное хранение сессий в памяти
-    
-    def _load_instruction(self) -> Dict[str, Any]:
-        try:
-            with open(INSTRUCTION_FILE, 'r', encoding='utf-8') as f:
-                instruction = json.load(f)
-                logger.info(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE}")
-                logger.info(f"📝 Последнее обновление: {instruction.get('last_updated', 'неизвестно')}")
-                logger.info(f"📏 Длина системной инструкции: {len(instruction.get('system_instruction', ''))}")
-                print(f"✅ Инструкции успешно загружены из {INSTRUCTION_FILE}")
-                print(f"📝 Последнее обновление: {instruction.get('last_updated', 'неизвестно')}")
-                return instruction
-        except FileNotFoundError:
-            logger.warning(f"⚠️ ВНИМАНИЕ: Файл {INSTRUCTION_FILE} не найден! Используется базовая инструкция.")
-            print(f"⚠️ ВНИМАНИЕ: Файл {INSTRUCTION_FILE} не найден! Используется базовая инструкция.")
-            return {
-                "system_instruction": "Вы - помощник службы поддержки Textil PRO.",
-                "welcome_message": "Добро пожаловать! Чем могу помочь?",
-                "last_updated": datetime.now().isoformat()
-            }
-        except Exception as e:
-            print(f"❌ Ошибка при загрузке инструкций: {e}")
-            return {
-                "system_instruction": "Вы - помощник службы поддержки Textil PRO.",
-                "welcome_message": "Добро пожаловать! Чем могу помочь?",
-                "last_updated": datetime.now().isoformat()
-            }
+        self.instruction_store = get_instruction_store()  # Инструкция с hot reload по mtime
+        self.local_sessions = get_local_session_store()  # Резервное хранение сессий (LRU + SQLite)
+        self.session_memory = get_session_memory_cache()  # Кэш памяти Zep по сессиям
+        self.answer_cache = get_answer_cache()  # Semantic кэш готовых ответов
+        # Single-flight: одинаковые одновременные запросы ждут один результат
+        self.retrieval_flight = SingleFlight("retrieval")
+        self.llm_flight = SingleFlight("llm")
+        # Лог в MySQL, запись в Zep и валидация выполняются после отправки ответа
+        self.post_processor = get_post_processor()
     
+    @property
+    def instruction(self) -> Dict[str, Any]:
+        """Текущая инструкция (снимок из InstructionStore, перечитывается при изменении файла)"""
+        return self.instruction_store.get().data
+
     def reload_instruction(self):
         logger.info("🔄 Перезагрузка инструкций...")
         print("🔄 Перезагрузка инструкций...")
-        old_updated = self.instruction.get('last_updated', 'неизвестно')
-        self.instruction = self._load_instruction()
-        new_updated = self.instruction.get('last_updated', 'неизвестно')
+        old, new = self.instruction_store.reload()
+        old_updated = old.last_updated
+        new_updated = new.last_updated
         
         if old_updated != new_updated:
             logger.info(f"✅ Инструкции обновлены: {old_updated} -> {new_updated}")
@@ -156,35 +167,7 @@ class TextilProAgent:
         else:
             logger.info("📝 Инструкции перезагружены (без изменений)")
             print("📝 Инструкции перезагружены (без изменений)")
-
-    def _remove_emojis(self, text: str) -> str:
-        """
-        Удаляет эмодзи из текста для улучшения векторного поиска
-
-        Проблема: Эмодзи могут искажать semantic similarity в embeddings,
-        особенно в старых моделях (all-MiniLM-L6-v2).
-
-        Args:
-            text: Исходный текст с эмодзи
-
-        Returns:
-            str: Текст без эмодзи
-        """
-        # Паттерн для эмодзи (Unicode ranges)
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-            "\U00002702-\U000027B0"  # dingbats
-            "\U000024C2-\U0001F251"  # enclosed characters
-            "\U0001F900-\U0001F9FF"  # supplemental symbols
-            "\U0001FA00-\U0001FA6F"  # extended symbols
-            "]+",
-            flags=re.UNICODE
-        )
-        return emoji_pattern.sub('', text).strip()
+        return old, new
 
     async def search_knowledge_base(self, query: str, limit: int = 5) -> tuple:
         """
@@ -202,7 +185,7 @@ class TextilProAgent:
 
         # Убираем эмодзи из запроса для улучшения векторного поиска
         original_query = query
-        cleaned_query = self._remove_emojis(query)
+        cleaned_query = analyze_query(query).cleaned
 
         if cleaned_query != original_query:
             logger.info(f"🔧 Убрали эмодзи из запроса для поиска")
@@ -250,7 +233,7 @@ class TextilProAgent:
                     # Форматируем контекст для LLM (увеличен лимит для детальных ответов)
                     context = knowledge_service.format_context_for_llm(
                         results=search_results,
-                        max_length=15000  # Увеличено с 3000 для ~20 results × 750 chars
+                        max_tokens=KB_CONTEXT_MAX_TOKENS  # Бюджет в токенах вместо 15000 символов
                     )
 
                     # ДИАГНОСТИЧЕСКОЕ ЛОГИРОВАНИЕ
@@ -276,6 +259,90 @@ class TextilProAgent:
         logger.info("📭 База знаний недоступна или не нашла релевантной информации")
         return "", [], []
     
+    async def _run_context_branch(self, name: str, coro, timeout: float, default):
+        """
+        Выполняет одну ветку сбора контекста с собственным deadline
+
+        При превышении deadline или ошибке возвращает default,
+        чтобы промпт собирался из того, что успело завершиться.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            with span(name):
+                result = await asyncio.wait_for(coro, timeout=timeout)
+            logger.info(f"⏱️ Контекст [{name}]: {(loop.time() - started) * 1000:.0f}ms")
+            return result
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ Контекст [{name}]: deadline {timeout:.1f}s превышен, продолжаем без него")
+            return default
+        except Exception as e:
+            logger.warning(f"⚠️ Контекст [{name}]: ошибка {type(e).__name__}: {e}, продолжаем без него")
+            return default
+
+    async def _coalesce(self, flight: SingleFlight, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить fn через single-flight (если не отключено SINGLE_FLIGHT_SCOPE=off)"""
+        if SINGLE_FLIGHT_SCOPE == "off":
+            return await fn()
+        return await flight.do(key, fn)
+
+    def _llm_flight_key(self, user_message: str, session_id: str, messages: list) -> tuple:
+        """
+        Ключ single-flight для LLM запроса
+
+        (нормализованный запрос, scope, версия инструкции, хэш контекста).
+        Scope "session" - ответ делится только внутри сессии. Scope "global" -
+        между пользователями, но лишь при полностью совпадающем контексте
+        (история Zep входит в messages, поэтому ответы, зависящие от сессии, не смешиваются).
+        """
+        scope = session_id if SINGLE_FLIGHT_SCOPE == "session" else "global"
+        return (
+            normalize_query(user_message),
+            scope,
+            str(self.instruction.get("last_updated", "")),
+            fingerprint(messages[:-1])
+        )
+
+    async def gather_context(self, user_message: str, session_id: str) -> Dict[str, Any]:
+        """
+        Параллельный сбор контекста перед LLM запросом
+
+        Поиск по базе знаний и загрузка памяти Zep (контекст + история одним запросом)
+        запускаются одновременно.
+        Время до старта LLM = самая медленная ветка, но не больше CONTEXT_BUDGET_SECONDS.
+
+        Returns:
+            dict: {"knowledge": (context, sources, results), "zep_context": str, "zep_history": str}
+        """
+        kb_timeout = min(KB_SEARCH_TIMEOUT, CONTEXT_BUDGET_SECONDS)
+        zep_timeout = min(ZEP_FETCH_TIMEOUT, CONTEXT_BUDGET_SECONDS)
+
+        knowledge, (zep_context, zep_history) = await asyncio.gather(
+            self._run_context_branch(
+                "kb_search",
+                # Поиск не зависит от сессии - объединяем одинаковые запросы всех пользователей
+                self._coalesce(
+                    self.retrieval_flight,
+                    (normalize_query(user_message), SEARCH_LIMIT, get_kb_version()),
+                    lambda: self.search_knowledge_base(user_message, limit=SEARCH_LIMIT)
+                ),
+                kb_timeout,
+                ("", [], [])
+            ),
+            self._run_context_branch(
+                "zep_fetch",
+                self.get_zep_memory(session_id),
+                zep_timeout,
+                ("", "")
+            ),
+        )
+
+        return {
+            "knowledge": knowledge,
+            "zep_context": zep_context,
+            "zep_history": zep_history
+        }
+
     async def add_to_zep_memory(self, session_id: str, user_message: str, bot_response: str, user_name: str = None):
         """Добавляет сообщения в Zep Memory с именами пользователей"""
         if not self.zep_client:
@@ -284,34 +351,10 @@ class TextilProAgent:
             return False
 
         try:
-            # === ZEP MESSAGE LIMIT: Обрезаем сообщения до 2500 символов ===
-            MAX_ZEP_MESSAGE_LENGTH = 2500
-
-            if len(user_message) > MAX_ZEP_MESSAGE_LENGTH:
-                logger.warning(f"⚠️ User message exceeds Zep limit ({len(user_message)} > {MAX_ZEP_MESSAGE_LENGTH}), truncating...")
-                user_message = user_message[:MAX_ZEP_MESSAGE_LENGTH] + "\n[...обрезано для Zep]"
-
-            if len(bot_response) > MAX_ZEP_MESSAGE_LENGTH:
-                logger.warning(f"⚠️ Bot response exceeds Zep limit ({len(bot_response)} > {MAX_ZEP_MESSAGE_LENGTH}), truncating...")
-                bot_response = bot_response[:MAX_ZEP_MESSAGE_LENGTH] + "\n[...обрезано для Zep]"
-
-            # Используем имя пользователя или ID для роли
-            user_role = user_name if user_name else f"User_{session_id.split('_')[-1][:6]}"
-
-            messages = [
-                Message(
-                    role=user_role,  # Имя пользователя вместо generic "user"
-                    role_type="user",
-                    content=user_message
-                ),
-                Message(
-                    role="Анастасия",  # Имя бота-консультанта
-                    role_type="assistant",
-                    content=bot_response
-                )
-            ]
-            
+            messages = self._build_zep_messages(session_id, user_message, bot_response, user_name)
             await self.zep_client.memory.add(session_id=session_id, messages=messages)
+            # Write-through: следующий ход получит историю из кэша без round-trip
+            self.session_memory.append_messages(session_id, messages)
             print(f"✅ Сообщения добавлены в Zep Cloud для сессии {session_id}")
             print(f"   📝 User: {user_message[:50]}...")
             print(f"   🤖 Bot: {bot_response[:50]}...")
@@ -322,425 +365,714 @@ class TextilProAgent:
             # Fallback: добавляем в локальную память
             self.add_to_local_session(session_id, user_message, bot_response)
             return False
+
+    def _build_zep_messages(self, session_id: str, user_message: str, bot_response: str, user_name: str = None) -> list:
+        """Пара сообщений хода для Zep (с обрезкой до лимита Zep)"""
+        # === ZEP MESSAGE LIMIT: Обрезаем сообщения до 2500 символов ===
+        MAX_ZEP_MESSAGE_LENGTH = 2500
+
+        if len(user_message) > MAX_ZEP_MESSAGE_LENGTH:
+            logger.warning(f"⚠️ User message exceeds Zep limit ({len(user_message)} > {MAX_ZEP_MESSAGE_LENGTH}), truncating...")
+            user_message = user_message[:MAX_ZEP_MESSAGE_LENGTH] + "\n[...обрезано для Zep]"
+
+        if len(bot_response) > MAX_ZEP_MESSAGE_LENGTH:
+            logger.warning(f"⚠️ Bot response exceeds Zep limit ({len(bot_response)} > {MAX_ZEP_MESSAGE_LENGTH}), truncating...")
+            bot_response = bot_response[:MAX_ZEP_MESSAGE_LENGTH] + "\n[...обрезано для Zep]"
+
+        # Используем имя пользователя или ID для роли
+        user_role = user_name if user_name else f"User_{session_id.split('_')[-1][:6]}"
+
+        return [
+            Message(
+                role=user_role,  # Имя пользователя вместо generic "user"
+                role_type="user",
+                content=user_message
+            ),
+            Message(
+                role="Анастасия",  # Имя бота-консультанта
+                role_type="assistant",
+                content=bot_response
+            )
+        ]
     
+    async def _fetch_zep_memory(self, session_id: str) -> SessionMemoryEntry:
+        """Один запрос memory.get() к Zep → запись для кэша сессии"""
+        memory = await self.zep_client.memory.get(session_id=session_id)
+        return SessionMemoryEntry(
+            context=memory.context if memory.context else "",
+            messages=list(memory.messages or [])
+        )
+
+    async def _get_session_memory(self, session_id: str) -> SessionMemoryEntry:
+        """Память сессии из кэша или одним запросом к Zep"""
+        return await self.session_memory.get_or_fetch(
+            session_id,
+            lambda: self._fetch_zep_memory(session_id)
+        )
+
+    async def get_zep_memory(self, session_id: str, limit: int = 6) -> tuple:
+        """
+        Получает контекст и последние сообщения из Zep Memory за один запрос
+
+        Returns:
+            tuple: (zep_context: str, zep_history: str)
+        """
+        if not self.zep_client:
+            print(f"⚠️ Zep не доступен, используем локальную историю для {session_id}")
+            return "", await self.get_local_session_history(session_id)
+
+        try:
+            entry = await self._get_session_memory(session_id)
+            print(f"✅ Получена память Zep для сессии {session_id}, контекст: {len(entry.context)}, сообщений: {len(entry.messages)}")
+            return entry.context, entry.format_recent(limit)
+
+        except Exception as e:
+            print(f"❌ Ошибка при получении памяти из Zep: {type(e).__name__}: {e}")
+            return "", await self.get_local_session_history(session_id)
+
     async def get_zep_memory_context(self, session_id: str) -> str:
         """Получает контекст из Zep Memory"""
         if not self.zep_client:
             print(f"⚠️ Zep не доступен, используем локальную историю для {session_id}")
-            return self.get_local_session_history(session_id)
+            return await self.get_local_session_history(session_id)
             
         try:
-            memory = await self.zep_client.memory.get(session_id=session_id)
-            context = memory.context if memory.context else ""
+            entry = await self._get_session_memory(session_id)
+            context = entry.context
             print(f"✅ Получен контекст из Zep для сессии {session_id}, длина: {len(context)}")
             return context
             
         except Exception as e:
             print(f"❌ Ошибка при получении контекста из Zep: {type(e).__name__}: {e}")
-            return self.get_local_session_history(session_id)
+            return await self.get_local_session_history(session_id)
     
     async def get_zep_recent_messages(self, session_id: str, limit: int = 6) -> str:
         """Получает последние сообщения из Zep Memory"""
         try:
-            memory = await self.zep_client.memory.get(session_id=session_id)
-            if not memory.messages:
+            entry = await self._get_session_memory(session_id)
+            if not entry.messages:
                 return ""
             
-            recent_messages = memory.messages[-limit:]
-            formatted_messages = []
-            
-            for msg in recent_messages:
-                role = "Пользователь" if msg.role_type == "user" else "Ассистент"
-                formatted_messages.append(f"{role}: {msg.content}")
-            
-            return "\n".join(formatted_messages)
+            return entry.format_recent(limit)
             
         except Exception as e:
             print(f"❌ Ошибка при получении сообщений из Zep: {e}")
-            return self.get_local_session_history(session_id)
+            return await self.get_local_session_history(session_id)
     
     def add_to_local_session(self, session_id: str, user_message: str, bot_response: str):
         """Резервное локальное хранение сессий"""
-        if session_id not in self.user_sessions:
-            self.user_sessions[session_id] = []
-        
-        self.user_sessions[session_id].append({
-            "user": user_message,
-            "assistant": bot_response,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Ограничиваем историю 10 последними сообщениями
-        if len(self.user_sessions[session_id]) > 10:
-            self.user_sessions[session_id] = self.user_sessions[session_id][-10:]
+        self.local_sessions.add(session_id, user_message, bot_response)
     
-    def get_local_session_history(self, session_id: str) -> str:
+    async def get_local_session_history(self, session_id: str) -> str:
         """Получает историю из локального хранилища"""
-        if session_id not in self.user_sessions:
-            return ""
-        
-        history = []
-        for exchange in self.user_sessions[session_id][-6:]:  # Последние 6 обменов
-            history.append(f"Пользователь: {exchange['user']}")
-            history.append(f"Ассистент: {exchange['assistant']}")
-        
-        return "\n".join(history) if history else ""
+        return await self.local_sessions.history(session_id)
     
     async def call_llm(self, messages: list, max_completion_tokens: int = 1000, temperature: float = 0.5) -> str:
         """
-        LLM запрос через OpenAI (единственный провайдер)
+        LLM запрос через роутер провайдеров (OpenAI → Anthropic)
 
-        Timeout: 60 секунд для обработки очень длинных контекстов (мозгоритмы ~11k символов)
+        Роутер ведёт статистику latency/ошибок, размыкает circuit breaker
+        проблемного провайдера и (если включено) отправляет hedge запрос
+        второму провайдеру, когда основной не ответил за свой p95.
+        Общий timeout: LLM_REQUEST_TIMEOUT (по умолчанию 60 секунд).
         """
+        if not self.llm_router.providers:
+            logger.error("❌ Ни один LLM клиент не доступен")
+            raise Exception("LLM клиенты не инициализированы")
 
-        # Timeout для очень длинных контекстов (мозгоритмы ~11k символов)
-        AI_REQUEST_TIMEOUT = 60.0  # Увеличено с 30s для gpt-5.1 с длинными запросами
+        provider_names = ", ".join(p.name for p in self.llm_router.providers)
+        logger.info(f"🤖 LLM запрос через роутер (провайдеры: {provider_names}, hedging: {self.llm_router.hedging_enabled})")
 
-        # Сначала пробуем OpenAI
-        if self.openai_client:
-            try:
-                logger.info(f"🤖 Пытаемся использовать OpenAI (модель: {OPENAI_MODEL}, timeout: {AI_REQUEST_TIMEOUT}s)")
+        result = await self.llm_router.complete(
+            messages,
+            max_completion_tokens=max_completion_tokens,
+            temperature=temperature
+        )
 
-                # Обёртываем в asyncio.wait_for для timeout
-                response = await asyncio.wait_for(
-                    self.openai_client.chat.completions.create(
-                        model=OPENAI_MODEL,  # Явно фиксируем gpt-4o-mini (быстрее)
-                        messages=messages,
-                        max_completion_tokens=max_completion_tokens,
-                        temperature=temperature
-                    ),
-                    timeout=AI_REQUEST_TIMEOUT
+        if result.provider == "openai":
+            # КРИТИЧЕСКИ ВАЖНО: Логируем фактически использованную модель
+            logger.info(f"📊 Запрошенная модель: {OPENAI_MODEL}")
+            logger.info(f"📊 Фактическая модель: {result.model}")
+            if OPENAI_MODEL != result.model:
+                logger.warning(f"⚠️ НЕСООТВЕТСТВИЕ МОДЕЛЕЙ! Запрошена '{OPENAI_MODEL}', но использована '{result.model}'")
+            get_prompt_cache_metrics().add_usage(result.model, result.usage)
+
+        self.current_model = result.model  # Track actual model used
+        logger.info(f"✅ Ответ получен (провайдер: {result.provider}, модель: {result.model}, latency: {result.latency_ms:.0f}ms)")
+        return result.text
+
+    async def call_llm_stream(
+        self,
+        messages: list,
+        on_delta: Callable[[str], Awaitable[None]],
+        max_completion_tokens: int = 1000,
+        temperature: float = 0.5
+    ) -> str:
+        """
+        Streaming LLM запрос через OpenAI
+
+        Отдаёт накопленный текст в on_delta по мере генерации,
+        чтобы пользователь видел ответ с первого токена.
+
+        Returns:
+            str: Полный текст ответа
+        """
+        AI_REQUEST_TIMEOUT = LLM_REQUEST_TIMEOUT
+
+        provider = self.llm_router.get_provider("openai")
+        if provider is None:
+            logger.error("❌ OpenAI клиент недоступен")
+            raise Exception("OpenAI клиент не инициализирован")
+
+        if not provider.breaker.allow():
+            # OpenAI исключён circuit breaker'ом - отвечаем без streaming через роутер
+            logger.warning("🔌 OpenAI circuit breaker open - ответ без streaming через роутер")
+            return await self.call_llm(messages, max_completion_tokens=max_completion_tokens, temperature=temperature)
+
+        logger.info(f"🤖 Streaming OpenAI (модель: {OPENAI_MODEL}, timeout: {AI_REQUEST_TIMEOUT}s)")
+        chunks = []
+        actual_model = OPENAI_MODEL
+        total_tokens = None
+        usage = None
+
+        provider.breaker.on_start()
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(AI_REQUEST_TIMEOUT):
+                stream = await self.openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    max_completion_tokens=max_completion_tokens,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True}
                 )
 
-                # КРИТИЧЕСКИ ВАЖНО: Логируем фактически использованную модель
-                actual_model = response.model
-                logger.info(f"📊 Запрошенная модель: {OPENAI_MODEL}")
-                logger.info(f"📊 Фактическая модель: {actual_model}")
+                async for chunk in stream:
+                    if chunk.model:
+                        actual_model = chunk.model
+                    if chunk.usage:
+                        usage = chunk.usage
+                        total_tokens = chunk.usage.total_tokens
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        try:
+                            await on_delta("".join(chunks))
+                        except Exception as delta_error:
+                            # Ошибки доставки промежуточного текста не прерывают генерацию
+                            logger.warning(f"⚠️ Ошибка отправки промежуточного текста: {delta_error}")
+
+        except asyncio.CancelledError:
+            provider.breaker.on_cancel()
+            raise
+
+        except TimeoutError:
+            provider.stats.record_error()
+            provider.breaker.on_failure()
+            logger.error(f"⏱️ OpenAI streaming timeout после {AI_REQUEST_TIMEOUT}s")
+            raise Exception(f"OpenAI timeout: запрос превысил {AI_REQUEST_TIMEOUT}s. Попробуйте упростить запрос или обратитесь позже.")
 
-                if OPENAI_MODEL != actual_model:
-                    logger.warning(f"⚠️ НЕСООТВЕТСТВИЕ МОДЕЛЕЙ! Запрошена '{OPENAI_MODEL}', но использована '{actual_model}'")
+        except Exception as e:
+            provider.stats.record_error()
+            provider.breaker.on_failure()
+            logger.error(f"❌ Ошибка OpenAI streaming: {e}")
+            if not chunks:
+                # Пользователь ещё ничего не увидел - можно ответить через другого провайдера
+                logger.warning("↪️ Streaming не начался, повтор через роутер")
+                return await self.call_llm(messages, max_completion_tokens=max_completion_tokens, temperature=temperature)
+            raise Exception(f"OpenAI error: {e}")
+
+        provider.stats.record_success((time.monotonic() - start) * 1000)
+        provider.breaker.on_success()
+
+        if OPENAI_MODEL != actual_model:
+            logger.warning(f"⚠️ НЕСООТВЕТСТВИЕ МОДЕЛЕЙ! Запрошена '{OPENAI_MODEL}', но использована '{actual_model}'")
+
+        self.current_model = actual_model
+        get_prompt_cache_metrics().add_usage(actual_model, usage)
+        logger.info(f"✅ OpenAI streaming ответ получен (модель: {actual_model}, tokens: {total_tokens})")
+        return "".join(chunks)
+
+    async def _prepare_turn(self, user_message: str, session_id: str, user_name: str = None) -> Dict[str, Any]:
+        """
+        Стадия 1: сбор контекста и построение messages для LLM
 
-                result = response.choices[0].message.content
-                self.current_model = actual_model  # Track actual model used
-                logger.info(f"✅ OpenAI ответ получен (модель: {actual_model}, tokens: {response.usage.total_tokens})")
-                return result
+        Returns:
+            dict с контекстом хода. Если ключ "early_response" не None -
+            ответ уже готов (редирект в поддержку) и LLM вызывать не нужно.
+        """
+        # Статический префикс (инструкция + правила RAG) одинаков для всех запросов - prompt caching,
+        # готов в снимке инструкции
+        static_prefix = self.instruction_store.get().static_prefix
+
+        # Диагностика входного сообщения
+        features = analyze_query(user_message)
+        has_emojis = features.has_emojis
+        logger.info(f"📨 Входное сообщение:")
+        logger.info(f"   Текст: '{user_message}'")
+        logger.info(f"   Длина: {len(user_message)} символов")
+        logger.info(f"   Содержит эмодзи: {'✅ Да' if has_emojis else '❌ Нет'}")
+
+        # Параллельно собираем контекст: база знаний + Zep контекст + Zep история
+        logger.info(f"🔎 Сбор контекста для запроса: '{user_message[:50]}...'")
+        gathered = await self.gather_context(user_message, session_id)
+        knowledge_context, sources_used, search_results = gathered["knowledge"]
+        zep_context = gathered["zep_context"]
+        zep_history = gathered["zep_history"]
+        logger.info(f"✅ Поиск завершён: context={len(knowledge_context)} символов, sources={len(sources_used)}, results={len(search_results)}")
+
+        turn = {
+            "knowledge_context": knowledge_context,
+            "sources_used": sources_used,
+            "search_results": search_results,
+            "zep_context": zep_context,
+            "zep_history": zep_history,
+            "has_valid_context": False,
+            "early_response": None
+        }
 
-            except asyncio.TimeoutError:
-                logger.error(f"⏱️ OpenAI timeout после {AI_REQUEST_TIMEOUT}s")
-                raise Exception(f"OpenAI timeout: запрос превысил {AI_REQUEST_TIMEOUT}s. Попробуйте упростить запрос или обратитесь позже.")
+        # Добавляем контекст из базы знаний с ГИБКИМ RAG pattern
+        # Проверяем что контекст содержит реальную информацию (не fallback текст)
+        has_valid_context = (
+            knowledge_context and
+            len(knowledge_context.strip()) > 50 and
+            "не найдена" not in knowledge_context.lower()
+        )
+        if has_valid_context:
+            logger.info(f"✅ Добавляем контекст из базы знаний в prompt (длина: {len(knowledge_context)} символов)")
+            turn["has_valid_context"] = True
+        else:
+            # Логируем почему контекст невалидный
+            if not knowledge_context:
+                logger.warning(f"⚠️ knowledge_context пустой (None или empty string)")
+            elif "не найдена" in knowledge_context.lower():
+                logger.warning(f"⚠️ knowledge_context содержит fallback текст 'не найдена'")
+                logger.warning(f"   Content: '{knowledge_context[:200]}...'")
+            elif len(knowledge_context.strip()) <= 50:
+                logger.warning(f"⚠️ knowledge_context слишком короткий ({len(knowledge_context)} символов)")
+                logger.warning(f"   Content preview: '{knowledge_context[:200]}...'")
+            else:
+                logger.info("📭 Контекст из базы знаний пуст")
+
+            # Проверяем тип запроса для определения fallback стратегии
+            logger.info("🔍 Анализ типа запроса для выбора fallback стратегии...")
+
+            # Признаки технических/организационных и платёжных вопросов - из разбора запроса
+            # ТОЛЬКО для технических/платёжных вопросов → отправляем в поддержку
+            if features.is_support_question:
+                logger.info("📨 Технический/платёжный вопрос → редирект в поддержку")
+                user_name_display = user_name if user_name else "Дорогая"
+
+                from .config import DEBUG_INFO_ENABLED
+                debug_info = ""
+                if DEBUG_INFO_ENABLED:
+                    debug_info = "\n\n---\n🔍 **DEBUG INFO:** Технический вопрос → support redirect\n"
+
+                turn["early_response"] = f"{user_name_display}, по этому вопросу рекомендую написать в поддержку курса или обратиться к @support_ignatova 🌸{debug_info}"
+                return turn
+
+            # Для всех остальных запросов (методология, практики, мозгоритмы) →
+            # используем системную инструкцию + общие знания AI
+            logger.info("🤖 Методологический запрос → используем AI без базы знаний")
+            logger.info("   Система генерирует ответ куратора на основе системной инструкции")
+
+        # Статический префикс → база знаний → контекст и история Zep отдельными сообщениями
+        turn["messages"] = build_messages(
+            static_prefix,
+            user_message,
+            knowledge_context=knowledge_context if has_valid_context else None,
+            zep_context=zep_context,
+            zep_history=zep_history
+        )
+        return turn
 
-            except Exception as e:
-                logger.error(f"❌ Ошибка OpenAI: {e}")
-                raise Exception(f"OpenAI error: {e}")
+    async def _complete_turn(self, turn: Dict[str, Any], bot_response: str, user_message: str, session_id: str, user_name: str = None) -> str:
+        """
+        Стадия 2: после успешного ответа LLM - summary лог, DEBUG INFO, лог в MySQL (в очередь)
 
-        # Если OpenAI клиент не инициализирован
-        logger.error("❌ OpenAI клиент недоступен")
-        raise Exception("OpenAI клиент не инициализирован")
-    
-    async def generate_response(self, user_message: str, session_id: str, user_name: str = None) -> str:
-        try:
-            system_prompt = self.instruction.get("system_instruction", "")
-
-            # Диагностика входного сообщения
-            has_emojis = any(ord(c) > 127 and ord(c) not in range(0x0400, 0x0500) for c in user_message)  # Исключаем кириллицу
-            logger.info(f"📨 Входное сообщение:")
-            logger.info(f"   Текст: '{user_message}'")
-            logger.info(f"   Длина: {len(user_message)} символов")
-            logger.info(f"   Содержит эмодзи: {'✅ Да' if has_emojis else '❌ Нет'}")
-
-            # Ищем релевантную информацию в базе знаний
-            logger.info(f"🔎 Вызов search_knowledge_base() для запроса: '{user_message[:50]}...'")
-            knowledge_context, sources_used, search_results = await self.search_knowledge_base(user_message, limit=SEARCH_LIMIT)
-            logger.info(f"✅ Поиск завершён: context={len(knowledge_context)} символов, sources={len(sources_used)}, results={len(search_results)}")
-
-            # Пытаемся получить контекст из Zep Memory
-            zep_context = await self.get_zep_memory_context(session_id)
-            zep_history = await self.get_zep_recent_messages(session_id)
-
-            # Добавляем контекст из базы знаний с ГИБКИМ RAG pattern
-            # Проверяем что контекст содержит реальную информацию (не fallback текст)
-            has_valid_context = (
-                knowledge_context and
-                len(knowledge_context.strip()) > 50 and
-                "не найдена" not in knowledge_context.lower()
-            )
-            if has_valid_context:
-                logger.info(f"✅ Добавляем контекст из базы знаний в system prompt (длина: {len(knowledge_context)} символов)")
-                system_prompt += f"""
+        Returns:
+            str: Ответ бота (с DEBUG INFO если включено)
+        """
+        knowledge_context = turn["knowledge_context"]
+        sources_used = turn["sources_used"]
+        search_results = turn["search_results"]
+        zep_context = turn["zep_context"]
+        zep_history = turn["zep_history"]
 
-⚠️ ПРАВИЛО ГЕНЕРАЦИИ ОТВЕТА:
-Используй информацию из раздела БАЗА ЗНАНИЙ ниже как ОСНОВУ и ПРИМЕРЫ для твоего ответа.
+        # GPT сам добавляет источники согласно инструкции в system_prompt
+        # Автоматическое добавление убрано чтобы избежать дублирования
 
-✅ ТЫ МОЖЕШЬ:
-- Комбинировать паттерны из разных примеров для создания детальных рекомендаций
-- Синтезировать детальные ответы на основе методологии курса из примеров
-- Использовать структуру и подход из примеров корректировок куратора
+        logger.info(f"✅ CHECKPOINT: LLM response generated successfully (length: {len(bot_response)} chars)")
 
-❌ ТЫ НЕ МОЖЕШЬ:
-- Добавлять информацию которая ПРОТИВОРЕЧИТ методологии курса "Всепрощающая"
-- Использовать общие психологические концепции НЕ из курса Натальи Игнатовой
-- Игнорировать инструкции из instruction.json (длина ответа, количество примеров)
+        # SUMMARY лог генерации
+        logger.info(f"""
+📊 SUMMARY генерации ответа:
+   • User message: '{user_message[:50]}{"..." if len(user_message) > 50 else ""}'
+   • Knowledge base used: {'✅ Yes' if knowledge_context else '❌ No'}
+   • Sources found: {len(sources_used)} - {', '.join(sources_used) if sources_used else 'N/A'}
+   • Zep context: {'✅ Yes' if zep_context else '❌ No'}
+   • Zep history: {'✅ Yes' if zep_history else '❌ No'}
+   • Response length: {len(bot_response)} символов
+   • Model: {getattr(self, 'current_model', 'unknown')}
+""")
 
-ВСЕГДА старайся дать полезный ответ на основе найденной информации из базы знаний!
+        # Добавляем отладочную информацию в ответ бота (если включено)
+        from .config import DEBUG_INFO_ENABLED
+        import uuid
 
-=== БАЗА ЗНАНИЙ КУРСА "ВСЕПРОЩАЮЩАЯ" ===
-{knowledge_context}
-=== КОНЕЦ БАЗЫ ЗНАНИЙ ===
+        # Генерируем уникальный Message ID для трейсинга
+        message_id = f"M{uuid.uuid4().hex[:7]}"
+        set_trace_message_id(message_id)
 
-ВАЖНО: Следуй инструкциям по длине ответа и количеству примеров из instruction.json!
-"""
+        if DEBUG_INFO_ENABLED:
+            # Компактный DEBUG INFO с Message ID для идентификации
+            debug_info = f"\n\n---\n🔍 **ID: #{message_id}**\n"
+
+            # Статус базы знаний и результаты
+            kb_status = "✅" if knowledge_context else "❌"
+
+            if search_results:
+                avg_score = sum(r.relevance_score for r in search_results) / len(search_results)
+                debug_info += f"📚 Knowledge: {kb_status} | 📊 Results: {len(search_results)} | ⭐ Relevance: {avg_score:.2f}\n"
+
+                # Разбивка по типам entities
+                entity_types = {}
+                for result in search_results:
+                    entity_type = result.metadata.get('entity_type') or getattr(result, 'entity_type', 'unknown')
+                    entity_types[entity_type] = entity_types.get(entity_type, 0) + 1
+
+                if entity_types:
+                    types_str = ', '.join([f"{k}:{v}" for k, v in entity_types.items()])
+                    debug_info += f"📁 Types: {types_str}\n"
             else:
-                # Логируем почему контекст невалидный
-                if not knowledge_context:
-                    logger.warning(f"⚠️ knowledge_context пустой (None или empty string)")
-                elif "не найдена" in knowledge_context.lower():
-                    logger.warning(f"⚠️ knowledge_context содержит fallback текст 'не найдена'")
-                    logger.warning(f"   Content: '{knowledge_context[:200]}...'")
-                elif len(knowledge_context.strip()) <= 50:
-                    logger.warning(f"⚠️ knowledge_context слишком короткий ({len(knowledge_context)} символов)")
-                    logger.warning(f"   Content preview: '{knowledge_context[:200]}...'")
-                else:
-                    logger.info("📭 Контекст из базы знаний пуст")
+                debug_info += f"📚 Knowledge: {kb_status} | 📊 Results: 0\n"
 
-                # Проверяем тип запроса для определения fallback стратегии
-                logger.info("🔍 Анализ типа запроса для выбора fallback стратегии...")
+            # Zep Memory статус
+            has_zep = (zep_context and len(str(zep_context).strip()) > 0) or \
+                      (zep_history and len(str(zep_history).strip()) > 0)
+            debug_info += f"🧠 Zep: {'✅' if has_zep else '❌'}\n"
+
+            if turn.get("cache_similarity") is not None:
+                debug_info += f"♻️ Answer cache: ✅ (similarity: {turn['cache_similarity']:.3f})\n"
+
+            bot_response += debug_info
+
+        # Логируем Message ID для поиска в логах
+        logger.info(f"🔗 Message ID: #{message_id} | Session: {session_id} | User: {user_name or 'Unknown'}")
+
+        # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Сохранение в MySQL ===
+        # Ошибки НЕ должны влиять на возврат ответа пользователю
+        try:
+            # Сохраняем детальный лог в MySQL для анализа
+            entity_types_for_log = {}
+            avg_score_for_log = None
+            if search_results:
+                avg_score_for_log = sum(r.relevance_score for r in search_results) / len(search_results)
+                for result in search_results:
+                    entity_type = result.metadata.get('entity_type') or getattr(result, 'entity_type', 'unknown')
+                    entity_types_for_log[entity_type] = entity_types_for_log.get(entity_type, 0) + 1
+
+            # Вычисляем полную длину промпта
+            full_prompt_len = messages_length(turn.get("messages", []))
+
+            # Извлекаем user_id из session_id (формат: user_229838448)
+            extracted_user_id = session_id.replace("user_", "") if session_id and session_id.startswith("user_") else session_id
+
+            await self.post_processor.submit_log({
+                "message_id": message_id,
+                "user_id": extracted_user_id,
+                "user_name": user_name,
+                "session_id": session_id,
+                "query": user_message,
+                "search_results_count": len(search_results) if search_results else 0,
+                "avg_relevance_score": avg_score_for_log,
+                "entity_types": entity_types_for_log if entity_types_for_log else None,
+                "sources": list(dict.fromkeys(sources_used)) if sources_used else None,
+                "knowledge_context": knowledge_context,
+                "zep_context": str(zep_context or "") + str(zep_history or ""),
+                "full_prompt_length": full_prompt_len,
+                "model_used": getattr(self, 'current_model', 'unknown'),
+                "response_text": bot_response
+            }, key=session_id)
+            logger.info(f"✅ CHECKPOINT: MySQL log queued")
+        except Exception as mysql_error:
+            # MySQL ошибки НЕ критичны - ответ уже сгенерирован
+            logger.warning(f"⚠️ MySQL log failed (non-critical): {type(mysql_error).__name__}: {mysql_error}")
+            # НЕ raise, НЕ return - продолжаем execution
+
+        return bot_response
+
+    def _llm_error_response(self, user_message: str, knowledge_context: str, sources_used: list) -> str:
+        """Fallback ответ когда LLM вернул ошибку"""
+        # Улучшенный fallback - используем найденную информацию
+        if knowledge_context:
+            bot_response = f"⚠️ AI временно недоступен, но нашла информацию в базе знаний:\n\n{knowledge_context[:500]}"
+            if sources_used:
+                # Убираем дубликаты из sources
+                unique_sources = list(dict.fromkeys(sources_used))
+                sources_text = ", ".join(unique_sources[:3])  # Максимум 3 источника
+                bot_response += f"\n\n📚 **Источник:** {sources_text}"
+            bot_response += "\n\n🔄 Попробуйте задать вопрос еще раз или уточните запрос.\n\nКристина, ignatova-stroinost"
+            return bot_response
 
-                # Определяем признаки технических/организационных вопросов
-                user_message_lower = user_message.lower()
-                is_technical_question = any(word in user_message_lower for word in [
-                    'не могу зайти', 'не работает', 'ошибка на сайте', 'доступ к платформе',
-                    'не открывается', 'не загружается', 'технические проблемы'
-                ])
-                is_payment_question = any(word in user_message_lower for word in [
-                    'оплата', 'оплатить', 'стоимость', 'цена', 'тариф', 'деньги', 'возврат'
-                ])
+        # Простые ответы как последний fallback
+        features = analyze_query(user_message)
 
-                # ТОЛЬКО для технических/платёжных вопросов → отправляем в поддержку
-                if is_technical_question or is_payment_question:
-                    logger.info("📨 Технический/платёжный вопрос → редирект в поддержку")
-                    user_name_display = user_name if user_name else "Дорогая"
+        if features.is_greeting:
+            return "👋 Привет! Меня зовут Кристина, я ассистент для менеджеров по продажам. Помогаю с:\n• Подбором скриптов для клиентов\n• Обработкой возражений\n• Планированием follow-up'ов\n\nО чём хотите посоветоваться?"
+        elif features.is_price_question:
+            return "💰 У нас есть несколько продуктов:\n• Диагностика психотипа (бесплатно)\n• Марафон похудения (990₽)\n• 4 практики (990₽)\n• Полный курс\n\nЧто вас интересует?"
+        else:
+            return f"⚠️ AI временно недоступен. Попробуйте:\n• Переформулировать вопрос\n• Задать конкретный вопрос (например: 'как обработать возражение о цене?')\n• Написать позже\n\nКристина, ignatova-stroinost"
 
-                    from .config import DEBUG_INFO_ENABLED
-                    debug_info = ""
-                    if DEBUG_INFO_ENABLED:
-                        debug_info = "\n\n---\n🔍 **DEBUG INFO:** Технический вопрос → support redirect\n"
+    def _no_llm_response(self, user_message: str) -> str:
+        """Простая логика ответов если нет API ключей"""
+        features = analyze_query(user_message)
 
-                    return f"{user_name_display}, по этому вопросу рекомендую написать в поддержку курса или обратиться к @support_ignatova 🌸{debug_info}"
+        if features.is_greeting:
+            return "👋 Привет! Меня зовут Кристина, я ассистент для менеджеров по продажам. Помогаю с:\n• Подбором скриптов для клиентов\n• Обработкой возражений\n• Планированием follow-up'ов\n\nО чём хотите посоветоваться?"
+        elif features.is_price_question:
+            return "💰 У нас есть несколько продуктов:\n• Диагностика психотипа (бесплатно)\n• Марафон похудения (990₽)\n• 4 практики (990₽)\n• Полный курс\n\nЧто вас интересует?"
+        else:
+            return f"⚠️ AI сервис не настроен. Обратитесь к администратору для настройки OpenAI или Anthropic API.\n\nКристина, ignatova-stroinost"
 
-                # Для всех остальных запросов (методология, практики, мозгоритмы) →
-                # используем системную инструкцию + общие знания AI
-                logger.info("🤖 Методологический запрос → используем AI без базы знаний")
-                logger.info("   Система генерирует ответ куратора на основе системной инструкции")
+    async def _after_response(self, session_id: str, user_message: str, bot_response: str, user_name: str = None):
+        """
+        Стадия 3: сохранение в Zep Memory и валидация ответа
 
-            # Добавляем контекст и историю в системный промпт
-            if zep_context:
-                system_prompt += f"\n\nКонтекст предыдущих разговоров:\n{zep_context}"
+        Обе операции ставятся в очередь пост-обработки и выполняются
+        после отправки ответа пользователю.
+        """
+        # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Сохранение в Zep Memory ===
+        # Ошибки НЕ должны влиять на возврат ответа пользователю
+        try:
+            await self._queue_zep_write(session_id, user_message, bot_response, user_name)
+            logger.info(f"✅ CHECKPOINT: Zep Memory queued")
+        except Exception as zep_error:
+            # Zep ошибки НЕ критичны - ответ уже сгенерирован
+            logger.warning(f"⚠️ Zep Memory failed (non-critical): {type(zep_error).__name__}: {zep_error}")
+            # НЕ raise, НЕ return - продолжаем execution
+
+        # === СОХРАНЕНИЕ В GRAPHITI: Temporal Knowledge Graph диалогов ===
+        # ВРЕМЕННО ОТКЛЮЧЕНО для отладки - TODO: исправить и включить обратно
+        # try:
+        #     if KNOWLEDGE_SEARCH_AVAILABLE:
+        #         knowledge_service = get_knowledge_search_service()
+        #         if knowledge_service.graphiti_enabled:
+        #             # Формируем episode из диалога
+        #             user_name_display = user_name or "Пользователь"
+        #             episode_content = f"Пользователь ({user_name_display}): {user_message}\n\nАссистент (Анастасия): {bot_response}"
+        #
+        #             # Добавляем episode в knowledge graph
+        #             success, episode_id = await knowledge_service.graphiti_service.add_episode(
+        #                 content=episode_content,
+        #                 episode_type="conversation",
+        #                 metadata={
+        #                     "session_id": session_id,
+        #                     "user_name": user_name_display,
+        #                     "timestamp": datetime.utcnow().isoformat()
+        #                 },
+        #                 source_description=f"Telegram conversation with {user_name_display}"
+        #             )
+        #
+        #             if success:
+        #                 logger.info(f"✅ Episode сохранён в Graphiti: {episode_id}")
+        #             else:
+        #                 logger.warning(f"⚠️ Не удалось сохранить episode в Graphiti: {episode_id}")
+        # except Exception as graphiti_error:
+        #     # Не критично - если Graphiti недоступен, бот продолжает работать
+        #     logger.warning(f"⚠️ Graphiti недоступен, диалог не сохранён в knowledge graph: {graphiti_error}")
+
+        # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Валидация ответа перед отправкой ===
+        # Ошибки валидации НЕ должны блокировать отправку ответа
+        async def validate():
+            validation_result = validate_response(bot_response, student_name=user_name)
+
+            if not validation_result["valid"]:
+                logger.error(f"❌ ВАЛИДАЦИЯ НЕ ПРОШЛА: {validation_result['errors']}")
+                # Логируем проблемный ответ для анализа
+                logger.error(f"Проблемный ответ:\n{bot_response}")
+
+            if validation_result["warnings"]:
+                logger.warning(f"⚠️ Предупреждения валидации: {validation_result['warnings']}")
+
+            logger.info(f"✅ CHECKPOINT: Validation completed")
 
-            if zep_history:
-                system_prompt += f"\n\nПоследние сообщения:\n{zep_history}"
+        try:
+            # Валидация детерминирована - повторять при ошибке бессмысленно
+            await self.post_processor.submit(PostJob(kind="validation", fn=validate, key=session_id, max_retries=0))
+        except Exception as validation_error:
+            # Validation ошибки НЕ критичны - ответ уже сгенерирован
+            logger.warning(f"⚠️ Validation failed (non-critical): {type(validation_error).__name__}: {validation_error}")
+            # НЕ raise, НЕ return - продолжаем execution
+
+    async def _queue_zep_write(self, session_id: str, user_message: str, bot_response: str, user_name: str = None):
+        """Запись хода в Zep через очередь пост-обработки (с retry, при неудаче - локальная память)"""
+        if not self.zep_client:
+            self.add_to_local_session(session_id, user_message, bot_response)
+            return
 
+        messages = self._build_zep_messages(session_id, user_message, bot_response, user_name)
 
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
+        async def write():
+            await self.zep_client.memory.add(session_id=session_id, messages=messages)
+            # Write-through только после подтверждения Zep: кэш не расходится с памятью
+            self.session_memory.append_messages(session_id, messages)
+
+        def on_failure():
+            # Zep не принял ход - кэш сессии мог устареть, следующий ход перечитает память
+            self.session_memory.invalidate(session_id)
+            self.add_to_local_session(session_id, user_message, bot_response)
+
+        await self.post_processor.submit(PostJob(
+            kind="zep_write",
+            fn=write,
+            key=session_id,
+            on_failure=on_failure
+        ))
+
+    async def _embed_query(self, text: str) -> Optional[list]:
+        """Embedding запроса для semantic кэша ответов (None при ошибке/таймауте)"""
+        if not self.openai_client:
+            return None
+        embedding_cache = get_embedding_cache()
+        cached = await embedding_cache.get(OPENAI_EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
+        try:
+            with span("embedding"):
+                response = await asyncio.wait_for(
+                    self.openai_client.embeddings.create(model=OPENAI_EMBEDDING_MODEL, input=text),
+                    timeout=ANSWER_CACHE_EMBED_TIMEOUT
+                )
+            embedding = response.data[0].embedding
+            embedding_cache.put(OPENAI_EMBEDDING_MODEL, text, embedding)
+            return embedding
+        except Exception as e:
+            logger.warning(f"⚠️ Answer cache: embedding недоступен ({type(e).__name__}: {e})")
+            return None
+
+    def _answer_cache_versions(self) -> tuple:
+        """(версия инструкции, версия KB) - ключ валидности закэшированных ответов"""
+        return str(self.instruction.get("last_updated", "")), get_kb_version()
+
+    def _store_cached_answer(self, turn: Dict[str, Any], user_message: str, query_embedding: Optional[list], bot_response: str, user_name: str = None):
+        """Сохранить ответ LLM в кэш (только ответы на основе базы знаний, прошедшие валидацию)"""
+        if query_embedding is None or not turn.get("has_valid_context"):
+            return
+        try:
+            if not validate_response(bot_response, student_name=user_name)["valid"]:
+                return
+            instruction_version, kb_version = self._answer_cache_versions()
+            self.answer_cache.store(user_message, query_embedding, bot_response, instruction_version, kb_version, user_name=user_name)
+            logger.info(f"♻️ Ответ сохранён в answer cache (entries: {len(self.answer_cache)})")
+        except Exception as e:
+            logger.warning(f"⚠️ Answer cache store failed (non-critical): {type(e).__name__}: {e}")
+
+    async def generate_response(
+        self,
+        user_message: str,
+        session_id: str,
+        user_name: str = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """
+        Генерация ответа: контекст → LLM → логирование, Zep, валидация
+
+        Args:
+            on_delta: Опциональный callback для streaming режима. Получает накопленный
+                текст ответа по мере генерации (только для OpenAI).
+        """
+        # Если вызывающий код не начал трейс хода (тестовые endpoints) - трейсим только генерацию
+        owned_trace = start_trace(session_id=session_id) if current_trace() is None else None
+        try:
+            return await self._generate_response(user_message, session_id, user_name, on_delta)
+        finally:
+            if owned_trace is not None:
+                await finish_trace(owned_trace)
+
+    async def _generate_response(
+        self,
+        user_message: str,
+        session_id: str,
+        user_name: str = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        try:
+            # Сбор контекста стартует сразу: при промахе answer cache (большинство ходов)
+            # embedding запроса считается параллельно с ним, а не перед ним.
+            # При попадании prepare отменяется вместе с поиском и fetch Zep,
+            # если их не ждут другие ходы (single_flight.wait_shared)
+            prepare = asyncio.ensure_future(self._prepare_turn(user_message, session_id, user_name))
+            # Не логировать "exception was never retrieved", если ход закрыт по кэшу
+            prepare.add_done_callback(lambda t: t.cancelled() or t.exception())
+            try:
+                # === SEMANTIC ANSWER CACHE: близкий вопрос уже отвечен ===
+                query_embedding = None
+                if ANSWER_CACHE_ENABLED and len(user_message.strip()) >= ANSWER_CACHE_MIN_CHARS:
+                    query_embedding = await self._embed_query(user_message)
+                    if query_embedding is not None:
+                        hit = self.answer_cache.lookup(query_embedding, *self._answer_cache_versions())
+                        if hit:
+                            prepare.cancel()
+                            logger.info(f"♻️ Answer cache HIT (similarity: {hit.similarity:.3f}, исходный вопрос: '{hit.entry.query[:50]}...')")
+                            self.current_model = "answer_cache"
+                            turn = {
+                                "knowledge_context": "",
+                                "sources_used": [],
+                                "search_results": [],
+                                "zep_context": "",
+                                "zep_history": "",
+                                "messages": [],
+                                "cache_similarity": hit.similarity
+                            }
+                            bot_response = await self._complete_turn(turn, hit.render(user_name), user_message, session_id, user_name)
+                            await self._after_response(session_id, user_message, bot_response, user_name)
+                            return bot_response
+
+                turn = await prepare
+            finally:
+                if not prepare.done():
+                    prepare.cancel()
+
+            if turn["early_response"] is not None:
+                return turn["early_response"]
 
             # Используем LLM роутер
             if self.openai_client or self.anthropic_client:
                 try:
                     logger.info(f"🤖 Генерируем ответ для: '{user_message[:50]}...'")
-                    bot_response = await self.call_llm(messages, max_completion_tokens=2000, temperature=0.5)
-
-                    # GPT сам добавляет источники согласно инструкции в system_prompt
-                    # Автоматическое добавление убрано чтобы избежать дублирования
-
-                    logger.info(f"✅ CHECKPOINT: LLM response generated successfully (length: {len(bot_response)} chars)")
+                    if on_delta is not None and self.openai_client:
+                        llm_call = lambda: self.call_llm_stream(turn["messages"], on_delta, max_completion_tokens=2000, temperature=0.5)
+                    else:
+                        llm_call = lambda: self.call_llm(turn["messages"], max_completion_tokens=2000, temperature=0.5)
+
+                    # Одинаковый одновременный запрос (двойная отправка, массовый вопрос после урока) ждёт один LLM вызов
+                    with span("llm"):
+                        bot_response = await self._coalesce(
+                            self.llm_flight,
+                            self._llm_flight_key(user_message, session_id, turn["messages"]),
+                            llm_call
+                        )
 
-                    # SUMMARY лог генерации
-                    logger.info(f"""
-📊 SUMMARY генерации ответа:
-   • User message: '{user_message[:50]}{"..." if len(user_message) > 50 else ""}'
-   • Knowledge base used: {'✅ Yes' if knowledge_context else '❌ No'}
-   • Sources found: {len(sources_used)} - {', '.join(sources_used) if sources_used else 'N/A'}
-   • Zep context: {'✅ Yes' if zep_context else '❌ No'}
-   • Zep history: {'✅ Yes' if zep_history else '❌ No'}
-   • Response length: {len(bot_response)} символов
-   • Model: {getattr(self, 'current_model', 'unknown')}
-""")
+                    # Кэшируем ответ до добавления DEBUG INFO
+                    self._store_cached_answer(turn, user_message, query_embedding, bot_response, user_name)
 
-                    # Добавляем отладочную информацию в ответ бота (если включено)
-                    from .config import DEBUG_INFO_ENABLED
-                    import uuid
-
-                    # Генерируем уникальный Message ID для трейсинга
-                    message_id = f"M{uuid.uuid4().hex[:7]}"
-
-                    if DEBUG_INFO_ENABLED:
-                        # Компактный DEBUG INFO с Message ID для идентификации
-                        debug_info = f"\n\n---\n🔍 **ID: #{message_id}**\n"
-
-                        # Статус базы знаний и результаты
-                        kb_status = "✅" if knowledge_context else "❌"
-
-                        if search_results:
-                            avg_score = sum(r.relevance_score for r in search_results) / len(search_results)
-                            debug_info += f"📚 Knowledge: {kb_status} | 📊 Results: {len(search_results)} | ⭐ Relevance: {avg_score:.2f}\n"
-
-                            # Разбивка по типам entities
-                            entity_types = {}
-                            for result in search_results:
-                                entity_type = result.metadata.get('entity_type') or getattr(result, 'entity_type', 'unknown')
-                                entity_types[entity_type] = entity_types.get(entity_type, 0) + 1
-
-                            if entity_types:
-                                types_str = ', '.join([f"{k}:{v}" for k, v in entity_types.items()])
-                                debug_info += f"📁 Types: {types_str}\n"
-                        else:
-                            debug_info += f"📚 Knowledge: {kb_status} | 📊 Results: 0\n"
-
-                        # Zep Memory статус
-                        has_zep = (zep_context and len(str(zep_context).strip()) > 0) or \
-                                  (zep_history and len(str(zep_history).strip()) > 0)
-                        debug_info += f"🧠 Zep: {'✅' if has_zep else '❌'}\n"
-
-                        bot_response += debug_info
-
-                    # Логируем Message ID для поиска в логах
-                    logger.info(f"🔗 Message ID: #{message_id} | Session: {session_id} | User: {user_name or 'Unknown'}")
-
-                    # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Сохранение в MySQL ===
-                    # Ошибки НЕ должны влиять на возврат ответа пользователю
-                    try:
-                        # Сохраняем детальный лог в MySQL для анализа
-                        entity_types_for_log = {}
-                        avg_score_for_log = None
-                        if search_results:
-                            avg_score_for_log = sum(r.relevance_score for r in search_results) / len(search_results)
-                            for result in search_results:
-                                entity_type = result.metadata.get('entity_type') or getattr(result, 'entity_type', 'unknown')
-                                entity_types_for_log[entity_type] = entity_types_for_log.get(entity_type, 0) + 1
-
-                        # Вычисляем полную длину промпта
-                        full_prompt_len = len(system_prompt) + len(user_message) + len(knowledge_context or "") + len(str(zep_context or "")) + len(str(zep_history or ""))
-
-                        # Извлекаем user_id из session_id (формат: user_229838448)
-                        extracted_user_id = session_id.replace("user_", "") if session_id and session_id.startswith("user_") else session_id
-
-                        await log_message(
-                            message_id=message_id,
-                            user_id=extracted_user_id,
-                            user_name=user_name,
-                            session_id=session_id,
-                            query=user_message,
-                            search_results_count=len(search_results) if search_results else 0,
-                            avg_relevance_score=avg_score_for_log,
-                            entity_types=entity_types_for_log if entity_types_for_log else None,
-                            sources=list(dict.fromkeys(sources_used)) if sources_used else None,
-                            knowledge_context=knowledge_context,
-                            zep_context=str(zep_context or "") + str(zep_history or ""),
-                            full_prompt_length=full_prompt_len,
-                            model_used=getattr(self, 'current_model', 'unknown'),
-                            response_text=bot_response
-                        )
-                        logger.info(f"✅ CHECKPOINT: MySQL log saved")
-                    except Exception as mysql_error:
-                        # MySQL ошибки НЕ критичны - ответ уже сгенерирован
-                        logger.warning(f"⚠️ MySQL log failed (non-critical): {type(mysql_error).__name__}: {mysql_error}")
-                        # НЕ raise, НЕ return - продолжаем execution
+                    bot_response = await self._complete_turn(turn, bot_response, user_message, session_id, user_name)
 
                 except Exception as llm_error:
                     logger.error(f"❌ Ошибка LLM: {type(llm_error).__name__}: {llm_error}")
                     logger.error(f"❌ Детали: {str(llm_error)}")
                     print(f"❌ КРИТИЧЕСКАЯ ОШИБКА LLM: {llm_error}")
 
-                    # Улучшенный fallback - используем найденную информацию
-                    if knowledge_context:
-                        bot_response = f"⚠️ AI временно недоступен, но нашла информацию в базе знаний:\n\n{knowledge_context[:500]}"
-                        if sources_used:
-                            # Убираем дубликаты из sources
-                            unique_sources = list(dict.fromkeys(sources_used))
-                            sources_text = ", ".join(unique_sources[:3])  # Максимум 3 источника
-                            bot_response += f"\n\n📚 **Источник:** {sources_text}"
-                        bot_response += "\n\n🔄 Попробуйте задать вопрос еще раз или уточните запрос.\n\nКристина, ignatova-stroinost"
-                    else:
-                        # Простые ответы как последний fallback
-                        user_message_lower = user_message.lower()
-
-                        if any(word in user_message_lower for word in ['привет', 'hello', 'hi', 'здравствуй']):
-                            bot_response = "👋 Привет! Меня зовут Кристина, я ассистент для менеджеров по продажам. Помогаю с:\n• Подбором скриптов для клиентов\n• Обработкой возражений\n• Планированием follow-up'ов\n\nО чём хотите посоветоваться?"
-                        elif any(word in user_message_lower for word in ['цена', 'стоимость', 'сколько']):
-                            bot_response = "💰 У нас есть несколько продуктов:\n• Диагностика психотипа (бесплатно)\n• Марафон похудения (990₽)\n• 4 практики (990₽)\n• Полный курс\n\nЧто вас интересует?"
-                        else:
-                            bot_response = f"⚠️ AI временно недоступен. Попробуйте:\n• Переформулировать вопрос\n• Задать конкретный вопрос (например: 'как обработать возражение о цене?')\n• Написать позже\n\nКристина, ignatova-stroinost"
+                    bot_response = self._llm_error_response(user_message, turn["knowledge_context"], turn["sources_used"])
             else:
-                # Простая логика ответов если нет API ключей
-                user_message_lower = user_message.lower()
-
-                if any(word in user_message_lower for word in ['привет', 'hello', 'hi', 'здравствуй']):
-                    bot_response = "👋 Привет! Меня зовут Кристина, я ассистент для менеджеров по продажам. Помогаю с:\n• Подбором скриптов для клиентов\n• Обработкой возражений\n• Планированием follow-up'ов\n\nО чём хотите посоветоваться?"
-                elif any(word in user_message_lower for word in ['цена', 'стоимость', 'сколько']):
-                    bot_response = "💰 У нас есть несколько продуктов:\n• Диагностика психотипа (бесплатно)\n• Марафон похудения (990₽)\n• 4 практики (990₽)\n• Полный курс\n\nЧто вас интересует?"
-                else:
-                    bot_response = f"⚠️ AI сервис не настроен. Обратитесь к администратору для настройки OpenAI или Anthropic API.\n\nКристина, ignatova-stroinost"
-
-            # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Сохранение в Zep Memory ===
-            # Ошибки НЕ должны влиять на возврат ответа пользователю
-            try:
-                await self.add_to_zep_memory(session_id, user_message, bot_response, user_name)
-                logger.info(f"✅ CHECKPOINT: Zep Memory saved")
-            except Exception as zep_error:
-                # Zep ошибки НЕ критичны - ответ уже сгенерирован
-                logger.warning(f"⚠️ Zep Memory failed (non-critical): {type(zep_error).__name__}: {zep_error}")
-                # НЕ raise, НЕ return - продолжаем execution
-
-            # === СОХРАНЕНИЕ В GRAPHITI: Temporal Knowledge Graph диалогов ===
-            # ВРЕМЕННО ОТКЛЮЧЕНО для отладки - TODO: исправить и включить обратно
-            # try:
-            #     if KNOWLEDGE_SEARCH_AVAILABLE:
-            #         knowledge_service = get_knowledge_search_service()
-            #         if knowledge_service.graphiti_enabled:
-            #             # Формируем episode из диалога
-            #             user_name_display = user_name or "Пользователь"
-            #             episode_content = f"Пользователь ({user_name_display}): {user_message}\n\nАссистент (Анастасия): {bot_response}"
-            #
-            #             # Добавляем episode в knowledge graph
-            #             success, episode_id = await knowledge_service.graphiti_service.add_episode(
-            #                 content=episode_content,
-            #                 episode_type="conversation",
-            #                 metadata={
-            #                     "session_id": session_id,
-            #                     "user_name": user_name_display,
-            #                     "timestamp": datetime.utcnow().isoformat()
-            #                 },
-            #                 source_description=f"Telegram conversation with {user_name_display}"
-            #             )
-            #
-            #             if success:
-            #                 logger.info(f"✅ Episode сохранён в Graphiti: {episode_id}")
-            #             else:
-            #                 logger.warning(f"⚠️ Не удалось сохранить episode в Graphiti: {episode_id}")
-            # except Exception as graphiti_error:
-            #     # Не критично - если Graphiti недоступен, бот продолжает работать
-            #     logger.warning(f"⚠️ Graphiti недоступен, диалог не сохранён в knowledge graph: {graphiti_error}")
-
-            # === НЕКРИТИЧНАЯ ОПЕРАЦИЯ: Валидация ответа перед отправкой ===
-            # Ошибки валидации НЕ должны блокировать отправку ответа
-            try:
-                validation_result = validate_response(bot_response, student_name=user_name)
-
-                if not validation_result["valid"]:
-                    logger.error(f"❌ ВАЛИДАЦИЯ НЕ ПРОШЛА: {validation_result['errors']}")
-                    # Логируем проблемный ответ для анализа
-                    logger.error(f"Проблемный ответ:\n{bot_response}")
-
-                if validation_result["warnings"]:
-                    logger.warning(f"⚠️ Предупреждения валидации: {validation_result['warnings']}")
+                bot_response = self._no_llm_response(user_message)
 
-                logger.info(f"✅ CHECKPOINT: Validation completed")
-            except Exception as validation_error:
-                # Validation ошибки НЕ критичны - ответ уже сгенерирован
-                logger.warning(f"⚠️ Validation failed (non-critical): {type(validation_error).__name__}: {validation_error}")
-                # НЕ raise, НЕ return - продолжаем execution
+            await self._after_response(session_id, user_message, bot_response, user_name)
 
             return bot_response
 
@@ -954,10 +954,11 @@ async def setup_telegram_webhook(
 
     try:
         import requests
+        from bot.config import TELEGRAM_API_URL
 
         # Вызываем Telegram API setWebhook
         response = requests.post(
-            f"https://api.telegram.org/bot{telegram_bot_token}/setWebhook",
+            f"{TELEGRAM_API_URL}/bot{telegram_bot_token}/setWebhook",
             json={
                 "url": webhook_url,
                 "allowed_updates": ["message", "business_connection", "business_message"]
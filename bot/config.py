@@ -9,6 +9,13 @@ ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 ZEP_API_KEY = os.getenv('ZEP_API_KEY', '').strip()  # Strip whitespace and newlines
 BOT_USERNAME = os.getenv('BOT_USERNAME')
 
+# API Endpoints (переопределяются для локальных заглушек bot/testing/fake_services.py)
+# Пустое значение - адрес по умолчанию SDK
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL') or None
+ZEP_BASE_URL = os.getenv('ZEP_BASE_URL') or None
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+
 # FalkorDB & Graphiti Configuration (496x faster than Neo4j!)
 FALKORDB_HOST = os.getenv('FALKORDB_HOST', 'localhost')
 FALKORDB_PORT = int(os.getenv('FALKORDB_PORT', '6379'))
@@ -34,6 +41,12 @@ QDRANT_API_KEY = os.getenv('QDRANT_API_KEY', '')
 QDRANT_COLLECTION = os.getenv('QDRANT_COLLECTION', 'course_knowledge')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
 USE_QDRANT = os.getenv('USE_QDRANT', 'false').lower() in ('true', '1', 'yes')
+# QDRANT_PREFER_GRPC - gRPC вместо HTTP (порт 6334)
+# QDRANT_OVERFETCH_FACTOR - во сколько раз больше точек запрашивать (запас на точки с пустым content);
+# KnowledgeSearchService сам запрашивает limit * 2 для boosting/RRF
+QDRANT_PREFER_GRPC = os.getenv('QDRANT_PREFER_GRPC', 'false').lower() in ('true', '1', 'yes')
+QDRANT_TIMEOUT = int(os.getenv('QDRANT_TIMEOUT', '30'))
+QDRANT_OVERFETCH_FACTOR = float(os.getenv('QDRANT_OVERFETCH_FACTOR', '1.0'))
 
 # Supabase Vector Store Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL', '')
@@ -41,20 +54,155 @@ SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY', '')
 SUPABASE_TABLE = os.getenv('SUPABASE_TABLE', 'course_knowledge')
 OPENAI_EMBEDDING_MODEL = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
 USE_SUPABASE = os.getenv('USE_SUPABASE', 'false').lower() in ('true', '1', 'yes')
+# Общий keep-alive HTTP клиент Supabase: таймауты подключения/чтения (сек) и размер пула
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '3.0'))
+SUPABASE_READ_TIMEOUT = float(os.getenv('SUPABASE_READ_TIMEOUT', '10.0'))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', '20'))
 
 # Knowledge Search Configuration
 SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', '10'))  # Количество результатов из базы знаний
+KB_CONTEXT_MAX_TOKENS = int(os.getenv('KB_CONTEXT_MAX_TOKENS', '5000'))  # Бюджет контекста базы знаний в токенах модели
+
+# Context Gathering Configuration (параллельный сбор контекста перед LLM)
+# Каждая ветка (поиск по базе знаний, Zep контекст, Zep история) имеет свой deadline,
+# общий бюджет ограничивает время до старта LLM запроса
+CONTEXT_BUDGET_SECONDS = float(os.getenv('CONTEXT_BUDGET_SECONDS', '8.0'))
+KB_SEARCH_TIMEOUT = float(os.getenv('KB_SEARCH_TIMEOUT', '6.0'))
+ZEP_FETCH_TIMEOUT = float(os.getenv('ZEP_FETCH_TIMEOUT', '3.0'))
+
+# Session Memory Cache (один memory.get() на ход + write-through кэш по сессии)
+SESSION_MEMORY_TTL_SECONDS = float(os.getenv('SESSION_MEMORY_TTL_SECONDS', '300'))
+SESSION_MEMORY_MAX_SESSIONS = int(os.getenv('SESSION_MEMORY_MAX_SESSIONS', '1000'))
+
+# Streaming Configuration (ответ показывается по мере генерации через edit_message_text)
+# STREAM_EDIT_INTERVAL - минимальный интервал между редактированиями сообщения (лимиты Telegram)
+# STREAM_MIN_CHARS - сколько символов накопить перед отправкой первого сообщения
+STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', 'false').lower() in ('true', '1', 'yes')
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+STREAM_MIN_CHARS = int(os.getenv('STREAM_MIN_CHARS', '40'))
+
+# Semantic Answer Cache (готовый ответ для близкого по смыслу вопроса)
+# ANSWER_CACHE_THRESHOLD - минимальная cosine similarity embeddings вопросов
+# ANSWER_CACHE_MIN_CHARS - короткие реплики ("спасибо", "ок") зависят от контекста диалога и не кэшируются
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '86400'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_MIN_CHARS = int(os.getenv('ANSWER_CACHE_MIN_CHARS', '20'))
+ANSWER_CACHE_EMBED_TIMEOUT = float(os.getenv('ANSWER_CACHE_EMBED_TIMEOUT', '2.0'))
+
+# Single-Flight Coalescing (одинаковые одновременные запросы ждут один результат)
+# session - LLM ответ делится только внутри одной сессии (по умолчанию)
+# global  - между пользователями при полностью совпадающем контексте (без истории Zep)
+# off     - без объединения
+SINGLE_FLIGHT_SCOPE = os.getenv('SINGLE_FLIGHT_SCOPE', 'session').lower()
+if SINGLE_FLIGHT_SCOPE not in ('session', 'global', 'off'):
+    print(f"⚠️ Неизвестный SINGLE_FLIGHT_SCOPE='{SINGLE_FLIGHT_SCOPE}', используется 'session'")
+    SINGLE_FLIGHT_SCOPE = 'session'
 
 # Абсолютный путь к файлу инструкций
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INSTRUCTION_FILE = os.path.join(BASE_DIR, 'data', 'instruction.json')
+# Как часто (сек) проверять изменение файла инструкций через os.stat (hot reload)
+INSTRUCTION_CHECK_INTERVAL = float(os.getenv('INSTRUCTION_CHECK_INTERVAL', '2.0'))
+
+# Локальная история сессий (fallback при недоступности Zep)
+# LOCAL_SESSION_MAX_MB - бюджет памяти на все сессии, давние сессии выгружаются в SQLite
+# LOCAL_SESSION_SPILL_PATH - файл SQLite для выгруженных сессий (пусто - не сохранять)
+LOCAL_SESSION_MAX_BYTES = int(float(os.getenv('LOCAL_SESSION_MAX_MB', '32')) * 1024 * 1024)
+LOCAL_SESSION_SPILL_PATH = os.getenv('LOCAL_SESSION_SPILL_PATH', os.path.join(BASE_DIR, 'data', 'local_sessions.db'))
+
+# Local Vector Index (точный поиск в процессе по data/parsed_kb вместо запроса к Qdrant/Supabase)
+# Индекс собирается скриптом scripts/build_local_index.py в LOCAL_INDEX_DIR
+# LOCAL_INDEX_DTYPE - float32 или float16 (вдвое меньше памяти, но поиск медленнее - приведение к float32 на запрос)
+USE_LOCAL_INDEX = os.getenv('USE_LOCAL_INDEX', 'false').lower() in ('true', '1', 'yes')
+LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', os.path.join(BASE_DIR, 'data', 'local_index'))
+LOCAL_INDEX_DTYPE = os.getenv('LOCAL_INDEX_DTYPE', 'float32').lower()
+
+# BM25 Index (лексический поиск, строится один раз на версию KB и хранится на диске)
+BM25_INDEX_DIR = os.getenv('BM25_INDEX_DIR', os.path.join(BASE_DIR, 'data', 'bm25_index'))
+
+# Retrieval Backends (хранилища KnowledgeSearchService, опрашиваются одновременно)
+# RETRIEVAL_BACKENDS - через запятую: local, supabase, qdrant, falkordb, simple_falkordb
+#   (пусто - одно хранилище по приоритету USE_LOCAL_INDEX > USE_SUPABASE > USE_QDRANT)
+# RETRIEVAL_FANOUT_MODE - merge: ответы всех хранилищ объединяются через RRF;
+#   first: используется первый успешный непустой ответ
+# RETRIEVAL_DEADLINE_SECONDS - сколько ждать хранилища при опросе нескольких (меньше KB_SEARCH_TIMEOUT)
+RETRIEVAL_BACKENDS = [name.strip().lower() for name in os.getenv('RETRIEVAL_BACKENDS', '').split(',') if name.strip()]
+RETRIEVAL_FANOUT_MODE = os.getenv('RETRIEVAL_FANOUT_MODE', 'merge').lower()
+if RETRIEVAL_FANOUT_MODE not in ('merge', 'first'):
+    print(f"⚠️ Неизвестный RETRIEVAL_FANOUT_MODE='{RETRIEVAL_FANOUT_MODE}', используется 'merge'")
+    RETRIEVAL_FANOUT_MODE = 'merge'
+RETRIEVAL_DEADLINE_SECONDS = float(os.getenv('RETRIEVAL_DEADLINE_SECONDS', '4.0'))
+
+# Hybrid Retrieval (векторный поиск + BM25 по data/parsed_kb, объединение через Reciprocal Rank Fusion)
+# HYBRID_RRF_K - константа RRF (больше - меньше разница между верхними позициями)
+# HYBRID_*_WEIGHT - вес каждого поиска в сумме RRF
+HYBRID_LEXICAL_ENABLED = os.getenv('HYBRID_LEXICAL_ENABLED', 'true').lower() in ('true', '1', 'yes')
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+HYBRID_VECTOR_WEIGHT = float(os.getenv('HYBRID_VECTOR_WEIGHT', '1.0'))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT', '1.0'))
+
+# Retrieval Cache (кэш результатов KnowledgeSearchService.search, сбрасывается при смене версии KB)
+# RETRIEVAL_CACHE_TTL_SECONDS - время жизни записи
+# RETRIEVAL_CACHE_RELEVANCE_STEP - шаг корзин min_relevance в ключе (близкие пороги делят запись)
+# RETRIEVAL_CACHE_REPLAY_QUERIES - сколько популярных запросов из MessageLog прогнать через поиск при старте
+#   (кэш в памяти, после рестарта заполняется живыми запросами; 0 - без replay)
+RETRIEVAL_CACHE_ENABLED = os.getenv('RETRIEVAL_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv('RETRIEVAL_CACHE_TTL_SECONDS', '3600'))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv('RETRIEVAL_CACHE_MAX_ENTRIES', '2000'))
+RETRIEVAL_CACHE_RELEVANCE_STEP = float(os.getenv('RETRIEVAL_CACHE_RELEVANCE_STEP', '0.05'))
+RETRIEVAL_CACHE_REPLAY_QUERIES = int(os.getenv('RETRIEVAL_CACHE_REPLAY_QUERIES', '0'))
+
+# Near-duplicate suppression (SimHash сигнатуры результатов поиска, см. bot/services/near_duplicate.py)
+# NEAR_DUPLICATE_MAX_DISTANCE - максимальное расстояние Хэмминга (из 64 бит) между почти-дубликатами
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '6'))
+
+# Cross-Encoder Reranking (второй этап ранжирования результатов поиска на CPU, требует sentence-transformers)
+# RERANKER_CANDIDATES - сколько кандидатов первого этапа переранжировать
+# RERANKER_TIME_BUDGET_MS - бюджет на reranking; не успели - остаётся порядок первого этапа
+# RERANKER_MAX_LENGTH - максимальная длина пары (запрос + документ) в токенах модели
+# Замер L12-H384 на 1 ядре CPU: 10 пар x 128 токенов ≈ 0.6-1.0s, 20 x 256 ≈ 2.6-3.4s.
+# Латентность растёт с CANDIDATES x MAX_LENGTH - при изменении проверьте лог прогрева
+RERANKER_ENABLED = os.getenv('RERANKER_ENABLED', 'false').lower() in ('true', '1', 'yes')
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RERANKER_CANDIDATES = int(os.getenv('RERANKER_CANDIDATES', '10'))
+RERANKER_TIME_BUDGET_MS = float(os.getenv('RERANKER_TIME_BUDGET_MS', '1200'))
+RERANKER_MAX_LENGTH = int(os.getenv('RERANKER_MAX_LENGTH', '128'))
+
+# Embedding Cache (общий кэш embeddings запросов для Qdrant/Supabase/локального индекса)
+# EMBEDDING_CACHE_MAX_ENTRIES - записей в памяти (LRU)
+# EMBEDDING_CACHE_PATH - файл SQLite, кэш переживает рестарт (пусто - только в памяти)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '2000'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'data', 'embedding_cache.db'))
+
+# Embedding Executor (локальный SentenceTransformer в отдельном потоке, micro-batching запросов)
+# EMBEDDING_BATCH_WINDOW_MS - сколько ждать одновременные запросы перед encode
+# EMBEDDING_BATCH_MAX_SIZE - батч отправляется сразу при наборе этого размера
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5'))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', '32'))
 
 # OpenAI Model Configuration
 # Поддерживает env переменную для гибкого переключения между моделями
 # Default: GPT-5.1 (gpt-5.1-2025-11-13) - улучшенное reasoning для длинных диалогов
 # Rollback: export OPENAI_MODEL=gpt-4o
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-5.1-2025-11-13')
-ANTHROPIC_MODEL = 'claude-3-5-sonnet-20241022'
+ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20241022')
+
+# LLM Router Configuration (несколько провайдеров, circuit breaker, hedging)
+# LLM_PROVIDER_ORDER - приоритет провайдеров (доступны только с заданным API ключом)
+# LLM_HEDGING_ENABLED - отправлять запрос второму провайдеру, если первый не ответил за свой p95
+# LLM_HEDGE_DEFAULT_DELAY - задержка hedging пока статистики p95 недостаточно
+# LLM_ATTEMPT_TIMEOUT - таймаут одного провайдера (зависание = ошибка для circuit breaker),
+#   LLM_REQUEST_TIMEOUT - общий дедлайн запроса, в него должен уложиться failover
+LLM_PROVIDER_ORDER = [p.strip() for p in os.getenv('LLM_PROVIDER_ORDER', 'openai,anthropic').lower().split(',') if p.strip()]
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '60'))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv('LLM_ATTEMPT_TIMEOUT', '25'))
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'false').lower() in ('true', '1', 'yes')
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '2.0'))
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '20.0'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
 
 # Настройки голосовых сообщений
 VOICE_ENABLED = os.getenv('VOICE_ENABLED', 'false').lower() in ('true', '1', 'yes')
@@ -62,6 +210,18 @@ VOICE_LANGUAGE = 'ru'  # Язык по умолчанию для транскр
 VOICE_MAX_DURATION = 600  # 10 минут максимальная длительность
 VOICE_MAX_SIZE_MB = 25  # 25MB максимальный размер файла
 
+# Tracing Configuration (тайминги стадий обработки сообщения)
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', '500'))  # Сколько последних трейсов держать в памяти
+
+# Post-Processing Queue (лог в MySQL, запись в Zep, валидация - после отправки ответа)
+# POST_PROCESSING_ENABLED=false - выполнять эти операции синхронно, как раньше
+POST_PROCESSING_ENABLED = os.getenv('POST_PROCESSING_ENABLED', 'true').lower() in ('true', '1', 'yes')
+POST_PROCESSING_WORKERS = int(os.getenv('POST_PROCESSING_WORKERS', '2'))
+POST_PROCESSING_QUEUE_SIZE = int(os.getenv('POST_PROCESSING_QUEUE_SIZE', '1000'))  # Суммарно по всем воркерам
+POST_PROCESSING_BATCH_SIZE = int(os.getenv('POST_PROCESSING_BATCH_SIZE', '20'))  # Сколько логов писать одним INSERT
+POST_PROCESSING_MAX_RETRIES = int(os.getenv('POST_PROCESSING_MAX_RETRIES', '3'))
+POST_PROCESSING_DRAIN_TIMEOUT = float(os.getenv('POST_PROCESSING_DRAIN_TIMEOUT', '10'))  # Ожидание очереди при остановке
+
 # Debug Configuration
 DEBUG_INFO_ENABLED = os.getenv('DEBUG_INFO_ENABLED', 'false').lower() in ('true', '1', 'yes')
 
@@ -105,6 +265,9 @@ else:
     print("⚪ Qdrant Vector Database отключен (USE_QDRANT=false)")
 
 # Информация о статусе Supabase Vector Store
+if USE_LOCAL_INDEX:
+    print(f"🟤 Local Vector Index включен (USE_LOCAL_INDEX=true, {LOCAL_INDEX_DIR})")
+
 if USE_SUPABASE:
     if SUPABASE_URL and SUPABASE_SERVICE_KEY and OPENAI_API_KEY:
         print("🟣 Supabase Vector Store включен (USE_SUPABASE=true, OpenAI embeddings ready)")
@@ -125,11 +125,44 @@ def init_db():
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully (including graphiti_checkpoint)")
 
+        # create_all не добавляет колонки в существующие таблицы
+        _ensure_columns()
+
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         raise
 
 
+# Колонки, добавленные в модели после создания таблиц: (table, column, SQL type)
+ADDED_COLUMNS = [
+    ("message_logs", "stage_timings", "JSON"),
+]
+
+
+def _ensure_columns():
+    """
+    Добавить недостающие колонки в существующие таблицы (ALTER TABLE ... ADD COLUMN).
+    Миграции (alembic) не применяются, поэтому новые nullable колонки добавляем здесь.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table, column, sql_type in ADDED_COLUMNS:
+        if table not in existing_tables:
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table)}
+        if column in columns:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type} NULL"))
+            logger.info(f"Added column {table}.{column} ({sql_type})")
+        except Exception as e:
+            logger.warning(f"Could not add column {table}.{column}: {e}")
+
+
 def check_db_connection():
     """
     Check if database connection is working.
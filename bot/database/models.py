@@ -185,6 +185,9 @@ class MessageLog(Base):
     # Error tracking
     error_message = Column(Text, nullable=True, comment="Сообщение об ошибке если была")
 
+    # Tracing
+    stage_timings = Column(JSON, nullable=True, comment="Длительность стадий обработки в мс {stage: ms}")
+
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True, comment="Время создания записи")
 
@@ -9,6 +9,8 @@ from datetime import datetime
 
 # Database storage
 from bot.services.message_storage_service import message_storage
+from bot.monitoring.tracing import span
+from bot.config import TELEGRAM_API_URL
 
 logger = logging.getLogger(__name__)
 
@@ -82,11 +84,12 @@ class BusinessHandler:
                 session_id = f"business_{user_id}"
 
                 # Создаем пользователя и сессию в Zep
-                await self.agent.ensure_user_exists(str(user_id), {
-                    'first_name': user_name,
-                    'source': 'business_telegram'
-                })
-                await self.agent.ensure_session_exists(session_id, str(user_id))
+                with span("zep_ensure"):
+                    await self.agent.ensure_user_exists(str(user_id), {
+                        'first_name': user_name,
+                        'source': 'business_telegram'
+                    })
+                    await self.agent.ensure_session_exists(session_id, str(user_id))
 
                 # Генерируем ответ
                 response = await self.agent.generate_response(text, session_id, user_name)
@@ -94,7 +97,8 @@ class BusinessHandler:
 
                 # Отправляем через Business API
                 if business_connection_id:
-                    result = self.send_business_message(chat_id, response, business_connection_id)
+                    with span("telegram_send"):
+                        result = self.send_business_message(chat_id, response, business_connection_id)
                     if result:
                         logger.info(f"✅ Business API: ответ отправлен клиенту {user_name}")
 
@@ -223,7 +227,7 @@ class BusinessHandler:
     
     def send_business_message(self, chat_id: int, text: str, business_connection_id: str) -> Optional[Dict[str, Any]]:
         """Отправка сообщения через Business API"""
-        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+        url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/sendMessage"
         data = {
             "chat_id": chat_id,
             "text": text,
@@ -258,7 +262,7 @@ class BusinessHandler:
                 return {"success": False, "error": "too_long"}
             
             # Получаем файл через API
-            file_url = f"https://api.telegram.org/bot{self.bot_token}/getFile?file_id={file_id}"
+            file_url = f"{TELEGRAM_API_URL}/bot{self.bot_token}/getFile?file_id={file_id}"
             file_response = requests.get(file_url, timeout=10)
             file_info = file_response.json()
             
@@ -266,7 +270,7 @@ class BusinessHandler:
                 return {"success": False, "error": "file_not_found"}
             
             file_path = file_info["result"]["file_path"]
-            audio_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+            audio_url = f"{TELEGRAM_API_URL}/file/bot{self.bot_token}/{file_path}"
             
             # Транскрибируем
             transcription = await self.agent.voice_service.transcribe_audio_url(audio_url)
@@ -2,6 +2,7 @@
 🔄 Обработчики сообщений для ignatova-stroinost-bot
 """
 
+import time
 import logging
 import asyncio
 from typing import Dict, Any, Optional
@@ -11,6 +12,9 @@ from datetime import datetime
 
 # Database storage
 from bot.services.message_storage_service import message_storage
+from bot.config import STREAMING_ENABLED, TELEGRAM_API_URL
+from bot.handlers.stream_sender import TelegramStreamWriter
+from bot.monitoring.tracing import span, add_span, current_trace, finish_trace, discard_trace
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +35,8 @@ class MessageHandler:
         # TELEGRAM LIMITS
         self.TELEGRAM_MAX_MESSAGE_LENGTH = 4096  # Telegram лимит символов в сообщении
 
-    def _split_long_message(self, text: str, max_length: int = 4096) -> list:
+    @staticmethod
+    def _split_long_message(text: str, max_length: int = 4096) -> list:
         """
         Разбивает длинное сообщение на части по max_length символов.
         Старается разбивать по параграфам (\n\n) или предложениям.
@@ -104,6 +109,20 @@ class MessageHandler:
         # Объединяем все тексты через двойной перевод строки
         combined_text = "\n\n".join(msg.get("text", "") for msg in buffered_messages)
 
+        # Время ожидания в буфере (от последнего сообщения до обработки)
+        buffered_at = buffered_messages[-1].get("_buffered_at")
+        if buffered_at is not None:
+            add_span("buffering", (time.monotonic() - buffered_at) * 1000)
+
+        # Ход ведёт трейс последнего сообщения (его контекст у таймера),
+        # трейсы предыдущих сообщений слиты в него и отбрасываются
+        for msg in buffered_messages[:-1]:
+            discard_trace(msg.pop("_trace", None))
+        buffered_messages[-1].pop("_trace", None)
+        trace = current_trace()
+        if trace is not None and len(buffered_messages) > 1:
+            trace.attrs["merged_messages"] = len(buffered_messages)
+
         # Берем данные из первого сообщения для метаинформации
         first_message = buffered_messages[0]
         combined_message_data = first_message.copy()
@@ -175,19 +194,44 @@ class MessageHandler:
             if self.agent:
                 session_id = f"user_{user_id}"
                 # Убедимся что пользователь и сессия существуют в Zep
-                await self.agent.ensure_user_exists(str(user_id), {
-                    'first_name': user_name,
-                    'source': 'telegram'
-                })
-                await self.agent.ensure_session_exists(session_id, str(user_id))
-
-                # Генерируем ответ
-                response = await self.agent.generate_response(text, session_id, user_name)
-                ai_model = getattr(self.agent, 'current_model', 'unknown')
+                with span("zep_ensure"):
+                    await self.agent.ensure_user_exists(str(user_id), {
+                        'first_name': user_name,
+                        'source': 'telegram'
+                    })
+                    await self.agent.ensure_session_exists(session_id, str(user_id))
+
+                if STREAMING_ENABLED:
+                    # Streaming: показываем ответ по мере генерации
+                    writer = TelegramStreamWriter(
+                        self.bot, chat_id,
+                        split_fn=self._split_long_message,
+                        max_length=self.TELEGRAM_MAX_MESSAGE_LENGTH
+                    )
+
+                    async def on_delta(partial_text: str):
+                        nonlocal typing_active
+                        await writer.update(partial_text)
+                        if writer.started and typing_active:
+                            # Пользователь уже видит текст - typing больше не нужен
+                            typing_active = False
+                            typing_task.cancel()
+
+                    response = await self.agent.generate_response(text, session_id, user_name, on_delta=on_delta)
+                    ai_model = getattr(self.agent, 'current_model', 'unknown')
+
+                    with span("telegram_send"):
+                        await writer.finalize(response)
+                    logger.info(f"✅ Ответ отправлен пользователю {user_name} (streaming)")
+                else:
+                    # Генерируем ответ
+                    response = await self.agent.generate_response(text, session_id, user_name)
+                    ai_model = getattr(self.agent, 'current_model', 'unknown')
 
-                # Отправляем ответ (автоматически разбивается если > 4096 символов)
-                self.send_long_message(chat_id, response)
-                logger.info(f"✅ Ответ отправлен пользователю {user_name}")
+                    # Отправляем ответ (автоматически разбивается если > 4096 символов)
+                    with span("telegram_send"):
+                        self.send_long_message(chat_id, response)
+                    logger.info(f"✅ Ответ отправлен пользователю {user_name}")
 
                 # === СОХРАНЕНИЕ В БД: Шаг 2 - Сохранить сообщение + ответ бота ===
                 if chat_record:
@@ -243,6 +287,9 @@ class MessageHandler:
             typing_task.cancel()
             logger.debug(f"⌨️ Typing indicator stopped for chat {chat_id}")
 
+            # Трейс хода завершён: webhook → buffering → ... → telegram_send
+            await finish_trace(current_trace())
+
     async def handle_regular_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
         """Обработка обычных сообщений"""
         user_id = message_data.get("from", {}).get("id")
@@ -273,6 +320,8 @@ class MessageHandler:
             self.user_buffers[user_id] = []
 
         # Добавляем сообщение в буфер
+        message_data["_buffered_at"] = time.monotonic()
+        message_data["_trace"] = current_trace()
         self.user_buffers[user_id].append(message_data)
         buffer_size = len(self.user_buffers[user_id])
         logger.info(f"➕ Message added to buffer for user {user_id} (buffer size: {buffer_size})")
@@ -295,6 +344,7 @@ class MessageHandler:
                 logger.debug(f"⏱️ Timer cancelled for user {user_id}")
             except Exception as e:
                 logger.error(f"❌ Error in timer callback for user {user_id}: {e}")
+                await finish_trace(current_trace())
 
         # Запускаем таймер
         timer_task = asyncio.create_task(timer_callback())
@@ -394,7 +444,7 @@ class MessageHandler:
             # Получаем файл от Telegram
             logger.info(f"📥 Получаем файл {file_id} от Telegram...")
             file_info = self.bot.get_file(file_id)
-            file_url = f"https://api.telegram.org/file/bot{self.bot.token}/{file_info.file_path}"
+            file_url = f"{TELEGRAM_API_URL}/file/bot{self.bot.token}/{file_info.file_path}"
             logger.info(f"📥 URL файла получен: {file_info.file_path}")
 
             # Транскрибируем через голосовой сервис
@@ -0,0 +1,179 @@
+"""
+📡 Streaming отправка ответа в Telegram
+
+Показывает ответ LLM по мере генерации: первое сообщение отправляется
+после первых токенов, дальше текст дописывается через edit_message_text
+не чаще одного раза в STREAM_EDIT_INTERVAL секунд.
+
+Ответ длиннее лимита Telegram (4096) разбивается тем же алгоритмом,
+что и MessageHandler._split_long_message: заполненные части "замораживаются",
+новые части отправляются отдельными сообщениями. Маркеры [i/n]
+добавляются при финализации.
+
+Промежуточные правки идут без разметки (незакрытые * и _ в середине
+генерации). Финальная правка может быть с parse_mode: если Telegram не
+разобрал разметку ("can't parse entities"), часть повторяется простым
+текстом, а "message is not modified" считается успехом.
+
+Usage:
+    writer = TelegramStreamWriter(bot, chat_id, split_fn=MessageHandler._split_long_message)
+    response = await agent.generate_response(text, session_id, user_name, on_delta=writer.update)
+    await writer.finalize(response)
+"""
+
+import time
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+import telebot
+
+from bot.config import STREAM_EDIT_INTERVAL, STREAM_MIN_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Запас под маркер "[i/n]\n\n" чтобы финальные части не превысили лимит
+PART_MARKER_RESERVE = 16
+
+
+class TelegramStreamWriter:
+    """Прогрессивное редактирование сообщений Telegram по мере генерации ответа"""
+
+    def __init__(
+        self,
+        bot: telebot.TeleBot,
+        chat_id: int,
+        split_fn: Callable[[str, int], list],
+        max_length: int = 4096,
+        edit_interval: float = STREAM_EDIT_INTERVAL,
+        min_chars: int = STREAM_MIN_CHARS
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.split_fn = split_fn
+        self.part_length = max_length - PART_MARKER_RESERVE
+        self.edit_interval = edit_interval
+        self.min_chars = min_chars
+
+        self._message_ids: List[int] = []   # message_id каждой отправленной части
+        self._shown: List[str] = []         # текст, который сейчас виден в каждой части
+        self._modes: List[Optional[str]] = []  # parse_mode, с которым показана каждая часть
+        self._last_render = 0.0
+        self._lock = asyncio.Lock()
+        self.edits = 0
+
+    @property
+    def started(self) -> bool:
+        """Отправлено ли пользователю хотя бы одно сообщение"""
+        return bool(self._message_ids)
+
+    async def update(self, text: str):
+        """
+        Callback для on_delta: получает накопленный текст ответа
+
+        Троттлинг: пропускаем обновление если с прошлого редактирования
+        прошло меньше edit_interval или текста пока слишком мало.
+        Пропущенный текст будет показан следующим обновлением или finalize().
+        """
+        if not self.started and len(text.strip()) < self.min_chars:
+            return
+        if time.monotonic() - self._last_render < self.edit_interval:
+            return
+        if self._lock.locked():
+            # Предыдущее редактирование ещё идёт - не копим очередь
+            return
+
+        async with self._lock:
+            await self._render(self.split_fn(text, self.part_length))
+            self._last_render = time.monotonic()
+
+    async def finalize(self, final_text: str, parse_mode: Optional[str] = None):
+        """
+        Показать финальный текст ответа
+
+        Добавляет маркеры [i/n] если ответ занял несколько сообщений.
+        Если во время генерации ничего не было отправлено - просто отправляет ответ.
+        """
+        async with self._lock:
+            parts = self.split_fn(final_text, self.part_length)
+            if len(parts) > 1:
+                total = len(parts)
+                parts = [
+                    f"[{i}/{total}]\n\n{part}" if i == 1 else f"{part}\n\n[{i}/{total}]"
+                    for i, part in enumerate(parts, 1)
+                ]
+
+            await self._render(parts, parse_mode=parse_mode)
+
+            # Финальный текст короче промежуточного - удаляем лишние части
+            for message_id in self._message_ids[len(parts):]:
+                try:
+                    await asyncio.to_thread(self.bot.delete_message, self.chat_id, message_id)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось удалить лишнюю часть стрима: {e}")
+            del self._message_ids[len(parts):]
+            del self._shown[len(parts):]
+            del self._modes[len(parts):]
+
+        logger.info(f"📡 Streaming ответ финализирован: {len(final_text)} символов, {len(parts)} сообщ., {self.edits} правок")
+
+    async def _render(self, parts: List[str], parse_mode: Optional[str] = None):
+        """Синхронизировать отправленные сообщения с нужными частями текста"""
+        for i, part in enumerate(parts):
+            if not part:
+                continue
+
+            if i < len(self._message_ids):
+                if self._shown[i] == part and self._modes[i] == parse_mode:
+                    # Часть не изменилась ("заморожена") - Telegram вернул бы ошибку "message is not modified"
+                    continue
+                applied = await self._edit(self._message_ids[i], part, parse_mode)
+                if applied is not False:
+                    self._shown[i] = part
+                    self._modes[i] = applied
+                continue
+
+            message, applied = await self._send(part, parse_mode)
+            if message is None:
+                # Не смогли отправить часть - следующие части не отправляем, чтобы не нарушить порядок
+                return
+            self._message_ids.append(message.message_id)
+            self._shown.append(part)
+            self._modes.append(applied)
+
+    @staticmethod
+    def _is_parse_error(error: Exception) -> bool:
+        return "can't parse entities" in str(error).lower()
+
+    @staticmethod
+    def _is_not_modified(error: Exception) -> bool:
+        return "message is not modified" in str(error).lower()
+
+    async def _send(self, text: str, parse_mode: Optional[str]):
+        """Отправить часть; возвращает (message, применённый parse_mode)"""
+        try:
+            message = await asyncio.to_thread(self.bot.send_message, self.chat_id, text, parse_mode=parse_mode)
+            return message, parse_mode
+        except Exception as e:
+            if parse_mode and self._is_parse_error(e):
+                logger.warning(f"⚠️ Telegram не разобрал {parse_mode}, отправляем без разметки: {e}")
+                return await self._send(text, None)
+            logger.error(f"❌ Ошибка отправки части стрима: {e}")
+            return None, None
+
+    async def _edit(self, message_id: int, text: str, parse_mode: Optional[str]):
+        """Отредактировать часть; возвращает применённый parse_mode или False при ошибке"""
+        try:
+            await asyncio.to_thread(
+                self.bot.edit_message_text, text, self.chat_id, message_id, parse_mode=parse_mode
+            )
+            self.edits += 1
+            return parse_mode
+        except Exception as e:
+            if self._is_not_modified(e):
+                return parse_mode
+            if parse_mode and self._is_parse_error(e):
+                logger.warning(f"⚠️ Telegram не разобрал {parse_mode}, правка без разметки: {e}")
+                return await self._edit(message_id, text, None)
+            logger.warning(f"⚠️ Ошибка редактирования части стрима: {e}")
+            return False
@@ -3,5 +3,11 @@
 """
 
 from .embedding_monitor import EmbeddingMetrics, get_metrics, track_embedding_call
+from .prompt_cache_monitor import PromptCacheMetrics, get_prompt_cache_metrics
+from .tracing import start_trace, finish_trace, discard_trace, span, add_span, current_trace, get_trace_buffer
 
-__all__ = ['EmbeddingMetrics', 'get_metrics', 'track_embedding_call']
+__all__ = [
+    'EmbeddingMetrics', 'get_metrics', 'track_embedding_call',
+    'PromptCacheMetrics', 'get_prompt_cache_metrics',
+    'start_trace', 'finish_trace', 'discard_trace', 'span', 'add_span', 'current_trace', 'get_trace_buffer'
+]
@@ -21,6 +21,8 @@ class EmbeddingMetrics:
     total_cost_usd: float = 0.0
     latencies_ms: List[float] = field(default_factory=list)
     errors: int = 0
+    cache_hits: int = 0  # Embedding взят из EmbeddingCache (без вызова API/encoder)
+    cache_misses: int = 0
     start_time: float = field(default_factory=time.time)
 
     # Константы стоимости (OpenAI text-embedding-3-small)
@@ -39,6 +41,21 @@ class EmbeddingMetrics:
             cost = (tokens / 1000.0) * self.COST_PER_1K_TOKENS
             self.total_cost_usd += cost
 
+    def add_cache_lookup(self, hit: bool):
+        """Добавить обращение к кэшу embeddings"""
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Процент попаданий в кэш embeddings (0-100)"""
+        lookups = self.cache_hits + self.cache_misses
+        if lookups == 0:
+            return 0.0
+        return (self.cache_hits / lookups) * 100.0
+
     @property
     def avg_latency_ms(self) -> float:
         """Средняя latency в миллисекундах"""
@@ -101,6 +118,11 @@ class EmbeddingMetrics:
                 "min_ms": round(self.min_latency_ms, 2),
                 "max_ms": round(self.max_latency_ms, 2)
             },
+            "cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate_percent": round(self.cache_hit_rate, 2)
+            },
             "uptime_seconds": round(self.uptime_seconds, 1),
             "started_at": datetime.fromtimestamp(self.start_time).isoformat()
         }
@@ -112,6 +134,8 @@ class EmbeddingMetrics:
         self.total_cost_usd = 0.0
         self.latencies_ms = []
         self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.start_time = time.time()
         logger.info("🔄 Метрики embeddings сброшены")
 
@@ -0,0 +1,109 @@
+"""
+Мониторинг prompt caching OpenAI
+Отслеживает usage.prompt_tokens_details.cached_tokens по каждой модели
+"""
+
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelCacheStats:
+    """Счётчики prompt caching для одной модели"""
+
+    calls: int = 0
+    calls_with_cache: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        """Доля входных токенов из кэша (0-100)"""
+        if self.prompt_tokens == 0:
+            return 0.0
+        return (self.cached_tokens / self.prompt_tokens) * 100.0
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "calls_with_cache": self.calls_with_cache,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio_percent": round(self.cache_hit_ratio, 2)
+        }
+
+
+@dataclass
+class PromptCacheMetrics:
+    """Метрики prompt caching по моделям"""
+
+    models: Dict[str, ModelCacheStats] = field(default_factory=dict)
+    start_time: float = field(default_factory=time.time)
+
+    def add_usage(self, model: str, usage: Any):
+        """
+        Записать usage ответа chat.completions
+
+        Args:
+            model: Фактическая модель из ответа
+            usage: response.usage (CompletionUsage) или None
+        """
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+
+        stats = self.models.setdefault(model or "unknown", ModelCacheStats())
+        stats.calls += 1
+        stats.prompt_tokens += prompt_tokens
+        stats.cached_tokens += cached_tokens
+        stats.completion_tokens += getattr(usage, "completion_tokens", None) or 0
+        if cached_tokens:
+            stats.calls_with_cache += 1
+
+        logger.info(f"💾 Prompt cache: {cached_tokens}/{prompt_tokens} входных токенов из кэша (модель: {model})")
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Получить сводку метрик для API"""
+        total = ModelCacheStats()
+        for stats in self.models.values():
+            total.calls += stats.calls
+            total.calls_with_cache += stats.calls_with_cache
+            total.prompt_tokens += stats.prompt_tokens
+            total.cached_tokens += stats.cached_tokens
+            total.completion_tokens += stats.completion_tokens
+
+        return {
+            "total": total.get_summary(),
+            "models": {model: stats.get_summary() for model, stats in self.models.items()},
+            "uptime_seconds": round(time.time() - self.start_time, 1),
+            "started_at": datetime.fromtimestamp(self.start_time).isoformat()
+        }
+
+    def reset(self):
+        """Сбросить все метрики"""
+        self.models = {}
+        self.start_time = time.time()
+        logger.info("🔄 Метрики prompt caching сброшены")
+
+
+# Singleton instance
+_prompt_cache_metrics = None
+
+
+def get_prompt_cache_metrics() -> PromptCacheMetrics:
+    """Получить глобальный экземпляр метрик prompt caching"""
+    global _prompt_cache_metrics
+    if _prompt_cache_metrics is None:
+        _prompt_cache_metrics = PromptCacheMetrics()
+        logger.info("📊 Инициализирован мониторинг prompt caching")
+    return _prompt_cache_metrics
@@ -0,0 +1,259 @@
+"""
+Трейсинг стадий обработки сообщения
+
+Каждый ход диалога - Trace, каждая стадия - Span с длительностью:
+webhook → buffering → zep_ensure → kb_search / embedding / zep_fetch →
+llm → telegram_send
+
+Лог в MySQL, запись в Zep и валидация выполняются очередью пост-обработки
+вне критического пути: их спаны (post:log_message, post:zep_write,
+post:validation) дописываются в трейс хода после его завершения - видны
+в /api/admin/traces, но не входят в total и в MessageLog.stage_timings.
+
+Трейс начинается на каждый update и закрывается в finally обработчика
+update; обычные сообщения уходят в буфер и закрываются после ответа, а
+трейсы сообщений, объединённых буфером в один ход, отбрасываются.
+
+Trace хранится в contextvar, поэтому span() из любого места пайплайна
+(включая задачи asyncio.gather) пишет в трейс текущего хода. Без активного
+трейса span() ничего не делает.
+
+Завершённые трейсы попадают в кольцевой буфер (TRACE_BUFFER_SIZE) для
+/api/admin/traces, а stage_timings сохраняются в MessageLog по message_id.
+
+Usage:
+    from bot.monitoring.tracing import start_trace, span, finish_trace
+
+    trace = start_trace(chat_id=chat_id)
+    with span("llm"):
+        response = await call_llm(...)
+    await finish_trace(trace)
+"""
+
+import time
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bot.config import TRACE_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    """Одна стадия хода"""
+
+    name: str
+    start_ms: float  # смещение от начала трейса
+    duration_ms: float
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "name": self.name,
+            "start_ms": round(self.start_ms, 1),
+            "duration_ms": round(self.duration_ms, 1)
+        }
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+@dataclass
+class Trace:
+    """Трейс одного хода диалога"""
+
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    message_id: Optional[str] = None
+    spans: List[Span] = field(default_factory=list)
+    started_at: float = field(default_factory=time.time)
+    started_monotonic: float = field(default_factory=time.monotonic)
+    total_ms: Optional[float] = None
+    token: Any = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.total_ms is not None
+
+    def add_span(self, name: str, duration_ms: float, start_monotonic: Optional[float] = None, error: Optional[str] = None):
+        start = start_monotonic if start_monotonic is not None else time.monotonic() - duration_ms / 1000
+        self.spans.append(Span(
+            name=name,
+            start_ms=(start - self.started_monotonic) * 1000,
+            duration_ms=duration_ms,
+            error=error
+        ))
+
+    def stage_timings(self) -> Dict[str, float]:
+        """Суммарная длительность по стадиям, мс (для MessageLog.stage_timings)"""
+        timings: Dict[str, float] = {}
+        for s in self.spans:
+            timings[s.name] = round(timings.get(s.name, 0.0) + s.duration_ms, 1)
+        if self.total_ms is not None:
+            timings["total"] = round(self.total_ms, 1)
+        return timings
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "message_id": self.message_id,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "total_ms": round(self.total_ms, 1) if self.total_ms is not None else None,
+            "attrs": self.attrs,
+            "spans": [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start_ms)]
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    """Активный (незавершённый) трейс текущего контекста или None"""
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        return None
+    return trace
+
+
+def start_trace(**attrs) -> Trace:
+    """Начать трейс и сделать его активным в текущем контексте"""
+    trace = Trace(attrs=attrs)
+    trace.token = _current_trace.set(trace)
+    return trace
+
+
+def set_trace_message_id(message_id: str):
+    """Привязать активный трейс к message_id (M{uuid}) из MessageLog"""
+    trace = current_trace()
+    if trace is not None:
+        trace.message_id = message_id
+
+
+@contextmanager
+def span(name: str):
+    """Замерить стадию в активном трейсе (работает и внутри async кода)"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+
+    start = time.monotonic()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, (time.monotonic() - start) * 1000, start_monotonic=start, error=error)
+
+
+def add_span(name: str, duration_ms: float):
+    """Записать уже измеренную стадию (например, время ожидания в буфере)"""
+    trace = current_trace()
+    if trace is not None:
+        trace.add_span(name, duration_ms)
+
+
+class TraceBuffer:
+    """Кольцевой буфер завершённых трейсов + перцентили по стадиям"""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self._traces: deque = deque(maxlen=size)
+
+    def add(self, trace: Trace):
+        self._traces.append(trace)
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        return [t.to_dict() for t in list(self._traces)[-limit:]][::-1]
+
+    def find(self, message_id: str) -> Optional[Dict[str, Any]]:
+        for trace in reversed(self._traces):
+            if trace.message_id == message_id:
+                return trace.to_dict()
+        return None
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> float:
+        index = min(int(len(values) * q), len(values) - 1)
+        return values[index]
+
+    def stage_summary(self) -> Dict[str, Any]:
+        """p50/p95/p99 длительности каждой стадии по трейсам в буфере"""
+        by_stage: Dict[str, List[float]] = {}
+        for trace in self._traces:
+            for stage, duration in trace.stage_timings().items():
+                by_stage.setdefault(stage, []).append(duration)
+
+        summary = {}
+        for stage, values in by_stage.items():
+            values.sort()
+            summary[stage] = {
+                "count": len(values),
+                "p50_ms": round(self._percentile(values, 0.5), 1),
+                "p95_ms": round(self._percentile(values, 0.95), 1),
+                "p99_ms": round(self._percentile(values, 0.99), 1),
+                "max_ms": round(values[-1], 1)
+            }
+        return {
+            "traces": len(self._traces),
+            "buffer_size": self._traces.maxlen,
+            "stages": summary
+        }
+
+
+# Singleton instance
+_trace_buffer = None
+
+
+def get_trace_buffer() -> TraceBuffer:
+    """Получить глобальный буфер трейсов"""
+    global _trace_buffer
+    if _trace_buffer is None:
+        _trace_buffer = TraceBuffer()
+        logger.info(f"📊 Инициализирован буфер трейсов (size={TRACE_BUFFER_SIZE})")
+    return _trace_buffer
+
+
+def discard_trace(trace: Optional[Trace]):
+    """Закрыть трейс без записи в буфер (update без хода диалога, сообщение слито в буфере)"""
+    if trace is None or trace.finished:
+        return
+
+    trace.total_ms = (time.monotonic() - trace.started_monotonic) * 1000
+    try:
+        _current_trace.reset(trace.token)
+    except (ValueError, RuntimeError):
+        pass
+
+
+async def finish_trace(trace: Optional[Trace], persist: bool = True):
+    """
+    Завершить трейс: в кольцевой буфер и (если есть message_id) в MessageLog.stage_timings
+    """
+    if trace is None or trace.finished:
+        return
+
+    trace.total_ms = (time.monotonic() - trace.started_monotonic) * 1000
+    get_trace_buffer().add(trace)
+
+    try:
+        _current_trace.reset(trace.token)
+    except (ValueError, RuntimeError):
+        # Трейс завершается в другом контексте (другой задаче) - достаточно флага finished
+        pass
+
+    timings = trace.stage_timings()
+    logger.info(f"⏱️ Trace #{trace.message_id or '-'}: " + ", ".join(f"{k}={v:.0f}ms" for k, v in timings.items()))
+
+    if persist and trace.message_id:
+        try:
+            # Через очередь пост-обработки: лог сообщения может быть ещё не записан
+            from bot.services.post_processing import get_post_processor
+            await get_post_processor().submit_stage_timings(trace.message_id, timings)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить stage_timings (non-critical): {e}")
@@ -0,0 +1,238 @@
+"""
+Semantic Answer Cache
+
+Кэш готовых ответов перед TextilProAgent.generate_response.
+Студенты часто задают одни и те же вопросы разными словами - если embedding
+нового вопроса близок к закэшированному (cosine >= порога) и версии
+инструкции и базы знаний совпадают, ответ возвращается без поиска по KB,
+чтения Zep и LLM запроса.
+
+Features:
+- Cosine similarity по нормализованным embeddings (NumPy если доступен)
+- Ключ версии: instruction last_updated + версия KB (kb_version.json)
+- Bounded LRU + TTL
+- Имя студента заменяется плейсхолдером при сохранении
+- Метрики hit/miss
+
+Usage:
+    from bot.services.answer_cache import get_answer_cache
+
+    cache = get_answer_cache()
+    hit = cache.lookup(embedding, instruction_version, kb_version)
+    if hit:
+        return hit.render(user_name)
+"""
+
+import math
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from bot.config import (
+    ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Плейсхолдер имени студента в закэшированном ответе
+STUDENT_NAME_PLACEHOLDER = "{{student_name}}"
+DEFAULT_STUDENT_NAME = "Дорогая"
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+@dataclass
+class CachedAnswer:
+    """Закэшированный ответ"""
+
+    query: str
+    answer: str  # с плейсхолдером вместо имени студента
+    embedding: List[float]  # нормализованный
+    instruction_version: str
+    kb_version: str
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+@dataclass
+class AnswerCacheHit:
+    """Результат успешного lookup"""
+
+    entry: CachedAnswer
+    similarity: float
+
+    def render(self, user_name: Optional[str] = None) -> str:
+        """Ответ с подставленным именем текущего студента"""
+        return self.entry.answer.replace(STUDENT_NAME_PLACEHOLDER, user_name or DEFAULT_STUDENT_NAME)
+
+
+class AnswerCache:
+    """Semantic кэш ответов: LRU + TTL, lookup по cosine similarity"""
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+
+        # Матрица embeddings для векторного lookup (перестраивается лениво)
+        self._matrix = None
+        self._matrix_ids: List[int] = []
+        self._dirty = True
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.stale_dropped = 0
+
+    def _is_fresh(self, entry: CachedAnswer) -> bool:
+        return (time.monotonic() - entry.created_at) < self.ttl_seconds
+
+    def _drop(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._dirty = True
+
+    def _similarities(self, query_vector: List[float]) -> List[tuple]:
+        """[(entry_id, cosine)] для всех записей"""
+        if NUMPY_AVAILABLE:
+            if self._dirty:
+                self._matrix_ids = list(self._entries.keys())
+                self._matrix = (
+                    np.array([self._entries[i].embedding for i in self._matrix_ids], dtype=np.float32)
+                    if self._matrix_ids else None
+                )
+                self._dirty = False
+            if self._matrix is None:
+                return []
+            scores = self._matrix @ np.asarray(query_vector, dtype=np.float32)
+            return list(zip(self._matrix_ids, scores.tolist()))
+
+        return [
+            (entry_id, sum(a * b for a, b in zip(entry.embedding, query_vector)))
+            for entry_id, entry in self._entries.items()
+        ]
+
+    def lookup(self, embedding: List[float], instruction_version: str, kb_version: str) -> Optional[AnswerCacheHit]:
+        """
+        Найти ближайший закэшированный ответ
+
+        Записи с другой версией инструкции/KB или с истёкшим TTL удаляются.
+        """
+        query_vector = _normalize(embedding)
+
+        best_id, best_score = None, -1.0
+        stale = []
+        for entry_id, score in self._similarities(query_vector):
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            if (
+                not self._is_fresh(entry)
+                or entry.instruction_version != instruction_version
+                or entry.kb_version != kb_version
+            ):
+                stale.append(entry_id)
+                continue
+            if score > best_score:
+                best_id, best_score = entry_id, score
+
+        for entry_id in stale:
+            self._drop(entry_id)
+        self.stale_dropped += len(stale)
+
+        if best_id is None or best_score < self.threshold:
+            self.misses += 1
+            return None
+
+        entry = self._entries[best_id]
+        entry.hits += 1
+        self._entries.move_to_end(best_id)
+        self.hits += 1
+        return AnswerCacheHit(entry=entry, similarity=best_score)
+
+    def store(
+        self,
+        query: str,
+        embedding: List[float],
+        answer: str,
+        instruction_version: str,
+        kb_version: str,
+        user_name: Optional[str] = None
+    ):
+        """Сохранить ответ (имя студента заменяется плейсхолдером)"""
+        if user_name and len(user_name.strip()) >= 2:
+            answer = answer.replace(user_name.strip(), STUDENT_NAME_PLACEHOLDER)
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = CachedAnswer(
+            query=query,
+            answer=answer,
+            embedding=_normalize(embedding),
+            instruction_version=instruction_version,
+            kb_version=kb_version
+        )
+        self._dirty = True
+        self.stores += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._dirty = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "stale_dropped": self.stale_dropped,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0.0,
+            "numpy": NUMPY_AVAILABLE
+        }
+
+
+# Singleton instance
+_answer_cache = None
+
+
+def get_answer_cache() -> AnswerCache:
+    """Получить singleton instance AnswerCache"""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+        logger.info(f"♻️ Answer cache: threshold={ANSWER_CACHE_THRESHOLD}, TTL={ANSWER_CACHE_TTL_SECONDS}s, max={ANSWER_CACHE_MAX_ENTRIES}")
+    return _answer_cache
@@ -0,0 +1,202 @@
+"""
+BM25 Index
+
+Инвертированный индекс с ранжированием BM25 для лексического поиска
+по базе знаний (русская токенизация и стемминг - russian_text.py).
+
+Индекс строится один раз на версию базы знаний и сохраняется в JSON
+(BM25_INDEX_DIR): при старте он читается с диска, а поиск - это обход
+постинг-листов терминов запроса без чтения файлов и regex.
+
+Документы индекса - dict с полями id, entity_type, title, content, metadata
+(как у kb_corpus), поэтому один класс обслуживает и fallback по markdown
+файлам, и корпус data/parsed_kb.
+
+Usage:
+    from bot.services.bm25_index import BM25Index, load_or_build
+
+    index = load_or_build("fallback", fingerprint, build_documents)
+    hits = index.search("что такое мозгоритм", limit=5)
+    for hit in hits:
+        hit.document["title"], hit.score, hit.relevance
+"""
+
+import os
+import json
+import math
+import time
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from bot.config import BM25_INDEX_DIR
+from bot.services.russian_text import tokenize, TOKENIZER_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Параметры BM25 (стандартные значения Robertson/Okapi)
+K1 = 1.5
+B = 0.75
+
+
+@dataclass
+class BM25Hit:
+    """Найденный документ"""
+
+    document: Dict[str, Any]
+    score: float  # Сырой BM25
+    relevance: float  # 0-1: доля от максимально возможного BM25 для этого запроса
+    matched_terms: int
+
+
+class BM25Index:
+    """Инвертированный индекс: терм → [номера документов], [частоты]"""
+
+    def __init__(
+        self,
+        documents: List[Dict[str, Any]],
+        postings: Dict[str, List[List[int]]],
+        doc_lengths: List[int],
+        fingerprint: str = ""
+    ):
+        self.documents = documents
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.fingerprint = fingerprint
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+        count = len(documents)
+        # IDF с +1 (вариант Lucene) - неотрицательный даже для частых термов
+        self.idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, documents: List[Dict[str, Any]], fingerprint: str = "") -> "BM25Index":
+        """
+        Построить индекс
+
+        Индексируется title + content документа, либо поле search_text, если
+        оно задано (полный текст, когда content хранится обрезанным).
+        search_text удаляется из документа и не сериализуется.
+        """
+        postings: Dict[str, List[List[int]]] = {}
+        doc_lengths = []
+        for doc_id, doc in enumerate(documents):
+            text = doc.pop("search_text", None) or f"{doc.get('title', '')}\n{doc.get('content', '')}"
+            terms = tokenize(text)
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                entry = postings.setdefault(term, [[], []])
+                entry[0].append(doc_id)
+                entry[1].append(tf)
+        return cls(documents, postings, doc_lengths, fingerprint)
+
+    def search(self, query: str, limit: int = 5, entity_type: Optional[str] = None) -> List[BM25Hit]:
+        """Top-N документов по BM25 (опционально только заданного entity_type)"""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.documents:
+            return []
+
+        scores: Dict[int, float] = {}
+        matched: Counter = Counter()
+        max_possible = 0.0
+        norm = K1 / self.avg_length if self.avg_length else 0.0
+
+        for term in query_terms:
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            idf = self.idf[term]
+            max_possible += idf * (K1 + 1)
+            doc_lengths = self.doc_lengths
+            for doc_id, tf in zip(entry[0], entry[1]):
+                denominator = tf + K1 * (1 - B) + norm * B * doc_lengths[doc_id]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / denominator
+                matched[doc_id] += 1
+
+        if entity_type is not None:
+            scores = {d: s for d, s in scores.items() if self.documents[d].get("entity_type") == entity_type}
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            BM25Hit(
+                document=self.documents[doc_id],
+                score=score,
+                relevance=score / max_possible if max_possible else 0.0,
+                matched_terms=matched[doc_id]
+            )
+            for doc_id, score in top
+        ]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def save(self, path: str):
+        """Сохранить индекс в JSON (атомарная замена файла)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = {
+            "tokenizer": TOKENIZER_VERSION,
+            "fingerprint": self.fingerprint,
+            "documents": self.documents,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings
+        }
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: Optional[str] = None) -> Optional["BM25Index"]:
+        """Загрузить индекс с диска (None если файла нет, он от другой версии KB или токенизатора)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ BM25: не удалось прочитать {path}: {e}")
+            return None
+
+        if data.get("tokenizer") != TOKENIZER_VERSION:
+            return None
+        if fingerprint is not None and data.get("fingerprint") != fingerprint:
+            return None
+        return cls(data["documents"], data["postings"], data["doc_lengths"], data.get("fingerprint", ""))
+
+
+def load_or_build(
+    name: str,
+    fingerprint: str,
+    build_documents: Callable[[], List[Dict[str, Any]]],
+    index_dir: str = BM25_INDEX_DIR
+) -> BM25Index:
+    """
+    Индекс с диска, если он построен для этого fingerprint, иначе построить и сохранить
+
+    Args:
+        name: Имя индекса (файл {index_dir}/{name}.json)
+        fingerprint: Версия исходных данных (версия KB + отпечаток файлов)
+        build_documents: Функция, возвращающая документы для построения
+    """
+    path = os.path.join(index_dir, f"{name}.json")
+    start = time.perf_counter()
+
+    index = BM25Index.load(path, fingerprint)
+    if index is not None:
+        logger.info(f"📇 BM25 '{name}': загружен с диска ({len(index)} документов, {(time.perf_counter() - start) * 1000:.1f}ms)")
+        return index
+
+    index = BM25Index.build(build_documents(), fingerprint)
+    logger.info(
+        f"📇 BM25 '{name}': построен ({len(index)} документов, {len(index.postings)} термов, "
+        f"{(time.perf_counter() - start) * 1000:.0f}ms)"
+    )
+    try:
+        index.save(path)
+    except OSError as e:
+        logger.warning(f"⚠️ BM25 '{name}': не удалось сохранить индекс ({e}), будет построен заново при старте")
+    return index
@@ -0,0 +1,208 @@
+"""
+Context Packer
+
+Упаковка результатов поиска в контекст для LLM по бюджету ТОКЕНОВ.
+
+Раньше format_context_for_llm резал контекст по символам (max_length=15000)
+и обрезал последний результат посреди текста. Для кириллицы символы плохо
+предсказывают число токенов, поэтому размер промпта "гулял".
+
+Алгоритм:
+1. Подсчёт токенов токенайзером целевой модели (tiktoken, если установлен;
+   иначе консервативная оценка по длине текста)
+2. Жадный выбор по relevance / tokens в пределах бюджета
+3. Если результат не помещается целиком - обрезка по границе предложения
+4. Вывод в порядке убывания релевантности
+
+Почти-дубликаты сюда не доходят: их убирает KnowledgeSearchService
+(SimHash, bot/services/near_duplicate.py).
+
+Encoding tiktoken загружается не в event loop: при старте (load_encoding
+в потоке) или, если запрос пришёл раньше, фоновым потоком - до загрузки
+используется оценка по длине текста.
+
+Usage:
+    from bot.services.context_packer import pack_results, count_tokens
+
+    packed = pack_results(results, budget_tokens=4000, header_fn=lambda i, r: f"...")
+"""
+
+import re
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from bot.config import OPENAI_MODEL
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+if not TIKTOKEN_AVAILABLE:
+    logger.warning("⚠️ tiktoken not installed - KB context budget uses a chars/3 estimate. Install: pip install tiktoken")
+
+# Оценка без tiktoken: ~3 символа на токен для русского текста (с запасом)
+CHARS_PER_TOKEN_ESTIMATE = 3.0
+
+# Минимальный остаток бюджета, ради которого имеет смысл обрезать результат
+MIN_PARTIAL_TOKENS = 60
+
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+# model → encoding (None - загрузка не удалась); модели, загружаемые сейчас
+_encodings: Dict[str, Any] = {}
+_loading: set = set()
+_encodings_lock = threading.Lock()
+
+
+def load_encoding(model: str = OPENAI_MODEL):
+    """
+    Загрузить tiktoken encoding модели. Блокирующий вызов: при первом
+    использовании tiktoken скачивает файл BPE - вызывать в потоке
+    """
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    with _encodings_lock:
+        if model in _encodings:
+            return _encodings[model]
+        _loading.add(model)
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # Новые модели могут отсутствовать в таблице tiktoken
+            encoding = tiktoken.get_encoding("o200k_base")
+        logger.info(f"✅ tiktoken: encoding {encoding.name} для {model}")
+    except Exception as e:
+        # Без сети файла BPE может не быть
+        logger.warning(f"⚠️ tiktoken: encoding для {model} недоступен ({type(e).__name__}: {e}), оценка chars/3")
+        encoding = None
+    with _encodings_lock:
+        _encodings[model] = encoding
+        _loading.discard(model)
+    return encoding
+
+
+def _get_encoding(model: str):
+    """Загруженный encoding или None (тогда загрузка запускается в фоновом потоке)"""
+    encoding = _encodings.get(model)
+    if encoding is not None or not TIKTOKEN_AVAILABLE:
+        return encoding
+    with _encodings_lock:
+        if model in _encodings or model in _loading:
+            return None
+        _loading.add(model)
+    threading.Thread(target=load_encoding, args=(model,), name="tiktoken-load", daemon=True).start()
+    return None
+
+
+def count_tokens(text: str, model: str = OPENAI_MODEL) -> int:
+    """Количество токенов текста для модели"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, int(len(text) / CHARS_PER_TOKEN_ESTIMATE + 0.5))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = OPENAI_MODEL) -> str:
+    """
+    Обрезать текст до max_tokens по границе предложения
+
+    Если не помещается даже первое предложение - обрезка по словам с "...".
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    kept = []
+    used = 0
+    for sentence in _SENTENCE_SPLIT.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence + " ", model)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+
+    if kept:
+        return " ".join(kept)
+
+    # Первое предложение длиннее бюджета - режем по словам
+    words = text.split()
+    kept_words = []
+    used = 0
+    for word in words:
+        tokens = count_tokens(word + " ", model)
+        if used + tokens > max_tokens - 1:
+            break
+        kept_words.append(word)
+        used += tokens
+    return " ".join(kept_words) + "..." if kept_words else ""
+
+
+def pack_results(
+    results: list,
+    budget_tokens: int,
+    header_fn: Callable[[int, object], str],
+    model: str = OPENAI_MODEL
+) -> List[Tuple[object, str]]:
+    """
+    Выбрать результаты и их текст в пределах бюджета токенов
+
+    Args:
+        results: SearchResult (нужны .content и .relevance_score), уже без почти-дубликатов
+        budget_tokens: Бюджет на весь блок (заголовки + контент)
+        header_fn: Заголовок результата по (номер, result) - учитывается в бюджете
+
+    Returns:
+        [(result, content)] в порядке убывания релевантности;
+        content может быть обрезан по границе предложения
+    """
+    candidates = sorted(results, key=lambda r: r.relevance_score, reverse=True)
+
+    # Стоимость заголовка считаем с максимальным номером - финальная нумерация ещё неизвестна
+    costs = {
+        id(result): (
+            count_tokens(result.content, model),
+            count_tokens(header_fn(len(candidates), result), model)
+        )
+        for result in candidates
+    }
+
+    # 1. Жадный выбор по релевантности на токен
+    by_density = sorted(
+        candidates,
+        key=lambda r: r.relevance_score / max(sum(costs[id(r)]), 1),
+        reverse=True
+    )
+
+    selected = {}
+    remaining = budget_tokens
+    for result in by_density:
+        tokens, header_tokens = costs[id(result)]
+        if tokens + header_tokens <= remaining:
+            selected[id(result)] = result.content
+            remaining -= tokens + header_tokens
+        elif remaining - header_tokens >= MIN_PARTIAL_TOKENS:
+            content = truncate_to_tokens(result.content, remaining - header_tokens, model)
+            if content:
+                selected[id(result)] = content
+                remaining -= count_tokens(content, model) + header_tokens
+
+    # 2. Порядок вывода - по релевантности
+    packed = [(result, selected[id(result)]) for result in candidates if id(result) in selected]
+
+    logger.info(
+        f"📦 Context packing: {len(packed)}/{len(results)} результатов, "
+        f"{budget_tokens - remaining}/{budget_tokens} токенов"
+        f"{'' if _encodings.get(model) is not None else ' (оценка без tiktoken)'}"
+    )
+    return packed
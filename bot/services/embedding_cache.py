@@ -0,0 +1,286 @@
+"""
+Embedding Cache
+
+Общий кэш embeddings запросов для всех сервисов поиска:
+- SupabaseService / LocalVectorIndex - OpenAI embeddings API (100-300ms на вызов)
+- QdrantService - SentenceTransformer.encode на CPU
+- TextilProAgent - embedding вопроса для semantic кэша ответов
+
+Студенты повторяют одни и те же вопросы, а админский /test_search гоняет
+одни и те же запросы - повторный embedding берётся из кэша.
+
+Features:
+- Ключ: (модель, нормализованный текст) - регистр и пробелы не важны
+- Bounded LRU в памяти (EMBEDDING_CACHE_MAX_ENTRIES)
+- Запись в SQLite (EMBEDDING_CACHE_PATH): кэш переживает рестарт,
+  вытесненные из памяти записи поднимаются с диска
+- Диск не трогается в event loop: чтение с диска - в потоке, записи
+  копятся и сбрасываются пачкой (одна транзакция) фоновым потоком writer;
+  открытие/очистка базы и подсчёт записей на диске - тоже в нём
+- Hit/miss пишутся в EmbeddingMetrics (/api/admin/embedding/stats)
+
+Usage:
+    from bot.services.embedding_cache import get_embedding_cache
+
+    cache = get_embedding_cache()
+    vector = await cache.get(model, text)
+    if vector is None:
+        vector = generate(text)
+        cache.put(model, text, vector)
+"""
+
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bot.config import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH
+
+# Мониторинг (опционально)
+try:
+    from bot.monitoring import get_metrics
+    MONITORING_AVAILABLE = True
+except ImportError:
+    MONITORING_AVAILABLE = False
+    get_metrics = None
+
+logger = logging.getLogger(__name__)
+
+# При старте на диске остаются записи не старше 30 дней,
+# не больше DISK_ENTRIES_FACTOR * max_entries самых свежих
+DISK_MAX_AGE_SECONDS = 30 * 24 * 3600
+DISK_ENTRIES_FACTOR = 10
+# Сколько чтение с диска ждёт открытия базы при старте, сек
+DISK_OPEN_WAIT_SECONDS = 5.0
+
+
+def normalize_text(text: str) -> str:
+    """Текст запроса для ключа кэша: нижний регистр, схлопнутые пробелы"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """LRU кэш embeddings с write-through в SQLite"""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, path: Optional[str] = EMBEDDING_CACHE_PATH):
+        self.max_entries = max_entries
+        self.path = path or None
+        self._entries: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None  # Открывается в потоке writer
+        self._disk = bool(self.path)  # False, если SQLite недоступен
+        self._disk_entries: Optional[int] = None  # COUNT(*) после последней записи (поток writer)
+        self._opened = threading.Event()  # _open_db завершён (успешно или нет)
+        # Соединение SQLite используется из потока чтения и потока записи
+        self._db_lock = threading.Lock()
+        # Записи, ожидающие сброса на диск: ключ → (vector, updated_at)
+        self._pending: Dict[Tuple[str, str], Tuple[List[float], float]] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache-writer")
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.disk_writes = 0
+
+        if self._disk:
+            # Открытие и чистка старых записей - первой задачей writer, не в event loop
+            self._writer.submit(self._open_db)
+
+    def _open_db(self):
+        """Открыть SQLite и удалить устаревшие записи (поток writer)"""
+        try:
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (model, text))"
+            )
+            db.execute("DELETE FROM embeddings WHERE updated_at < ?", (time.time() - DISK_MAX_AGE_SECONDS,))
+            db.execute(
+                "DELETE FROM embeddings WHERE rowid NOT IN "
+                "(SELECT rowid FROM embeddings ORDER BY updated_at DESC LIMIT ?)",
+                (self.max_entries * DISK_ENTRIES_FACTOR,)
+            )
+            with self._db_lock:
+                self._db = db
+            self._count_disk()
+            logger.info(f"💾 Embedding cache: SQLite {self.path} ({self._disk_entries} записей)")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Embedding cache: SQLite недоступен ({e}), кэш только в памяти")
+            self._disk = False
+            with self._pending_lock:
+                self._pending.clear()
+        finally:
+            self._opened.set()
+
+    def _count_disk(self):
+        """Обновить число записей на диске для get_stats (поток writer)"""
+        try:
+            with self._db_lock:
+                self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except sqlite3.Error:
+            pass
+
+    def _load(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        """Чтение с диска (выполняется в потоке)"""
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            return pending[0]
+        self._opened.wait(DISK_OPEN_WAIT_SECONDS)
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Embedding cache: ошибка чтения SQLite: {e}")
+            return None
+        if row is None:
+            return None
+        return array('f', row[0]).tolist()
+
+    def _save(self, key: Tuple[str, str], vector: List[float]):
+        """Поставить запись в очередь на диск (сбрасывает фоновый поток)"""
+        if not self._disk:
+            return
+        with self._pending_lock:
+            self._pending[key] = (vector, time.time())
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._writer.submit(self._flush)
+
+    def _flush(self):
+        """Сбросить накопленные записи одной транзакцией (поток writer)"""
+        with self._pending_lock:
+            batch, self._pending = self._pending, {}
+            self._flush_scheduled = False
+        if not batch or self._db is None:
+            return
+        rows = [(*key, array('f', vector).tobytes(), updated_at) for key, (vector, updated_at) in batch.items()]
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN")
+                try:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, text, vector, updated_at) VALUES (?, ?, ?, ?)",
+                        rows
+                    )
+                    self._db.execute("COMMIT")
+                except sqlite3.Error:
+                    self._db.execute("ROLLBACK")
+                    raise
+            self.disk_writes += len(rows)
+            self._count_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Embedding cache: ошибка записи SQLite ({len(rows)} записей): {e}")
+
+    def flush(self):
+        """Дождаться записи всех накопленных embeddings на диск (shutdown)"""
+        if self._disk:
+            self._writer.submit(self._flush).result()
+
+    def _remember(self, key: Tuple[str, str], vector: List[float]):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _record(self, hit: bool):
+        if MONITORING_AVAILABLE and get_metrics:
+            get_metrics().add_cache_lookup(hit)
+
+    async def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Embedding из кэша (память, затем SQLite в потоке) или None"""
+        key = (model, normalize_text(text))
+
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._record(True)
+            return vector
+
+        vector = await asyncio.to_thread(self._load, key) if self._disk else None
+        if vector is not None:
+            self._remember(key, vector)
+            self.disk_hits += 1
+            self._record(True)
+            return vector
+
+        self.misses += 1
+        self._record(False)
+        return None
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Сохранить embedding (в память сразу, на диск - фоновым потоком)"""
+        key = (model, normalize_text(text))
+        vector = list(vector)
+        self._remember(key, vector)
+        self._save(key, vector)
+        self.stores += 1
+
+    def clear(self):
+        """Очистить кэш (в памяти и на диске)"""
+        self._entries.clear()
+        with self._pending_lock:
+            self._pending.clear()
+        if self._disk:
+            self._writer.submit(self._clear_disk)
+        logger.info("🧹 Embedding cache очищен")
+
+    def _clear_disk(self):
+        """DELETE всех записей на диске (поток writer)"""
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute("DELETE FROM embeddings")
+            self._count_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Embedding cache: ошибка очистки SQLite: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "entries_on_disk": self._disk_entries if self._disk else None,
+            "path": self.path if self._disk else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "disk_writes": self.disk_writes,
+            "pending_writes": len(self._pending),
+            "hit_rate_percent": round((self.hits + self.disk_hits) / total * 100, 2) if total else 0.0
+        }
+
+
+# Singleton instance
+_embedding_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Получить общий кэш embeddings"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
@@ -0,0 +1,181 @@
+"""
+Embedding Executor
+
+Локальный encoder (SentenceTransformer) вне event loop с micro-batching.
+
+Раньше QdrantService вызывал encoder.encode(query) прямо в async def:
+весь CPU-bound encode (и загрузка модели при первом вызове) блокировал
+event loop, и на это время замирала обработка всех webhook.
+
+Теперь:
+1. encode выполняется в выделенном потоке (ThreadPoolExecutor, 1 worker) -
+   torch отпускает GIL на время вычислений, event loop продолжает работу
+2. Одновременные запросы собираются в батч (окно EMBEDDING_BATCH_WINDOW_MS)
+   и кодируются одним вызовом encode - батч из N текстов заметно дешевле
+   N отдельных вызовов
+3. Модель загружается в том же потоке при первом батче (или через warmup())
+
+Usage:
+    from bot.services.embedding_executor import get_embedding_executor
+
+    executor = get_embedding_executor(EMBEDDING_MODEL)
+    vector = await executor.encode("что такое мозгоритм")
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SentenceTransformer = None
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+from bot.config import EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_BATCH_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingExecutor:
+    """Micro-batching encoder в выделенном потоке"""
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE
+    ):
+        self.model_name = model_name
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+
+        # Ожидающие тексты текущего окна: (текст, future)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()  # Ссылки на задачи батчей (иначе их может собрать GC)
+
+        self.batches = 0
+        self.texts = 0
+        self.unique_texts = 0
+        self.max_batch_seen = 0
+        self.total_encode_ms = 0.0
+        self.errors = 0
+
+    def load(self) -> "SentenceTransformer":
+        """Модель (загружается один раз, потокобезопасно). Блокирующий вызов"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    if not SENTENCE_TRANSFORMERS_AVAILABLE:
+                        raise RuntimeError("sentence-transformers not installed")
+                    logger.info(f"🔄 Loading sentence transformer model: {self.model_name} (first use)")
+                    self._model = SentenceTransformer(self.model_name)
+                    logger.info(f"✅ Sentence transformer loaded: {self.model_name}")
+        return self._model
+
+    async def warmup(self):
+        """Загрузить модель в потоке encoder заранее (не блокируя event loop)"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._pool, self.load)
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding executor: прогрев {self.model_name} не удался: {type(e).__name__}: {e}")
+
+    def _encode_batch(self, texts: List[str]) -> Tuple[List[List[float]], float]:
+        """Выполняется в потоке encoder"""
+        model = self.load()
+        start = time.perf_counter()
+        vectors = model.encode(texts, batch_size=len(texts)).tolist()
+        return vectors, (time.perf_counter() - start) * 1000
+
+    async def encode(self, text: str) -> List[float]:
+        """Embedding текста; одновременные вызовы кодируются одним батчем"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Отправить накопленный батч в поток encoder"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Одинаковые тексты в батче кодируются один раз
+        texts = list(dict.fromkeys(text for text, _ in batch))
+
+        self.batches += 1
+        self.texts += len(batch)
+        self.unique_texts += len(texts)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+        try:
+            vectors, encode_ms = await asyncio.get_running_loop().run_in_executor(
+                self._pool, self._encode_batch, texts
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Embedding executor: batch of {len(texts)} failed: {type(e).__name__}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.total_encode_ms += encode_ms
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():  # Ожидающий мог быть отменён (таймаут поиска)
+                future.set_result(by_text[text])
+
+        if len(batch) > 1:
+            logger.debug(f"📦 Embedding batch: {len(batch)} запросов ({len(texts)} уникальных), {encode_ms:.1f}ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "batch_window_ms": round(self.batch_window * 1000, 2),
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "texts": self.texts,
+            "unique_texts": self.unique_texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_batch_seen,
+            "avg_encode_ms": round(self.total_encode_ms / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending),
+            "errors": self.errors
+        }
+
+
+# Singleton instances (по одному на модель)
+_executors: Dict[str, EmbeddingExecutor] = {}
+
+
+def get_embedding_executor(model_name: str) -> EmbeddingExecutor:
+    """Получить encoder для модели"""
+    executor = _executors.get(model_name)
+    if executor is None:
+        executor = EmbeddingExecutor(model_name)
+        _executors[model_name] = executor
+    return executor
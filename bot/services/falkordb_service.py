@@ -100,6 +100,10 @@ logger = logging.getLogger(__name__)
 class FalkorDBService:
     """Сервис для работы с Graphiti через FalkorDB"""
 
+    # RetrievalBackend (bot/services/retrieval_backend.py)
+    name = "falkordb"
+    kind = "vector"
+
     def __init__(self):
         """Инициализация FalkorDB service"""
         self.graphiti_client: Optional[Graphiti] = None
@@ -191,6 +195,20 @@ class FalkorDBService:
             logger.exception("Full traceback:")
             return False
 
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """RetrievalBackend: semantic search по графу в общем формате результатов"""
+        results = await self.search_semantic(query=query, limit=limit, min_relevance=score_threshold)
+        return [
+            {
+                "id": r.get("metadata", {}).get("uuid") or f"falkordb_{idx}",
+                "content": r.get("content", ""),
+                "entity_type": r.get("entity_type", "unknown"),
+                "metadata": r.get("metadata", {}),
+                "score": r.get("relevance_score", 0.0)
+            }
+            for idx, r in enumerate(results)
+        ]
+
     async def health_check(self) -> Dict[str, Any]:
         """Проверка здоровья FalkorDB connection"""
         if not self.enabled or not self.graphiti_client:
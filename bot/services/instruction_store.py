@@ -0,0 +1,204 @@
+"""
+Instruction Store
+
+Хранилище системной инструкции (data/instruction.json) с hot reload по stat.
+
+Раньше webhook.py на КАЖДОЕ сообщение читал и парсил файл инструкций (~57 KB),
+чтобы сравнить last_updated. Теперь:
+1. На запрос - только os.stat (не чаще INSTRUCTION_CHECK_INTERVAL секунд)
+2. Файл перечитывается, только если изменились mtime / inode / размер
+3. Новый снимок подменяется атомарно (одно присваивание под lock) -
+   читатели всегда видят целый снимок, старый или новый
+4. В снимке уже готов статический префикс промпта (prompt caching)
+
+Если новый файл не парсится - остаётся последний рабочий снимок.
+
+Usage:
+    from bot.services.instruction_store import get_instruction_store
+
+    snapshot = get_instruction_store().get()
+    snapshot.data["system_instruction"], snapshot.static_prefix, snapshot.last_updated
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from bot.config import INSTRUCTION_FILE, INSTRUCTION_CHECK_INTERVAL
+from bot.services.prompt_builder import build_static_prefix
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_INSTRUCTION = "Вы - помощник службы поддержки Textil PRO."
+DEFAULT_WELCOME_MESSAGE = "Добро пожаловать! Чем могу помочь?"
+
+
+@dataclass(frozen=True)
+class InstructionSnapshot:
+    """Неизменяемый снимок инструкции (data не изменять - он общий для всех запросов)"""
+
+    data: Dict[str, Any]
+    static_prefix: str
+    file_key: Optional[Tuple[int, int, int]]  # (mtime_ns, inode, size), None - базовая инструкция
+    loaded_at: float
+
+    @property
+    def last_updated(self) -> str:
+        return str(self.data.get("last_updated", "неизвестно"))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+
+def _file_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def _make_snapshot(data: Dict[str, Any], file_key: Optional[Tuple[int, int, int]]) -> InstructionSnapshot:
+    return InstructionSnapshot(
+        data=data,
+        static_prefix=build_static_prefix(data.get("system_instruction", "")),
+        file_key=file_key,
+        loaded_at=time.time()
+    )
+
+
+def _default_instruction() -> Dict[str, Any]:
+    return {
+        "system_instruction": DEFAULT_SYSTEM_INSTRUCTION,
+        "welcome_message": DEFAULT_WELCOME_MESSAGE,
+        "last_updated": datetime.now().isoformat()
+    }
+
+
+class InstructionStore:
+    """Инструкция с перечитыванием файла только при его изменении"""
+
+    def __init__(self, path: str = INSTRUCTION_FILE, check_interval: float = INSTRUCTION_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._failed_key = None  # Версия файла, которая не распарсилась - не перечитываем её повторно
+        self.reloads = 0
+        self.checks = 0
+        self._snapshot = self._load(_file_key(path), previous=None)
+
+    def _load(self, file_key: Optional[Tuple[int, int, int]], previous: Optional[InstructionSnapshot]) -> InstructionSnapshot:
+        """Прочитать файл; при ошибке - предыдущий снимок или базовая инструкция"""
+        if file_key is None:
+            logger.warning(f"⚠️ ВНИМАНИЕ: Файл {self.path} не найден! Используется базовая инструкция.")
+            print(f"⚠️ ВНИМАНИЕ: Файл {self.path} не найден! Используется базовая инструкция.")
+            if previous is not None and previous.file_key is None:
+                return previous
+            return _make_snapshot(_default_instruction(), None)
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"❌ Ошибка при загрузке инструкций: {e}")
+            logger.error(f"❌ Ошибка при загрузке инструкций: {e}")
+            self._failed_key = file_key
+            if previous is not None:
+                logger.warning("⚠️ Оставляем предыдущую версию инструкций")
+                return previous
+            return _make_snapshot(_default_instruction(), None)
+
+        snapshot = _make_snapshot(data, file_key)
+        logger.info(f"✅ Инструкции успешно загружены из {self.path}")
+        logger.info(f"📝 Последнее обновление: {snapshot.last_updated}")
+        logger.info(f"📏 Длина системной инструкции: {len(data.get('system_instruction', ''))}")
+        print(f"✅ Инструкции успешно загружены из {self.path}")
+        print(f"📝 Последнее обновление: {snapshot.last_updated}")
+        return snapshot
+
+    def get(self) -> InstructionSnapshot:
+        """
+        Текущий снимок инструкции
+
+        Не чаще check_interval делает os.stat и перечитывает файл,
+        если он изменился. В остальных случаях - без I/O.
+        """
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.checks += 1
+            file_key = _file_key(self.path)
+            if file_key != self._snapshot.file_key and file_key != self._failed_key:
+                self._reload_if_changed(file_key)
+        return self._snapshot
+
+    def _reload_if_changed(self, file_key: Optional[Tuple[int, int, int]]):
+        with self._lock:
+            current = self._snapshot
+            if file_key == current.file_key or file_key == self._failed_key:
+                return  # Уже перечитан другим потоком / эта версия файла битая
+            if file_key is None and current.file_key is None:
+                return
+            snapshot = self._load(file_key, previous=current)
+            if snapshot is not current:
+                self._snapshot = snapshot
+                self.reloads += 1
+                logger.info(f"🔄 Инструкции обновлены: {current.last_updated} -> {snapshot.last_updated}")
+
+    def reload(self) -> Tuple[InstructionSnapshot, InstructionSnapshot]:
+        """
+        Принудительно перечитать файл (админ эндпоинты)
+
+        Returns:
+            (старый снимок, новый снимок)
+        """
+        with self._lock:
+            old = self._snapshot
+            self._snapshot = self._load(_file_key(self.path), previous=old)
+            self._last_check = time.monotonic()
+            if self._snapshot is not old:
+                self.reloads += 1
+            return old, self._snapshot
+
+    def write(self, data: Dict[str, Any]) -> Tuple[InstructionSnapshot, InstructionSnapshot]:
+        """
+        Записать новую инструкцию в файл (атомарно через os.replace) и применить
+
+        Returns:
+            (старый снимок, новый снимок)
+        """
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.path)
+        return self.reload()
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "last_updated": snapshot.last_updated,
+            "loaded_at": datetime.fromtimestamp(snapshot.loaded_at).isoformat(),
+            "from_file": snapshot.file_key is not None,
+            "check_interval_seconds": self.check_interval,
+            "checks": self.checks,
+            "reloads": self.reloads
+        }
+
+
+# Singleton instance
+_instruction_store = None
+
+
+def get_instruction_store() -> InstructionStore:
+    """Получить глобальное хранилище инструкций"""
+    global _instruction_store
+    if _instruction_store is None:
+        _instruction_store = InstructionStore()
+    return _instruction_store
@@ -0,0 +1,181 @@
+"""
+Knowledge Base Corpus
+
+Документы базы знаний из data/parsed_kb/*.json (результат
+scripts/parse_knowledge_base.py) в том же формате, в котором их загружает
+scripts/migrate_to_supabase.py:
+
+    {"id": "faq_0", "entity_type": "faq", "title": "...", "content": "...", "metadata": {...}}
+
+metadata["simhash"] - SimHash сигнатура content для отсева почти-дубликатов
+при поиске (bot/services/near_duplicate.py).
+
+id и content совпадают с записями Supabase, поэтому локальные индексы
+(векторный, BM25) и удалённые хранилища возвращают одни и те же документы.
+
+Usage:
+    from bot.services.kb_corpus import load_kb_corpus, corpus_fingerprint, corpus_stat_key
+
+    documents = load_kb_corpus()
+    fingerprint = corpus_fingerprint()  # Хэш содержимого parsed_kb
+    stat_key = corpus_stat_key()  # mtime/размер файлов - для проверки на каждый запрос
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from bot.services.near_duplicate import simhash_hex
+from bot.models.knowledge_entities import (
+    CourseLesson,
+    StudentQuestion,
+    CuratorCorrection,
+    BrainwriteExample,
+    FAQEntry,
+    GlossaryEntry
+)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PARSED_KB_DIR = os.path.join(BASE_DIR, 'data', 'parsed_kb')
+
+
+def _faq(faq: FAQEntry) -> Tuple[str, Dict[str, Any]]:
+    return faq.question[:100], {
+        "category": faq.category,
+        "keywords": faq.keywords,
+        "frequency": faq.frequency
+    }
+
+
+def _lesson(lesson: CourseLesson) -> Tuple[str, Dict[str, Any]]:
+    return lesson.title, {
+        "lesson_number": lesson.lesson_number,
+        "category": lesson.category.value,
+        "chunk_index": lesson.chunk_index,
+        "total_chunks": lesson.total_chunks,
+        "key_concepts": lesson.key_concepts
+    }
+
+
+def _correction(correction: CuratorCorrection) -> Tuple[str, Dict[str, Any]]:
+    title = correction.student_text[:100] if correction.student_text else correction.error_type
+    return title, {
+        "error_type": correction.error_type,
+        "related_technique": correction.related_technique,
+        "related_lesson": correction.related_lesson,
+        "curator_name": correction.curator_name,
+        "student_name": correction.student_name,
+        "has_explanation": bool(correction.explanation)
+    }
+
+
+def _question(question: StudentQuestion) -> Tuple[str, Dict[str, Any]]:
+    return question.question_text[:100], {
+        "category": question.category,
+        "lesson_reference": question.lesson_reference,
+        "student_name": question.student_name
+    }
+
+
+def _brainwrite(brainwrite: BrainwriteExample) -> Tuple[str, Dict[str, Any]]:
+    return brainwrite.text[:100], {
+        "student_name": brainwrite.student_name,
+        "lesson_number": brainwrite.lesson_number,
+        "technique_used": brainwrite.technique_used,
+        "quality_rating": brainwrite.quality_rating
+    }
+
+
+def _glossary(term: GlossaryEntry) -> Tuple[str, Dict[str, Any]]:
+    return term.term, {
+        "lesson_number": term.lesson_number,
+        "keywords": term.keywords
+    }
+
+
+# Файл parsed_kb → (модель, entity_type, title + metadata), порядок как в migrate_to_supabase
+CORPUS_FILES: List[Tuple[str, Type[BaseModel], str, Callable[[Any], Tuple[str, Dict[str, Any]]]]] = [
+    ("parsed_faq.json", FAQEntry, "faq", _faq),
+    ("parsed_lessons.json", CourseLesson, "lesson", _lesson),
+    ("parsed_corrections.json", CuratorCorrection, "correction", _correction),
+    ("parsed_questions.json", StudentQuestion, "question", _question),
+    ("parsed_brainwrites.json", BrainwriteExample, "brainwrite", _brainwrite),
+    ("parsed_glossary.json", GlossaryEntry, "glossary", _glossary),
+]
+
+
+def load_kb_corpus(parsed_dir: str = PARSED_KB_DIR) -> List[Dict[str, Any]]:
+    """
+    Загрузить все документы базы знаний
+
+    Отсутствующие файлы пропускаются, записи, не прошедшие валидацию модели,
+    пропускаются с предупреждением (индекс записи в id сохраняется).
+    """
+    documents = []
+    for filename, model, entity_type, describe in CORPUS_FILES:
+        path = os.path.join(parsed_dir, filename)
+        if not os.path.exists(path):
+            continue
+
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+
+        skipped = 0
+        for idx, item in enumerate(items):
+            try:
+                entity = model.model_validate(item)
+            except Exception:
+                skipped += 1
+                continue
+            if entity_type == "glossary":
+                content = f"{entity.term}: {entity.definition}"
+            else:
+                content = entity.to_episode_content()
+            title, metadata = describe(entity)
+            metadata["simhash"] = simhash_hex(content)
+            documents.append({
+                "id": f"{entity_type}_{idx}",
+                "entity_type": entity_type,
+                "title": title,
+                "content": content,
+                "metadata": metadata
+            })
+
+        if skipped:
+            logger.warning(f"⚠️ KB corpus: {filename} - пропущено {skipped} невалидных записей")
+
+    logger.info(f"📚 KB corpus: загружено {len(documents)} документов из {parsed_dir}")
+    return documents
+
+
+def corpus_fingerprint(parsed_dir: str = PARSED_KB_DIR) -> Optional[str]:
+    """Хэш содержимого файлов parsed_kb (None если файлов нет)"""
+    digest = hashlib.sha1()
+    found = False
+    for filename, *_ in CORPUS_FILES:
+        path = os.path.join(parsed_dir, filename)
+        if not os.path.exists(path):
+            continue
+        found = True
+        digest.update(filename.encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16] if found else None
+
+
+def corpus_stat_key(parsed_dir: str = PARSED_KB_DIR) -> str:
+    """Дешёвый отпечаток parsed_kb по mtime/размеру файлов (без чтения содержимого)"""
+    parts = []
+    for filename, *_ in CORPUS_FILES:
+        try:
+            stat = os.stat(os.path.join(parsed_dir, filename))
+        except FileNotFoundError:
+            continue
+        parts.append(f"{filename}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
@@ -0,0 +1,85 @@
+"""
+Knowledge Base Version
+
+Версия базы знаний для инвалидации кэшей, зависящих от содержимого KB
+(кэш ответов, кэш результатов поиска).
+
+Версия хранится в data/kb_version.json и увеличивается скриптами миграции
+после загрузки новых данных (bump_kb_version). Если файла нет - версия "0".
+
+Usage:
+    from bot.services.kb_version import get_kb_version, bump_kb_version
+
+    version = get_kb_version()
+    bump_kb_version(reason="migrate_to_supabase")
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from bot.config import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+KB_VERSION_FILE = os.path.join(BASE_DIR, 'data', 'kb_version.json')
+
+# Кэш прочитанной версии: (mtime_ns, version)
+_cached: Optional[tuple] = None
+
+
+def get_kb_version() -> str:
+    """
+    Текущая версия базы знаний
+
+    Файл перечитывается только при изменении mtime, поэтому вызов дешёвый
+    и подхватывает bump из другого процесса (скрипта миграции).
+    """
+    global _cached
+    try:
+        mtime_ns = os.stat(KB_VERSION_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return "0"
+
+    if _cached is not None and _cached[0] == mtime_ns:
+        return _cached[1]
+
+    try:
+        with open(KB_VERSION_FILE, 'r', encoding='utf-8') as f:
+            version = str(json.load(f).get("version", 0))
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать версию KB: {e}")
+        return _cached[1] if _cached is not None else "0"
+
+    _cached = (mtime_ns, version)
+    return version
+
+
+def bump_kb_version(reason: str = "") -> str:
+    """
+    Увеличить версию базы знаний (вызывается после загрузки новых данных)
+
+    Returns:
+        str: Новая версия
+    """
+    try:
+        current = int(get_kb_version())
+    except ValueError:
+        current = 0
+
+    new_version = current + 1
+    data = {
+        "version": new_version,
+        "updated_at": datetime.now().isoformat(),
+        "reason": reason
+    }
+
+    tmp_file = KB_VERSION_FILE + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, KB_VERSION_FILE)
+
+    logger.info(f"📦 Версия KB: {current} → {new_version} ({reason or 'без причины'})")
+    return str(new_version)
@@ -7,14 +7,19 @@ Knowledge Search Service
 - Graph traversal (поиск по relationships)
 - Fallback к локальным файлам если Graphiti недоступен
 
+Хранилища (локальный индекс, Supabase, Qdrant, FalkorDB) реализуют общий
+интерфейс RetrievalBackend (bot/services/retrieval_backend.py) и могут
+опрашиваться одновременно (RETRIEVAL_BACKENDS).
+
 Architecture:
     User Query → Query Routing → Hybrid Search → Ranked Results → LLM Context
 """
 
 import os
 import re
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 from enum import Enum
 
@@ -23,10 +28,40 @@ from enum import Enum
 # from bot.services.simple_falkordb_service import get_simple_falkordb_service  # SimpleFalkorDB (без Graphiti)
 from bot.services.qdrant_service import get_qdrant_service
 from bot.services.supabase_service import get_supabase_service
-from bot.config import GRAPHITI_ENABLED, USE_QDRANT, USE_SUPABASE
+from bot.services.local_vector_index import get_local_vector_index
+from bot.services.bm25_index import BM25Index, load_or_build
+from bot.services.kb_version import get_kb_version
+from bot.services.rank_fusion import reciprocal_rank_fusion
+from bot.services.retrieval_backend import RetrievalBackend, CorpusBM25Backend, fan_out, first_healthy
+from bot.services.near_duplicate import deduplicate
+from bot.services.reranker import get_reranker
+from bot.services.retrieval_cache import get_retrieval_cache
+from bot.config import (
+    GRAPHITI_ENABLED, USE_QDRANT, USE_SUPABASE, USE_LOCAL_INDEX,
+    HYBRID_LEXICAL_ENABLED, HYBRID_RRF_K, HYBRID_VECTOR_WEIGHT, HYBRID_LEXICAL_WEIGHT,
+    RETRIEVAL_CACHE_ENABLED, RERANKER_ENABLED, RERANKER_CANDIDATES,
+    RETRIEVAL_BACKENDS, RETRIEVAL_FANOUT_MODE, RETRIEVAL_DEADLINE_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
+# Файлы fallback поиска: (файл в KNOWLEDGE_BASE, источник для SearchResult, entity_type в индексе)
+FALLBACK_FILES = [
+    ("FAQ_EXTENDED.md", "FAQ", "faq"),
+    ("KNOWLEDGE_BASE_FULL.md", "Lessons", "lesson"),
+]
+
+# Сколько символов секции отдавать в контекст
+FALLBACK_SECTION_CHARS = 1500
+
+# Score boosting для приоритизации типов
+ENTITY_BOOSTS = {
+    "lesson": 1.2,      # Уроки - методология курса
+    "faq": 1.1,         # FAQ тоже важны
+    "correction": 1.0,  # Нейтральный приоритет
+    "question": 1.0,    # Вопросы учениц - наравне с corrections
+    "brainwrite": 0.9   # Примеры студентов - чуть ниже (могут содержать ошибки)
+}
 
 class SearchStrategy(str, Enum):
     """Стратегии поиска"""
@@ -83,33 +118,106 @@ class KnowledgeSearchService:
     def __init__(self):
         # Инициализация всех систем
         # FalkorDB временно отключен - требует graphiti-core[falkordb]
+        # (подключается через RETRIEVAL_BACKENDS=falkordb / simple_falkordb)
         self.falkordb_service = None  # get_falkordb_service()
         self.simple_falkordb_service = None  # get_simple_falkordb_service()
         self.qdrant_service = get_qdrant_service()
         self.supabase_service = get_supabase_service()
+        self.local_index = get_local_vector_index()
 
         # Определение какую систему использовать
+        self.use_local_index = USE_LOCAL_INDEX
         self.use_qdrant = USE_QDRANT
         self.use_supabase = USE_SUPABASE
         self.use_simple_falkordb = False  # GRAPHITI_ENABLED and self.simple_falkordb_service.enabled
         self.graphiti_enabled = False  # GRAPHITI_ENABLED and self.falkordb_service.enabled
         self.qdrant_enabled = USE_QDRANT and self.qdrant_service.enabled
         self.supabase_enabled = USE_SUPABASE and self.supabase_service.enabled
+        self.local_index_enabled = USE_LOCAL_INDEX and self.local_index.enabled
 
         # Paths для fallback
         self.kb_dir = Path(__file__).parent.parent.parent / "KNOWLEDGE_BASE"
+        self._fallback_index: Optional[BM25Index] = None
+
+        # BM25 по data/parsed_kb - лексическая часть hybrid поиска
+        self.lexical_backend = CorpusBM25Backend()
+
+        # Хранилища, которые опрашивает search() (bot/services/retrieval_backend.py)
+        self.backends: List[RetrievalBackend] = self._select_backends()
+        self.fanout_mode = RETRIEVAL_FANOUT_MODE
+
+        # Кэш результатов поиска (по версии KB)
+        self.cache = get_retrieval_cache() if RETRIEVAL_CACHE_ENABLED else None
+
+        # Второй этап ранжирования (cross-encoder), если включён и доступен
+        self.reranker = get_reranker() if RERANKER_ENABLED else None
+        if self.reranker is not None and not self.reranker.enabled:
+            self.reranker = None
 
         # Логирование активной системы
-        if self.use_supabase and self.supabase_enabled:
-            logger.info("🟣 KnowledgeSearchService initialized (Using: SUPABASE)")
-        elif self.use_qdrant and self.qdrant_enabled:
-            logger.info("🔵 KnowledgeSearchService initialized (Using: QDRANT)")
-        elif self.use_simple_falkordb:
-            logger.info("🟠 KnowledgeSearchService initialized (Using: SimpleFalkorDB)")
-        elif self.graphiti_enabled:
-            logger.info("🟢 KnowledgeSearchService initialized (Using: GRAPHITI)")
+        if self.backends:
+            names = ", ".join(backend.name.upper() for backend in self.backends)
+            mode = f", fan-out: {self.fanout_mode}" if len(self.backends) > 1 else ""
+            logger.info(f"🔎 KnowledgeSearchService initialized (Using: {names}{mode})")
         else:
             logger.info("⚪ KnowledgeSearchService initialized (Using: FALLBACK - local files)")
+            # Индекс нужен с первого запроса - читаем/строим при старте
+            self._get_fallback_index()
+
+    def _select_backends(self) -> List[RetrievalBackend]:
+        """
+        Активные хранилища
+
+        RETRIEVAL_BACKENDS - перечисленные (каждое должно быть включено своим USE_* флагом),
+        иначе одно по приоритету: локальный индекс > Supabase > Qdrant
+        """
+        if not RETRIEVAL_BACKENDS:
+            if self.use_local_index and self.local_index_enabled:
+                return [self.local_index]
+            if self.use_supabase and self.supabase_enabled:
+                return [self.supabase_service]
+            if self.use_qdrant and self.qdrant_enabled:
+                return [self.qdrant_service]
+            return []
+
+        backends = []
+        for name in RETRIEVAL_BACKENDS:
+            service = self._backend_service(name)
+            if service is None or not service.enabled:
+                logger.warning(f"⚠️ Retrieval backend '{name}' недоступен - пропускается")
+                continue
+            backends.append(service)
+        return backends
+
+    def _backend_service(self, name: str) -> Optional[RetrievalBackend]:
+        """Сервис хранилища по имени из RETRIEVAL_BACKENDS"""
+        if name == "local":
+            return self.local_index
+        if name == "supabase":
+            return self.supabase_service
+        if name == "qdrant":
+            return self.qdrant_service
+        try:
+            # FalkorDB сервисы требуют graphiti-core[falkordb] / falkordb - импорт только по запросу
+            if name == "falkordb":
+                from bot.services.falkordb_service import get_falkordb_service
+                self.falkordb_service = get_falkordb_service()
+                self.graphiti_enabled = self.falkordb_service.enabled
+                return self.falkordb_service
+            if name == "simple_falkordb":
+                from bot.services.simple_falkordb_service import get_simple_falkordb_service
+                self.simple_falkordb_service = get_simple_falkordb_service()
+                self.use_simple_falkordb = self.simple_falkordb_service.enabled
+                return self.simple_falkordb_service
+        except ImportError as e:
+            logger.warning(f"⚠️ Retrieval backend '{name}': {e}")
+            return None
+        logger.warning(f"⚠️ Неизвестный retrieval backend '{name}'")
+        return None
+
+    def _backends(self, kind: str) -> List[RetrievalBackend]:
+        """Активные хранилища вида kind ("vector" / "lexical")"""
+        return [backend for backend in self.backends if backend.kind == kind]
 
     async def search(
         self,
@@ -132,223 +240,173 @@ class KnowledgeSearchService:
         """
         logger.info(f"Search query: '{query}' (strategy: {strategy}, limit: {limit})")
 
-        # Определить какую систему использовать
-        if self.use_supabase and self.supabase_enabled:
-            # Использовать Supabase
-            logger.info("🟣 Using Supabase for search")
-            if strategy == SearchStrategy.GRAPH:
-                # Supabase не поддерживает graph traversal - fallback на semantic
-                logger.warning("Supabase doesn't support graph traversal, using semantic search instead")
-                strategy = SearchStrategy.SEMANTIC
-        elif self.use_qdrant and self.qdrant_enabled:
-            # Использовать Qdrant
-            logger.info("🔵 Using Qdrant for search")
-            if strategy == SearchStrategy.GRAPH:
-                # Qdrant не поддерживает graph traversal - fallback на semantic
-                logger.warning("Qdrant doesn't support graph traversal, using semantic search instead")
-                strategy = SearchStrategy.SEMANTIC
-        elif self.use_simple_falkordb:
-            # Использовать SimpleFalkorDB
-            logger.info("🟠 Using SimpleFalkorDB for search")
-            if strategy == SearchStrategy.GRAPH:
-                # SimpleFalkorDB пока не поддерживает graph traversal - fallback на fulltext
-                logger.warning("SimpleFalkorDB doesn't support graph traversal yet, using fulltext instead")
-                strategy = SearchStrategy.FULLTEXT
-        elif self.graphiti_enabled:
-            # Использовать Graphiti
-            logger.info("🟢 Using Graphiti for search")
-        else:
+        if not self.backends:
             # Fallback к локальным файлам
             logger.warning("All search backends disabled, using fallback to local files")
-            return await self._search_fallback(query, limit)
+            backend = "fallback"
+            strategy = SearchStrategy.FALLBACK
+        else:
+            backend = "+".join(b.name for b in self.backends)
+            if len(self.backends) > 1:
+                backend += f":{self.fanout_mode}"
+            logger.info(f"🔎 Using {backend} for search")
+            if strategy == SearchStrategy.GRAPH:
+                # Graph traversal не поддерживает ни одно хранилище
+                strategy = SearchStrategy.SEMANTIC if self._backends("vector") else SearchStrategy.FULLTEXT
+                logger.warning(f"Graph traversal is not supported, using {strategy.value} search instead")
+
+        # Повторный запрос при той же версии KB - из кэша
+        cache_key = None
+        if self.cache is not None:
+            kb_version = get_kb_version()
+            cache_key = self.cache.make_key(query, strategy.value, limit, min_relevance, backend, kb_version)
+            cached = self.cache.get(cache_key, kb_version)
+            if cached is not None:
+                logger.info(f"🗂️ Search returned {len(cached)} results (retrieval cache)")
+                return cached
+
+        # С reranking первый этап отдаёт больше кандидатов, top-limit выбирает cross-encoder
+        candidates = max(limit, RERANKER_CANDIDATES) if self.reranker is not None else limit
 
         # Выполнить поиск по стратегии
-        if strategy == SearchStrategy.SEMANTIC:
-            results = await self._search_semantic(query, limit, min_relevance)
+        if strategy == SearchStrategy.FALLBACK:
+            results = await self._search_fallback(query, candidates)
+        elif strategy == SearchStrategy.SEMANTIC:
+            results = await self._search_semantic(query, candidates, min_relevance)
         elif strategy == SearchStrategy.FULLTEXT:
-            results = await self._search_fulltext(query, limit, min_relevance)
-        elif strategy == SearchStrategy.GRAPH:
-            results = await self._search_graph(query, limit, min_relevance)
+            results = await self._search_fulltext(query, candidates, min_relevance)
         elif strategy == SearchStrategy.HYBRID:
-            results = await self._search_hybrid(query, limit, min_relevance)
+            results = await self._search_hybrid(query, candidates, min_relevance)
         else:
             logger.error(f"Unknown strategy: {strategy}")
             results = []
 
+        cacheable = True
+        if self.reranker is not None:
+            first_stage_count = len(results)
+            results, reranked = await self.reranker.rerank(query, results, limit, boosts=ENTITY_BOOSTS)
+            # Порядок первого этапа (бюджет исчерпан, модель грузится) не кэшируем -
+            # повторный запрос получит переранжированный результат
+            cacheable = reranked or first_stage_count < 2 or not self.reranker.enabled
+
+        if cache_key is not None and cacheable:
+            self.cache.put(cache_key, results)
+
         logger.info(f"Search returned {len(results)} results")
         return results
 
-    async def _search_semantic(
+    async def _retrieve(
         self,
+        backends: List[RetrievalBackend],
         query: str,
         limit: int,
         min_relevance: float
-    ) -> List[SearchResult]:
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Опросить хранилища (одновременно, с дедлайном) по RETRIEVAL_FANOUT_MODE"""
+        if not backends:
+            return {}
+        if self.fanout_mode == "first" and len(backends) > 1:
+            return await first_healthy(backends, query, limit, min_relevance, RETRIEVAL_DEADLINE_SECONDS)
+        return await fan_out(backends, query, limit, min_relevance, RETRIEVAL_DEADLINE_SECONDS)
+
+    def _rank(self, ranked_lists: Dict[str, List[Dict[str, Any]]], search_type: str) -> List[SearchResult]:
         """
-        Unified семантический поиск через Qdrant или Graphiti
+        Результаты хранилищ → SearchResult по убыванию relevance, без почти-дубликатов
 
-        Ищет по ВСЕЙ базе знаний без entity_type фильтрации.
-        Qdrant/Graphiti возвращают самые релевантные результаты с учётом semantic similarity.
+        Один список - relevance = score хранилища. Несколько - объединение через
+        Reciprocal Rank Fusion (шкалы хранилищ несравнимы), документ, найденный
+        несколькими хранилищами, поднимается выше; ranks и scores - в metadata.
 
-        Опциональный score boosting для приоритизации типов:
+        Score boosting по entity_type применяется здесь, один раз:
         - Lessons (1.2x) - методология курса
         - FAQ (1.1x) - часто задаваемые вопросы
         - Corrections/Questions (1.0x) - корректировки и вопросы учениц
         - Brainwrites (0.9x) - примеры студентов (могут содержать ошибки)
         """
-        try:
-            # Переключение между Supabase, Qdrant и Graphiti
-            if self.use_supabase and self.supabase_enabled:
-                # Unified search по всей базе знаний через Supabase
-                logger.info(f"🔍 Supabase: Unified search по всей базе знаний...")
-
-                # Единый запрос к Supabase без фильтрации по entity_type
-                raw_results = await self.supabase_service.search_semantic(
-                    query=query,
-                    limit=limit * 2,  # Берём в 2 раза больше для последующей фильтрации
-                    score_threshold=min_relevance,
-                    entity_type=None  # ❌ Убрали entity_type фильтр!
-                )
-
-                # Score boosting для приоритизации типов
-                boosting_factors = {
-                    "lesson": 1.2,      # Уроки важнее
-                    "faq": 1.1,         # FAQ тоже важны
-                    "correction": 1.0,  # Нейтральный
-                    "question": 1.0,    # Вопросы учениц
-                    "brainwrite": 0.9   # Примеры студентов (могут содержать ошибки)
-                }
+        if not ranked_lists:
+            return []
 
-                results = []
-                for r in raw_results:
-                    entity_type = r.get("entity_type", "unknown")
-                    boost_factor = boosting_factors.get(entity_type, 1.0)
-                    boosted_score = r.get("score", 0.0) * boost_factor
-
-                    # Добавляем entity_type в metadata для debug info
-                    metadata = {**r.get("metadata", {}), "entity_type": entity_type}
-                    results.append(SearchResult(
-                        content=r.get("content", ""),
-                        source=f"supabase_{entity_type}",
-                        relevance_score=boosted_score,
-                        metadata=metadata,
-                        search_type="semantic"
-                    ))
-
-                # Сортируем по boosted score и обрезаем до limit
-                results = sorted(results, key=lambda x: x.relevance_score, reverse=True)[:limit]
-
-                logger.info(f"✅ Supabase: Found {len(results)} results")
-                return results
-
-            elif self.use_qdrant and self.qdrant_enabled:
-                # Unified search по всей базе знаний (БЕЗ entity_type фильтрации)
-                logger.info(f"🔍 Unified search по всей базе знаний...")
-
-                # Единый запрос к Qdrant без фильтрации по entity_type
-                raw_results = await self.qdrant_service.search_semantic(
-                    query=query,
-                    limit=limit * 2,  # Берём в 2 раза больше для последующей фильтрации
-                    score_threshold=min_relevance,
-                    entity_type=None  # ❌ Убрали entity_type фильтр!
-                )
-
-                # Опциональный score boosting для приоритизации типов
-                boosting_factors = {
-                    "lesson": 1.2,      # Уроки немного важнее
-                    "faq": 1.1,         # FAQ тоже важны
-                    "correction": 1.0,  # Нейтральный приоритет
-                    "question": 1.0,    # Вопросы учениц - наравне с corrections
-                    "brainwrite": 0.9   # Примеры студентов - чуть ниже (могут содержать ошибки)
+        if len(ranked_lists) == 1:
+            origin, raw_results = next(iter(ranked_lists.items()))
+            entries = [(origin, r, r.get("score", 0.0)) for r in raw_results]
+            search_type = f"{search_type}_{origin}"
+        else:
+            lexical = {self.lexical_backend.name} | {b.name for b in self._backends("lexical")}
+            fused = reciprocal_rank_fusion(
+                ranked_lists,
+                k=HYBRID_RRF_K,
+                weights={
+                    name: HYBRID_LEXICAL_WEIGHT if name in lexical else HYBRID_VECTOR_WEIGHT
+                    for name in ranked_lists
                 }
+            )
+            # Источник - первое (по порядку хранилищ) хранилище, нашедшее документ
+            entries = [(next(iter(r["ranks"])), r, r["relevance"]) for r in fused]
+            search_type = f"{search_type}_rrf"
 
-                all_results = []
-                entity_type_counts = {}
-
-                for r in raw_results:
-                    entity_type = r.get("entity_type", "unknown")
-                    boost_factor = boosting_factors.get(entity_type, 1.0)
-                    boosted_score = r.get("score", 0.0) * boost_factor
-
-                    metadata = {**r.get("metadata", {}), "entity_type": entity_type}
-                    result = SearchResult(
-                        content=r.get("content", ""),
-                        source=f"qdrant_{entity_type}",
-                        relevance_score=boosted_score,
-                        metadata=metadata,
-                        search_type="unified_qdrant"
-                    )
-                    all_results.append(result)
-
-                    # Статистика по типам
-                    entity_type_counts[entity_type] = entity_type_counts.get(entity_type, 0) + 1
-
-                # Сортируем по boosted relevance score
-                all_results.sort(key=lambda x: x.relevance_score, reverse=True)
-
-                # Возвращаем top N результатов
-                final_results = all_results[:limit]
-
-                # Статистика по типам в финальных результатах
-                final_type_counts = {}
-                for r in final_results:
-                    entity_type = r.metadata.get("entity_type", "unknown")
-                    final_type_counts[entity_type] = final_type_counts.get(entity_type, 0) + 1
-
-                types_str = ', '.join([f"{k}:{v}" for k, v in final_type_counts.items()])
-                logger.info(f"✅ Unified search: найдено {len(final_results)} результатов ({types_str})")
-
-                return final_results
-
-            elif self.use_simple_falkordb:
-                # Поиск через SimpleFalkorDB (fulltext, т.к. семантического поиска пока нет)
-                logger.info("Using SimpleFalkorDB fulltext search instead of semantic")
-                simple_results = await self.simple_falkordb_service.search_fulltext(
-                    query=query,
-                    limit=limit
-                )
-
-                results = []
-                for r in simple_results:
-                    result = SearchResult(
-                        content=r.get("content", ""),
-                        source=f"simple_falkordb_{r.get('type', 'knowledge')}",
-                        relevance_score=r.get("relevance_score", 0.5),
-                        metadata={"type": r.get("type", "")},
-                        search_type="fulltext_simple_falkordb"
-                    )
-                    results.append(result)
-
-                return results
+        results = []
+        for origin, r, relevance in entries:
+            entity_type = r.get("entity_type", "unknown")
+            metadata = {**r.get("metadata", {}), "entity_type": entity_type}
+            if "ranks" in r:
+                metadata["ranks"] = r["ranks"]
+                metadata["scores"] = r["scores"]
+            results.append(SearchResult(
+                content=r.get("content", ""),
+                source=f"{origin}_{entity_type}",
+                relevance_score=relevance * ENTITY_BOOSTS.get(entity_type, 1.0),
+                metadata=metadata,
+                search_type=search_type
+            ))
+
+        return self._deduplicate_results(results)
+
+    def _log_results(self, label: str, results: List[SearchResult], ranked_lists: Dict[str, List[Dict[str, Any]]]):
+        """Статистика по типам и хранилищам в финальных результатах"""
+        type_counts = {}
+        shared = 0
+        for r in results:
+            entity_type = r.metadata.get("entity_type", "unknown")
+            type_counts[entity_type] = type_counts.get(entity_type, 0) + 1
+            if len(r.metadata.get("ranks", {})) > 1:
+                shared += 1
+
+        types_str = ', '.join([f"{k}:{v}" for k, v in type_counts.items()])
+        sizes_str = ', '.join([f"{k}:{len(v)}" for k, v in ranked_lists.items()])
+        logger.info(
+            f"✅ {label}: найдено {len(results)} результатов ({types_str}), "
+            f"кандидаты ({sizes_str}), в нескольких списках: {shared}"
+        )
 
-            else:
-                # Поиск через FalkorDB (Graphiti backend)
-                graphiti_results = await self.falkordb_service.search_semantic(
-                    query=query,
-                    limit=limit,
-                    min_relevance=min_relevance
-                )
-
-                results = []
-                for r in graphiti_results:
-                    result = SearchResult(
-                        content=r.get("content", ""),
-                        source=r.get("source", "knowledge_base"),
-                        relevance_score=r.get("similarity", 0.0),
-                        metadata=r.get("metadata", {}),
-                        search_type="semantic_graphiti"
-                    )
-                    results.append(result)
-
-                return results
+    async def _search_semantic(
+        self,
+        query: str,
+        limit: int,
+        min_relevance: float
+    ) -> List[SearchResult]:
+        """
+        Семантический поиск по ВСЕЙ базе знаний без entity_type фильтрации
+
+        Опрашиваются векторные хранилища (если их нет - лексические, например
+        SimpleFalkorDB), ранжирование и boosting - в _rank.
+        """
+        try:
+            backends = self._backends("vector") or self.backends
+            ranked_lists = await self._retrieve(
+                backends,
+                query,
+                limit * 2,  # Берём в 2 раза больше для последующей фильтрации
+                min_relevance
+            )
+            results = self._rank(ranked_lists, "semantic")[:limit]
+            self._log_results("Semantic", results, ranked_lists)
+            return results
 
         except Exception as e:
             logger.error(f"❌ Semantic search FAILED: {type(e).__name__}: {e}")
             logger.error(f"   Query: '{query[:100]}...'")
             logger.error(f"   Limit: {limit}, Min relevance: {min_relevance}")
-            logger.error(f"   Qdrant enabled: {self.use_qdrant and self.qdrant_enabled}")
-            logger.error(f"   SimpleFalkorDB enabled: {self.use_simple_falkordb}")
-            logger.error(f"   Graphiti enabled: {self.graphiti_enabled}")
+            logger.error(f"   Backends: {[b.name for b in self.backends]} ({self.fanout_mode})")
             logger.exception("Full traceback:")
             return []
 
@@ -358,47 +416,18 @@ class KnowledgeSearchService:
         limit: int,
         min_relevance: float
     ) -> List[SearchResult]:
-        """Full-text search через SimpleFalkorDB или Graphiti"""
+        """Full-text search через лексические хранилища (SimpleFalkorDB) или BM25 по data/parsed_kb"""
         try:
-            if self.use_simple_falkordb:
-                # Поиск через SimpleFalkorDB
-                simple_results = await self.simple_falkordb_service.search_fulltext(
-                    query=query,
-                    limit=limit
-                )
-
-                results = []
-                for r in simple_results:
-                    result = SearchResult(
-                        content=r.get("content", ""),
-                        source=f"simple_falkordb_{r.get('type', 'knowledge')}",
-                        relevance_score=r.get("relevance_score", 0.5),
-                        metadata={"type": r.get("type", "")},
-                        search_type="fulltext_simple_falkordb"
-                    )
-                    results.append(result)
-
-                return results
-            else:
-                # TODO: Реализовать fulltext search для Graphiti
-                logger.warning("Fulltext search not implemented for Graphiti yet")
-                return []
+            backends = self._backends("lexical") or [self.lexical_backend]
+            ranked_lists = await self._retrieve(backends, query, limit * 2, min_relevance)
+            results = self._rank(ranked_lists, "fulltext")[:limit]
+            self._log_results("Fulltext", results, ranked_lists)
+            return results
 
         except Exception as e:
             logger.error(f"Fulltext search failed: {e}")
             return []
 
-    async def _search_graph(
-        self,
-        query: str,
-        limit: int,
-        min_relevance: float
-    ) -> List[SearchResult]:
-        """Graph traversal search"""
-        # TODO: Реализовать после загрузки relationships
-        logger.warning("Graph search not implemented yet")
-        return []
-
     async def _search_hybrid(
         self,
         query: str,
@@ -406,209 +435,126 @@ class KnowledgeSearchService:
         min_relevance: float
     ) -> List[SearchResult]:
         """
-        Unified гибридный поиск через Qdrant или Graphiti
-
-        Для Qdrant: Unified search по всей базе знаний без entity_type фильтрации
-        - Score boosting: lessons (1.2x), FAQ (1.1x), corrections/questions (1.0x), brainwrites (0.9x)
-        - Qdrant сам определяет самые релевантные результаты на основе semantic similarity
-
-        Для Graphiti: комбинация semantic + fulltext + graph
-        - Semantic: 1.0 (высший приоритет)
-        - Fulltext: 0.8
-        - Graph: 0.6
+        Гибридный поиск: векторные хранилища + BM25 параллельно, объединение через RRF
+
+        - Векторный поиск и BM25 по data/parsed_kb выполняются одновременно
+        - Списки объединяются Reciprocal Rank Fusion (bot/services/rank_fusion.py),
+          документ, найденный несколькими поисками, поднимается выше
+        - Score boosting по entity_type применяется один раз к объединённому score
+        - BM25 находит точные термины курса ("мозгоритм", "если бы я хотя бы"),
+          которые embeddings пропускают
         """
-        # Переключение между Qdrant и Graphiti
-        if self.use_qdrant and self.qdrant_enabled:
-            # Unified hybrid search по всей базе знаний
-            try:
-                logger.info(f"🔍 Unified hybrid search по всей базе знаний...")
-
-                # Единый запрос к Qdrant без фильтрации по entity_type
-                raw_results = await self.qdrant_service.search_semantic(
-                    query=query,
-                    limit=limit * 2,  # Берём в 2 раза больше для последующей фильтрации
-                    score_threshold=min_relevance,
-                    entity_type=None  # ❌ Убрали entity_type фильтр!
-                )
-
-                # Опциональный score boosting для приоритизации типов
-                boosting_factors = {
-                    "lesson": 1.2,      # Уроки немного важнее
-                    "faq": 1.1,         # FAQ тоже важны
-                    "correction": 1.0,  # Нейтральный приоритет
-                    "question": 1.0,    # Вопросы учениц - наравне с corrections
-                    "brainwrite": 0.9   # Примеры студентов - чуть ниже (могут содержать ошибки)
-                }
-
-                all_results = []
-
-                for r in raw_results:
-                    entity_type = r.get("entity_type", "unknown")
-                    boost_factor = boosting_factors.get(entity_type, 1.0)
-                    boosted_score = r.get("score", 0.0) * boost_factor
+        try:
+            logger.info(f"🔍 Hybrid search ({', '.join(b.name for b in self.backends)} + BM25) по всей базе знаний...")
 
-                    metadata = {**r.get("metadata", {}), "entity_type": entity_type}
-                    result = SearchResult(
-                        content=r.get("content", ""),
-                        source=f"qdrant_{entity_type}",
-                        relevance_score=boosted_score,
-                        metadata=metadata,
-                        search_type="unified_hybrid"
-                    )
-                    all_results.append(result)
+            lexical = self._backends("lexical")
+            if HYBRID_LEXICAL_ENABLED:
+                lexical = lexical + [self.lexical_backend]
 
-                # Сортировка по relevance score (с учётом boost)
-                all_results.sort(key=lambda x: x.relevance_score, reverse=True)
+            # Берём в 2 раза больше - RRF нужен запас кандидатов
+            vector_lists, lexical_lists = await asyncio.gather(
+                self._retrieve(self._backends("vector"), query, limit * 2, min_relevance),
+                fan_out(lexical, query, limit * 2, min_relevance, RETRIEVAL_DEADLINE_SECONDS)
+            )
 
-                # Возвращаем top N результатов
-                final_results = all_results[:limit]
+            ranked_lists = {**vector_lists, **lexical_lists}
+            results = self._rank(ranked_lists, "hybrid")[:limit]
+            self._log_results("Hybrid RRF", results, ranked_lists)
+            return results
 
-                # Статистика по типам в финальных результатах
-                final_type_counts = {}
-                for r in final_results:
-                    entity_type = r.metadata.get("entity_type", "unknown")
-                    final_type_counts[entity_type] = final_type_counts.get(entity_type, 0) + 1
+        except Exception as e:
+            logger.error(f"Hybrid search failed: {e}")
+            return []
 
-                types_str = ', '.join([f"{k}:{v}" for k, v in final_type_counts.items()])
-                logger.info(f"✅ Unified hybrid: найдено {len(final_results)} результатов ({types_str})")
+    def _deduplicate_results(self, results: List[SearchResult]) -> List[SearchResult]:
+        """
+        Удалить почти-дубликаты (SimHash, bot/services/near_duplicate.py)
 
-                return final_results
+        Из группы похожих результатов остаётся самый релевантный -
+        пересекающиеся чанки уроков и повторяющиеся правки кураторов
+        не занимают место в контексте. Результат отсортирован по relevance.
+        """
+        return deduplicate(results)
 
+    def _fallback_fingerprint(self) -> str:
+        """Версия KB + mtime/размер файлов fallback - ключ валидности BM25 индекса"""
+        parts = [get_kb_version()]
+        for filename, _, _ in FALLBACK_FILES:
+            try:
+                stat = (self.kb_dir / filename).stat()
+                parts.append(f"{filename}:{stat.st_mtime_ns}:{stat.st_size}")
+            except FileNotFoundError:
+                continue
+        return "|".join(parts)
+
+    def _fallback_documents(self) -> List[Dict[str, Any]]:
+        """Секции markdown файлов (по заголовкам ##) как документы BM25 индекса"""
+        documents = []
+        for filename, source, entity_type in FALLBACK_FILES:
+            file_path = self.kb_dir / filename
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
             except Exception as e:
-                logger.error(f"Qdrant hybrid search failed: {e}")
-                return []
-
-        else:
-            # Graphiti hybrid search (semantic + fulltext + graph)
-            all_results = []
-
-            # 1. Semantic search
-            semantic_results = await self._search_semantic(query, limit * 2, min_relevance)
-            for r in semantic_results:
-                r.relevance_score *= 1.0  # Вес semantic
-            all_results.extend(semantic_results)
-
-            # 2. Fulltext search (когда реализуется для Graphiti)
-            # fulltext_results = await self._search_fulltext(query, limit, min_relevance)
-            # for r in fulltext_results:
-            #     r.relevance_score *= 0.8
-            # all_results.extend(fulltext_results)
-
-            # 3. Graph search (когда реализуется для Graphiti)
-            # graph_results = await self._search_graph(query, limit, min_relevance)
-            # for r in graph_results:
-            #     r.relevance_score *= 0.6
-            # all_results.extend(graph_results)
-
-            # Deduplicate (по content hash)
-            unique_results = self._deduplicate_results(all_results)
+                logger.error(f"Failed to read {file_path}: {e}")
+                continue
 
-            # Sort by relevance
-            unique_results.sort(key=lambda x: x.relevance_score, reverse=True)
-
-            return unique_results[:limit]
-
-    def _deduplicate_results(self, results: List[SearchResult]) -> List[SearchResult]:
-        """Удалить дубликаты результатов"""
-        seen = set()
-        unique = []
-
-        for result in results:
-            content_hash = hash(result.content[:200])  # Первые 200 символов
-            if content_hash not in seen:
-                seen.add(content_hash)
-                unique.append(result)
-
-        return unique
+            # Разбить на секции (по заголовкам ##)
+            for idx, section in enumerate(re.split(r'\n## ', content)):
+                if not section.strip():
+                    continue
+                section_title = section.split('\n')[0]
+                documents.append({
+                    "id": f"{entity_type}_section_{idx}",
+                    "entity_type": entity_type,
+                    "title": section_title,
+                    # Ограничить размер content, индексируется вся секция
+                    "content": section[:FALLBACK_SECTION_CHARS] + "..." if len(section) > FALLBACK_SECTION_CHARS else section,
+                    "search_text": section,
+                    "metadata": {"file": filename, "source": source}
+                })
+        return documents
+
+    def _get_fallback_index(self) -> BM25Index:
+        """BM25 индекс fallback файлов (с диска или построенный для текущей версии KB)"""
+        fingerprint = self._fallback_fingerprint()
+        if self._fallback_index is None or self._fallback_index.fingerprint != fingerprint:
+            self._fallback_index = load_or_build("fallback", fingerprint, self._fallback_documents)
+        return self._fallback_index
 
     async def _search_fallback(self, query: str, limit: int) -> List[SearchResult]:
         """
         Fallback поиск по локальным файлам (когда Graphiti недоступен)
 
-        Простой keyword matching в markdown файлах
+        BM25 по секциям FAQ и уроков: индекс строится один раз на версию KB,
+        запрос - обход постинг-листов без чтения файлов.
         """
-        logger.info("Using fallback search (local files)")
-        results = []
+        logger.info("Using fallback search (local files, BM25)")
 
-        # Поиск в FAQ
-        faq_file = self.kb_dir / "FAQ_EXTENDED.md"
-        if faq_file.exists():
-            faq_results = self._search_in_file(faq_file, query, "FAQ")
-            results.extend(faq_results[:limit // 2])
+        index = self._fallback_index
+        if index is None or index.fingerprint != self._fallback_fingerprint():
+            # Перестроение индекса (смена версии KB) - не в event loop
+            index = await asyncio.to_thread(self._get_fallback_index)
 
-        # Поиск в уроках
-        lessons_file = self.kb_dir / "KNOWLEDGE_BASE_FULL.md"
-        if lessons_file.exists():
-            lesson_results = self._search_in_file(lessons_file, query, "Lessons")
-            results.extend(lesson_results[:limit // 2])
-
-        # Sort by relevance
-        results.sort(key=lambda x: x.relevance_score, reverse=True)
+        results = []
+        # Поровну из FAQ и уроков, как раньше
+        for filename, source, entity_type in FALLBACK_FILES:
+            for hit in index.search(query, limit // 2, entity_type=entity_type):
+                results.append(SearchResult(
+                    content=hit.document["content"],
+                    source=f"{source}: {hit.document['title']}",
+                    relevance_score=hit.relevance,
+                    metadata={"file": filename, "bm25_score": round(hit.score, 3)},
+                    search_type="fallback"
+                ))
+
+        # Без почти-дубликатов, по relevance
+        results = self._deduplicate_results(results)
 
         return results[:limit]
 
-    def _search_in_file(
-        self,
-        file_path: Path,
-        query: str,
-        source: str
-    ) -> List[SearchResult]:
-        """
-        Простой keyword поиск в файле
-
-        Args:
-            file_path: Путь к файлу
-            query: Поисковый запрос
-            source: Источник (для metadata)
-
-        Returns:
-            List of SearchResult
-        """
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-
-            # Разбить на секции (по заголовкам ##)
-            sections = re.split(r'\n## ', content)
-
-            results = []
-            query_lower = query.lower()
-            query_words = set(query_lower.split())
-
-            for section in sections:
-                section_lower = section.lower()
-
-                # Подсчитать совпадения ключевых слов
-                matches = sum(1 for word in query_words if word in section_lower)
-
-                if matches > 0:
-                    # Relevance = matches / total query words
-                    relevance = matches / len(query_words) if query_words else 0
-
-                    # Извлечь заголовок секции
-                    section_title = section.split('\n')[0] if section else "Unknown"
-
-                    # Ограничить размер content
-                    section_content = section[:1500] + "..." if len(section) > 1500 else section
-
-                    result = SearchResult(
-                        content=section_content,
-                        source=f"{source}: {section_title}",
-                        relevance_score=relevance,
-                        metadata={"file": str(file_path.name)},
-                        search_type="fallback"
-                    )
-                    results.append(result)
-
-            # Sort by relevance
-            results.sort(key=lambda x: x.relevance_score, reverse=True)
-
-            return results
-
-        except Exception as e:
-            logger.error(f"Failed to search in {file_path}: {e}")
-            return []
-
     def route_query(self, query: str) -> SearchStrategy:
         """
         Определить оптимальную стратегию поиска для запроса
@@ -625,20 +571,23 @@ class KnowledgeSearchService:
         Returns:
             Рекомендуемая SearchStrategy
         """
-        query_lower = query.lower()
+        from bot.services.query_features import analyze_query
+
+        # Все таблицы ключевых слов проверяются за один проход (см. query_features)
+        route = analyze_query(query).route
 
         # Точные номера уроков
-        if re.search(r'урок\s+\d+|lesson\s+\d+', query_lower):
+        if route == "fulltext":
             logger.info(f"🎯 Выбрана стратегия FULLTEXT (найден паттерн 'урок N' в запросе)")
             return SearchStrategy.FULLTEXT
 
         # Концептуальные вопросы
-        if any(word in query_lower for word in ["что такое", "как понять", "объясни", "в чем смысл"]):
+        if route == "semantic":
             logger.info(f"🎯 Выбрана стратегия SEMANTIC (концептуальный вопрос)")
             return SearchStrategy.SEMANTIC
 
         # Поиск связей
-        if any(word in query_lower for word in ["похожие", "связанные", "смежные", "related"]):
+        if route == "graph":
             logger.info(f"🎯 Выбрана стратегия GRAPH (поиск связей)")
             return SearchStrategy.GRAPH
 
@@ -649,7 +598,8 @@ class KnowledgeSearchService:
     def format_context_for_llm(
         self,
         results: List[SearchResult],
-        max_length: int = 3000
+        max_length: int = 3000,
+        max_tokens: Optional[int] = None
     ) -> str:
         """
         Форматировать результаты поиска в контекст для LLM
@@ -657,6 +607,9 @@ class KnowledgeSearchService:
         Args:
             results: Результаты поиска
             max_length: Максимальная длина контекста (в символах)
+            max_tokens: Бюджет в токенах целевой модели. Если задан - результаты
+                выбираются по релевантности на токен, обрезка идёт по границе
+                предложения (max_length игнорируется). Почти-дубликаты уже убраны в search()
 
         Returns:
             Formatted context string
@@ -664,7 +617,21 @@ class KnowledgeSearchService:
         if not results:
             return "Контекст из базы знаний пуст."
 
-        context_parts = ["Найденная информация из базы знаний:\n"]
+        intro = "Найденная информация из базы знаний:\n"
+
+        if max_tokens is not None:
+            from bot.services.context_packer import pack_results, count_tokens
+
+            def header(i: int, result: SearchResult) -> str:
+                return f"\n📚 Источник {i}: {result.source} (relevance: {result.relevance_score:.2f})\n"
+
+            packed = pack_results(results, max_tokens - count_tokens(intro), header_fn=header)
+            context_parts = [intro]
+            for i, (result, content) in enumerate(packed, 1):
+                context_parts.append(header(i, result) + content)
+            return "\n".join(context_parts)
+
+        context_parts = [intro]
         current_length = len(context_parts[0])
 
         for i, result in enumerate(results, 1):
@@ -0,0 +1,391 @@
+"""
+LLM Router
+
+Маршрутизация LLM запросов между провайдерами (OpenAI, Anthropic)
+с учётом задержек и ошибок.
+
+Features:
+- Rolling статистика по провайдеру: latency p50/p95, доля ошибок
+- Circuit breaker на провайдера: после N ошибок подряд провайдер
+  исключается на cooldown, затем один пробный запрос (half-open)
+- Hedging (опционально): если основной провайдер не ответил за свой p95,
+  тот же запрос отправляется второму провайдеру; побеждает первый ответ,
+  проигравший запрос отменяется
+- Failover без hedging: ошибка/timeout основного → следующий провайдер
+- Таймаут на каждую попытку (LLM_ATTEMPT_TIMEOUT): зависший провайдер
+  считается ошибкой и открывает circuit breaker, а общий дедлайн
+  (LLM_REQUEST_TIMEOUT) оставляет время следующему провайдеру
+
+Usage:
+    router = LLMRouter([OpenAIProvider(client, model), AnthropicProvider(client, model)])
+    result = await router.complete(messages, max_completion_tokens=2000, temperature=0.5)
+    result.text, result.provider, result.model
+"""
+
+import abc
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from bot.config import (
+    LLM_REQUEST_TIMEOUT, LLM_ATTEMPT_TIMEOUT, LLM_HEDGING_ENABLED, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_DEFAULT_DELAY,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер окна rolling статистики
+STATS_WINDOW = 200
+# Минимум успешных запросов, чтобы доверять p95
+MIN_SAMPLES_FOR_P95 = 10
+# Запас общего дедлайна сверх таймаутов попыток: срабатывает только если
+# провайдер не реагирует на отмену
+BACKSTOP_GRACE_SECONDS = 1.0
+
+
+@dataclass
+class LLMResult:
+    """Ответ провайдера"""
+
+    text: str
+    provider: str
+    model: str
+    usage: Any = None
+    latency_ms: float = 0.0
+
+
+class ProviderStats:
+    """Rolling статистика latency и ошибок провайдера"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.latencies_ms = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True - успех, False - ошибка
+        self.total_calls = 0
+        self.total_errors = 0
+        self.timeouts = 0
+        self.hedge_wins = 0
+        self.cancelled = 0  # Проигравшие hedge запросы
+
+    def record_success(self, latency_ms: float):
+        self.latencies_ms.append(latency_ms)
+        self.outcomes.append(True)
+        self.total_calls += 1
+
+    def record_error(self):
+        self.outcomes.append(False)
+        self.total_calls += 1
+        self.total_errors += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies_ms:
+            return None
+        ordered = sorted(self.latencies_ms)
+        index = min(int(len(ordered) * q), len(ordered) - 1)
+        return ordered[index]
+
+    @property
+    def error_rate(self) -> float:
+        """Доля ошибок в окне (0-100)"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes) * 100.0
+
+    def get_summary(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        p99 = self.percentile(0.99)
+        return {
+            "total_calls": self.total_calls,
+            "total_errors": self.total_errors,
+            "timeouts": self.timeouts,
+            "window_error_rate_percent": round(self.error_rate, 2),
+            "hedge_wins": self.hedge_wins,
+            "cancelled": self.cancelled,
+            "latency": {
+                "p50_ms": round(p50, 2) if p50 is not None else None,
+                "p95_ms": round(p95, 2) if p95 is not None else None,
+                "p99_ms": round(p99, 2) if p99 is not None else None,
+                "samples": len(self.latencies_ms)
+            }
+        }
+
+
+class CircuitBreaker:
+    """Circuit breaker: closed → open (после N ошибок подряд) → half_open → closed"""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown_seconds: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос провайдеру"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_progress:
+            return True
+        return False
+
+    def on_start(self):
+        if self.state == "half_open":
+            self._trial_in_progress = True
+
+    def on_success(self):
+        if self.opened_at is not None:
+            logger.info("✅ Circuit breaker закрыт после успешного пробного запроса")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_progress = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def on_cancel(self):
+        self._trial_in_progress = False
+
+
+class LLMProvider(abc.ABC):
+    """Базовый адаптер провайдера"""
+
+    name = "base"
+
+    def __init__(self, client, model: str):
+        self.client = client
+        self.model = model
+        self.stats = ProviderStats()
+        self.breaker = CircuitBreaker()
+
+    @abc.abstractmethod
+    async def complete(self, messages: list, max_completion_tokens: int, temperature: float) -> LLMResult:
+        """Один запрос к API провайдера"""
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    async def complete(self, messages: list, max_completion_tokens: int, temperature: float) -> LLMResult:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_completion_tokens=max_completion_tokens,
+            temperature=temperature
+        )
+        return LLMResult(
+            text=response.choices[0].message.content,
+            provider=self.name,
+            model=response.model,
+            usage=response.usage
+        )
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+
+    async def complete(self, messages: list, max_completion_tokens: int, temperature: float) -> LLMResult:
+        # Anthropic принимает system отдельным параметром
+        system_parts = [m["content"] for m in messages if m["role"] == "system"]
+        chat_messages = [
+            {"role": m["role"], "content": m["content"]}
+            for m in messages if m["role"] in ("user", "assistant")
+        ]
+        response = await self.client.messages.create(
+            model=self.model,
+            system="\n\n".join(system_parts),
+            messages=chat_messages,
+            max_tokens=max_completion_tokens,
+            temperature=temperature
+        )
+        text = "".join(block.text for block in response.content if getattr(block, "type", "") == "text")
+        return LLMResult(
+            text=text,
+            provider=self.name,
+            model=response.model,
+            usage=response.usage
+        )
+
+
+class LLMRouter:
+    """Маршрутизатор LLM запросов с hedging, failover и circuit breaker"""
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        hedging_enabled: bool = LLM_HEDGING_ENABLED,
+        timeout: float = LLM_REQUEST_TIMEOUT,
+        attempt_timeout: float = LLM_ATTEMPT_TIMEOUT
+    ):
+        self.providers = providers
+        self.hedging_enabled = hedging_enabled
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.hedged_requests = 0
+
+    def get_provider(self, name: str) -> Optional[LLMProvider]:
+        for provider in self.providers:
+            if provider.name == name:
+                return provider
+        return None
+
+    def _available(self) -> List[LLMProvider]:
+        return [p for p in self.providers if p.breaker.allow()]
+
+    def _hedge_delay(self, provider: LLMProvider) -> float:
+        """Сколько ждать основного провайдера перед hedge запросом"""
+        if len(provider.stats.latencies_ms) < MIN_SAMPLES_FOR_P95:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return max(provider.stats.percentile(0.95) / 1000.0, LLM_HEDGE_MIN_DELAY)
+
+    def _attempt_budget(self, deadline: float) -> float:
+        """Таймаут попытки: LLM_ATTEMPT_TIMEOUT, но не дольше остатка общего дедлайна"""
+        return min(self.attempt_timeout, deadline - asyncio.get_running_loop().time())
+
+    def _on_failure(self, provider: LLMProvider):
+        provider.stats.record_error()
+        provider.breaker.on_failure()
+        if provider.breaker.state != "closed":
+            logger.warning(f"🔌 Circuit breaker {provider.name}: OPEN на {provider.breaker.cooldown_seconds}s")
+
+    async def _call(self, provider: LLMProvider, messages: list, max_completion_tokens: int, temperature: float, timeout: float) -> LLMResult:
+        """Запрос к провайдеру с таймаутом попытки, учётом статистики и circuit breaker"""
+        if timeout <= 0:
+            raise Exception(f"{provider.name}: не осталось времени до дедлайна")
+        provider.breaker.on_start()
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout):
+                result = await provider.complete(messages, max_completion_tokens, temperature)
+        except TimeoutError:
+            # Зависание провайдера - такая же ошибка, как и исключение API
+            provider.stats.timeouts += 1
+            self._on_failure(provider)
+            logger.error(f"⏱️ {provider.name} не ответил за {timeout:.1f}s")
+            raise Exception(f"{provider.name} timeout ({timeout:.1f}s)")
+        except asyncio.CancelledError:
+            # Отмена снаружи (проигравший hedge запрос) - не ошибка провайдера
+            provider.breaker.on_cancel()
+            raise
+        except Exception as e:
+            self._on_failure(provider)
+            logger.error(f"❌ Ошибка {provider.name}: {type(e).__name__}: {e}")
+            raise
+
+        result.latency_ms = (time.monotonic() - start) * 1000
+        provider.stats.record_success(result.latency_ms)
+        provider.breaker.on_success()
+        return result
+
+    async def complete(self, messages: list, max_completion_tokens: int = 1000, temperature: float = 0.5) -> LLMResult:
+        """
+        Выполнить запрос через доступных провайдеров
+
+        Raises:
+            Exception: если ни один провайдер не ответил за timeout
+        """
+        providers = self._available()
+        if not providers:
+            raise Exception("Все LLM провайдеры недоступны (circuit breaker open)")
+
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        try:
+            # Попытки укладываются в deadline сами, общий таймаут - страховка
+            async with asyncio.timeout(self.timeout + BACKSTOP_GRACE_SECONDS):
+                if self.hedging_enabled and len(providers) > 1:
+                    return await self._complete_hedged(providers, messages, max_completion_tokens, temperature, deadline)
+                return await self._complete_failover(providers, messages, max_completion_tokens, temperature, deadline)
+        except TimeoutError:
+            logger.error(f"⏱️ LLM timeout после {self.timeout}s")
+            raise Exception(f"LLM timeout: запрос превысил {self.timeout}s. Попробуйте упростить запрос или обратитесь позже.")
+
+    async def _complete_failover(self, providers: List[LLMProvider], messages: list, max_completion_tokens: int, temperature: float, deadline: float) -> LLMResult:
+        """Последовательно: основной провайдер, при ошибке или таймауте - следующий"""
+        last_error = None
+        for provider in providers:
+            budget = self._attempt_budget(deadline)
+            if budget <= 0:
+                break
+            try:
+                return await self._call(provider, messages, max_completion_tokens, temperature, budget)
+            except Exception as e:
+                last_error = e
+                logger.warning(f"↪️ Переключаемся с {provider.name} на следующего провайдера")
+        if last_error is None or self._attempt_budget(deadline) <= 0:
+            logger.error(f"⏱️ LLM timeout после {self.timeout}s")
+            raise Exception(f"LLM timeout: запрос превысил {self.timeout}s. Попробуйте упростить запрос или обратитесь позже.")
+        raise Exception(f"LLM error: {last_error}")
+
+    async def _complete_hedged(self, providers: List[LLMProvider], messages: list, max_completion_tokens: int, temperature: float, deadline: float) -> LLMResult:
+        """Основной провайдер + hedge запрос второму, если основной не ответил за p95"""
+        primary, secondary = providers[0], providers[1]
+        hedge_delay = self._hedge_delay(primary)
+
+        tasks = {
+            asyncio.create_task(self._call(primary, messages, max_completion_tokens, temperature, self._attempt_budget(deadline))): primary
+        }
+        try:
+            done, _ = await asyncio.wait(tasks.keys(), timeout=hedge_delay)
+            if done:
+                task = done.pop()
+                if task.exception() is None:
+                    return task.result()
+                # Основной упал (или превысил таймаут попытки) до hedging - сразу ко второму
+                logger.warning(f"↪️ {primary.name} ответил ошибкой, переключаемся на {secondary.name}")
+                return await self._call(secondary, messages, max_completion_tokens, temperature, self._attempt_budget(deadline))
+
+            logger.info(f"🏁 Hedging: {primary.name} не ответил за {hedge_delay:.1f}s (p95), запускаем {secondary.name}")
+            self.hedged_requests += 1
+            tasks[asyncio.create_task(
+                self._call(secondary, messages, max_completion_tokens, temperature, self._attempt_budget(deadline))
+            )] = secondary
+
+            last_error = None
+            pending = set(tasks.keys())
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        winner.stats.hedge_wins += 1
+                        logger.info(f"🏆 Hedging: победил {winner.name}")
+                        return task.result()
+                    last_error = task.exception()
+            raise Exception(f"LLM error: {last_error}")
+        finally:
+            # Отменяем проигравший / незавершённый запрос
+            for task, provider in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    provider.stats.cancelled += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "hedging_enabled": self.hedging_enabled,
+            "timeout_seconds": self.timeout,
+            "attempt_timeout_seconds": self.attempt_timeout,
+            "hedged_requests": self.hedged_requests,
+            "providers": {
+                p.name: {
+                    "model": p.model,
+                    "circuit_breaker": p.breaker.state,
+                    "hedge_delay_seconds": round(self._hedge_delay(p), 2),
+                    **p.stats.get_summary()
+                }
+                for p in self.providers
+            }
+        }
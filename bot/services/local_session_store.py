@@ -0,0 +1,282 @@
+"""
+Local Session Store
+
+Локальная история диалогов - fallback, когда Zep недоступен.
+
+Раньше это был dict agent.user_sessions: история каждой сессии обрезалась
+до 10 обменов, но сами сессии не вытеснялись никогда - при долгом сбое Zep
+и тысячах пользователей память росла без ограничений.
+
+Теперь:
+1. Общий бюджет памяти (LOCAL_SESSION_MAX_BYTES), LRU по сессиям
+2. Вытесненные сессии сохраняются в SQLite (LOCAL_SESSION_SPILL_PATH)
+   и возвращаются в память при следующем обращении
+3. Строка истории "последние N обменов" для промпта хранится готовой
+   и пересобирается только при добавлении обмена
+
+Все операции с SQLite выполняются в отдельном потоке (writer), event loop
+не ждёт диск: add() вытесняет сессии без ожидания записи, history() ждёт
+чтения с диска через await. Если сессии нет в памяти, add() начинает её
+заново (partial), а история с диска подмешивается при следующем чтении
+или вытеснении.
+
+Если SQLite недоступен (read-only файловая система) - вытесненные сессии
+просто удаляются.
+
+Usage:
+    from bot.services.local_session_store import get_local_session_store
+
+    store = get_local_session_store()
+    store.add(session_id, user_message, bot_response)
+    history = await store.history(session_id)
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bot.config import LOCAL_SESSION_MAX_BYTES, LOCAL_SESSION_SPILL_PATH
+
+logger = logging.getLogger(__name__)
+
+# Сколько обменов хранить на сессию и сколько из них отдавать в промпт
+MAX_EXCHANGES = 10
+HISTORY_EXCHANGES = 6
+
+# Сессии на диске старше этого срока удаляются при старте
+SPILL_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+# Накладные расходы на обмен (dict + ключи) сверх размера строк
+EXCHANGE_OVERHEAD_BYTES = 400
+
+
+@dataclass
+class LocalSession:
+    """История одной сессии + готовая строка для промпта"""
+
+    exchanges: List[Dict[str, str]] = field(default_factory=list)
+    rendered: str = ""
+    size_bytes: int = 0
+    partial: bool = False  # Начата без чтения диска - на диске могут быть более ранние обмены
+
+    def refresh(self):
+        """Пересобрать строку истории и оценку размера после изменения"""
+        history = []
+        for exchange in self.exchanges[-HISTORY_EXCHANGES:]:  # Последние 6 обменов
+            history.append(f"Пользователь: {exchange['user']}")
+            history.append(f"Ассистент: {exchange['assistant']}")
+        self.rendered = "\n".join(history)
+
+        self.size_bytes = sys.getsizeof(self.rendered) + sum(
+            sys.getsizeof(exchange["user"]) + sys.getsizeof(exchange["assistant"]) + EXCHANGE_OVERHEAD_BYTES
+            for exchange in self.exchanges
+        )
+
+
+class LocalSessionStore:
+    """LRU история сессий с бюджетом памяти и выгрузкой в SQLite"""
+
+    def __init__(self, max_bytes: int = LOCAL_SESSION_MAX_BYTES, spill_path: Optional[str] = LOCAL_SESSION_SPILL_PATH):
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path or None
+        self._sessions: "OrderedDict[str, LocalSession]" = OrderedDict()
+        self._total_bytes = 0
+        self._db: Optional[sqlite3.Connection] = None  # Используется только в потоке writer
+        self._disk = bool(self.spill_path)  # False, если SQLite недоступен
+        self._disk_sessions: Optional[int] = None  # COUNT(*) после последней записи (поток writer)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-sessions-writer")
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.spilled = 0
+        self.dropped = 0
+
+        if self._disk:
+            # Открытие и чистка старых сессий - первой задачей writer, не в event loop
+            self._writer.submit(self._open_spill)
+
+    def _open_spill(self):
+        """Открыть SQLite и удалить устаревшие сессии (поток writer)"""
+        try:
+            db = sqlite3.connect(self.spill_path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, exchanges TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - SPILL_MAX_AGE_SECONDS,))
+            self._db = db
+            self._count_disk()
+            logger.info(f"💾 Local session store: выгрузка в SQLite {self.spill_path}")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Local session store: SQLite недоступен ({e}), вытесненные сессии не сохраняются")
+            self._db = None
+            self._disk = False
+
+    def _count_disk(self):
+        """Обновить число сессий на диске для get_stats (поток writer)"""
+        try:
+            self._disk_sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        except sqlite3.Error:
+            pass
+
+    def _take_row(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """Забрать обмены сессии с диска, запись удаляется (поток writer)"""
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT exchanges FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._count_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Local session store: ошибка чтения SQLite: {e}")
+            return None
+        return json.loads(row[0])
+
+    def _write_row(self, session_id: str, exchanges: List[Dict[str, str]], partial: bool):
+        """Сохранить вытесненную сессию; partial - дописать к уже сохранённой (поток writer)"""
+        if self._db is None:
+            self.dropped += 1
+            return
+        try:
+            if partial:
+                row = self._db.execute("SELECT exchanges FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                if row is not None:
+                    exchanges = (json.loads(row[0]) + exchanges)[-MAX_EXCHANGES:]
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, exchanges, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(exchanges, ensure_ascii=False), time.time())
+            )
+            self._count_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Local session store: ошибка записи SQLite: {e}")
+            self.dropped += 1
+
+    def _clear_disk(self):
+        """Удалить все сохранённые сессии (поток writer)"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute("DELETE FROM sessions")
+            self._count_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Local session store: ошибка очистки SQLite: {e}")
+
+    def _spill(self, session_id: str, session: LocalSession):
+        if not self._disk:
+            self.dropped += 1
+            return
+        self.spilled += 1
+        self._writer.submit(self._write_row, session_id, list(session.exchanges), session.partial)
+
+    def _put(self, session_id: str, session: LocalSession, previous_size: int = 0):
+        """Положить сессию в память; previous_size - её учтённый размер до изменения"""
+        self._sessions.pop(session_id, None)
+        self._sessions[session_id] = session
+        self._total_bytes += session.size_bytes - previous_size
+
+        # Вытесняем самые давние сессии, текущую оставляем в любом случае
+        while self._total_bytes > self.max_bytes and len(self._sessions) > 1:
+            evicted_id, evicted = self._sessions.popitem(last=False)
+            self._total_bytes -= evicted.size_bytes
+            self._spill(evicted_id, evicted)
+
+    def add(self, session_id: str, user_message: str, bot_response: str):
+        """Добавить обмен в историю сессии (без ожидания диска)"""
+        session = self._sessions.get(session_id)
+        previous_size = session.size_bytes if session is not None else 0
+        if session is None:
+            # Более ранние обмены могут быть на диске - подмешаем их при чтении
+            session = LocalSession(partial=self._disk)
+        session.exchanges.append({
+            "user": user_message,
+            "assistant": bot_response,
+            "timestamp": datetime.now().isoformat()
+        })
+        # Ограничиваем историю 10 последними обменами
+        if len(session.exchanges) > MAX_EXCHANGES:
+            session.exchanges = session.exchanges[-MAX_EXCHANGES:]
+        session.refresh()
+        self._put(session_id, session, previous_size)
+
+    async def history(self, session_id: str) -> str:
+        """Готовая строка последних обменов для промпта ("" если истории нет)"""
+        session = self._sessions.get(session_id)
+        if session is not None and not session.partial:
+            self.hits += 1
+            self._sessions.move_to_end(session_id)
+            return session.rendered
+
+        exchanges = None
+        if self._disk:
+            exchanges = await asyncio.wrap_future(self._writer.submit(self._take_row, session_id))
+
+        # Пока читали диск, сессия могла измениться
+        session = self._sessions.get(session_id)
+        if exchanges is None:
+            if session is None:
+                self.misses += 1
+                return ""
+            self.hits += 1
+            session.partial = False
+            self._sessions.move_to_end(session_id)
+            return session.rendered
+
+        self.disk_hits += 1
+        previous_size = session.size_bytes if session is not None else 0
+        if session is None:
+            session = LocalSession(exchanges=exchanges)
+        else:
+            session.exchanges = (exchanges + session.exchanges)[-MAX_EXCHANGES:]
+            session.partial = False
+        session.refresh()
+        self._put(session_id, session, previous_size)
+        return session.rendered
+
+    def clear(self):
+        """Очистить историю всех сессий (в памяти и на диске)"""
+        self._sessions.clear()
+        self._total_bytes = 0
+        if self._disk:
+            self._writer.submit(self._clear_disk)
+        logger.info("🧹 Локальная история сессий очищена")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "sessions_in_memory": len(self._sessions),
+            "memory_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "sessions_on_disk": self._disk_sessions if self._disk else None,
+            "spill_path": self.spill_path if self._disk else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "spilled": self.spilled,
+            "dropped": self.dropped
+        }
+
+
+# Singleton instance
+_local_session_store = None
+
+
+def get_local_session_store() -> LocalSessionStore:
+    """Получить глобальное локальное хранилище сессий"""
+    global _local_session_store
+    if _local_session_store is None:
+        _local_session_store = LocalSessionStore()
+    return _local_session_store
@@ -0,0 +1,343 @@
+"""
+Local Vector Index
+
+Точный векторный поиск по базе знаний внутри процесса.
+
+База знаний - около тысячи документов (data/parsed_kb), а каждый запрос
+шёл по сети в Qdrant Cloud или Supabase RPC. На таком объёме точный поиск
+(одно умножение матрицы на вектор) быстрее сетевого round-trip и не зависит
+от доступности внешнего сервиса.
+
+Формат индекса (LOCAL_INDEX_DIR, собирается scripts/build_local_index.py):
+- vectors.npy    - матрица N x D нормализованных embeddings (float32/float16),
+                   открывается через memory map - загрузка за миллисекунды
+- documents.json - id, entity_type, title, content, metadata документов (строки матрицы)
+- meta.json      - модель embeddings, размерность, dtype, отпечаток parsed_kb
+
+Поиск: scores = vectors @ query, top-k через argpartition, фильтр по
+entity_type - заранее посчитанные номера строк каждого типа.
+
+Embedding запроса - OpenAI (та же модель, что при сборке индекса,
+совместима с Supabase: OPENAI_EMBEDDING_MODEL).
+
+Usage:
+    from bot.services.local_vector_index import get_local_vector_index
+
+    index = get_local_vector_index()
+    results = await index.search_semantic(query="как делать мозгоритмы?", limit=10)
+"""
+
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logging.warning("⚠️ numpy not installed. Local vector index disabled. Install: pip install numpy")
+
+try:
+    from openai import AsyncOpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+# Опциональный импорт мониторинга
+try:
+    from bot.monitoring import get_metrics
+    MONITORING_AVAILABLE = True
+except ImportError:
+    MONITORING_AVAILABLE = False
+    get_metrics = None
+
+from bot.config import (
+    USE_LOCAL_INDEX, LOCAL_INDEX_DIR, OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_EMBEDDING_MODEL
+)
+from bot.services.kb_corpus import corpus_fingerprint
+from bot.services.embedding_cache import get_embedding_cache
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+DOCUMENTS_FILE = "documents.json"
+META_FILE = "meta.json"
+
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+def write_index(
+    index_dir: str,
+    documents: List[Dict[str, Any]],
+    embeddings: Sequence[Sequence[float]],
+    model: str,
+    dtype: str = "float32",
+    fingerprint: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Записать индекс на диск (нормализация строк, атомарная замена файлов)
+
+    meta.json пишется последним - загрузчик сверяет count с матрицей
+    и не откроет наполовину записанный индекс.
+
+    Returns:
+        Dict: Содержимое meta.json
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Неподдерживаемый dtype индекса: {dtype} (доступны: {', '.join(SUPPORTED_DTYPES)})")
+    if len(documents) != len(embeddings):
+        raise ValueError(f"Документов {len(documents)}, embeddings {len(embeddings)}")
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = (matrix / norms).astype(dtype)
+
+    os.makedirs(index_dir, exist_ok=True)
+    meta = {
+        "model": model,
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "dtype": dtype,
+        "count": len(documents),
+        "kb_fingerprint": fingerprint,
+        "built_at": datetime.now().isoformat()
+    }
+
+    vectors_tmp = os.path.join(index_dir, VECTORS_FILE + ".tmp")
+    with open(vectors_tmp, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(vectors_tmp, os.path.join(index_dir, VECTORS_FILE))
+
+    for filename, data in ((DOCUMENTS_FILE, documents), (META_FILE, meta)):
+        tmp = os.path.join(index_dir, filename + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(index_dir, filename))
+
+    return meta
+
+
+class LocalVectorIndex:
+    """Точный top-k поиск по memory-mapped матрице embeddings"""
+
+    # RetrievalBackend (bot/services/retrieval_backend.py)
+    name = "local"
+    kind = "vector"
+
+    def __init__(self, index_dir: str = LOCAL_INDEX_DIR):
+        self.enabled = USE_LOCAL_INDEX and NUMPY_AVAILABLE
+        self.index_dir = index_dir
+        self.vectors = None
+        self.documents: List[Dict[str, Any]] = []
+        self.meta: Dict[str, Any] = {}
+        self._type_rows: Dict[str, Any] = {}
+        self.openai_client = None
+
+        self.searches = 0
+        self.total_search_ms = 0.0
+
+        if not self.enabled:
+            if USE_LOCAL_INDEX and not NUMPY_AVAILABLE:
+                logger.warning("⚠️ Local vector index disabled: numpy not installed")
+            return
+
+        if not self.load():
+            self.enabled = False
+
+    def load(self) -> bool:
+        """Открыть индекс с диска (True при успехе)"""
+        start = time.perf_counter()
+        try:
+            with open(os.path.join(self.index_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(self.index_dir, VECTORS_FILE), mmap_mode='r')
+            with open(os.path.join(self.index_dir, DOCUMENTS_FILE), 'r', encoding='utf-8') as f:
+                documents = json.load(f)
+        except FileNotFoundError:
+            logger.error(f"❌ Local vector index не найден в {self.index_dir} (запустите scripts/build_local_index.py)")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить local vector index: {type(e).__name__}: {e}")
+            return False
+
+        if vectors.ndim != 2 or vectors.shape[0] != len(documents) or meta.get("count") != len(documents):
+            logger.error(
+                f"❌ Local vector index повреждён: матрица {vectors.shape}, документов {len(documents)}, "
+                f"meta.count={meta.get('count')}"
+            )
+            return False
+
+        entity_types = np.array([doc.get("entity_type", "unknown") for doc in documents])
+        self._type_rows = {
+            entity_type: np.flatnonzero(entity_types == entity_type)
+            for entity_type in set(entity_types.tolist())
+        }
+        self.vectors = vectors
+        self.documents = documents
+        self.meta = meta
+
+        fingerprint = corpus_fingerprint()
+        if fingerprint and meta.get("kb_fingerprint") and fingerprint != meta["kb_fingerprint"]:
+            logger.warning("⚠️ Local vector index собран по другой версии data/parsed_kb - пересоберите индекс")
+        if meta.get("model") != OPENAI_EMBEDDING_MODEL:
+            logger.warning(
+                f"⚠️ Local vector index собран моделью {meta.get('model')}, "
+                f"OPENAI_EMBEDDING_MODEL={OPENAI_EMBEDDING_MODEL} - запросы векторизуются моделью индекса"
+            )
+
+        load_ms = (time.perf_counter() - start) * 1000
+        logger.info(
+            f"🟤 Local vector index загружен: {len(documents)} документов, "
+            f"{meta.get('dim')}D {meta.get('dtype')}, {load_ms:.1f}ms"
+        )
+        return True
+
+    def search_vector(
+        self,
+        query_vector: Sequence[float],
+        limit: int = 5,
+        score_threshold: float = 0.0,
+        entity_type: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Точный top-k по cosine similarity
+
+        Returns:
+            List в формате SupabaseService.search_semantic:
+            [{"id", "score", "entity_type", "title", "content", "metadata"}, ...]
+        """
+        if self.vectors is None or limit <= 0:
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query /= norm
+
+        if entity_type:
+            rows = self._type_rows.get(entity_type)
+            if rows is None or not len(rows):
+                return []
+            scores = np.dot(self.vectors[rows], query)
+        else:
+            rows = None
+            scores = np.dot(self.vectors, query)
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for position in top:
+            score = float(scores[position])
+            if score < score_threshold:
+                break
+            doc = self.documents[int(rows[position]) if rows is not None else int(position)]
+            results.append({
+                "id": doc["id"],
+                "score": score,
+                "entity_type": doc.get("entity_type", "unknown"),
+                "title": doc.get("title", ""),
+                "content": doc.get("content", ""),
+                "metadata": doc.get("metadata", {})
+            })
+        return results
+
+    async def _embed(self, text: str) -> List[float]:
+        """Embedding запроса той же моделью, что и индекс (через общий кэш)"""
+        model = self.meta.get("model", OPENAI_EMBEDDING_MODEL)
+        cache = get_embedding_cache()
+        cached = await cache.get(model, text)
+        if cached is not None:
+            return cached
+
+        if self.openai_client is None:
+            if not OPENAI_AVAILABLE or not OPENAI_API_KEY:
+                raise RuntimeError("OpenAI недоступен - embedding запроса для local vector index невозможен")
+            self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+        start_time = time.time()
+        error = False
+        try:
+            response = await self.openai_client.embeddings.create(
+                input=text,
+                model=model
+            )
+            embedding = response.data[0].embedding
+            cache.put(model, text, embedding)
+            return embedding
+        except Exception:
+            error = True
+            raise
+        finally:
+            if MONITORING_AVAILABLE and get_metrics:
+                get_metrics().add_call(
+                    tokens=len(text) // 4,
+                    latency_ms=(time.time() - start_time) * 1000,
+                    error=error
+                )
+
+    async def search_semantic(
+        self,
+        query: str,
+        limit: int = 5,
+        score_threshold: float = 0.5,
+        entity_type: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Семантический поиск (интерфейс как у Supabase/Qdrant сервисов)"""
+        if not self.enabled:
+            logger.warning("⚠️ Local vector index not available")
+            return []
+
+        query_vector = await self._embed(query)
+
+        start = time.perf_counter()
+        results = self.search_vector(query_vector, limit, score_threshold, entity_type)
+        search_ms = (time.perf_counter() - start) * 1000
+        self.searches += 1
+        self.total_search_ms += search_ms
+
+        logger.info(f"🟤 Local index: {len(results)} результатов за {search_ms:.2f}ms (threshold {score_threshold})")
+        return results
+
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """RetrievalBackend: семантический поиск по всей базе знаний"""
+        return await self.search_semantic(query=query, limit=limit, score_threshold=score_threshold)
+
+    async def health_check(self) -> Dict[str, Any]:
+        return {
+            "service": "local_index",
+            "status": "healthy" if self.vectors is not None else "disabled",
+            "enabled": self.enabled,
+            "index_dir": self.index_dir,
+            **self.get_stats()
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.documents),
+            "dim": self.meta.get("dim"),
+            "dtype": self.meta.get("dtype"),
+            "model": self.meta.get("model"),
+            "built_at": self.meta.get("built_at"),
+            "by_type": {entity_type: len(rows) for entity_type, rows in self._type_rows.items()},
+            "searches": self.searches,
+            "avg_search_ms": round(self.total_search_ms / self.searches, 3) if self.searches else None
+        }
+
+
+# Singleton instance
+_local_vector_index = None
+
+
+def get_local_vector_index() -> LocalVectorIndex:
+    """Получить глобальный локальный векторный индекс"""
+    global _local_vector_index
+    if _local_vector_index is None:
+        _local_vector_index = LocalVectorIndex()
+    return _local_vector_index
@@ -19,6 +19,7 @@ Usage:
     log = await get_message_log("M624aa39")
 """
 
+import asyncio
 import logging
 from typing import Optional, Dict, Any, List
 from datetime import datetime
@@ -36,6 +37,16 @@ except ImportError as e:
     MessageLog = None
 
 
+def _build_log_entry(**fields) -> "MessageLog":
+    """Запись MessageLog из полей log_message"""
+    response_text = fields.get("response_text")
+    return MessageLog(
+        **fields,
+        response_length=len(response_text) if response_text else 0,
+        created_at=datetime.utcnow()
+    )
+
+
 async def log_message(
     message_id: str,
     user_id: Optional[str] = None,
@@ -51,7 +62,8 @@ async def log_message(
     full_prompt_length: Optional[int] = None,
     model_used: Optional[str] = None,
     response_text: Optional[str] = None,
-    error_message: Optional[str] = None
+    error_message: Optional[str] = None,
+    stage_timings: Optional[Dict[str, float]] = None
 ) -> bool:
     """
     Сохранить детальный лог обработки сообщения в MySQL.
@@ -72,6 +84,7 @@ async def log_message(
         model_used: Использованная модель
         response_text: Ответ модели
         error_message: Сообщение об ошибке если была
+        stage_timings: Тайминги стадий трейса {stage: ms}, если уже известны
 
     Returns:
         True если лог сохранён успешно, False в противном случае
@@ -84,7 +97,7 @@ async def log_message(
         db = SessionLocal()
         try:
             # Создаём запись лога
-            log_entry = MessageLog(
+            log_entry = _build_log_entry(
                 message_id=message_id,
                 user_id=user_id,
                 user_name=user_name,
@@ -99,9 +112,8 @@ async def log_message(
                 full_prompt_length=full_prompt_length,
                 model_used=model_used,
                 response_text=response_text,
-                response_length=len(response_text) if response_text else 0,
                 error_message=error_message,
-                created_at=datetime.utcnow()
+                stage_timings=stage_timings
             )
 
             db.add(log_entry)
@@ -122,6 +134,84 @@ async def log_message(
         return False
 
 
+def _insert_logs(entries: List[Dict[str, Any]]) -> int:
+    """Синхронная вставка пачки логов одной транзакцией (выполняется в потоке)"""
+    db = SessionLocal()
+    try:
+        db.add_all([_build_log_entry(**fields) for fields in entries])
+        db.commit()
+        return len(entries)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def log_messages_batch(entries: List[Dict[str, Any]]) -> int:
+    """
+    Сохранить пачку логов одним INSERT (для очереди пост-обработки).
+
+    В отличие от log_message ошибку БД НЕ глотает - вызывающий решает,
+    повторять ли запись. Сама вставка выполняется в потоке, чтобы не
+    блокировать event loop.
+
+    Args:
+        entries: Список kwargs для log_message
+
+    Returns:
+        Количество сохранённых записей (0 если БД недоступна)
+    """
+    if not DB_AVAILABLE or not entries:
+        return 0
+
+    saved = await asyncio.to_thread(_insert_logs, entries)
+    logger.info(f"📝 Message logs saved: {saved} ({', '.join('#' + e['message_id'] for e in entries)})")
+    return saved
+
+
+def _update_stage_timings(message_id: str, stage_timings: Dict[str, float]) -> bool:
+    """Синхронный UPDATE stage_timings (выполняется в потоке)"""
+    db = SessionLocal()
+    try:
+        updated = db.query(MessageLog).filter(
+            MessageLog.message_id == message_id
+        ).update({MessageLog.stage_timings: stage_timings}, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Failed to update stage timings {message_id}: {e}")
+        return False
+    finally:
+        db.close()
+
+
+async def update_stage_timings(message_id: str, stage_timings: Dict[str, float]) -> bool:
+    """
+    Сохранить тайминги стадий в уже созданный лог сообщения.
+
+    Трейс завершается после log_message (отправка в Telegram, Zep, валидация),
+    поэтому тайминги дописываются отдельным UPDATE.
+
+    Args:
+        message_id: ID сообщения (формат: M624aa39)
+        stage_timings: {stage: ms}
+
+    Returns:
+        True если запись обновлена
+    """
+    if not DB_AVAILABLE:
+        return False
+
+    try:
+        # Синхронный UPDATE + commit - в потоке, чтобы не блокировать event loop
+        return await asyncio.to_thread(_update_stage_timings, message_id, stage_timings)
+    except Exception as e:
+        logger.error(f"❌ Database error in update_stage_timings: {e}")
+        return False
+
+
 async def get_message_log(message_id: str) -> Optional[Dict[str, Any]]:
     """
     Получить лог сообщения по Message ID.
@@ -163,6 +253,7 @@ async def get_message_log(message_id: str) -> Optional[Dict[str, Any]]:
                 "response_text": log_entry.response_text,
                 "response_length": log_entry.response_length,
                 "error_message": log_entry.error_message,
+                "stage_timings": log_entry.stage_timings,
                 "created_at": log_entry.created_at.isoformat() if log_entry.created_at else None
             }
 
@@ -0,0 +1,120 @@
+"""
+Near-Duplicate Detection
+
+Поиск почти-дубликатов среди результатов поиска через SimHash.
+
+Раньше _deduplicate_results сравнивал только первые 200 символов:
+пересекающиеся чанки уроков, перефразированные FAQ и повторяющиеся
+правки кураторов проходили в контекст и занимали место в промпте.
+
+SimHash - 64-битная сигнатура по шинглам (пары соседних основ слов,
+russian_text.tokenize). Похожие тексты дают сигнатуры, отличающиеся
+в небольшом числе бит, сравнение - popcount от XOR.
+
+Сигнатура считается при загрузке данных (kb_corpus, скрипты миграции)
+и хранится в metadata["simhash"] (hex), при поиске пересчитывается
+только для документов без неё.
+
+Usage:
+    from bot.services.near_duplicate import simhash_hex, deduplicate
+
+    metadata["simhash"] = simhash_hex(content)  # При загрузке
+    unique = deduplicate(results)  # Результаты с .content/.relevance_score/.metadata
+"""
+
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional
+
+from bot.config import NEAR_DUPLICATE_MAX_DISTANCE
+from bot.services.russian_text import tokenize
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 2
+
+
+def _feature_hash(feature: str) -> int:
+    # blake2b, а не hash(): сигнатуры сохраняются и сравниваются между процессами
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text: str) -> int:
+    """64-битная SimHash сигнатура текста (0 для текста без слов)"""
+    tokens = tokenize(text)
+    if len(tokens) >= SHINGLE_SIZE:
+        features = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+    else:
+        features = tokens
+    if not features:
+        return 0
+
+    # Бит сигнатуры = 1, если он установлен в хэшах больше чем у половины шинглов
+    counts = [0] * SIMHASH_BITS
+    for feature in features:
+        for bit, value in enumerate(f"{_feature_hash(feature):064b}"):
+            if value == "1":
+                counts[bit] += 1
+
+    half = len(features) / 2
+    return int("".join("1" if count > half else "0" for count in counts), 2)
+
+
+def simhash_hex(text: str) -> str:
+    """Сигнатура для хранения в metadata (JSON не везде держит 64-битные числа)"""
+    return f"{simhash(text):016x}"
+
+
+@lru_cache(maxsize=4096)
+def _cached_simhash(text: str) -> int:
+    return simhash(text)
+
+
+def signature_of(result: Any) -> int:
+    """Сигнатура результата: из metadata["simhash"] или посчитанная по content"""
+    stored = (getattr(result, "metadata", None) or {}).get("simhash")
+    if stored:
+        try:
+            return int(stored, 16)
+        except (TypeError, ValueError):
+            pass
+    return _cached_simhash(result.content or "")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def deduplicate(results: List[Any], max_distance: Optional[int] = None) -> List[Any]:
+    """
+    Убрать почти-дубликаты, оставив из каждой группы самый релевантный результат
+
+    Args:
+        results: Объекты с .content, .relevance_score, .metadata
+        max_distance: Максимальное расстояние Хэмминга между сигнатурами дубликатов
+
+    Returns:
+        Уникальные результаты по убыванию relevance_score
+    """
+    if max_distance is None:
+        max_distance = NEAR_DUPLICATE_MAX_DISTANCE
+
+    kept = []
+    kept_signatures = []
+    for result in sorted(results, key=lambda r: r.relevance_score, reverse=True):
+        signature = signature_of(result)
+        # Пустая сигнатура (нет слов) - сравниваем только точный текст
+        if signature == 0:
+            if any(other.content == result.content for other in kept):
+                continue
+        elif any(hamming_distance(signature, other) <= max_distance for other in kept_signatures if other):
+            continue
+        kept.append(result)
+        kept_signatures.append(signature)
+
+    dropped = len(results) - len(kept)
+    if dropped:
+        logger.debug(f"🧬 Near-duplicates: отброшено {dropped} из {len(results)}")
+    return kept
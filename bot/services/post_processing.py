@@ -0,0 +1,375 @@
+"""
+Post-Processing Queue
+
+Побочные операции после готового ответа: лог в MySQL, запись в Zep Memory,
+валидация ответа, stage_timings трейса.
+
+Раньше generate_response ждал их все (синхронный INSERT SQLAlchemy, round-trip
+в Zep) и только потом handler отправлял ответ в Telegram. Теперь они ставятся
+в ограниченную очередь и выполняются воркерами уже после отправки.
+
+Features:
+- Шардирование по ключу (session_id): операции одной сессии выполняются
+  одним воркером по порядку (запись в Zep не перемешивается между ходами)
+- Батчинг: логи MySQL, накопившиеся в очереди воркера, пишутся одним INSERT
+- Retry с экспоненциальной задержкой (POST_PROCESSING_MAX_RETRIES): операция
+  возвращается в очередь по таймеру, воркер в это время выполняет другие;
+  следующие операции того же ключа ждут исход retry, порядок сессии сохраняется
+- Переполнение очереди → операция выполняется сразу (как раньше), не теряется
+- drain() при остановке приложения дожидается очереди (с таймаутом)
+- stage_timings, пришедшие пока лог ещё в очереди, пишутся в тот же INSERT
+- Длительность операции пишется спаном post:<kind> в трейс хода, из
+  которого она поставлена (трейс к этому моменту обычно уже завершён)
+
+Usage:
+    from bot.services.post_processing import get_post_processor, PostJob
+
+    processor = get_post_processor()
+    await processor.submit_log(log_fields, key=session_id)
+    await processor.submit(PostJob(kind="zep_write", fn=lambda: zep.memory.add(...), key=session_id))
+    await processor.drain()
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from bot.monitoring.tracing import Trace, current_trace
+from bot.config import (
+    POST_PROCESSING_ENABLED, POST_PROCESSING_WORKERS, POST_PROCESSING_QUEUE_SIZE,
+    POST_PROCESSING_BATCH_SIZE, POST_PROCESSING_MAX_RETRIES, POST_PROCESSING_DRAIN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+LOG_MESSAGE = "log_message"
+STAGE_TIMINGS = "stage_timings"
+
+# Базовая задержка retry, сек (0.5 → 1 → 2 ...)
+RETRY_BASE_DELAY = 0.5
+
+
+@dataclass
+class PostJob:
+    """Операция пост-обработки"""
+
+    kind: str
+    fn: Optional[Callable[[], Awaitable[Any]]] = None
+    payload: Optional[Dict[str, Any]] = None  # Поля log_message (только для kind=log_message)
+    key: Optional[str] = None  # Ключ шардирования - порядок операций в рамках сессии
+    max_retries: Optional[int] = None  # None - POST_PROCESSING_MAX_RETRIES
+    on_failure: Optional[Callable[[], Any]] = None  # Fallback после исчерпания попыток
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempt: int = 0  # Номер повтора (0 - первая попытка)
+    trace: Optional[Trace] = field(default_factory=current_trace, repr=False)  # Трейс хода для спана post:<kind>
+
+
+@dataclass
+class KindStats:
+    """Счётчики по типу операции"""
+
+    completed: int = 0
+    failed: int = 0
+    retried: int = 0
+    total_ms: float = 0.0
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_ms": round(self.total_ms / self.completed, 1) if self.completed else None
+        }
+
+
+class PostProcessor:
+    """Очередь пост-обработки с воркерами, батчингом и retry"""
+
+    def __init__(
+        self,
+        enabled: bool = POST_PROCESSING_ENABLED,
+        workers: int = POST_PROCESSING_WORKERS,
+        queue_size: int = POST_PROCESSING_QUEUE_SIZE,
+        batch_size: int = POST_PROCESSING_BATCH_SIZE,
+        max_retries: int = POST_PROCESSING_MAX_RETRIES
+    ):
+        self.enabled = enabled
+        self.worker_count = max(1, workers)
+        self.queue_size = max(1, queue_size // self.worker_count)
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._next_queue = 0
+        self._closing = False
+        # message_id → поля лога, ещё не записанного в БД
+        self._pending_logs: Dict[str, Dict[str, Any]] = {}
+        # key → (операция в retry, операции этого ключа, ждущие её исхода)
+        self._retrying: Dict[str, Tuple[PostJob, List[PostJob]]] = {}
+        # Таймеры retry: операция вернётся в очередь после задержки
+        self._retry_tasks: Set[asyncio.Task] = set()
+
+        self.submitted = 0
+        self.inline = 0
+        self.batches = 0
+        self.batched_logs = 0
+        self.max_wait_ms = 0.0
+        self.kinds: Dict[str, KindStats] = {}
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.worker_count)]
+        self._workers = [
+            asyncio.create_task(self._worker(queue), name=f"post-processing-{i}")
+            for i, queue in enumerate(self._queues)
+        ]
+        logger.info(f"🧵 Post-processing: запущено {self.worker_count} воркеров (очередь {self.queue_size} на воркер)")
+
+    def _queue_for(self, key: Optional[str]) -> asyncio.Queue:
+        if key is None:
+            self._next_queue = (self._next_queue + 1) % len(self._queues)
+            return self._queues[self._next_queue]
+        return self._queues[hash(key) % len(self._queues)]
+
+    async def submit(self, job: PostJob):
+        """Поставить операцию в очередь (или выполнить сразу, если очередь выключена/переполнена)"""
+        self.submitted += 1
+        if not self.enabled or self._closing:
+            self.inline += 1
+            await self._process([job])
+            return
+
+        self._ensure_started()
+        if job.kind == LOG_MESSAGE:
+            self._pending_logs[job.payload["message_id"]] = job.payload
+        try:
+            self._queue_for(job.key).put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(f"⚠️ Post-processing: очередь переполнена, {job.kind} выполняется сразу")
+            if job.kind == LOG_MESSAGE:
+                self._pending_logs.pop(job.payload["message_id"], None)
+            self.inline += 1
+            await self._process([job])
+
+    async def submit_log(self, fields: Dict[str, Any], key: Optional[str] = None):
+        """Лог сообщения в MySQL (поля как у log_message)"""
+        await self.submit(PostJob(kind=LOG_MESSAGE, payload=dict(fields), key=key))
+
+    async def submit_stage_timings(self, message_id: str, timings: Dict[str, float], key: Optional[str] = None):
+        """
+        Тайминги стадий трейса для MessageLog
+
+        Если лог ещё в очереди - тайминги попадут в тот же INSERT,
+        иначе отдельный UPDATE (с retry, пока запись не появится в БД).
+        """
+        pending = self._pending_logs.get(message_id)
+        if pending is not None:
+            pending["stage_timings"] = timings
+            return
+
+        from bot.services import message_logger
+
+        if not message_logger.DB_AVAILABLE:
+            return
+
+        async def update():
+            if not await message_logger.update_stage_timings(message_id, timings):
+                raise LookupError(f"MessageLog #{message_id} ещё не записан")
+
+        await self.submit(PostJob(kind=STAGE_TIMINGS, fn=update, key=key))
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            batch = [job]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"❌ Post-processing worker error: {type(e).__name__}: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _process(self, batch: List[PostJob]):
+        """Выполнить пачку: сначала все логи одним INSERT, затем остальное по порядку"""
+        now = time.monotonic()
+        self.max_wait_ms = max(self.max_wait_ms, max((now - j.enqueued_at) * 1000 for j in batch))
+
+        logs = [job for job in batch if job.kind == LOG_MESSAGE]
+        if logs:
+            start = time.monotonic()
+            error = await self._write_logs(logs)
+            for job in logs:
+                self._trace_span(job, start, error)
+                if error is not None and not self._schedule_retry(job, error):
+                    self._fail(job, error)
+
+        for job in batch:
+            if job.kind != LOG_MESSAGE:
+                await self._run_job(job)
+
+    async def _run_job(self, job: PostJob):
+        """Одна операция; при ошибке - retry по таймеру, операции того же ключа ждут его"""
+        key = job.key
+        if key is not None and key in self._retrying:
+            head, parked = self._retrying[key]
+            if job is not head:
+                parked.append(job)
+                return
+
+        start = time.monotonic()
+        error = await self._run(job.kind, job.fn)
+        self._trace_span(job, start, error)
+
+        if error is not None and self._schedule_retry(job, error):
+            if key is not None:
+                _, parked = self._retrying.pop(key, (None, []))
+                self._retrying[key] = (job, parked)
+            return
+        if error is not None:
+            self._fail(job, error)
+
+        # Операция ключа завершена - выполняем отложенные за ней по порядку
+        if key is not None and key in self._retrying and self._retrying[key][0] is job:
+            _, parked = self._retrying.pop(key)
+            while parked:
+                await self._run_job(parked.pop(0))
+                if key in self._retrying:
+                    # Отложенная операция сама ушла в retry - остальные ждут уже её
+                    self._retrying[key][1].extend(parked)
+                    return
+
+    @staticmethod
+    def _trace_span(job: PostJob, start: float, error: Optional[str]):
+        if job.trace is not None:
+            job.trace.add_span(f"post:{job.kind}", (time.monotonic() - start) * 1000, start_monotonic=start, error=error)
+
+    async def _write_logs(self, jobs: List[PostJob]) -> Optional[str]:
+        from bot.services.message_logger import log_messages_batch
+
+        # После этого момента stage_timings идут отдельным UPDATE
+        entries = [self._pending_logs.pop(job.payload["message_id"], job.payload) for job in jobs]
+        self.batches += 1
+        self.batched_logs += len(entries)
+        return await self._run(LOG_MESSAGE, lambda: log_messages_batch(entries), count=len(entries))
+
+    async def _run(self, kind: str, fn: Callable[[], Awaitable[Any]], count: int = 1) -> Optional[str]:
+        """Одна попытка операции; возвращает тип ошибки или None при успехе"""
+        stats = self.kinds.setdefault(kind, KindStats())
+        start = time.monotonic()
+        try:
+            await fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"🔁 Post-processing {kind}: {type(e).__name__}: {e}")
+            return type(e).__name__
+        stats.completed += count
+        stats.total_ms += (time.monotonic() - start) * 1000
+        return None
+
+    def _schedule_retry(self, job: PostJob, error: str) -> bool:
+        """Вернуть операцию в очередь после задержки (False - попытки исчерпаны)"""
+        retries = self.max_retries if job.max_retries is None else job.max_retries
+        if job.attempt >= retries:
+            return False
+
+        delay = RETRY_BASE_DELAY * (2 ** job.attempt)
+        job.attempt += 1
+        self.kinds.setdefault(job.kind, KindStats()).retried += 1
+        logger.warning(f"🔁 Post-processing {job.kind}: {error} - повтор #{job.attempt} через {delay:.1f}s")
+
+        task = asyncio.create_task(self._requeue_later(job, delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+        return True
+
+    async def _requeue_later(self, job: PostJob, delay: float):
+        await asyncio.sleep(delay)
+        job.enqueued_at = time.monotonic()
+        if not self._queues:
+            # Очередь выключена или остановлена - повтор выполняется здесь же
+            await self._process([job])
+            return
+        if job.kind == LOG_MESSAGE:
+            self._pending_logs[job.payload["message_id"]] = job.payload
+        try:
+            self._queue_for(job.key).put_nowait(job)
+        except asyncio.QueueFull:
+            if job.kind == LOG_MESSAGE:
+                self._pending_logs.pop(job.payload["message_id"], None)
+            await self._process([job])
+
+    def _fail(self, job: PostJob, error: str):
+        """Попытки исчерпаны: счётчик и fallback операции"""
+        self.kinds.setdefault(job.kind, KindStats()).failed += 1
+        logger.warning(f"⚠️ Post-processing {job.kind} failed (non-critical): {error}")
+        if job.on_failure is not None:
+            try:
+                job.on_failure()
+            except Exception as fallback_error:
+                logger.warning(f"⚠️ Post-processing {job.kind} fallback failed: {fallback_error}")
+
+    async def drain(self, timeout: float = POST_PROCESSING_DRAIN_TIMEOUT):
+        """Дождаться выполнения очереди и остановить воркеры (shutdown приложения)"""
+        self._closing = True
+        if not self._workers:
+            return
+
+        pending = sum(q.qsize() for q in self._queues)
+        logger.info(f"🧵 Post-processing: ожидаем {pending} операций в очереди (timeout {timeout}s)")
+        try:
+            await asyncio.wait_for(self._wait_idle(), timeout=timeout)
+            logger.info("✅ Post-processing: очередь выполнена")
+        except asyncio.TimeoutError:
+            left = sum(q.qsize() for q in self._queues) + len(self._retry_tasks)
+            logger.warning(f"⚠️ Post-processing: не успели выполнить {left} операций за {timeout}s")
+        finally:
+            for task in list(self._retry_tasks) + self._workers:
+                task.cancel()
+            await asyncio.gather(*self._retry_tasks, *self._workers, return_exceptions=True)
+            self._retrying.clear()
+            self._workers = []
+            self._queues = []
+
+    async def _wait_idle(self):
+        """Очереди пусты и ни одна операция не ждёт retry"""
+        while True:
+            await asyncio.gather(*(q.join() for q in self._queues))
+            if not self._retry_tasks:
+                return
+            await asyncio.gather(*self._retry_tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "workers": len(self._workers),
+            "queued": [q.qsize() for q in self._queues],
+            "retry_pending": len(self._retry_tasks),
+            "queue_size_per_worker": self.queue_size,
+            "submitted": self.submitted,
+            "inline": self.inline,
+            "log_batches": self.batches,
+            "avg_log_batch": round(self.batched_logs / self.batches, 2) if self.batches else None,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+            "kinds": {kind: stats.get_summary() for kind, stats in self.kinds.items()}
+        }
+
+
+# Singleton instance
+_post_processor = None
+
+
+def get_post_processor() -> PostProcessor:
+    """Получить глобальную очередь пост-обработки"""
+    global _post_processor
+    if _post_processor is None:
+        _post_processor = PostProcessor()
+        logger.info(f"🧵 Инициализирована очередь пост-обработки (enabled={POST_PROCESSING_ENABLED})")
+    return _post_processor
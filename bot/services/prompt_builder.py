@@ -0,0 +1,97 @@
+"""
+Prompt Builder
+
+Сборка messages для LLM с учётом prompt caching OpenAI.
+
+OpenAI кэширует самый длинный совпадающий ПРЕФИКС запроса (от 1024 токенов).
+Раньше system prompt собирался конкатенацией instruction + правила RAG +
+база знаний + Zep в одну строку, поэтому префикс отличался от запроса к запросу
+уже на правилах RAG (они добавлялись только при найденном контексте).
+
+Теперь:
+1. Статический префикс (system_instruction + правила RAG) - байт-в-байт
+   одинаковый для всех запросов при одной версии инструкции
+2. Динамические сегменты (база знаний, контекст Zep, последние сообщения) -
+   отдельными system messages после префикса
+3. Сообщение пользователя
+
+Usage:
+    from bot.services.prompt_builder import build_static_prefix, build_messages
+
+    prefix = build_static_prefix(instruction["system_instruction"])
+    messages = build_messages(prefix, user_message, knowledge_context=..., zep_context=..., zep_history=...)
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# Правила RAG - часть статического префикса, поэтому сформулированы условно:
+# раздел БАЗА ЗНАНИЙ может отсутствовать в конкретном запросе
+RAG_RULES = """
+
+⚠️ ПРАВИЛО ГЕНЕРАЦИИ ОТВЕТА:
+Если в следующих сообщениях есть раздел БАЗА ЗНАНИЙ - используй информацию из него как ОСНОВУ и ПРИМЕРЫ для твоего ответа.
+
+✅ ТЫ МОЖЕШЬ:
+- Комбинировать паттерны из разных примеров для создания детальных рекомендаций
+- Синтезировать детальные ответы на основе методологии курса из примеров
+- Использовать структуру и подход из примеров корректировок куратора
+
+❌ ТЫ НЕ МОЖЕШЬ:
+- Добавлять информацию которая ПРОТИВОРЕЧИТ методологии курса "Всепрощающая"
+- Использовать общие психологические концепции НЕ из курса Натальи Игнатовой
+- Игнорировать инструкции из instruction.json (длина ответа, количество примеров)
+
+ВСЕГДА старайся дать полезный ответ на основе найденной информации из базы знаний!
+
+ВАЖНО: Следуй инструкциям по длине ответа и количеству примеров из instruction.json!
+"""
+
+KNOWLEDGE_HEADER = '=== БАЗА ЗНАНИЙ КУРСА "ВСЕПРОЩАЮЩАЯ" ==='
+KNOWLEDGE_FOOTER = "=== КОНЕЦ БАЗЫ ЗНАНИЙ ==="
+
+
+@lru_cache(maxsize=4)
+def build_static_prefix(system_instruction: str) -> str:
+    """
+    Статический префикс: system_instruction + правила RAG
+
+    Кэшируется по тексту инструкции - при перезагрузке instruction.json
+    префикс пересобирается, иначе возвращается тот же объект строки.
+    """
+    return system_instruction + RAG_RULES
+
+
+def build_messages(
+    static_prefix: str,
+    user_message: str,
+    knowledge_context: Optional[str] = None,
+    zep_context: Optional[str] = None,
+    zep_history: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """
+    Messages для chat.completions: префикс → динамические сегменты → вопрос
+
+    Пустые сегменты не добавляются.
+    """
+    messages = [{"role": "system", "content": static_prefix}]
+
+    if knowledge_context:
+        messages.append({
+            "role": "system",
+            "content": f"{KNOWLEDGE_HEADER}\n{knowledge_context}\n{KNOWLEDGE_FOOTER}"
+        })
+
+    if zep_context:
+        messages.append({"role": "system", "content": f"Контекст предыдущих разговоров:\n{zep_context}"})
+
+    if zep_history:
+        messages.append({"role": "system", "content": f"Последние сообщения:\n{zep_history}"})
+
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+
+def messages_length(messages: List[Dict[str, str]]) -> int:
+    """Суммарная длина messages в символах (для логов)"""
+    return sum(len(m.get("content") or "") for m in messages)
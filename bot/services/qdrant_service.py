@@ -6,23 +6,31 @@ Qdrant Vector Database Service
 по базе знаний курса "Всепрощающая".
 
 Architecture:
-- Qdrant Cloud: Vector database backend
+- Qdrant Cloud: Vector database backend (AsyncQdrantClient - одно долгоживущее
+  соединение с пулом, запросы не блокируют event loop). Клиент создаётся при
+  первом запросе и пересоздаётся, если сервис используется из другого event loop.
+  Проверка подключения - verify_connection() при старте приложения, а не в __init__
 - sentence-transformers: Генерация embeddings (all-MiniLM-L6-v2)
 - Hybrid search: Vector + Full-text search
+
+Порог score_threshold применяется на стороне Qdrant, в ответе только поля
+payload из PAYLOAD_FIELDS.
 """
 
+import math
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 try:
-    from qdrant_client import QdrantClient
+    from qdrant_client import AsyncQdrantClient
     from qdrant_client.models import (
         Distance, VectorParams, PointStruct,
         Filter, FieldCondition, MatchValue,
         SearchRequest, QueryResponse, ScoredPoint
     )
-    from sentence_transformers import SentenceTransformer
+    import sentence_transformers  # noqa: F401 - encoder в embedding_executor
     QDRANT_AVAILABLE = True
 except ImportError:
     QDRANT_AVAILABLE = False
@@ -33,11 +41,19 @@ from bot.config import (
     QDRANT_API_KEY,
     QDRANT_COLLECTION,
     EMBEDDING_MODEL,
-    USE_QDRANT
+    USE_QDRANT,
+    QDRANT_PREFER_GRPC,
+    QDRANT_TIMEOUT,
+    QDRANT_OVERFETCH_FACTOR
 )
+from bot.services.embedding_cache import get_embedding_cache
+from bot.services.embedding_executor import get_embedding_executor
 
 logger = logging.getLogger(__name__)
 
+# Поля payload, которые нужны результатам поиска (created_at и прочее не передаётся)
+PAYLOAD_FIELDS = ["entity_type", "title", "content", "metadata"]
+
 
 class QdrantService:
     """
@@ -50,11 +66,16 @@ class QdrantService:
     - Fast retrieval (HNSW algorithm, оптимизирован для speed)
     """
 
+    # RetrievalBackend (bot/services/retrieval_backend.py)
+    name = "qdrant"
+    kind = "vector"
+
     def __init__(self):
         """Инициализация Qdrant client"""
         self.enabled = USE_QDRANT and QDRANT_AVAILABLE
-        self.client = None
-        self.encoder = None
+        self.client: Optional["AsyncQdrantClient"] = None  # Создаётся при первом запросе
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Event loop, к которому привязан client
+        self.embedder = get_embedding_executor(EMBEDDING_MODEL)
         self.collection_name = QDRANT_COLLECTION
 
         if not self.enabled:
@@ -62,55 +83,80 @@ class QdrantService:
             return
 
         try:
-            # Инициализация Qdrant client
-            if QDRANT_URL and QDRANT_API_KEY:
-                self.client = QdrantClient(
-                    url=QDRANT_URL,
-                    api_key=QDRANT_API_KEY,
-                    timeout=30
-                )
-                logger.info(f"Qdrant client initialized: {QDRANT_URL}")
-            else:
+            if not (QDRANT_URL and QDRANT_API_KEY):
                 logger.error("Qdrant credentials not configured (QDRANT_URL/QDRANT_API_KEY)")
                 self.enabled = False
                 return
 
             # LAZY LOADING: sentence transformer загружается при первом использовании
-            # чтобы не блокировать startup приложения
+            # (в потоке embedding_executor), чтобы не блокировать startup приложения
             logger.info(f"Sentence transformer will be loaded on first use: {EMBEDDING_MODEL}")
-            self.encoder = None  # Будет загружен в _get_encoder()
 
-            # Проверка подключения
-            try:
-                collections = self.client.get_collections()
-                logger.info(f"✅ Qdrant connected. Collections: {[c.name for c in collections.collections]}")
-            except Exception as e:
-                logger.error(f"Failed to connect to Qdrant: {e}")
-                self.enabled = False
-                return
-
-            logger.info(f"✅ Qdrant service initialized successfully")
+            # Клиент создаётся при первом запросе (_get_client), подключение
+            # проверяет verify_connection() при старте - __init__ не ходит в сеть
+            logger.info(f"✅ Qdrant service configured: {QDRANT_URL} ({'gRPC' if QDRANT_PREFER_GRPC else 'HTTP'})")
 
         except Exception as e:
             logger.error(f"Failed to initialize Qdrant service: {e}")
             logger.exception("Full traceback:")
             self.enabled = False
 
-    def _get_encoder(self) -> "SentenceTransformer":
+    def _get_client(self) -> "AsyncQdrantClient":
+        """
+        Рабочий клиент: async, соединения переиспользуются между запросами.
+        Клиент привязан к event loop, в котором создан: из другого loop
+        (несколько asyncio.run() в скриптах) создаётся новый
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self.client is not None:
+                # Старый клиент не закрываем: его loop уже недоступен
+                logger.info("🔄 Qdrant: новый event loop, клиент пересоздаётся")
+            self.client = None
+            self._loop = loop
+        if self.client is None:
+            self.client = AsyncQdrantClient(
+                url=QDRANT_URL,
+                api_key=QDRANT_API_KEY,
+                timeout=QDRANT_TIMEOUT,
+                prefer_grpc=QDRANT_PREFER_GRPC
+            )
+            logger.info(f"Qdrant client initialized: {QDRANT_URL} ({'gRPC' if QDRANT_PREFER_GRPC else 'HTTP'})")
+        return self.client
+
+    async def verify_connection(self) -> bool:
+        """
+        Проверка подключения (startup приложения, не в обработке запроса).
+        Недоступный Qdrant отключает сервис
         """
-        Lazy loading для sentence transformer модели
+        if not self.enabled:
+            return False
+        try:
+            collections = await self._get_client().get_collections()
+            logger.info(f"✅ Qdrant connected. Collections: {[c.name for c in collections.collections]}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to Qdrant: {e}")
+            self.enabled = False
+            return False
 
-        Модель загружается только при первом использовании,
-        чтобы не блокировать startup приложения.
+    async def _encode_query(self, query: str) -> List[float]:
+        """
+        Embedding запроса через общий кэш
 
-        Returns:
-            SentenceTransformer instance
+        При промахе encode выполняется в потоке embedding_executor
+        (micro-batch с одновременными запросами), event loop не блокируется.
         """
-        if self.encoder is None:
-            logger.info(f"🔄 Loading sentence transformer model: {EMBEDDING_MODEL} (first use)")
-            self.encoder = SentenceTransformer(EMBEDDING_MODEL)
-            logger.info(f"✅ Sentence transformer loaded: {EMBEDDING_MODEL}")
-        return self.encoder
+        cache = get_embedding_cache()
+        vector = await cache.get(EMBEDDING_MODEL, query)
+        if vector is None:
+            vector = await self.embedder.encode(query)
+            cache.put(EMBEDDING_MODEL, query, vector)
+        return vector
+
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """RetrievalBackend: семантический поиск по всей базе знаний"""
+        return await self.search_semantic(query=query, limit=limit, score_threshold=score_threshold)
 
     async def health_check(self) -> Dict[str, Any]:
         """
@@ -138,7 +184,7 @@ class QdrantService:
 
         try:
             # Проверка подключения
-            collections = self.client.get_collections()
+            collections = await self._get_client().get_collections()
             collection_exists = any(c.name == self.collection_name for c in collections.collections)
 
             return {
@@ -174,7 +220,7 @@ class QdrantService:
                 "status": str
             }
         """
-        if not self.enabled or not self.client:
+        if not self.enabled:
             return {
                 "error": "Qdrant service not enabled or not initialized",
                 "enabled": self.enabled
@@ -182,14 +228,15 @@ class QdrantService:
 
         try:
             # Получаем информацию о коллекции
-            collection_info = self.client.get_collection(self.collection_name)
+            collection_info = await self._get_client().get_collection(self.collection_name)
 
             return {
                 "collection": self.collection_name,
                 "points_count": collection_info.points_count,
                 "indexed_vectors_count": collection_info.indexed_vectors_count,
                 "vectors_count": collection_info.vectors_count,
-                "status": collection_info.status
+                "status": collection_info.status,
+                "encoder": self.embedder.get_stats()
             }
         except Exception as e:
             logger.error(f"Failed to get Qdrant stats: {e}")
@@ -198,6 +245,69 @@ class QdrantService:
                 "collection": self.collection_name
             }
 
+    async def _query(
+        self,
+        query_vector: List[float],
+        limit: int,
+        score_threshold: float,
+        search_filter: Optional["Filter"]
+    ) -> List[Dict[str, Any]]:
+        """
+        query_points с порогом на стороне Qdrant и проекцией payload
+
+        Запрашивается limit * QDRANT_OVERFETCH_FACTOR точек - запас на точки
+        с пустым content, которые пропускаются.
+        """
+        response = await self._get_client().query_points(
+            collection_name=self.collection_name,
+            query=query_vector,
+            limit=max(limit, math.ceil(limit * QDRANT_OVERFETCH_FACTOR)),
+            query_filter=search_filter,
+            score_threshold=score_threshold,
+            with_payload=PAYLOAD_FIELDS  # КРИТИЧЕСКИ ВАЖНО: без payload content=None!
+        )
+
+        # Форматируем результаты
+        results = []
+        skipped_empty_content = 0
+        for hit in response.points:
+            if len(results) >= limit:
+                break
+
+            # Проверка что payload существует
+            if not hit.payload:
+                logger.warning(f"⚠️ Skipping hit {hit.id}: payload is None")
+                skipped_empty_content += 1
+                continue
+
+            # Извлекаем content
+            content_value = hit.payload.get("content", "")
+
+            # КРИТИЧЕСКИ ВАЖНО: пропускаем результаты с пустым content
+            if not content_value or len(content_value.strip()) == 0:
+                entity_type_debug = hit.payload.get("entity_type", "unknown")
+                logger.warning(f"⚠️ Skipping hit {hit.id} (type={entity_type_debug}): content is empty!")
+                skipped_empty_content += 1
+                continue
+
+            # DEBUG: логируем детали включая content
+            logger.info(f"✅ Hit {hit.id}: score={hit.score:.3f}, type={hit.payload.get('entity_type', 'unknown')}, content_len={len(content_value)}")
+            logger.info(f"   Content preview: '{content_value[:200]}...'")
+
+            results.append({
+                "id": str(hit.id),
+                "score": hit.score,
+                "entity_type": hit.payload.get("entity_type", "unknown"),
+                "title": hit.payload.get("title", ""),
+                "content": content_value,
+                "metadata": hit.payload.get("metadata", {})
+            })
+
+        if skipped_empty_content > 0:
+            logger.warning(f"⚠️ Skipped {skipped_empty_content} results with empty content")
+
+        return results
+
     async def search_semantic(
         self,
         query: str,
@@ -228,14 +338,13 @@ class QdrantService:
                 ...
             ]
         """
-        if not self.enabled or not self.client:
+        if not self.enabled:
             logger.warning("Qdrant service not available for search")
             return []
 
         try:
-            # Генерируем embedding для запроса (lazy load encoder)
-            encoder = self._get_encoder()
-            query_vector = encoder.encode(query).tolist()
+            # Embedding запроса (из кэша или в потоке encoder)
+            query_vector = await self._encode_query(query)
 
             # Создаём фильтр если указан entity_type
             search_filter = None
@@ -249,57 +358,7 @@ class QdrantService:
                     ]
                 )
 
-            # Выполняем поиск (ИСПРАВЛЕНО: query_points вместо search)
-            response = self.client.query_points(
-                collection_name=self.collection_name,
-                query=query_vector,  # ИЗМЕНЕНО: query вместо query_vector
-                limit=limit * 2,  # Берём больше для manual filtering по score
-                query_filter=search_filter,
-                with_payload=True  # КРИТИЧЕСКИ ВАЖНО: без этого payload=None!
-            )
-
-            # Фильтруем по score_threshold вручную (query_points не поддерживает встроенный threshold)
-            filtered_points = [p for p in response.points if p.score >= score_threshold]
-
-            # Обрезаем до нужного limit
-            final_points = filtered_points[:limit]
-
-            # Форматируем результаты
-            results = []
-            skipped_empty_content = 0
-            for hit in final_points:
-                # Проверка что payload существует
-                if not hit.payload:
-                    logger.warning(f"⚠️ Skipping hit {hit.id}: payload is None")
-                    skipped_empty_content += 1
-                    continue
-
-                # Извлекаем content
-                content_value = hit.payload.get("content", "")
-
-                # КРИТИЧЕСКИ ВАЖНО: пропускаем результаты с пустым content
-                if not content_value or len(content_value.strip()) == 0:
-                    entity_type_debug = hit.payload.get("entity_type", "unknown")
-                    logger.warning(f"⚠️ Skipping hit {hit.id} (type={entity_type_debug}): content is empty!")
-                    skipped_empty_content += 1
-                    continue
-
-                # DEBUG: логируем детали включая content
-                logger.info(f"✅ Hit {hit.id}: score={hit.score:.3f}, type={hit.payload.get('entity_type', 'unknown')}, content_len={len(content_value)}")
-                logger.info(f"   Content preview: '{content_value[:200]}...'")
-
-                result = {
-                    "id": str(hit.id),
-                    "score": hit.score,
-                    "entity_type": hit.payload.get("entity_type", "unknown"),
-                    "title": hit.payload.get("title", ""),
-                    "content": content_value,
-                    "metadata": hit.payload.get("metadata", {})
-                }
-                results.append(result)
-
-            if skipped_empty_content > 0:
-                logger.warning(f"⚠️ Skipped {skipped_empty_content} results with empty content")
+            results = await self._query(query_vector, limit, score_threshold, search_filter)
 
             logger.info(f"🔍 Qdrant semantic search: query='{query[:50]}', found={len(results)}")
             return results
@@ -333,14 +392,13 @@ class QdrantService:
         Returns:
             List результатов поиска (формат как в search_semantic)
         """
-        if not self.enabled or not self.client:
+        if not self.enabled:
             logger.warning("Qdrant service not available for hybrid search")
             return []
 
         try:
-            # Генерируем embedding для запроса (lazy load encoder)
-            encoder = self._get_encoder()
-            query_vector = encoder.encode(query).tolist()
+            # Embedding запроса (из кэша или в потоке encoder)
+            query_vector = await self._encode_query(query)
 
             # Создаём фильтр из filters dict
             search_filter = None
@@ -357,57 +415,7 @@ class QdrantService:
                 if filter_conditions:
                     search_filter = Filter(must=filter_conditions)
 
-            # Выполняем поиск (ИСПРАВЛЕНО: query_points вместо search)
-            response = self.client.query_points(
-                collection_name=self.collection_name,
-                query=query_vector,  # ИЗМЕНЕНО: query вместо query_vector
-                limit=limit * 2,  # Берём больше для manual filtering по score
-                query_filter=search_filter,
-                with_payload=True  # КРИТИЧЕСКИ ВАЖНО: без этого payload=None!
-            )
-
-            # Фильтруем по score_threshold вручную (query_points не поддерживает встроенный threshold)
-            filtered_points = [p for p in response.points if p.score >= score_threshold]
-
-            # Обрезаем до нужного limit
-            final_points = filtered_points[:limit]
-
-            # Форматируем результаты
-            results = []
-            skipped_empty_content = 0
-            for hit in final_points:
-                # Проверка что payload существует
-                if not hit.payload:
-                    logger.warning(f"⚠️ Skipping hit {hit.id}: payload is None")
-                    skipped_empty_content += 1
-                    continue
-
-                # Извлекаем content
-                content_value = hit.payload.get("content", "")
-
-                # КРИТИЧЕСКИ ВАЖНО: пропускаем результаты с пустым content
-                if not content_value or len(content_value.strip()) == 0:
-                    entity_type_debug = hit.payload.get("entity_type", "unknown")
-                    logger.warning(f"⚠️ Skipping hit {hit.id} (type={entity_type_debug}): content is empty!")
-                    skipped_empty_content += 1
-                    continue
-
-                # DEBUG: логируем детали включая content
-                logger.info(f"✅ Hit {hit.id}: score={hit.score:.3f}, type={hit.payload.get('entity_type', 'unknown')}, content_len={len(content_value)}")
-                logger.info(f"   Content preview: '{content_value[:200]}...'")
-
-                result = {
-                    "id": str(hit.id),
-                    "score": hit.score,
-                    "entity_type": hit.payload.get("entity_type", "unknown"),
-                    "title": hit.payload.get("title", ""),
-                    "content": content_value,
-                    "metadata": hit.payload.get("metadata", {})
-                }
-                results.append(result)
-
-            if skipped_empty_content > 0:
-                logger.warning(f"⚠️ Skipped {skipped_empty_content} results with empty content")
+            results = await self._query(query_vector, limit, score_threshold, search_filter)
 
             logger.info(f"🔍 Qdrant hybrid search: query='{query[:50]}', filters={filters}, found={len(results)}")
             return results
@@ -417,6 +425,13 @@ class QdrantService:
             logger.exception("Full traceback:")
             return []
 
+    async def close(self):
+        """Закрыть соединения клиента (shutdown приложения)"""
+        if self.client is not None and self._loop is asyncio.get_running_loop():
+            await self.client.close()
+        self.client = None
+        self._loop = None
+
     async def add_entity(
         self,
         entity_id: str,
@@ -438,13 +453,12 @@ class QdrantService:
         Returns:
             Tuple (success: bool, error_message: Optional[str])
         """
-        if not self.enabled or not self.client:
+        if not self.enabled:
             return False, "Qdrant service not available"
 
         try:
-            # Генерируем embedding (lazy load encoder)
-            encoder = self._get_encoder()
-            vector = encoder.encode(content).tolist()
+            # Генерируем embedding (в потоке encoder)
+            vector = await self.embedder.encode(content)
 
             # Подготавливаем payload
             payload = {
@@ -456,7 +470,7 @@ class QdrantService:
             }
 
             # Добавляем point в коллекцию
-            self.client.upsert(
+            await self._get_client().upsert(
                 collection_name=self.collection_name,
                 points=[
                     PointStruct(
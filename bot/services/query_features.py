@@ -0,0 +1,199 @@
+"""
+Query Features
+
+Нормализация запроса и определение намерений за один разбор текста.
+
+Раньше каждый запрос проходил несколько независимых проверок:
+- _remove_emojis компилировал regex эмодзи на каждый вызов
+- route_query - цепочка any(word in query_lower ...)
+- проверки технических/платёжных вопросов - повторный lower() и скан
+- диагностика has_emojis - отдельный цикл по символам
+- fallback ответы - ещё раз lower() и скан по приветствиям
+
+Теперь все таблицы ключевых слов собраны в один автомат Aho-Corasick:
+один проход по тексту находит совпадения всех таблиц сразу, независимо
+от того, сколько ключевых слов в них добавится. Результат - неизменяемый
+QueryFeatures, который переиспользуют поиск, роутинг и fallback логика
+(analyze_query кэширует разбор последних запросов).
+
+Семантика совпадений прежняя - поиск подстроки в тексте в нижнем регистре.
+
+Usage:
+    from bot.services.query_features import analyze_query
+
+    features = analyze_query(user_message)
+    features.cleaned, features.route, features.is_support_question
+"""
+
+import re
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Set
+
+# Паттерн для эмодзи (Unicode ranges), компилируется один раз
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002702-\U000027B0"  # dingbats
+    "\U000024C2-\U0001F251"  # enclosed characters
+    "\U0001F900-\U0001F9FF"  # supplemental symbols
+    "\U0001FA00-\U0001FA6F"  # extended symbols
+    "]+",
+    flags=re.UNICODE
+)
+
+# Точные номера уроков: "урок 5", "lesson 12"
+LESSON_NUMBER_PATTERN = re.compile(r'урок\s+\d+|lesson\s+\d+')
+
+# Метки таблиц ключевых слов
+ROUTE_SEMANTIC = "route_semantic"
+ROUTE_GRAPH = "route_graph"
+SUPPORT_TECHNICAL = "support_technical"
+SUPPORT_PAYMENT = "support_payment"
+GREETING = "greeting"
+PRICE = "price"
+
+KEYWORD_TABLES: Dict[str, List[str]] = {
+    # Концептуальные вопросы → SEMANTIC
+    ROUTE_SEMANTIC: ["что такое", "как понять", "объясни", "в чем смысл"],
+    # Поиск связей → GRAPH
+    ROUTE_GRAPH: ["похожие", "связанные", "смежные", "related"],
+    # Технические/организационные вопросы → редирект в поддержку
+    SUPPORT_TECHNICAL: [
+        'не могу зайти', 'не работает', 'ошибка на сайте', 'доступ к платформе',
+        'не открывается', 'не загружается', 'технические проблемы'
+    ],
+    # Платёжные вопросы → редирект в поддержку
+    SUPPORT_PAYMENT: ['оплата', 'оплатить', 'стоимость', 'цена', 'тариф', 'деньги', 'возврат'],
+    # Fallback ответы без LLM
+    GREETING: ['привет', 'hello', 'hi', 'здравствуй'],
+    PRICE: ['цена', 'стоимость', 'сколько'],
+}
+
+
+class KeywordAutomaton:
+    """Автомат Aho-Corasick: все вхождения всех ключевых слов за один проход"""
+
+    def __init__(self, tables: Dict[str, Iterable[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Set[str]] = [set()]
+
+        for label, keywords in tables.items():
+            for keyword in keywords:
+                self._add(keyword.lower(), label)
+        self._build()
+
+    def _add(self, keyword: str, label: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            state = next_state
+        self._output[state].add(label)
+
+    def _build(self):
+        """Суффиксные ссылки (BFS) и объединение выходов"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+    def find_labels(self, text: str) -> FrozenSet[str]:
+        """Метки всех таблиц, ключевые слова которых встречаются в тексте"""
+        goto, fail, output = self._goto, self._fail, self._output
+        labels: Set[str] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                labels |= output[state]
+        return frozenset(labels)
+
+
+_AUTOMATON = KeywordAutomaton(KEYWORD_TABLES)
+
+
+@dataclass(frozen=True)
+class QueryFeatures:
+    """Результат разбора запроса"""
+
+    text: str
+    lower: str
+    cleaned: str  # Без эмодзи и пробелов по краям (для векторного поиска), может быть пустым
+    has_emojis: bool
+    has_lesson_number: bool
+    labels: FrozenSet[str]
+
+    @property
+    def route(self) -> str:
+        """Стратегия поиска: fulltext | semantic | graph | hybrid"""
+        if self.has_lesson_number:
+            return "fulltext"
+        if ROUTE_SEMANTIC in self.labels:
+            return "semantic"
+        if ROUTE_GRAPH in self.labels:
+            return "graph"
+        return "hybrid"
+
+    @property
+    def is_technical_question(self) -> bool:
+        return SUPPORT_TECHNICAL in self.labels
+
+    @property
+    def is_payment_question(self) -> bool:
+        return SUPPORT_PAYMENT in self.labels
+
+    @property
+    def is_support_question(self) -> bool:
+        """Технический или платёжный вопрос - редирект в поддержку"""
+        return self.is_technical_question or self.is_payment_question
+
+    @property
+    def is_greeting(self) -> bool:
+        return GREETING in self.labels
+
+    @property
+    def is_price_question(self) -> bool:
+        return PRICE in self.labels
+
+
+def remove_emojis(text: str) -> str:
+    """Удаляет эмодзи из текста (эмодзи искажают semantic similarity в embeddings)"""
+    return EMOJI_PATTERN.sub('', text).strip()
+
+
+@lru_cache(maxsize=256)
+def analyze_query(text: str) -> QueryFeatures:
+    """
+    Разобрать запрос: нормализация, эмодзи, совпадения всех таблиц ключевых слов
+
+    Результат кэшируется - один и тот же запрос разбирается один раз
+    за ход (подготовка хода, поиск, роутинг, fallback).
+    """
+    lower = text.lower()
+    return QueryFeatures(
+        text=text,
+        lower=lower,
+        cleaned=remove_emojis(text),
+        has_emojis=EMOJI_PATTERN.search(text) is not None,
+        has_lesson_number=LESSON_NUMBER_PATTERN.search(lower) is not None,
+        labels=_AUTOMATON.find_labels(lower)
+    )
@@ -0,0 +1,77 @@
+"""
+Rank Fusion
+
+Объединение ранжированных списков из разных поисков (векторный, BM25)
+через Reciprocal Rank Fusion:
+
+    rrf(d) = Σ weight_i / (k + rank_i(d))
+
+RRF использует только позиции, поэтому несравнимые шкалы (cosine similarity
+и BM25) не нужно калибровать. Документ, найденный обоими поисками, поднимается
+выше найденного одним.
+
+Документы сопоставляются по тексту (первые 200 символов без пробелов по краям):
+id в Qdrant - числа, в Supabase и локальных индексах - строки kb_corpus,
+а content у всех одинаковый (to_episode_content).
+
+Usage:
+    from bot.services.rank_fusion import reciprocal_rank_fusion
+
+    fused = reciprocal_rank_fusion({"vector": vector_results, "lexical": bm25_results}, k=60)
+    fused[0]["rrf_score"], fused[0]["relevance"], fused[0]["ranks"]
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+def content_key(result: Dict[str, Any]) -> str:
+    """Ключ дедупликации результата"""
+    return (result.get("content") or "")[:200].strip()
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Dict[str, List[Dict[str, Any]]],
+    k: int = 60,
+    weights: Optional[Dict[str, float]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Объединить ранжированные списки результатов
+
+    Args:
+        ranked_lists: имя поиска → результаты по убыванию релевантности
+            (dict с полями content, score, entity_type, ...)
+        k: Константа RRF (больше - меньше разница между верхними позициями)
+        weights: Вес каждого поиска (по умолчанию 1.0)
+
+    Returns:
+        Уникальные результаты по убыванию rrf_score. Поля первого вхождения
+        документа + rrf_score, relevance (0-1, доля от максимума при первом
+        месте во всех списках), ranks и scores по каждому поиску.
+    """
+    weights = weights or {}
+    fused: Dict[str, Dict[str, Any]] = {}
+
+    for name, results in ranked_lists.items():
+        weight = weights.get(name, 1.0)
+        seen = set()
+        rank = 0
+        for result in results:
+            key = content_key(result)
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            rank += 1
+
+            entry = fused.get(key)
+            if entry is None:
+                entry = {**result, "rrf_score": 0.0, "ranks": {}, "scores": {}}
+                fused[key] = entry
+            entry["rrf_score"] += weight / (k + rank)
+            entry["ranks"][name] = rank
+            entry["scores"][name] = result.get("score")
+
+    max_score = sum(weights.get(name, 1.0) for name in ranked_lists) / (k + 1)
+    ordered = sorted(fused.values(), key=lambda e: e["rrf_score"], reverse=True)
+    for entry in ordered:
+        entry["relevance"] = entry["rrf_score"] / max_score if max_score else 0.0
+    return ordered
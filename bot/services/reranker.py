@@ -0,0 +1,279 @@
+"""
+Cross-Encoder Reranker
+
+Второй этап ранжирования результатов KnowledgeSearchService.
+
+Первый этап сортирует по cosine similarity (с boost по entity_type),
+а для MiniLM на русском тексте эти scores шумные. Cross-encoder читает
+запрос и документ вместе и оценивает релевантность пары точнее.
+
+Features:
+- Небольшая multilingual модель на CPU (RERANKER_MODEL)
+- Все пары (запрос, кандидат) - один вызов predict (один батч)
+- Выполняется в выделенном потоке, event loop не блокируется
+- Жёсткий бюджет времени (RERANKER_TIME_BUDGET_MS): не успели - остаётся
+  порядок первого этапа. Пока опоздавший батч досчитывается, новые
+  запросы не ставятся в очередь за ним
+- Статистика латентности и изменений порядка (/api/admin/reranker/stats)
+
+Usage:
+    from bot.services.reranker import get_reranker
+
+    reranker = get_reranker()
+    results, reranked = await reranker.rerank(query, results, limit=5)
+"""
+
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from sentence_transformers import CrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CrossEncoder = None
+    CROSS_ENCODER_AVAILABLE = False
+
+from bot.config import (
+    RERANKER_MODEL,
+    RERANKER_CANDIDATES,
+    RERANKER_TIME_BUDGET_MS,
+    RERANKER_MAX_LENGTH
+)
+
+# Трейсинг стадий (опционально)
+try:
+    from bot.monitoring.tracing import add_span
+    TRACING_AVAILABLE = True
+except ImportError:
+    TRACING_AVAILABLE = False
+    add_span = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних латентностей хранить для перцентилей
+LATENCY_WINDOW = 500
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+class CrossEncoderReranker:
+    """Cross-encoder reranking с бюджетом времени"""
+
+    def __init__(
+        self,
+        model_name: str = RERANKER_MODEL,
+        time_budget_ms: float = RERANKER_TIME_BUDGET_MS,
+        max_length: int = RERANKER_MAX_LENGTH
+    ):
+        self.model_name = model_name
+        self.time_budget = time_budget_ms / 1000.0
+        self.max_length = max_length
+        self.enabled = CROSS_ENCODER_AVAILABLE
+
+        self._model = None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        # Батч, не уложившийся в бюджет и ещё занимающий поток
+        self._overrun: Optional[asyncio.Future] = None
+
+        self.calls = 0
+        self.reranked = 0
+        self.timeouts = 0
+        self.skipped_busy = 0
+        self.errors = 0
+        self.candidates = 0
+        self.top1_changed = 0
+        self.promoted = 0  # Результаты в итоговом top-k, бывшие за пределами top-k первого этапа
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+        if not self.enabled:
+            logger.warning("⚠️ sentence-transformers not installed. Reranking disabled.")
+
+    def load(self) -> "CrossEncoder":
+        """Модель (загружается в потоке reranker при первом вызове)"""
+        if self._model is None:
+            logger.info(f"🔄 Loading cross-encoder: {self.model_name}")
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            logger.info(f"✅ Cross-encoder loaded: {self.model_name}")
+        return self._model
+
+    async def warmup(self, candidates: int = RERANKER_CANDIDATES):
+        """
+        Загрузить модель заранее (первый запрос не тратит бюджет на загрузку)
+        и замерить полный батч: candidates пар длиной max_length
+        """
+        if not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._pool, self.load)
+            # Текст заведомо длиннее max_length - пары обрезаются до полной длины
+            text = "мозгоритм " * self.max_length
+            start = time.perf_counter()
+            await loop.run_in_executor(self._pool, self._predict, text, [text] * candidates)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            logger.warning(f"⚠️ Reranker: прогрев {self.model_name} не удался: {type(e).__name__}: {e}")
+            return
+
+        budget_ms = self.time_budget * 1000
+        if elapsed_ms > budget_ms:
+            logger.warning(
+                f"⚠️ Reranker: батч {candidates}x{self.max_length} токенов занял {elapsed_ms:.0f}ms "
+                f"при бюджете {budget_ms:.0f}ms - reranking будет отменяться по таймауту. "
+                f"Уменьшите RERANKER_CANDIDATES / RERANKER_MAX_LENGTH или увеличьте RERANKER_TIME_BUDGET_MS"
+            )
+        else:
+            logger.info(f"🎯 Reranker: батч {candidates}x{self.max_length} токенов - {elapsed_ms:.0f}ms (бюджет {budget_ms:.0f}ms)")
+
+    def _predict(self, query: str, texts: List[str]) -> List[float]:
+        """Выполняется в потоке reranker: все пары одним батчем"""
+        model = self.load()
+        pairs = [(query, text) for text in texts]
+        return [float(score) for score in model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)]
+
+    async def rerank(
+        self,
+        query: str,
+        results: List[Any],
+        limit: int,
+        boosts: Optional[Dict[str, float]] = None
+    ) -> Tuple[List[Any], bool]:
+        """
+        Переранжировать кандидатов первого этапа
+
+        Args:
+            query: Поисковый запрос
+            results: SearchResult первого этапа по убыванию relevance_score
+            limit: Сколько результатов вернуть
+            boosts: Множители по metadata["entity_type"] - relevance_score
+                переранжированного результата = score cross-encoder * boost
+
+        Returns:
+            (top-limit результатов, был ли применён reranking).
+            Если модель недоступна, бюджет исчерпан или произошла ошибка -
+            первые limit результатов первого этапа без изменений
+        """
+        if not self.enabled or len(results) < 2:
+            return results[:limit], False
+
+        if self._model is None and self._overrun is None:
+            # Загрузка модели не укладывается в бюджет - грузим в фоне, этот запрос без reranking
+            self._overrun = asyncio.get_running_loop().run_in_executor(self._pool, self.load)
+            self.skipped_busy += 1
+            return results[:limit], False
+
+        if self._overrun is not None:
+            if not self._overrun.done():
+                self.skipped_busy += 1
+                return results[:limit], False
+            overrun, self._overrun = self._overrun, None
+            if self._model is None:
+                logger.error(f"❌ Reranker: не удалось загрузить {self.model_name}: {overrun.exception()}. Reranking disabled.")
+                self.enabled = False
+                return results[:limit], False
+
+        self.calls += 1
+        self.candidates += len(results)
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, self._predict, query, [r.content for r in results]
+        )
+        try:
+            scores = await asyncio.wait_for(asyncio.shield(future), timeout=self.time_budget)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._overrun = future
+            future.add_done_callback(lambda f: f.exception())  # Не логировать "exception was never retrieved"
+            logger.warning(
+                f"⏱️ Reranker: бюджет {self.time_budget * 1000:.0f}ms исчерпан "
+                f"({len(results)} кандидатов), порядок первого этапа"
+            )
+            return results[:limit], False
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"❌ Reranker failed: {type(e).__name__}: {e}")
+            return results[:limit], False
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._latencies.append(elapsed_ms)
+        if TRACING_AVAILABLE and add_span:
+            add_span("rerank", elapsed_ms)
+
+        boosts = boosts or {}
+        boosted = [
+            score * boosts.get(result.metadata.get("entity_type"), 1.0)
+            for score, result in zip(scores, results)
+        ]
+        order = sorted(range(len(results)), key=lambda i: boosted[i], reverse=True)
+        reranked = []
+        for i in order[:limit]:
+            result = results[i]
+            result.metadata = {
+                **result.metadata,
+                "first_stage_rank": i + 1,
+                "first_stage_score": round(result.relevance_score, 4),
+                "rerank_score": round(scores[i], 4)
+            }
+            result.relevance_score = boosted[i]
+            reranked.append(result)
+
+        self.reranked += 1
+        top1_changed = order[0] != 0
+        promoted = sum(1 for i in order[:limit] if i >= limit)
+        self.top1_changed += top1_changed
+        self.promoted += promoted
+
+        logger.info(
+            f"🎯 Rerank: {len(results)} кандидатов за {elapsed_ms:.0f}ms, "
+            f"top-1 {'изменён' if top1_changed else 'тот же'}, поднято в top-{limit}: {promoted}"
+        )
+        return reranked, True
+
+    def get_stats(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        return {
+            "enabled": self.enabled,
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "time_budget_ms": round(self.time_budget * 1000, 1),
+            "calls": self.calls,
+            "reranked": self.reranked,
+            "timeouts": self.timeouts,
+            "skipped_busy": self.skipped_busy,
+            "errors": self.errors,
+            "avg_candidates": round(self.candidates / self.calls, 2) if self.calls else 0.0,
+            "latency_ms": {
+                "avg": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p50": round(_percentile(latencies, 50), 2),
+                "p95": round(_percentile(latencies, 95), 2),
+                "max": round(max(latencies), 2) if latencies else 0.0
+            },
+            "quality": {
+                # Доля запросов, где cross-encoder выбрал другой лучший результат
+                "top1_changed_rate": round(self.top1_changed / self.reranked, 3) if self.reranked else 0.0,
+                # Сколько в среднем результатов в итоговом top-k пришло из-за пределов top-k первого этапа
+                "avg_promoted": round(self.promoted / self.reranked, 2) if self.reranked else 0.0
+            }
+        }
+
+
+# Singleton instance
+_reranker = None
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """Получить singleton instance CrossEncoderReranker"""
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
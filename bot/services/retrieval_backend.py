@@ -0,0 +1,272 @@
+"""
+Retrieval Backends
+
+Общий интерфейс хранилищ для KnowledgeSearchService и параллельный опрос
+нескольких хранилищ.
+
+Раньше выбор хранилища был цепочкой if/elif по use_supabase/use_qdrant,
+а маппинг результатов и boosting по entity_type были скопированы в каждую
+ветку. Теперь каждое хранилище реализует RetrievalBackend:
+
+    name: str                  # "local", "supabase", "qdrant", "falkordb", "bm25", ...
+    kind: str                  # "vector" или "lexical"
+    enabled: bool
+    async search(query, limit, score_threshold) -> [
+        {"id", "content", "entity_type", "metadata", "score"}, ...
+    ]
+
+Реализации: LocalVectorIndex, SupabaseService, QdrantService,
+FalkorDBService, SimpleFalkorDBService и CorpusBM25Backend (BM25 по
+data/parsed_kb, лексическая часть hybrid поиска).
+
+Несколько хранилищ опрашиваются одновременно (RETRIEVAL_BACKENDS):
+- fan_out: ответы всех, кто уложился в дедлайн (объединяются через RRF)
+- first_healthy: первый успешный непустой ответ, остальные отменяются
+
+Так быстрый локальный индекс и удалённое хранилище работают рядом:
+медленное или упавшее хранилище не задерживает ответ дольше дедлайна.
+
+Usage:
+    from bot.services.retrieval_backend import fan_out, first_healthy
+
+    ranked_lists = await fan_out(backends, query, limit=10, score_threshold=0.08, deadline=4.0)
+    # {"local": [...], "supabase": [...]}
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Protocol, runtime_checkable
+
+from bot.services.bm25_index import BM25Index, load_or_build
+from bot.services.kb_version import get_kb_version
+from bot.services.kb_corpus import load_kb_corpus, corpus_stat_key
+
+logger = logging.getLogger(__name__)
+
+# Минимальная доля от максимального BM25 для запроса - отсекает документы,
+# совпавшие только по частым словам запроса ("что такое" без "мозгоритм")
+LEXICAL_MIN_RELEVANCE = 0.15
+
+
+@runtime_checkable
+class RetrievalBackend(Protocol):
+    """Хранилище базы знаний для KnowledgeSearchService"""
+
+    name: str
+    kind: str
+    enabled: bool
+
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """Результаты по убыванию score: {"id", "content", "entity_type", "metadata", "score"}"""
+        ...
+
+
+class CorpusBM25Backend:
+    """BM25 по data/parsed_kb (индекс строится один раз на версию KB и хранится на диске)"""
+
+    name = "bm25"
+    kind = "lexical"
+
+    def __init__(self):
+        self.enabled = True
+        self._index: Optional[BM25Index] = None
+
+    def _fingerprint(self) -> str:
+        return f"{get_kb_version()}|{corpus_stat_key()}"
+
+    def get_index(self) -> BM25Index:
+        """BM25 индекс (с диска или построенный для текущей версии KB). Блокирующий вызов"""
+        fingerprint = self._fingerprint()
+        if self._index is None or self._index.fingerprint != fingerprint:
+            self._index = load_or_build("corpus", fingerprint, load_kb_corpus)
+        return self._index
+
+    async def search(self, query: str, limit: int, score_threshold: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        score - доля от максимально возможного BM25 для запроса (0-1),
+        совпадения ниже LEXICAL_MIN_RELEVANCE отбрасываются
+        (порог векторного поиска к BM25 не применяется - шкалы разные)
+        """
+        index = self._index
+        if index is None or index.fingerprint != self._fingerprint():
+            # Первая загрузка / перестроение индекса - не в event loop
+            index = await asyncio.to_thread(self.get_index)
+
+        hits = index.search(query, limit)
+        return [
+            {
+                "id": hit.document["id"],
+                "content": hit.document["content"],
+                "entity_type": hit.document["entity_type"],
+                "metadata": hit.document.get("metadata", {}),
+                "score": hit.relevance
+            }
+            for hit in hits
+            if hit.relevance >= LEXICAL_MIN_RELEVANCE
+        ]
+
+
+class BackendStats:
+    """Счётчики опроса одного хранилища"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.wins = 0  # first_healthy: ответ этого хранилища был использован
+        self.superseded = 0  # first_healthy: отменён, т.к. другое хранилище ответило раньше
+        self.total_ms = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        completed = self.calls - self.errors - self.timeouts - self.superseded
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "wins": self.wins,
+            "superseded": self.superseded,
+            "avg_ms": round(self.total_ms / completed, 2) if completed > 0 else 0.0
+        }
+
+
+_stats: Dict[str, BackendStats] = {}
+
+
+def _stats_for(name: str) -> BackendStats:
+    stats = _stats.get(name)
+    if stats is None:
+        stats = BackendStats()
+        _stats[name] = stats
+    return stats
+
+
+def get_backend_stats() -> Dict[str, Dict[str, Any]]:
+    """Статистика опроса хранилищ (для /api/admin/retrieval/backends)"""
+    return {name: stats.to_dict() for name, stats in _stats.items()}
+
+
+async def _timed_search(backend: RetrievalBackend, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+    stats = _stats_for(backend.name)
+    stats.calls += 1
+    start = time.perf_counter()
+    try:
+        results = await backend.search(query, limit, score_threshold)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        stats.errors += 1
+        raise
+    stats.total_ms += (time.perf_counter() - start) * 1000
+    return results
+
+
+def _start(backends: List[RetrievalBackend], query: str, limit: int, score_threshold: float) -> Dict[asyncio.Task, str]:
+    return {
+        asyncio.ensure_future(_timed_search(backend, query, limit, score_threshold)): backend.name
+        for backend in backends
+    }
+
+
+def _cancel_late(pending, tasks: Dict[asyncio.Task, str], deadline: float):
+    for task in pending:
+        task.cancel()
+        _stats_for(tasks[task]).timeouts += 1
+        logger.warning(f"⏱️ Retrieval: {tasks[task]} не ответил за {deadline:.1f}s")
+
+
+def _result_or_none(task: asyncio.Task, name: str) -> Optional[List[Dict[str, Any]]]:
+    """Результаты завершённой задачи или None (ошибка логируется)"""
+    if task.cancelled():
+        return None
+    e = task.exception()
+    if e is not None:
+        logger.error(f"❌ Retrieval: {name} failed: {type(e).__name__}: {e}")
+        return None
+    return task.result()
+
+
+async def fan_out(
+    backends: List[RetrievalBackend],
+    query: str,
+    limit: int,
+    score_threshold: float,
+    deadline: float
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Опросить хранилища одновременно
+
+    Returns:
+        имя хранилища → результаты, в порядке backends. Хранилища, которые
+        упали или не ответили за deadline секунд, пропускаются
+    """
+    if not backends:
+        return {}
+    if len(backends) == 1:
+        # Одно хранилище - без задач и дедлайна (общий таймаут у вызывающего кода)
+        backend = backends[0]
+        try:
+            return {backend.name: await _timed_search(backend, query, limit, score_threshold)}
+        except Exception as e:
+            logger.error(f"❌ Retrieval: {backend.name} failed: {type(e).__name__}: {e}")
+            return {}
+
+    tasks = _start(backends, query, limit, score_threshold)
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    _cancel_late(pending, tasks, deadline)
+
+    ranked_lists = {}
+    for task, name in tasks.items():
+        if task in done:
+            results = _result_or_none(task, name)
+            if results is not None:
+                ranked_lists[name] = results
+    return ranked_lists
+
+
+async def first_healthy(
+    backends: List[RetrievalBackend],
+    query: str,
+    limit: int,
+    score_threshold: float,
+    deadline: float
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Опросить хранилища одновременно и взять первый успешный непустой ответ
+
+    Returns:
+        {имя хранилища: результаты} или {} если никто не ответил за deadline
+    """
+    tasks = _start(backends, query, limit, score_threshold)
+    pending = set(tasks)
+    winner: Dict[str, List[Dict[str, Any]]] = {}
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+    try:
+        while pending and not winner:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, stop_at - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            # Порядок backends - приоритет среди завершившихся одновременно
+            for task in sorted(done, key=list(tasks).index):
+                name = tasks[task]
+                results = _result_or_none(task, name)
+                if results and not winner:
+                    _stats_for(name).wins += 1
+                    winner = {name: results}
+        return winner
+    finally:
+        if winner:
+            # Опоздавшие уже не нужны - это не таймаут
+            for task in pending:
+                task.cancel()
+                _stats_for(tasks[task]).superseded += 1
+        else:
+            _cancel_late(pending, tasks, deadline)
@@ -0,0 +1,226 @@
+"""
+Retrieval Cache
+
+Кэш результатов KnowledgeSearchService.search перед всеми backend'ами
+(локальный индекс, Supabase, Qdrant, fallback).
+
+Популярные вопросы ("что такое мозгоритм", вопросы после рассылки урока)
+повторяются постоянно - повторный поиск не ходит в векторное хранилище.
+
+Features:
+- Ключ: (нормализованный запрос, стратегия, limit, корзина min_relevance, backend, версия KB)
+- Bounded LRU + TTL
+- bump_kb_version (скрипты миграции) инвалидирует весь кэш
+- Пустые результаты не кэшируются (могут быть следствием сбоя backend'а)
+- Кэш только в памяти. Опционально при старте популярные запросы из
+  MessageLog.query прогоняются через обычный поиск (replay) и заполняют его заново
+
+Usage:
+    from bot.services.retrieval_cache import get_retrieval_cache
+
+    cache = get_retrieval_cache()
+    key = cache.make_key(query, strategy, limit, min_relevance, backend, kb_version)
+    results = cache.get(key, kb_version)
+    if results is None:
+        results = await search(...)
+        cache.put(key, results)
+"""
+
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from bot.config import (
+    RETRIEVAL_CACHE_TTL_SECONDS,
+    RETRIEVAL_CACHE_MAX_ENTRIES,
+    RETRIEVAL_CACHE_RELEVANCE_STEP
+)
+from bot.services.single_flight import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedRetrieval:
+    """Закэшированный результат поиска"""
+
+    results: List[Any]  # SearchResult
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+class RetrievalCache:
+    """LRU + TTL кэш результатов поиска, сбрасывается при смене версии KB"""
+
+    def __init__(
+        self,
+        ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS,
+        max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+        relevance_step: float = RETRIEVAL_CACHE_RELEVANCE_STEP
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.relevance_step = relevance_step
+
+        self._entries: "OrderedDict[Hashable, CachedRetrieval]" = OrderedDict()
+        self._kb_version: Optional[str] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.replayed = 0
+
+    def make_key(
+        self,
+        query: str,
+        strategy: str,
+        limit: int,
+        min_relevance: float,
+        backend: str,
+        kb_version: str
+    ) -> tuple:
+        """Ключ кэша; близкие пороги релевантности попадают в одну корзину"""
+        bucket = round(min_relevance / self.relevance_step) if self.relevance_step > 0 else min_relevance
+        return (normalize_query(query), strategy, limit, bucket, backend, kb_version)
+
+    def _check_version(self, kb_version: str):
+        """Новая версия KB - все записи устарели"""
+        if self._kb_version != kb_version:
+            if self._entries:
+                logger.info(f"🔄 Retrieval cache: версия KB {self._kb_version} → {kb_version}, сброс {len(self._entries)} записей")
+                self._entries.clear()
+                self.invalidations += 1
+            self._kb_version = kb_version
+
+    def get(self, key: Hashable, kb_version: str) -> Optional[List[Any]]:
+        """Копии закэшированных SearchResult или None"""
+        self._check_version(kb_version)
+
+        entry = self._entries.get(key)
+        if entry is not None and (time.monotonic() - entry.created_at) >= self.ttl_seconds:
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Вызывающий код может менять relevance_score - отдаём копии
+        return [copy.copy(result) for result in entry.results]
+
+    def put(self, key: Hashable, results: List[Any]):
+        """Сохранить результаты поиска (пустые не кэшируются)"""
+        if not results:
+            return
+        self._entries[key] = CachedRetrieval(results=[copy.copy(result) for result in results])
+        self._entries.move_to_end(key)
+        self.stores += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "kb_version": self._kb_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+            "replayed": self.replayed,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0.0
+        }
+
+
+def load_popular_queries(limit: int) -> List[str]:
+    """Самые частые запросы из MessageLog.query (пустой список если БД недоступна)"""
+    try:
+        from sqlalchemy import func
+        from bot.database import SessionLocal, DATABASE_ENABLED
+        from bot.database.models import MessageLog
+    except ImportError:
+        return []
+    if not DATABASE_ENABLED or SessionLocal is None:
+        return []
+
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(MessageLog.query, func.count(MessageLog.id).label("count"))
+            .filter(MessageLog.query.isnot(None))
+            .group_by(MessageLog.query)
+            .order_by(func.count(MessageLog.id).desc())
+            .limit(limit)
+            .all()
+        )
+        return [row[0] for row in rows if row[0] and row[0].strip()]
+    finally:
+        db.close()
+
+
+async def replay_popular_queries(search: Callable[[str], Awaitable[Any]], limit: int) -> int:
+    """
+    Заполнить кэш заново после рестарта: прогнать популярные запросы из MessageLog
+    через обычный поиск (кэш не сохраняется на диск - это живые запросы к backend'ам)
+
+    Args:
+        search: Поиск, через который идут обычные запросы (заполняет кэш)
+        limit: Сколько самых частых запросов прогнать
+
+    Returns:
+        Количество выполненных запросов
+    """
+    start = time.perf_counter()
+    try:
+        queries = await asyncio.to_thread(load_popular_queries, limit)
+    except Exception as e:
+        logger.warning(f"⚠️ Retrieval cache: не удалось прочитать MessageLog для replay: {e}")
+        return 0
+
+    replayed = 0
+    for query in queries:
+        try:
+            await search(query)
+            replayed += 1
+        except Exception as e:
+            logger.warning(f"⚠️ Retrieval cache: replay '{query[:50]}' не удался: {type(e).__name__}: {e}")
+
+    get_retrieval_cache().replayed += replayed
+    logger.info(f"🔥 Retrieval cache: replay {replayed}/{len(queries)} популярных запросов из MessageLog ({time.perf_counter() - start:.1f}s)")
+    return replayed
+
+
+# Singleton instance
+_retrieval_cache = None
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Получить singleton instance RetrievalCache"""
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        _retrieval_cache = RetrievalCache()
+        logger.info(f"🗂️ Retrieval cache: TTL={RETRIEVAL_CACHE_TTL_SECONDS}s, max={RETRIEVAL_CACHE_MAX_ENTRIES}")
+    return _retrieval_cache
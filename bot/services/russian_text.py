@@ -0,0 +1,92 @@
+"""
+Russian Text Processing
+
+Токенизация и стемминг русского текста для лексического поиска (BM25).
+
+Стеммер - алгоритм Snowball (Porter) для русского языка: отрезает окончания
+в области RV, чтобы "мозгоритм", "мозгоритма", "мозгоритмы" давали один терм.
+Реализация на чистом Python без зависимостей, результат кэшируется по слову
+(словарь базы знаний ограничен).
+
+Usage:
+    from bot.services.russian_text import tokenize, stem
+
+    stem("мозгоритмами")  # "мозгоритм"
+    tokenize("Как делать мозгоритмы?")  # ["как", "дела", "мозгоритм"]
+"""
+
+import re
+from functools import lru_cache
+from typing import List
+
+# Версия токенизации - сохраняется в сериализованных индексах,
+# при изменении алгоритма индексы пересобираются
+TOKENIZER_VERSION = "ru-snowball-1"
+
+_WORD = re.compile(r'\w+')
+
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_I = re.compile(r'и$')
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DER = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_SOFT_SIGN = re.compile(r'ь$')
+_DOUBLE_N = re.compile(r'нн$')
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    """Основа русского слова (Snowball). Слова без кириллических гласных возвращаются как есть"""
+    word = word.lower().replace('ё', 'е')
+    match = _RV.match(word)
+    if not match:
+        return word
+
+    prefix, rv = match.groups()
+
+    # Шаг 1: деепричастие, иначе возвратность + прилагательное/глагол/существительное
+    temp = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        temp = _ADJECTIVE.sub('', rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE.sub('', temp, 1)
+        else:
+            temp = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+
+    # Шаг 2: конечное "и"
+    rv = _I.sub('', rv, 1)
+
+    # Шаг 3: словообразовательный суффикс "ост(ь)" в R2
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub('', rv, 1)
+
+    # Шаг 4: мягкий знак, иначе превосходная степень и "нн" → "н"
+    temp = _SOFT_SIGN.sub('', rv, 1)
+    if temp == rv:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        rv = _DOUBLE_N.sub('н', rv, 1)
+    else:
+        rv = temp
+
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """Термы текста: слова в нижнем регистре → основы (стоп-слова не удаляются, их вес гасит IDF)"""
+    return [stem(word) for word in _WORD.findall(text.lower())]
@@ -0,0 +1,183 @@
+"""
+Session Memory Cache
+
+Кэш памяти Zep на уровне сессии.
+Один запрос memory.get() за ход диалога обслуживает и summary-контекст,
+и последние N сообщений.
+
+Features:
+- Bounded LRU по сессиям + TTL
+- Coalescing: параллельные запросы одной сессии ждут один fetch
+- Write-through: после успешной записи хода в Zep сообщения дописываются
+  в кэш, следующий ход не требует round-trip в Zep (при ошибке записи
+  сессия сбрасывается из кэша)
+
+Usage:
+    from bot.services.session_memory import get_session_memory_cache
+
+    cache = get_session_memory_cache()
+    entry = await cache.get_or_fetch(session_id, fetcher)
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bot.config import SESSION_MEMORY_TTL_SECONDS, SESSION_MEMORY_MAX_SESSIONS
+from bot.services.single_flight import wait_shared
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних сообщений держим в кэше на сессию
+MAX_CACHED_MESSAGES = 20
+
+
+@dataclass
+class SessionMemoryEntry:
+    """Снимок памяти одной сессии"""
+
+    context: str = ""
+    messages: List[Any] = field(default_factory=list)  # объекты с role_type / content
+    fetched_at: float = field(default_factory=time.monotonic)
+
+    def format_recent(self, limit: int = 6) -> str:
+        """Последние N сообщений в формате для system prompt"""
+        formatted = []
+        for msg in self.messages[-limit:]:
+            role = "Пользователь" if msg.role_type == "user" else "Ассистент"
+            formatted.append(f"{role}: {msg.content}")
+        return "\n".join(formatted)
+
+
+class SessionMemoryCache:
+    """Bounded TTL кэш памяти Zep по session_id"""
+
+    def __init__(self, ttl_seconds: float = SESSION_MEMORY_TTL_SECONDS, max_sessions: int = SESSION_MEMORY_MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._entries: "OrderedDict[str, SessionMemoryEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_fresh(self, entry: SessionMemoryEntry) -> bool:
+        return (time.monotonic() - entry.fetched_at) < self.ttl_seconds
+
+    def get(self, session_id: str) -> Optional[SessionMemoryEntry]:
+        """Вернуть свежую запись или None"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry):
+            del self._entries[session_id]
+            return None
+        self._entries.move_to_end(session_id)
+        return entry
+
+    def put(self, session_id: str, entry: SessionMemoryEntry):
+        """Сохранить запись с LRU вытеснением"""
+        entry.messages = list(entry.messages[-MAX_CACHED_MESSAGES:])
+        self._entries[session_id] = entry
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(
+        self,
+        session_id: str,
+        fetcher: Callable[[], Awaitable[SessionMemoryEntry]]
+    ) -> SessionMemoryEntry:
+        """
+        Вернуть запись из кэша или загрузить её одним запросом
+
+        Параллельные вызовы для одной сессии ждут один и тот же fetch.
+        Ошибки fetcher пробрасываются всем ожидающим и не кэшируются.
+        Отмена вызывающего (deadline ветки контекста) не отменяет fetch для
+        остальных ожидающих; отмена последнего ожидающего отменяет fetch.
+        """
+        entry = self.get(session_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        task = self._inflight.get(session_id)
+        if task is not None:
+            self.hits += 1
+            return await wait_shared(task, lambda: self._forget(session_id, task))
+
+        self.misses += 1
+        # Fetch - отдельная задача, общая для всех ожидающих (как в SingleFlight):
+        # deadline или отмена одного вызова не обрывает fetch для остальных
+        task = asyncio.ensure_future(self._fetch(session_id, fetcher))
+        self._inflight[session_id] = task
+        task.add_done_callback(lambda t: self._on_fetch_done(session_id, t))
+        return await wait_shared(task, lambda: self._forget(session_id, task))
+
+    async def _fetch(
+        self,
+        session_id: str,
+        fetcher: Callable[[], Awaitable[SessionMemoryEntry]]
+    ) -> SessionMemoryEntry:
+        entry = await fetcher()
+        self.put(session_id, entry)
+        return entry
+
+    def _forget(self, session_id: str, task: asyncio.Task):
+        if self._inflight.get(session_id) is task:
+            del self._inflight[session_id]
+
+    def _on_fetch_done(self, session_id: str, task: asyncio.Task):
+        self._forget(session_id, task)
+        if not task.cancelled():
+            # Помечаем исключение как полученное, если все ожидающие были отменены
+            task.exception()
+
+    def append_messages(self, session_id: str, messages: List[Any]):
+        """
+        Write-through: дописать новые сообщения в закэшированную сессию
+
+        Если сессии нет в кэше - ничего не делаем, следующий ход загрузит её из Zep.
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        entry.messages = (entry.messages + list(messages))[-MAX_CACHED_MESSAGES:]
+        self._entries.move_to_end(session_id)
+
+    def invalidate(self, session_id: Optional[str] = None):
+        """Сбросить одну сессию или весь кэш"""
+        if session_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate_percent": round(self.hits / total * 100, 2) if total else 0.0
+        }
+
+
+# Singleton instance
+_session_memory_cache = None
+
+
+def get_session_memory_cache() -> SessionMemoryCache:
+    """Получить singleton instance SessionMemoryCache"""
+    global _session_memory_cache
+    if _session_memory_cache is None:
+        _session_memory_cache = SessionMemoryCache()
+        logger.info(f"🧠 Session memory cache: TTL={SESSION_MEMORY_TTL_SECONDS}s, max={SESSION_MEMORY_MAX_SESSIONS} сессий")
+    return _session_memory_cache
@@ -23,6 +23,10 @@ logger = logging.getLogger(__name__)
 class SimpleFalkorDBService:
     """Простой сервис для работы с FalkorDB без Graphiti"""
 
+    # RetrievalBackend (bot/services/retrieval_backend.py)
+    name = "simple_falkordb"
+    kind = "lexical"
+
     def __init__(self):
         """Инициализация FalkorDB service"""
         self.client: Optional[FalkorDB] = None
@@ -58,6 +62,20 @@ class SimpleFalkorDBService:
             logger.exception("Full traceback:")
             self.enabled = False
 
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """RetrievalBackend: fulltext search (семантического поиска нет, порог не применяется)"""
+        results = await self.search_fulltext(query=query, limit=limit)
+        return [
+            {
+                "id": r.get("id"),
+                "content": r.get("content", ""),
+                "entity_type": r.get("type") or "knowledge",
+                "metadata": {"source": r.get("source")},
+                "score": r.get("relevance_score", 0.5)
+            }
+            for r in results
+        ]
+
     async def health_check(self) -> Dict[str, Any]:
         """Проверка здоровья FalkorDB connection"""
         if not self.enabled or not self.client:
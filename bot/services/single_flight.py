@@ -0,0 +1,117 @@
+"""
+Single-Flight Coalescing
+
+Одинаковые запросы, выполняющиеся одновременно, ждут один общий результат.
+
+Сценарии:
+- Пользователь отправил одно и то же сообщение дважды подряд
+- Сотни студентов задают один и тот же вопрос сразу после рассылки урока
+
+Первый вызов ("лидер") запускает работу отдельной задачей, остальные
+("последователи") ждут её через asyncio.shield - отмена одного из ожидающих
+не отменяет работу для остальных. Если отменены все ожидающие (ответ взят
+из кэша, deadline хода), результат никому не нужен - работа отменяется. Ошибка пробрасывается всем ожидающим
+и не кэшируется: следующий вызов после завершения запустит работу заново.
+
+Usage:
+    from bot.services.single_flight import SingleFlight
+
+    flight = SingleFlight("llm")
+    result = await flight.do(key, lambda: call_llm(messages))
+"""
+
+import re
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Общая задача → сколько вызовов её сейчас ждут
+_waiters: Dict[asyncio.Future, int] = {}
+
+
+def normalize_query(text: str) -> str:
+    """Нормализация текста запроса для ключа: регистр, пробелы, пунктуация по краям"""
+    return _WHITESPACE.sub(' ', text.lower()).strip(' .,!?…')
+
+
+def fingerprint(*parts: Any) -> str:
+    """Короткий стабильный хэш для ключа (например, от messages LLM запроса)"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+async def wait_shared(task: asyncio.Future, on_abandon: Optional[Callable[[], None]] = None) -> Any:
+    """
+    Дождаться общей задачи, не отменяя её для других ожидающих
+
+    Если отменён последний ожидающий, задача отменяется (перед этим вызывается
+    on_abandon - убрать её из in-flight, чтобы новые вызовы не присоединились
+    к отменяемой задаче).
+    """
+    _waiters[task] = _waiters.get(task, 0) + 1
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if _waiters[task] == 1 and not task.done():
+            if on_abandon is not None:
+                on_abandon()
+            task.cancel()
+        raise
+    finally:
+        left = _waiters[task] - 1
+        if left:
+            _waiters[task] = left
+        else:
+            del _waiters[task]
+
+
+class SingleFlight:
+    """Объединение одновременных вызовов с одинаковым ключом"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить fn() или дождаться уже выполняющегося вызова с тем же ключом"""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            logger.info(f"🔗 Single-flight [{self.name}]: запрос присоединён к выполняющемуся ({len(self._inflight)} в работе)")
+            return await wait_shared(task, lambda: self._forget(key, task))
+
+        self.leaders += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_done(key, t))
+        return await wait_shared(task, lambda: self._forget(key, task))
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        self._forget(key, task)
+        if not task.cancelled():
+            # Помечаем исключение как полученное, если все ожидающие были отменены
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.shared
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "shared": self.shared,
+            "shared_percent": round(self.shared / total * 100, 2) if total else 0.0
+        }
@@ -8,6 +8,8 @@ Architecture:
 - Supabase: PostgreSQL + pgvector extension
 - OpenAI: text-embedding-3-small (1536D vectors)
 - RPC functions: match_documents для similarity search
+- Transport: один общий httpx.AsyncClient (keep-alive пул, HTTP/2 если
+  установлен h2) и AsyncOpenAI для embeddings - запросы не блокируют event loop
 
 Usage:
     from bot.services.supabase_service import get_supabase_service
@@ -25,16 +27,23 @@ from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 import asyncio
 
-# Use requests instead of Supabase SDK (SDK doesn't support new key format sb_secret_...)
+# REST API напрямую вместо Supabase SDK (SDK doesn't support new key format sb_secret_...)
 try:
-    import requests
-    REQUESTS_AVAILABLE = True
+    import httpx
+    HTTPX_AVAILABLE = True
 except ImportError:
-    REQUESTS_AVAILABLE = False
-    logging.warning("⚠️ requests not installed. Install: pip install requests")
+    HTTPX_AVAILABLE = False
+    logging.warning("⚠️ httpx not installed. Install: pip install httpx")
 
+# HTTP/2 только если установлен h2 (pip install httpx[http2])
 try:
-    from openai import OpenAI
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    from openai import AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
@@ -54,9 +63,14 @@ from bot.config import (
     SUPABASE_SERVICE_KEY,
     SUPABASE_TABLE,
     OPENAI_API_KEY,
+    OPENAI_BASE_URL,
     OPENAI_EMBEDDING_MODEL,
-    USE_SUPABASE
+    USE_SUPABASE,
+    SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_READ_TIMEOUT,
+    SUPABASE_MAX_CONNECTIONS
 )
+from bot.services.embedding_cache import get_embedding_cache
 
 logger = logging.getLogger(__name__)
 
@@ -64,10 +78,16 @@ logger = logging.getLogger(__name__)
 class SupabaseService:
     """Сервис для работы с Supabase pgvector"""
 
+    # RetrievalBackend (bot/services/retrieval_backend.py)
+    name = "supabase"
+    kind = "vector"
+
     def __init__(self):
         """Инициализация Supabase REST API client"""
-        self.enabled = USE_SUPABASE and REQUESTS_AVAILABLE and OPENAI_AVAILABLE
-        self.openai_client: Optional[OpenAI] = None
+        self.enabled = USE_SUPABASE and HTTPX_AVAILABLE and OPENAI_AVAILABLE
+        self.openai_client: Optional[AsyncOpenAI] = None
+        self.http: Optional["httpx.AsyncClient"] = None  # Создаётся при первом запросе
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # Event loop, к которому привязаны клиенты
         self.table_name = SUPABASE_TABLE
         self.embedding_model = OPENAI_EMBEDDING_MODEL
 
@@ -76,8 +96,8 @@ class SupabaseService:
         self.headers = None
 
         if not self.enabled:
-            if not REQUESTS_AVAILABLE:
-                logger.warning("⚠️ Supabase service disabled: requests not installed")
+            if not HTTPX_AVAILABLE:
+                logger.warning("⚠️ Supabase service disabled: httpx not installed")
             elif not OPENAI_AVAILABLE:
                 logger.warning("⚠️ Supabase service disabled: openai SDK not installed")
             else:
@@ -111,12 +131,13 @@ class SupabaseService:
             self.openai_client = None
             logger.info(f"✅ OpenAI client will be initialized on first use: {self.embedding_model}")
 
-            # Проверка подключения к таблице
+            # Проверка подключения к таблице (один синхронный запрос при старте - __init__ не async)
             try:
-                response = requests.get(
+                response = httpx.get(
                     f"{self.api_url}/{self.table_name}",
                     headers=self.headers,
-                    params={"select": "id", "limit": 1}
+                    params={"select": "id", "limit": 1},
+                    timeout=self._timeout()
                 )
                 response.raise_for_status()
                 logger.info(f"✅ Supabase table '{self.table_name}' accessible")
@@ -131,7 +152,64 @@ class SupabaseService:
             logger.exception("Full traceback:")
             self.enabled = False
 
-    def _generate_embedding(self, text: str) -> List[float]:
+    @staticmethod
+    def _timeout() -> "httpx.Timeout":
+        return httpx.Timeout(SUPABASE_READ_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT)
+
+    def _bind_loop(self):
+        """
+        Клиенты привязаны к event loop, в котором созданы. Если сервис используется
+        из другого loop (несколько asyncio.run() в скриптах) - создаём их заново
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None and (self.http is not None or self.openai_client is not None):
+                logger.info("🔄 Supabase: новый event loop, HTTP клиенты пересоздаются")
+            # Старые клиенты не закрываем: их loop уже недоступен
+            self.http = None
+            self.openai_client = None
+            self._loop = loop
+
+    def _get_http(self) -> "httpx.AsyncClient":
+        """Общий HTTP клиент: соединения (и TLS сессия) переиспользуются между запросами"""
+        self._bind_loop()
+        if self.http is None:
+            self.http = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self._timeout(),
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_CONNECTIONS
+                ),
+                http2=HTTP2_AVAILABLE
+            )
+            logger.info(f"✅ Supabase HTTP client: keep-alive pool {SUPABASE_MAX_CONNECTIONS}, {'HTTP/2' if HTTP2_AVAILABLE else 'HTTP/1.1'}")
+        return self.http
+
+    async def close(self):
+        """Закрыть соединения (shutdown приложения)"""
+        if self._loop is not asyncio.get_running_loop():
+            self._bind_loop()
+            return
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+        if self.openai_client is not None:
+            await self.openai_client.close()
+            self.openai_client = None
+
+    async def _count(self, params: Dict[str, str]) -> int:
+        """Количество строк таблицы через Prefer: count=exact (Content-Range: 0-9/100 → 100)"""
+        response = await self._get_http().get(
+            f"{self.api_url}/{self.table_name}",
+            headers={"Prefer": "count=exact"},
+            params={"select": "id", "limit": 1, **params}
+        )
+        response.raise_for_status()
+        parts = response.headers.get("Content-Range", "").split("/")
+        return int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else 0
+
+    async def _generate_embedding(self, text: str) -> List[float]:
         """
         Генерация embedding через OpenAI API
 
@@ -148,12 +226,17 @@ class SupabaseService:
 
         # Lazy initialization: создать OpenAI client при первом использовании
         # Это гарантирует что мы используем актуальный OPENAI_API_KEY из environment
+        self._bind_loop()
         if not self.openai_client:
             import os
             api_key = os.getenv('OPENAI_API_KEY')
             if not api_key:
                 raise RuntimeError("OPENAI_API_KEY not found in environment")
-            self.openai_client = OpenAI(api_key=api_key)
+            self.openai_client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=OPENAI_BASE_URL,
+                timeout=httpx.Timeout(SUPABASE_READ_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT)
+            )
             logger.info(f"✅ OpenAI client initialized (lazy): API key ending in ...{api_key[-4:]}")
 
         # Начало отслеживания метрик
@@ -161,7 +244,7 @@ class SupabaseService:
         error_occurred = False
 
         try:
-            response = self.openai_client.embeddings.create(
+            response = await self.openai_client.embeddings.create(
                 input=text,
                 model=self.embedding_model
             )
@@ -201,6 +284,10 @@ class SupabaseService:
 
             raise
 
+    async def search(self, query: str, limit: int, score_threshold: float) -> List[Dict[str, Any]]:
+        """RetrievalBackend: семантический поиск по всей базе знаний"""
+        return await self.search_semantic(query=query, limit=limit, score_threshold=score_threshold)
+
     async def health_check(self) -> Dict[str, Any]:
         """Проверка здоровья Supabase service"""
         if not self.enabled:
@@ -213,31 +300,8 @@ class SupabaseService:
             }
 
         try:
-            # Проверка подключения через REST API
-            response = requests.get(
-                f"{self.api_url}/{self.table_name}",
-                headers=self.headers,
-                params={"select": "id", "limit": 1}
-            )
-            response.raise_for_status()
-
-            # Подсчет entities через REST API (используем Prefer: count=exact)
-            count_headers = {**self.headers, "Prefer": "count=exact"}
-            count_response = requests.get(
-                f"{self.api_url}/{self.table_name}",
-                headers=count_headers,
-                params={"select": "id"}
-            )
-            count_response.raise_for_status()
-
-            # Получаем count из Content-Range header
-            content_range = count_response.headers.get("Content-Range", "")
-            total_count = 0
-            if content_range:
-                # Format: "0-9/100" → extract 100
-                parts = content_range.split("/")
-                if len(parts) == 2:
-                    total_count = int(parts[1])
+            # Проверка подключения и подсчет entities через REST API (Prefer: count=exact)
+            total_count = await self._count({})
 
             return {
                 "service": "supabase",
@@ -298,11 +362,17 @@ class SupabaseService:
             logger.info(f"🔍 Supabase: Генерируем embedding для query: '{query[:80]}...'")
             logger.info(f"   Threshold: {score_threshold}, Limit: {limit}, Entity filter: {entity_type or 'all'}")
 
-            query_embedding = self._generate_embedding(query)
-            logger.info(f"✅ Embedding сгенерирован: {len(query_embedding)} dimensions")
+            cache = get_embedding_cache()
+            query_embedding = await cache.get(self.embedding_model, query)
+            if query_embedding is None:
+                query_embedding = await self._generate_embedding(query)
+                cache.put(self.embedding_model, query, query_embedding)
+                logger.info(f"✅ Embedding сгенерирован: {len(query_embedding)} dimensions")
+            else:
+                logger.info(f"♻️ Embedding из кэша: {len(query_embedding)} dimensions")
 
             # Вызываем RPC function через REST API
-            rpc_url = f"{SUPABASE_URL}/rest/v1/rpc/match_documents"
+            rpc_url = f"{self.api_url}/rpc/match_documents"
 
             rpc_params = {
                 "query_embedding": query_embedding,
@@ -319,11 +389,7 @@ class SupabaseService:
             logger.info(f"📡 Вызываем RPC match_documents...")
 
             # POST request для RPC
-            response = requests.post(
-                rpc_url,
-                headers=self.headers,
-                json=rpc_params
-            )
+            response = await self._get_http().post(rpc_url, json=rpc_params)
             response.raise_for_status()
 
             # Парсим результаты
@@ -402,7 +468,7 @@ class SupabaseService:
 
         try:
             # Генерируем embedding
-            embedding = self._generate_embedding(content)
+            embedding = await self._generate_embedding(content)
 
             # Подготавливаем данные
             data = {
@@ -416,10 +482,9 @@ class SupabaseService:
             }
 
             # Upsert через REST API (используем Prefer: resolution=merge-duplicates)
-            upsert_headers = {**self.headers, "Prefer": "resolution=merge-duplicates"}
-            response = requests.post(
+            response = await self._get_http().post(
                 f"{self.api_url}/{self.table_name}",
-                headers=upsert_headers,
+                headers={"Prefer": "resolution=merge-duplicates"},
                 json=data
             )
             response.raise_for_status()
@@ -443,42 +508,20 @@ class SupabaseService:
 
         try:
             # Общее количество через REST API
-            count_headers = {**self.headers, "Prefer": "count=exact"}
-            count_response = requests.get(
-                f"{self.api_url}/{self.table_name}",
-                headers=count_headers,
-                params={"select": "id"}
-            )
-            count_response.raise_for_status()
-
-            # Получаем count из Content-Range header
-            content_range = count_response.headers.get("Content-Range", "")
-            total = 0
-            if content_range:
-                parts = content_range.split("/")
-                if len(parts) == 2:
-                    total = int(parts[1])
+            total = await self._count({})
 
-            # По типам (отдельные запросы для каждого типа)
+            # По типам (запросы параллельно по общему пулу соединений)
+            entity_types = ["lesson", "faq", "correction", "question", "brainwrite"]
+            type_counts = await asyncio.gather(
+                *(self._count({"entity_type": f"eq.{entity_type}"}) for entity_type in entity_types),
+                return_exceptions=True
+            )
             stats_by_type = {}
-            for entity_type in ["lesson", "faq", "correction", "question", "brainwrite"]:
-                try:
-                    type_response = requests.get(
-                        f"{self.api_url}/{self.table_name}",
-                        headers=count_headers,
-                        params={"select": "id", "entity_type": f"eq.{entity_type}"}
-                    )
-                    type_response.raise_for_status()
-
-                    type_content_range = type_response.headers.get("Content-Range", "")
-                    if type_content_range:
-                        parts = type_content_range.split("/")
-                        if len(parts) == 2:
-                            type_count = int(parts[1])
-                            if type_count > 0:
-                                stats_by_type[entity_type] = type_count
-                except Exception as type_error:
-                    logger.warning(f"Failed to get count for {entity_type}: {type_error}")
+            for entity_type, type_count in zip(entity_types, type_counts):
+                if isinstance(type_count, Exception):
+                    logger.warning(f"Failed to get count for {entity_type}: {type_count}")
+                elif type_count > 0:
+                    stats_by_type[entity_type] = type_count
 
             return {
                 "table": self.table_name,
@@ -0,0 +1,6 @@
+"""
+Testing utilities
+
+Локальные заглушки внешних сервисов для воспроизводимых замеров
+производительности без доступа к сети (см. fake_services.py).
+"""
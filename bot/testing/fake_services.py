@@ -0,0 +1,669 @@
+"""
+Fake Services
+
+Детерминированные локальные заглушки внешних сервисов - весь пайплайн
+main.py / webhook.py запускается без сети с воспроизводимыми задержками.
+
+Один FastAPI сервер эмулирует:
+- OpenAI:    /openai/v1/chat/completions (включая stream), /embeddings,
+             /audio/transcriptions, /models
+- Anthropic: /anthropic/v1/messages
+- Zep Cloud: /zep/api/v2/users, /sessions, /sessions/{id}/memory (в памяти)
+- Telegram:  /telegram/bot{token}/{method}, /telegram/file/bot{token}/{path}
+             (sink: все отправленные сообщения доступны через /_fake/telegram/messages)
+- Qdrant:    /collections/... (get_collections, query_points, upsert)
+- Supabase:  /rest/v1/{table}, /rest/v1/rpc/match_documents
+
+Embeddings детерминированы (feature hashing по словам, L2 нормализация):
+одинаковый текст → одинаковый вектор, общие слова → выше cosine similarity.
+Supabase эмулятор при старте загружает базу знаний из data/parsed_kb
+с такими же embeddings, поэтому поиск возвращает осмысленные результаты.
+
+Ответы LLM детерминированы по тексту запроса. Prompt caching эмулируется:
+повторный system префикс (от 1024 токенов) отдаётся как cached_tokens.
+
+Задержки и ошибки настраиваются через env:
+    FAKE_LATENCY_<SERVICE>     fixed:MS | uniform:LO:HI | normal:MEAN:STD | lognormal:MEDIAN:SIGMA
+    FAKE_ERROR_RATE_<SERVICE>  доля ответов 500 (0.0-1.0)
+    SERVICE: CHAT, STREAM_CHUNK, EMBEDDINGS, TRANSCRIPTION, ANTHROPIC, ZEP, TELEGRAM, VECTOR
+    FAKE_SEED                  seed генератора задержек (по умолчанию 42)
+    FAKE_EMBEDDING_DIM         размерность embeddings (по умолчанию 1536)
+    FAKE_CHAT_RESPONSE_CHARS   длина ответа LLM (по умолчанию 600)
+
+Usage:
+    python -m bot.testing.fake_services --port 9100
+
+    # .env бота
+    OPENAI_BASE_URL=http://localhost:9100/openai/v1
+    ANTHROPIC_BASE_URL=http://localhost:9100/anthropic
+    ZEP_BASE_URL=http://localhost:9100/zep/api/v2
+    TELEGRAM_API_URL=http://localhost:9100/telegram
+    QDRANT_URL=http://localhost:9100
+    SUPABASE_URL=http://localhost:9100
+"""
+
+import os
+import re
+import math
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+try:
+    from fastapi import FastAPI, Request, Response
+    from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    FASTAPI_AVAILABLE = True
+except ImportError:
+    FASTAPI_AVAILABLE = False
+
+from bot.services.kb_corpus import load_kb_corpus
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = int(os.getenv('FAKE_EMBEDDING_DIM', '1536'))
+CHAT_RESPONSE_CHARS = int(os.getenv('FAKE_CHAT_RESPONSE_CHARS', '600'))
+
+# Минимальный префикс для prompt caching OpenAI и гранулярность кэша
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+
+_WORD = re.compile(r'\w+')
+
+# Задержки по умолчанию, близкие к продакшену (мс)
+DEFAULT_LATENCIES = {
+    "CHAT": "lognormal:2500:0.4",
+    "STREAM_CHUNK": "fixed:30",
+    "EMBEDDINGS": "lognormal:150:0.3",
+    "TRANSCRIPTION": "lognormal:1500:0.3",
+    "ANTHROPIC": "lognormal:3000:0.4",
+    "ZEP": "lognormal:120:0.3",
+    "TELEGRAM": "lognormal:80:0.3",
+    "VECTOR": "lognormal:60:0.3",
+}
+
+
+class LatencyModel:
+    """Распределение задержки сервиса + доля ошибок"""
+
+    def __init__(self, spec: str, error_rate: float = 0.0, rng: Optional[random.Random] = None):
+        self.spec = spec
+        self.error_rate = error_rate
+        self.rng = rng or random.Random(0)
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    @classmethod
+    def from_env(cls, service: str, rng: random.Random) -> "LatencyModel":
+        spec = os.getenv(f"FAKE_LATENCY_{service}", DEFAULT_LATENCIES[service])
+        error_rate = float(os.getenv(f"FAKE_ERROR_RATE_{service}", "0"))
+        return cls(spec, error_rate, rng)
+
+    def sample_ms(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = self.rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = self.rng.gauss(p[0], p[1])
+        else:
+            value = p[0] * math.exp(self.rng.gauss(0.0, p[1]))
+        return max(0.0, value)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    async def wait(self):
+        await asyncio.sleep(self.sample_ms() / 1000)
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Детерминированный embedding: feature hashing по словам + L2 нормализация"""
+    vector = [0.0] * dim
+    for word, count in Counter(_WORD.findall(text.lower())).items():
+        digest = hashlib.md5(word.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[index] += sign * (1.0 + math.log(count))
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def cosine(a: List[float], b: List[float]) -> float:
+    if len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка токенов (~3 символа на токен для русского текста)"""
+    return max(1, len(text) // 3)
+
+
+def fake_answer(prompt: str, chars: int = CHAT_RESPONSE_CHARS) -> str:
+    """Детерминированный ответ LLM по тексту запроса"""
+    seed = int.from_bytes(hashlib.sha1(prompt.encode('utf-8')).digest()[:8], 'little')
+    rng = random.Random(seed)
+    words = _WORD.findall(prompt) or ["ответ"]
+    parts = [f"Тестовый ответ на вопрос: {prompt[:80]}."]
+    while sum(len(p) + 1 for p in parts) < chars:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 14)))
+        parts.append(sentence.capitalize() + ".")
+    return " ".join(parts)[:chars]
+
+
+class FakeState:
+    """Состояние всех эмуляторов (в памяти)"""
+
+    def __init__(self, seed: int = int(os.getenv('FAKE_SEED', '42')), preload_kb: bool = True):
+        rng = random.Random(seed)
+        self.latency = {service: LatencyModel.from_env(service, rng) for service in DEFAULT_LATENCIES}
+        self.calls: Counter = Counter()
+
+        # OpenAI prompt caching: хэши уже виденных префиксов
+        self.seen_prefixes: set = set()
+
+        # Zep
+        self.zep_users: Dict[str, Dict[str, Any]] = {}
+        self.zep_sessions: Dict[str, Dict[str, Any]] = {}
+        self.zep_messages: Dict[str, List[Dict[str, Any]]] = {}
+
+        # Telegram sink
+        self.telegram_messages: List[Dict[str, Any]] = []
+        self._next_message_id = 1
+
+        # Qdrant: collection → {point_id: {"vector", "payload"}}
+        self.qdrant: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+        # Supabase: table → {id: row}
+        self.supabase: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        if preload_kb:
+            table = os.getenv('SUPABASE_TABLE', 'course_knowledge')
+            rows = self.supabase.setdefault(table, {})
+            for doc in load_kb_corpus():
+                rows[doc["id"]] = {**doc, "embedding": fake_embedding(doc["content"])}
+            logger.info(f"🧪 Fake Supabase: загружено {len(rows)} документов в '{table}'")
+
+    def next_message_id(self) -> int:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    def cached_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Эмуляция prompt caching: первый system message как кэшируемый префикс"""
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        tokens = estimate_tokens(prefix)
+        if tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        digest = hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+        if digest not in self.seen_prefixes:
+            self.seen_prefixes.add(digest)
+            return 0
+        return tokens // PROMPT_CACHE_BLOCK_TOKENS * PROMPT_CACHE_BLOCK_TOKENS
+
+
+def create_app(state: Optional[FakeState] = None) -> "FastAPI":
+    """FastAPI приложение со всеми эмуляторами"""
+    if not FASTAPI_AVAILABLE:
+        raise RuntimeError("fastapi не установлен: pip install fastapi uvicorn")
+
+    state = state or FakeState()
+    app = FastAPI(title="Fake external services")
+    app.state.fake = state
+
+    async def simulate(service: str, name: str) -> Optional[JSONResponse]:
+        """Задержка сервиса; JSONResponse 500 если выпала ошибка"""
+        state.calls[name] += 1
+        model = state.latency[service]
+        await model.wait()
+        if model.should_fail():
+            state.calls[f"{name}:error"] += 1
+            return JSONResponse({"error": {"message": f"Fake {service} error", "type": "server_error"}}, status_code=500)
+        return None
+
+    # ==================== OpenAI ====================
+
+    @app.get("/openai/v1/models")
+    async def openai_models():
+        return {"object": "list", "data": [
+            {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+            for model in ("gpt-5.1-2025-11-13", "gpt-4o", "text-embedding-3-small", "whisper-1")
+        ]}
+
+    @app.post("/openai/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "fake-model")
+        prompt = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        answer = fake_answer(prompt)
+
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(answer),
+            "total_tokens": prompt_tokens + estimate_tokens(answer),
+            "prompt_tokens_details": {"cached_tokens": state.cached_tokens(messages)}
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            error = await simulate("CHAT", "openai.chat")
+            if error:
+                return error
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            }
+
+        # Stream: задержка CHAT до первого чанка, затем STREAM_CHUNK между чанками
+        error = await simulate("CHAT", "openai.chat.stream")
+        if error:
+            return error
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events():
+            def chunk(delta: Dict[str, Any], finish_reason=None, chunk_usage=None) -> str:
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else []
+                }
+                if chunk_usage is not None:
+                    data["usage"] = chunk_usage
+                return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for i in range(0, len(answer), 20):
+                await state.latency["STREAM_CHUNK"].wait()
+                yield chunk({"content": answer[i:i + 20]})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk(None, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/openai/v1/embeddings")
+    async def openai_embeddings(request: Request):
+        body = await request.json()
+        error = await simulate("EMBEDDINGS", "openai.embeddings")
+        if error:
+            return error
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dim = int(body.get("dimensions") or EMBEDDING_DIM)
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {
+                "prompt_tokens": sum(estimate_tokens(str(t)) for t in inputs),
+                "total_tokens": sum(estimate_tokens(str(t)) for t in inputs)
+            }
+        }
+
+    @app.post("/openai/v1/audio/transcriptions")
+    async def openai_transcriptions(request: Request):
+        form = await request.form()
+        error = await simulate("TRANSCRIPTION", "openai.transcriptions")
+        if error:
+            return error
+        upload = form.get("file")
+        size = len(await upload.read()) if hasattr(upload, "read") else 0
+        text = f"Тестовая транскрипция голосового сообщения ({size} байт)"
+        if form.get("response_format", "json") == "text":
+            return PlainTextResponse(text)
+        return {"text": text}
+
+    # ==================== Anthropic ====================
+
+    @app.post("/anthropic/v1/messages")
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        error = await simulate("ANTHROPIC", "anthropic.messages")
+        if error:
+            return error
+        messages = body.get("messages", [])
+        prompt = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        answer = fake_answer(prompt)
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake-claude"),
+            "content": [{"type": "text", "text": answer}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": estimate_tokens(str(body.get("system", ""))) + sum(estimate_tokens(str(m.get("content", ""))) for m in messages),
+                "output_tokens": estimate_tokens(answer)
+            }
+        }
+
+    # ==================== Zep ====================
+
+    def zep_not_found(what: str) -> JSONResponse:
+        return JSONResponse({"message": f"{what} not found"}, status_code=404)
+
+    @app.get("/zep/api/v2/users/{user_id}")
+    async def zep_get_user(user_id: str):
+        error = await simulate("ZEP", "zep.user.get")
+        if error:
+            return error
+        user = state.zep_users.get(user_id)
+        return user if user is not None else zep_not_found("user")
+
+    @app.post("/zep/api/v2/users")
+    async def zep_add_user(request: Request):
+        body = await request.json()
+        error = await simulate("ZEP", "zep.user.add")
+        if error:
+            return error
+        user = {**body, "uuid": str(uuid.uuid4()), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        state.zep_users[body["user_id"]] = user
+        return user
+
+    @app.post("/zep/api/v2/sessions")
+    async def zep_add_session(request: Request):
+        body = await request.json()
+        error = await simulate("ZEP", "zep.session.add")
+        if error:
+            return error
+        session = {**body, "uuid": str(uuid.uuid4()), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        state.zep_sessions[body["session_id"]] = session
+        state.zep_messages.setdefault(body["session_id"], [])
+        return session
+
+    @app.get("/zep/api/v2/sessions/{session_id}")
+    async def zep_get_session(session_id: str):
+        error = await simulate("ZEP", "zep.session.get")
+        if error:
+            return error
+        session = state.zep_sessions.get(session_id)
+        return session if session is not None else zep_not_found("session")
+
+    @app.post("/zep/api/v2/sessions/{session_id}/memory")
+    async def zep_add_memory(session_id: str, request: Request):
+        body = await request.json()
+        error = await simulate("ZEP", "zep.memory.add")
+        if error:
+            return error
+        stored = state.zep_messages.setdefault(session_id, [])
+        for message in body.get("messages", []):
+            stored.append({**message, "uuid": str(uuid.uuid4()), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ")})
+        return {"context": None}
+
+    @app.get("/zep/api/v2/sessions/{session_id}/memory")
+    async def zep_get_memory(session_id: str, lastn: Optional[int] = None):
+        error = await simulate("ZEP", "zep.memory.get")
+        if error:
+            return error
+        messages = state.zep_messages.get(session_id)
+        if messages is None:
+            return zep_not_found("session")
+        recent = messages[-(lastn or 12):]
+        context = ""
+        if messages:
+            users = [m["content"][:60] for m in messages if m.get("role_type") == "user"][-3:]
+            context = "FACTS:\n" + "\n".join(f"- Пользователь спрашивал: {u}" for u in users)
+        return {"context": context, "messages": recent}
+
+    @app.delete("/zep/api/v2/sessions/{session_id}/memory")
+    async def zep_delete_memory(session_id: str):
+        error = await simulate("ZEP", "zep.memory.delete")
+        if error:
+            return error
+        state.zep_messages[session_id] = []
+        return {"message": "deleted"}
+
+    # ==================== Telegram ====================
+
+    @app.api_route("/telegram/bot{token}/{method}", methods=["GET", "POST"])
+    async def telegram_method(token: str, method: str, request: Request):
+        params: Dict[str, Any] = dict(request.query_params)
+        if request.method == "POST":
+            content_type = request.headers.get("content-type", "")
+            if "application/json" in content_type:
+                params.update(await request.json())
+            else:
+                form = await request.form()
+                params.update({k: v for k, v in form.items() if isinstance(v, str)})
+
+        error = await simulate("TELEGRAM", f"telegram.{method}")
+        if error:
+            return JSONResponse({"ok": False, "error_code": 500, "description": "Fake Telegram error"}, status_code=500)
+
+        chat_id = params.get("chat_id")
+        now = int(time.time())
+
+        def message(text: Optional[str], message_id: Optional[int] = None) -> Dict[str, Any]:
+            return {
+                "message_id": message_id or state.next_message_id(),
+                "date": now,
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+                "text": text
+            }
+
+        if method in ("sendMessage", "editMessageText"):
+            message_id = int(params["message_id"]) if params.get("message_id") else None
+            result = message(params.get("text"), message_id)
+            state.telegram_messages.append({"method": method, "chat_id": chat_id, **result})
+            return {"ok": True, "result": result}
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}}
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {"ok": True, "result": {"file_id": file_id, "file_unique_id": file_id, "file_size": 1024, "file_path": f"voice/{file_id}.oga"}}
+        if method == "getWebhookInfo":
+            return {"ok": True, "result": {"url": "", "has_custom_certificate": False, "pending_update_count": 0}}
+        # sendChatAction, deleteMessage, setWebhook, deleteWebhook, ...
+        return {"ok": True, "result": True}
+
+    @app.get("/telegram/file/bot{token}/{file_path:path}")
+    async def telegram_file(token: str, file_path: str):
+        await simulate("TELEGRAM", "telegram.file")
+        # Заголовок OGG + детерминированные байты
+        return Response(b"OggS" + hashlib.sha256(file_path.encode()).digest() * 32, media_type="audio/ogg")
+
+    # ==================== Qdrant ====================
+
+    def qdrant_ok(result: Any) -> Dict[str, Any]:
+        return {"result": result, "status": "ok", "time": 0.0}
+
+    @app.get("/collections")
+    async def qdrant_collections():
+        await simulate("VECTOR", "qdrant.get_collections")
+        return qdrant_ok({"collections": [{"name": name} for name in state.qdrant]})
+
+    @app.get("/collections/{name}")
+    async def qdrant_collection(name: str):
+        await simulate("VECTOR", "qdrant.get_collection")
+        points = state.qdrant.get(name)
+        if points is None:
+            return JSONResponse({"status": {"error": f"Collection `{name}` doesn't exist!"}, "time": 0.0}, status_code=404)
+        size = len(next(iter(points.values()))["vector"]) if points else EMBEDDING_DIM
+        return qdrant_ok({
+            "status": "green",
+            "optimizer_status": "ok",
+            "points_count": len(points),
+            "indexed_vectors_count": len(points),
+            "segments_count": 1,
+            "config": {
+                "params": {"vectors": {"size": size, "distance": "Cosine"}},
+                "hnsw_config": {"m": 16, "ef_construct": 100, "full_scan_threshold": 10000},
+                "optimizer_config": {
+                    "deleted_threshold": 0.2, "vacuum_min_vector_number": 1000, "default_segment_number": 0,
+                    "flush_interval_sec": 5
+                },
+                "wal_config": {"wal_capacity_mb": 32, "wal_segments_ahead": 0}
+            },
+            "payload_schema": {}
+        })
+
+    @app.put("/collections/{name}/points")
+    async def qdrant_upsert(name: str, request: Request):
+        body = await request.json()
+        await simulate("VECTOR", "qdrant.upsert")
+        points = state.qdrant.setdefault(name, {})
+        for point in body.get("points", []):
+            vector = point.get("vector")
+            if isinstance(vector, dict):
+                vector = next(iter(vector.values()), [])
+            points[str(point["id"])] = {"id": point["id"], "vector": vector, "payload": point.get("payload") or {}}
+        return qdrant_ok({"operation_id": 0, "status": "completed"})
+
+    def qdrant_matches(payload: Dict[str, Any], query_filter: Optional[Dict[str, Any]]) -> bool:
+        for condition in (query_filter or {}).get("must", []) or []:
+            match = condition.get("match") or {}
+            if payload.get(condition.get("key")) != match.get("value"):
+                return False
+        return True
+
+    @app.post("/collections/{name}/points/query")
+    async def qdrant_query(name: str, request: Request):
+        body = await request.json()
+        await simulate("VECTOR", "qdrant.query_points")
+        query = body.get("query")
+        if isinstance(query, dict):
+            query = query.get("nearest", query)
+        with_payload = body.get("with_payload", False)
+        threshold = body.get("score_threshold")
+
+        scored = []
+        for point in state.qdrant.get(name, {}).values():
+            if not qdrant_matches(point["payload"], body.get("filter")):
+                continue
+            score = cosine(query, point["vector"])
+            if threshold is not None and score < threshold:
+                continue
+            payload = point["payload"]
+            if isinstance(with_payload, list):
+                payload = {k: v for k, v in payload.items() if k in with_payload}
+            elif isinstance(with_payload, dict) and "include" in with_payload:
+                payload = {k: v for k, v in payload.items() if k in with_payload["include"]}
+            scored.append({"id": point["id"], "version": 0, "score": score, "payload": payload if with_payload else None})
+
+        scored.sort(key=lambda p: p["score"], reverse=True)
+        return qdrant_ok({"points": scored[:int(body.get("limit", 10))]})
+
+    # ==================== Supabase ====================
+
+    @app.post("/rest/v1/rpc/match_documents")
+    async def supabase_match(request: Request):
+        body = await request.json()
+        await simulate("VECTOR", "supabase.match_documents")
+        table = os.getenv('SUPABASE_TABLE', 'course_knowledge')
+        query = body.get("query_embedding") or []
+        threshold = float(body.get("match_threshold", 0.0))
+        entity_type = body.get("filter_entity_type")
+
+        rows = []
+        for row in state.supabase.get(table, {}).values():
+            if entity_type and row.get("entity_type") != entity_type:
+                continue
+            similarity = cosine(query, row.get("embedding") or [])
+            if similarity >= threshold:
+                rows.append({k: v for k, v in row.items() if k != "embedding"} | {"similarity": similarity})
+        rows.sort(key=lambda r: r["similarity"], reverse=True)
+        return rows[:int(body.get("match_count", 5))]
+
+    @app.get("/rest/v1/{table}")
+    async def supabase_select(table: str, request: Request):
+        await simulate("VECTOR", "supabase.select")
+        rows = list(state.supabase.get(table, {}).values())
+        for key, value in request.query_params.items():
+            if key not in ("select", "limit", "offset", "order") and value.startswith("eq."):
+                rows = [r for r in rows if str(r.get(key)) == value[3:]]
+        total = len(rows)
+        limit = int(request.query_params.get("limit", total or 1))
+        select = request.query_params.get("select", "*")
+        columns = None if select == "*" else select.split(",")
+        data = [
+            {k: v for k, v in r.items() if (columns is None and k != "embedding") or (columns and k in columns)}
+            for r in rows[:limit]
+        ]
+        headers = {"Content-Range": f"0-{max(len(data) - 1, 0)}/{total}"}
+        return JSONResponse(data, headers=headers)
+
+    @app.post("/rest/v1/{table}")
+    async def supabase_insert(table: str, request: Request):
+        body = await request.json()
+        await simulate("VECTOR", "supabase.insert")
+        rows = body if isinstance(body, list) else [body]
+        stored = state.supabase.setdefault(table, {})
+        for row in rows:
+            stored[str(row.get("id", uuid.uuid4()))] = row
+        return JSONResponse([{k: v for k, v in r.items() if k != "embedding"} for r in rows], status_code=201)
+
+    # ==================== Инспекция ====================
+
+    @app.get("/_fake/stats")
+    async def fake_stats():
+        return {
+            "calls": dict(state.calls),
+            "latency": {service: model.spec for service, model in state.latency.items()},
+            "zep_sessions": len(state.zep_messages),
+            "telegram_messages": len(state.telegram_messages),
+            "qdrant_points": {name: len(points) for name, points in state.qdrant.items()},
+            "supabase_rows": {name: len(rows) for name, rows in state.supabase.items()}
+        }
+
+    @app.get("/_fake/telegram/messages")
+    async def fake_telegram_messages(chat_id: Optional[str] = None, limit: int = 50):
+        messages = [m for m in state.telegram_messages if chat_id is None or str(m["chat_id"]) == chat_id]
+        return messages[-limit:]
+
+    @app.post("/_fake/reset")
+    async def fake_reset():
+        state.calls.clear()
+        state.seen_prefixes.clear()
+        state.zep_users.clear()
+        state.zep_sessions.clear()
+        state.zep_messages.clear()
+        state.telegram_messages.clear()
+        return {"status": "ok"}
+
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Локальные заглушки OpenAI / Anthropic / Zep / Telegram / Qdrant / Supabase")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
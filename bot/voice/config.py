@@ -22,10 +22,13 @@ SUPPORTED_AUDIO_FORMATS = [
 ]
 
 # Настройки Telegram Bot API
-TELEGRAM_API_BASE_URL = "https://api.telegram.org/bot{token}/{method}"
-TELEGRAM_FILE_BASE_URL = "https://api.telegram.org/file/bot{token}/{file_path}"
+# TELEGRAM_API_URL переопределяется для локальной заглушки Bot API
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_API_BASE_URL = TELEGRAM_API_URL + "/bot{token}/{method}"
+TELEGRAM_FILE_BASE_URL = TELEGRAM_API_URL + "/file/bot{token}/{file_path}"
 
 # Настройки Whisper API
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # None - адрес по умолчанию SDK
 WHISPER_MODEL = "whisper-1"
 WHISPER_RESPONSE_FORMAT = "text"  # или "json", "srt", "verbose_json", "vtt"
 WHISPER_LANGUAGE = "ru"  # Русский язык по умолчанию для ignatova-stroinost
@@ -13,7 +13,7 @@ from openai import AsyncOpenAI
 
 from .config import (
     WHISPER_MODEL, WHISPER_RESPONSE_FORMAT, WHISPER_LANGUAGE,
-    WHISPER_TIMEOUT_SECONDS, SUPPORTED_AUDIO_FORMATS
+    WHISPER_TIMEOUT_SECONDS, SUPPORTED_AUDIO_FORMATS, OPENAI_BASE_URL
 )
 
 logger = logging.getLogger(__name__)
@@ -28,6 +28,7 @@ class WhisperTranscriber:
         
         self.client = AsyncOpenAI(
             api_key=api_key,
+            base_url=OPENAI_BASE_URL,
             timeout=WHISPER_TIMEOUT_SECONDS
         )
     
@@ -12,6 +12,7 @@
 
 import os
 import sys
+import time
 import logging
 import asyncio
 from datetime import datetime
@@ -50,6 +51,7 @@ except Exception as e:
 try:
     from bot.handlers.message_handler import MessageHandler
     from bot.handlers.business_handler import BusinessHandler
+    from bot.monitoring.tracing import start_trace, finish_trace, discard_trace, add_span
     print("✅ Обработчики загружены")
 except ImportError as e:
     print(f"❌ Ошибка загрузки обработчиков: {e}")
@@ -67,7 +69,7 @@ except ImportError as e:
 
 # Импорт мониторинга
 try:
-    from bot.monitoring import get_metrics
+    from bot.monitoring import get_metrics, get_trace_buffer
     MONITORING_ENABLED = True
     print("✅ Мониторинг embeddings загружен")
 except ImportError as e:
@@ -77,6 +79,7 @@ except ImportError as e:
 
 # Настройки
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "QxLZquGScgx1QmwsuUSfJU6HpyTUJoHf2XD4QisrjCk")
 
 if not TELEGRAM_BOT_TOKEN:
@@ -87,6 +90,10 @@ print(f"✅ Токен бота получен: {TELEGRAM_BOT_TOKEN[:20]}...")
 # Создание бота
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
 
+# Адрес Bot API (локальная заглушка при TELEGRAM_API_URL)
+telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+telebot.apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
 # Инициализация обработчиков
 if AI_ENABLED and agent:
     message_handler = MessageHandler(bot, agent)
@@ -150,16 +157,26 @@ async def root():
         "hint": "Используйте /webhook/set в браузере для установки webhook"
     }
 
-async def process_update_in_background(update_dict: dict):
+async def process_update_in_background(update_dict: dict, received_at: float = None):
     """
     Обработка update в фоновом режиме.
     КРИТИЧНО: Эта функция выполняется ПОСЛЕ отправки HTTP 200 ответа Telegram.
     Это предотвращает повторные вызовы webhook от Telegram.
     """
+    update_id = update_dict.get('update_id', 'unknown')
+    # Трейс хода: от получения webhook до отправки ответа
+    trace = start_trace(update_id=update_id)
+    # Сообщение ушло в буфер - трейс закроет MessageHandler после ответа
+    handed_off = False
+    # Ход диалога (ответ пользователю) - трейс в буфер, иначе отбрасывается
+    is_turn = False
+
     try:
-        update_id = update_dict.get('update_id', 'unknown')
         logger.info(f"🔄 Background processing update: {update_id}")
 
+        if received_at is not None:
+            add_span("webhook", (time.monotonic() - received_at) * 1000)
+
         # Обработка Business Connection
         if "business_connection" in update_dict:
             conn_data = update_dict["business_connection"]
@@ -167,22 +184,27 @@ async def process_update_in_background(update_dict: dict):
 
         # Обработка Business сообщений
         elif "business_message" in update_dict:
+            is_turn = True
             message_data = update_dict["business_message"]
             await business_handler.handle_business_message(message_data)
 
         # Обработка обычных сообщений
         elif "message" in update_dict:
             message_data = update_dict["message"]
+            result = None
 
             # Голосовые сообщения
             if "voice" in message_data:
-                await message_handler.handle_voice_message(message_data)
+                is_turn = True
+                result = await message_handler.handle_voice_message(message_data)
             # Текстовые сообщения
             elif "text" in message_data:
-                await message_handler.handle_regular_message(message_data)
+                result = await message_handler.handle_regular_message(message_data)
             else:
                 logger.info("📋 Пропущено сообщение без текста/голоса")
 
+            handed_off = isinstance(result, dict) and result.get("action") == "buffered"
+
         # Неизвестный тип update
         else:
             logger.info(f"❓ Неизвестный тип update: {list(update_dict.keys())}")
@@ -191,6 +213,12 @@ async def process_update_in_background(update_dict: dict):
 
     except Exception as e:
         logger.error(f"❌ Ошибка background processing: {e}")
+    finally:
+        if not handed_off:
+            if is_turn:
+                await finish_trace(trace)
+            else:
+                discard_trace(trace)
 
 @app.post("/webhook")
 async def process_webhook(request: Request, background_tasks: BackgroundTasks):
@@ -201,12 +229,13 @@ async def process_webhook(request: Request, background_tasks: BackgroundTasks):
     Это предотвращает повторные вызовы webhook от Telegram (которые вызывали 3x дублирование).
     """
     try:
+        received_at = time.monotonic()
         update_dict = await request.json()
         update_id = update_dict.get('update_id', 'unknown')
         logger.info(f"📨 Получен webhook update: {update_id}")
 
         # Добавляем обработку в фоновую задачу
-        background_tasks.add_task(process_update_in_background, update_dict)
+        background_tasks.add_task(process_update_in_background, update_dict, received_at)
 
         # СРАЗУ возвращаем HTTP 200 OK
         logger.info(f"⚡ Немедленный HTTP 200 для update: {update_id}")
@@ -247,12 +276,13 @@ async def reload_instruction_endpoint():
         }
 
     try:
-        agent.reload_instruction()
+        old, new = agent.reload_instruction()
         return {
             "status": "success",
             "message": "Инструкция успешно перезагружена",
             "timestamp": datetime.now().isoformat(),
-            "last_updated": agent.instruction.get("last_updated", "unknown")
+            "last_updated": new.data.get("last_updated", "unknown"),
+            "changed": old.last_updated != new.last_updated
         }
     except Exception as e:
         logger.error(f"❌ Ошибка перезагрузки инструкции: {e}")
@@ -272,6 +302,7 @@ async def migrate_glossary():
     from supabase import create_client
     from openai import OpenAI
     from scripts.parse_knowledge_base import KnowledgeBaseParser
+    from bot.services.near_duplicate import simhash_hex
 
     try:
         # Initialize clients
@@ -283,7 +314,7 @@ async def migrate_glossary():
             return {"status": "error", "message": "Missing required environment variables"}
 
         supabase = create_client(supabase_url, supabase_key)
-        openai_client = OpenAI(api_key=openai_key)
+        openai_client = OpenAI(api_key=openai_key, base_url=os.getenv("OPENAI_BASE_URL") or None)
 
         # Parse glossary
         kb_dir = Path("KNOWLEDGE_BASE")
@@ -322,7 +353,8 @@ async def migrate_glossary():
                     "content": content,
                     "metadata": {
                         "lesson_number": term.lesson_number,
-                        "keywords": term.keywords
+                        "keywords": term.keywords,
+                        "simhash": simhash_hex(content)
                     },
                     "embedding": embedding,
                     "created_at": datetime.now().isoformat()
@@ -339,8 +371,15 @@ async def migrate_glossary():
                 errors.append(f"{term.term}: {str(e)}")
                 logger.error(f"Failed to upload term '{term.term}': {e}")
 
+        # Новые строки KB - кэши результатов поиска и ответов устарели
+        kb_version = None
+        if success_count:
+            from bot.services.kb_version import bump_kb_version
+            kb_version = bump_kb_version(reason="migrate-glossary")
+
         return {
             "status": "success",
+            "kb_version": kb_version,
             "total_terms": len(glossary_terms),
             "uploaded": success_count,
             "failed": len(errors),
@@ -364,11 +403,13 @@ async def get_embedding_stats():
         }
 
     try:
+        from bot.services.embedding_cache import get_embedding_cache
         metrics = get_metrics()
         return {
             "status": "success",
             "timestamp": datetime.now().isoformat(),
-            "metrics": metrics.get_summary()
+            "metrics": metrics.get_summary(),
+            "cache": get_embedding_cache().get_stats()
         }
     except Exception as e:
         logger.error(f"❌ Ошибка получения метрик: {e}")
@@ -377,6 +418,267 @@ async def get_embedding_stats():
             "message": str(e)
         }
 
+@app.post("/api/admin/embedding/cache/clear")
+async def clear_embedding_cache():
+    """Очистка кэша embeddings запросов (в памяти и SQLite)
+
+    Использование: curl -X POST http://localhost:8000/api/admin/embedding/cache/clear
+    """
+    from bot.services.embedding_cache import get_embedding_cache
+    cache = get_embedding_cache()
+    cleared = len(cache)
+    cache.clear()
+    return {
+        "status": "success",
+        "cleared_entries": cleared
+    }
+
+@app.get("/api/admin/retrieval-cache/stats")
+async def get_retrieval_cache_stats():
+    """Статистика кэша результатов поиска по базе знаний
+
+    Использование: curl http://localhost:8000/api/admin/retrieval-cache/stats
+    """
+    from bot.config import RETRIEVAL_CACHE_ENABLED
+    from bot.services.retrieval_cache import get_retrieval_cache
+    return {
+        "status": "success" if RETRIEVAL_CACHE_ENABLED else "disabled",
+        "timestamp": datetime.now().isoformat(),
+        "cache": get_retrieval_cache().get_stats()
+    }
+
+@app.post("/api/admin/retrieval-cache/clear")
+async def clear_retrieval_cache():
+    """Очистка кэша результатов поиска (версия KB не меняется)
+
+    Использование: curl -X POST http://localhost:8000/api/admin/retrieval-cache/clear
+    """
+    from bot.services.retrieval_cache import get_retrieval_cache
+    cache = get_retrieval_cache()
+    cleared = len(cache)
+    cache.clear()
+    return {
+        "status": "success",
+        "cleared_entries": cleared
+    }
+
+@app.get("/api/admin/reranker/stats")
+async def get_reranker_stats():
+    """Статистика cross-encoder reranking: латентность, таймауты, изменения порядка
+
+    Использование: curl http://localhost:8000/api/admin/reranker/stats
+    """
+    from bot.config import RERANKER_ENABLED, RERANKER_CANDIDATES
+    if not RERANKER_ENABLED:
+        return {
+            "status": "disabled",
+            "message": "Reranking отключен (RERANKER_ENABLED=false)"
+        }
+
+    from bot.services.reranker import get_reranker
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "candidates": RERANKER_CANDIDATES,
+        "reranker": get_reranker().get_stats()
+    }
+
+@app.get("/api/admin/retrieval/backends")
+async def get_retrieval_backends():
+    """Активные хранилища поиска и статистика их опроса (вызовы, ошибки, таймауты, латентность)
+
+    Использование: curl http://localhost:8000/api/admin/retrieval/backends
+    """
+    from bot.services.knowledge_search import get_knowledge_search_service
+    from bot.services.retrieval_backend import get_backend_stats
+    knowledge_service = get_knowledge_search_service()
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "backends": [
+            {"name": backend.name, "kind": backend.kind}
+            for backend in knowledge_service.backends
+        ],
+        "fanout_mode": knowledge_service.fanout_mode,
+        "stats": get_backend_stats()
+    }
+
+@app.get("/api/admin/traces")
+async def get_traces(limit: int = 20):
+    """Тайминги стадий обработки сообщений: p50/p95/p99 по стадиям + последние трейсы
+
+    Использование: curl "http://localhost:8000/api/admin/traces?limit=20"
+    """
+    if not MONITORING_ENABLED:
+        return {
+            "status": "unavailable",
+            "message": "Мониторинг не инициализирован"
+        }
+
+    buffer = get_trace_buffer()
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "summary": buffer.stage_summary(),
+        "recent": buffer.recent(limit)
+    }
+
+@app.get("/api/admin/traces/{message_id}")
+async def get_trace(message_id: str):
+    """Трейс одного сообщения по Message ID (формат: M624aa39)
+
+    Использование: curl http://localhost:8000/api/admin/traces/M624aa39
+    """
+    if not MONITORING_ENABLED:
+        return {
+            "status": "unavailable",
+            "message": "Мониторинг не инициализирован"
+        }
+
+    trace = get_trace_buffer().find(message_id.lstrip("#"))
+    if trace is None:
+        return {
+            "status": "not_found",
+            "message": f"Трейс {message_id} не найден в буфере (см. MessageLog.stage_timings)"
+        }
+    return {
+        "status": "success",
+        "trace": trace
+    }
+
+@app.get("/api/admin/prompt-cache/stats")
+async def get_prompt_cache_stats():
+    """Статистика prompt caching OpenAI (cached_tokens / prompt_tokens по моделям)
+
+    Использование: curl http://localhost:8000/api/admin/prompt-cache/stats
+    """
+    if not MONITORING_ENABLED:
+        return {
+            "status": "unavailable",
+            "message": "Мониторинг не инициализирован"
+        }
+
+    try:
+        from bot.monitoring import get_prompt_cache_metrics
+        return {
+            "status": "success",
+            "timestamp": datetime.now().isoformat(),
+            "metrics": get_prompt_cache_metrics().get_summary()
+        }
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения метрик prompt caching: {e}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.get("/api/admin/llm-router/stats")
+async def get_llm_router_stats():
+    """Статистика LLM провайдеров: latency p50/p95/p99, ошибки, circuit breaker, hedging
+
+    Использование: curl http://localhost:8000/api/admin/llm-router/stats
+    """
+    if not AI_ENABLED or not agent:
+        return {
+            "status": "error",
+            "message": "AI Agent не инициализирован"
+        }
+
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "router": agent.llm_router.get_stats()
+    }
+
+@app.get("/api/admin/single-flight/stats")
+async def get_single_flight_stats():
+    """Статистика объединения одинаковых одновременных запросов
+
+    Использование: curl http://localhost:8000/api/admin/single-flight/stats
+    """
+    if not AI_ENABLED or not agent:
+        return {
+            "status": "error",
+            "message": "AI Agent не инициализирован"
+        }
+
+    from bot.config import SINGLE_FLIGHT_SCOPE
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "scope": SINGLE_FLIGHT_SCOPE,
+        "retrieval": agent.retrieval_flight.get_stats(),
+        "llm": agent.llm_flight.get_stats()
+    }
+
+@app.get("/api/admin/post-processing/stats")
+async def get_post_processing_stats():
+    """Статистика очереди пост-обработки (лог MySQL, Zep, валидация)
+
+    Использование: curl http://localhost:8000/api/admin/post-processing/stats
+    """
+    if not AI_ENABLED or not agent:
+        return {
+            "status": "error",
+            "message": "AI Agent не инициализирован"
+        }
+
+    return {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "post_processing": agent.post_processor.get_stats()
+    }
+
+@app.get("/api/admin/answer-cache/stats")
+async def get_answer_cache_stats():
+    """Статистика semantic кэша ответов
+
+    Использование: curl http://localhost:8000/api/admin/answer-cache/stats
+    """
+    if not AI_ENABLED or not agent:
+        return {
+            "status": "error",
+            "message": "AI Agent не инициализирован"
+        }
+
+    try:
+        from bot.config import ANSWER_CACHE_ENABLED
+        from bot.services.kb_version import get_kb_version
+        return {
+            "status": "success",
+            "timestamp": datetime.now().isoformat(),
+            "enabled": ANSWER_CACHE_ENABLED,
+            "instruction_version": agent.instruction.get("last_updated", "unknown"),
+            "kb_version": get_kb_version(),
+            "cache": agent.answer_cache.get_stats()
+        }
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики answer cache: {e}")
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.post("/api/admin/answer-cache/clear")
+async def clear_answer_cache():
+    """Очистка semantic кэша ответов
+
+    Использование: curl -X POST http://localhost:8000/api/admin/answer-cache/clear
+    """
+    if not AI_ENABLED or not agent:
+        return {
+            "status": "error",
+            "message": "AI Agent не инициализирован"
+        }
+
+    cleared = len(agent.answer_cache)
+    agent.answer_cache.clear()
+    logger.info(f"🧹 Answer cache очищен ({cleared} записей)")
+    return {
+        "status": "success",
+        "cleared_entries": cleared
+    }
+
 @app.get("/debug/env")
 async def debug_env():
     """DEBUG: Проверка переменных окружения"""
@@ -420,7 +722,7 @@ async def set_webhook():
         # ВАЖНО: не используем secret_token - telegram-bot библиотека не работает с ним
         import requests
         response = requests.post(
-            f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook",
+            f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/setWebhook",
             json={
                 "url": webhook_url,
                 "allowed_updates": [
@@ -514,6 +816,39 @@ async def startup():
     else:
         logger.info("⚠️ База данных отключена (DATABASE_URL/POSTGRES_URL не настроен)")
 
+    # Модель SentenceTransformer для Qdrant грузится в фоне, в потоке encoder -
+    # первый запрос не ждёт загрузку, startup не блокируется
+    from bot.config import USE_QDRANT
+    if USE_QDRANT:
+        try:
+            from bot.services.qdrant_service import get_qdrant_service
+            qdrant_service = get_qdrant_service()
+            if qdrant_service.enabled:
+                # Проверка подключения (раньше - синхронный запрос в __init__, на пути первого запроса)
+                asyncio.create_task(qdrant_service.verify_connection())
+                asyncio.create_task(qdrant_service.embedder.warmup())
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось запустить прогрев encoder: {e}")
+
+    # tiktoken encoding для бюджета KB контекста (файл BPE может скачиваться) - в потоке
+    from bot.services.context_packer import load_encoding
+    asyncio.create_task(asyncio.to_thread(load_encoding))
+
+    # Cross-encoder для reranking грузится в фоне, в потоке reranker
+    from bot.config import RERANKER_ENABLED
+    if RERANKER_ENABLED:
+        from bot.services.reranker import get_reranker
+        asyncio.create_task(get_reranker().warmup())
+
+    # Replay популярных запросов из MessageLog через поиск - заполняет кэш результатов (в фоне)
+    from bot.config import RETRIEVAL_CACHE_ENABLED, RETRIEVAL_CACHE_REPLAY_QUERIES, SEARCH_LIMIT
+    if RETRIEVAL_CACHE_ENABLED and RETRIEVAL_CACHE_REPLAY_QUERIES > 0 and DATABASE_ENABLED and AI_ENABLED and agent:
+        from bot.services.retrieval_cache import replay_popular_queries
+        asyncio.create_task(replay_popular_queries(
+            lambda query: agent.search_knowledge_base(query, limit=SEARCH_LIMIT),
+            RETRIEVAL_CACHE_REPLAY_QUERIES
+        ))
+
     # 🚫 WEBHOOK SETUP УДАЛЁН ИЗ STARTUP (blocking retry loops)
     # ✅ Используйте POST /api/admin/setup-webhook для установки webhook после deployment
     webhook_url = os.getenv('WEBHOOK_URL')
@@ -526,6 +861,20 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     """События при остановке"""
+    # Дописываем логи / Zep из очереди пост-обработки
+    if AI_ENABLED and agent:
+        await agent.post_processor.drain()
+
+    from bot.config import USE_QDRANT, USE_SUPABASE
+    if USE_QDRANT:
+        from bot.services.qdrant_service import get_qdrant_service
+        await get_qdrant_service().close()
+    if USE_SUPABASE:
+        from bot.services.supabase_service import get_supabase_service
+        await get_supabase_service().close()
+    # Дописываем на диск накопленные embeddings
+    from bot.services.embedding_cache import get_embedding_cache
+    await asyncio.to_thread(get_embedding_cache().flush)
     logger.info("🛑 FastAPI приложение остановлено")
 
 if __name__ == "__main__":
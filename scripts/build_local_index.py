@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Build Local Vector Index
+
+Собирает локальный векторный индекс базы знаний для USE_LOCAL_INDEX=true.
+
+Процесс:
+1. Загрузка документов из data/parsed_kb (bot/services/kb_corpus.py)
+2. Генерация embeddings через OpenAI API (OPENAI_EMBEDDING_MODEL, батчами)
+3. Запись vectors.npy + documents.json + meta.json в LOCAL_INDEX_DIR
+4. bump_kb_version - кэши, зависящие от базы знаний, инвалидируются
+
+Usage:
+    python3 scripts/build_local_index.py
+    python3 scripts/build_local_index.py --dtype float16 --batch-size 100
+    python3 scripts/build_local_index.py --output /tmp/local_index --no-bump
+"""
+
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+
+# Добавить корень в PYTHONPATH
+root_dir = Path(__file__).parent.parent
+sys.path.insert(0, str(root_dir))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    from openai import OpenAI
+except ImportError:
+    print("❌ ERROR: openai SDK not installed")
+    print("Install: pip install openai")
+    sys.exit(1)
+
+from bot.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_EMBEDDING_MODEL, LOCAL_INDEX_DIR, LOCAL_INDEX_DTYPE
+)
+from bot.services.kb_corpus import load_kb_corpus, corpus_fingerprint
+from bot.services.local_vector_index import NUMPY_AVAILABLE, SUPPORTED_DTYPES, write_index
+from bot.services.kb_version import bump_kb_version
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def embed_documents(client: "OpenAI", texts, model: str, batch_size: int):
+    """Embeddings всех документов батчами (порядок сохраняется)"""
+    embeddings = []
+    total_tokens = 0
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        response = client.embeddings.create(input=batch, model=model)
+        embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        total_tokens += response.usage.total_tokens
+        logger.info(f"   📤 Embeddings: {min(i + batch_size, len(texts))}/{len(texts)}")
+    return embeddings, total_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build local vector index from data/parsed_kb")
+    parser.add_argument("--output", default=LOCAL_INDEX_DIR, help="Папка индекса (LOCAL_INDEX_DIR)")
+    parser.add_argument("--dtype", default=LOCAL_INDEX_DTYPE, choices=SUPPORTED_DTYPES)
+    parser.add_argument("--batch-size", type=int, default=100, help="Текстов в одном запросе embeddings")
+    parser.add_argument("--no-bump", action="store_true", help="Не увеличивать версию KB")
+    args = parser.parse_args()
+
+    if not NUMPY_AVAILABLE:
+        logger.error("❌ numpy not installed. Install: pip install numpy")
+        sys.exit(1)
+    if not OPENAI_API_KEY:
+        logger.error("❌ OPENAI_API_KEY required for embeddings")
+        sys.exit(1)
+
+    start_time = time.time()
+
+    documents = load_kb_corpus()
+    if not documents:
+        logger.error("❌ data/parsed_kb пуст - сначала запустите scripts/parse_knowledge_base.py")
+        sys.exit(1)
+
+    client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    logger.info(f"🚀 Embeddings для {len(documents)} документов ({OPENAI_EMBEDDING_MODEL})...")
+    embeddings, total_tokens = embed_documents(
+        client, [doc["content"] for doc in documents], OPENAI_EMBEDDING_MODEL, args.batch_size
+    )
+
+    meta = write_index(
+        args.output,
+        documents,
+        embeddings,
+        model=OPENAI_EMBEDDING_MODEL,
+        dtype=args.dtype,
+        fingerprint=corpus_fingerprint()
+    )
+
+    # Стоимость для text-embedding-3-small: $0.00002 за 1K tokens
+    logger.info("")
+    logger.info("=" * 60)
+    logger.info(f"✅ Local vector index: {meta['count']} документов, {meta['dim']}D {meta['dtype']} → {args.output}")
+    logger.info(f"   Tokens: {total_tokens:,} | Cost: ${total_tokens / 1000 * 0.00002:.4f}")
+    logger.info(f"   Time: {time.time() - start_time:.1f}s")
+    logger.info("=" * 60)
+
+    if not args.no_bump:
+        bump_kb_version(reason="build_local_index")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ sys.path.insert(0, str(root_dir))
 
 from openai import OpenAI
 from scripts.parse_knowledge_base import KnowledgeBaseParser
+from bot.services.kb_version import bump_kb_version
+from bot.services.near_duplicate import simhash_hex
 
 # Load environment
 load_dotenv()
@@ -94,7 +96,8 @@ def main():
                 "content": content,
                 "metadata": {
                     "lesson_number": term.lesson_number,
-                    "keywords": term.keywords
+                    "keywords": term.keywords,
+                    "simhash": simhash_hex(content)
                 },
                 "embedding": embedding,
                 "created_at": datetime.utcnow().isoformat()
@@ -127,6 +130,10 @@ def main():
     logger.info(f"   Uploaded: {success_count}/{len(glossary_terms)} terms")
     logger.info(f"{'=' * 60}")
 
+    if success_count:
+        # Кэши ответов и результатов поиска в боте сбросятся
+        bump_kb_version(reason="migrate_glossary_only")
+
 
 if __name__ == "__main__":
     main()
@@ -46,6 +46,8 @@ except ImportError:
     sys.exit(1)
 
 from bot.config import QDRANT_URL, QDRANT_API_KEY, QDRANT_COLLECTION, EMBEDDING_MODEL
+from bot.services.kb_version import bump_kb_version
+from bot.services.near_duplicate import simhash_hex
 from bot.models.knowledge_entities import (
     CourseLesson, FAQEntry, BrainwriteTechnique,
     StudentQuestion, CuratorCorrection, BrainwriteExample
@@ -307,7 +309,8 @@ class QdrantMigration:
                 "entity_type": entity["entity_type"],
                 "title": entity["title"],
                 "content": entity["content"],
-                "metadata": entity["metadata"],
+                # SimHash для отсева почти-дубликатов при поиске
+                "metadata": {**entity["metadata"], "simhash": simhash_hex(entity["content"])},
                 "created_at": datetime.utcnow().isoformat()
             }
 
@@ -394,6 +397,9 @@ class QdrantMigration:
                 self.stats["failed_entities"] += len(batch)
 
         logger.info("✅ Migration completed!")
+        if self.stats["uploaded_entities"]:
+            # Кэши ответов и результатов поиска в боте сбросятся
+            bump_kb_version(reason="migrate_to_qdrant")
         self._print_stats()
 
     def _print_stats(self):
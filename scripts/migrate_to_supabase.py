@@ -53,6 +53,8 @@ from bot.config import (
     SUPABASE_URL, SUPABASE_SERVICE_KEY, SUPABASE_TABLE,
     OPENAI_API_KEY, OPENAI_EMBEDDING_MODEL
 )
+from bot.services.kb_version import bump_kb_version
+from bot.services.near_duplicate import simhash_hex
 
 # Import parser
 from parse_knowledge_base import KnowledgeBaseParser
@@ -324,7 +326,8 @@ class SupabaseMigration:
                     "entity_type": entity["entity_type"],
                     "title": entity["title"],
                     "content": entity["content"],
-                    "metadata": entity["metadata"],
+                    # SimHash для отсева почти-дубликатов при поиске
+                    "metadata": {**entity["metadata"], "simhash": simhash_hex(entity["content"])},
                     "embedding": embedding,
                     "created_at": datetime.utcnow().isoformat()
                 }
@@ -426,6 +429,9 @@ class SupabaseMigration:
         logger.info("")
         logger.info("=" * 60)
         logger.info("✅ MIGRATION COMPLETE!")
+        if self.stats['uploaded_entities']:
+            # Кэши ответов и результатов поиска в боте сбросятся
+            bump_kb_version(reason="migrate_to_supabase")
         logger.info("=" * 60)
         logger.info(f"Total entities: {self.stats['total_entities']}")
         logger.info(f"Uploaded: {self.stats['uploaded_entities']}")
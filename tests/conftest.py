@@ -0,0 +1,17 @@
+"""
+Общие настройки unit-тестов
+
+bot.config требует TELEGRAM_BOT_TOKEN при импорте - для тестов подставляем
+фиктивный токен. Внешние сервисы тестами не вызываются.
+
+Запуск: python -m pytest -q tests
+"""
+
+import os
+import sys
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
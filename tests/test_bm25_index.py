@@ -0,0 +1,102 @@
+"""BM25Index: скоринг против прямой формулы Okapi BM25, фильтр entity_type, сохранение"""
+
+import math
+
+import pytest
+
+from bot.services.bm25_index import B, K1, BM25Index
+from bot.services.russian_text import tokenize
+
+DOCUMENTS = [
+    {"id": "d1", "entity_type": "lesson", "title": "Мозгоритмы", "content": "Как делать мозгоритмы каждый день"},
+    {"id": "d2", "entity_type": "faq", "title": "Оплата", "content": "Оплата курса картой или переводом"},
+    {"id": "d3", "entity_type": "lesson", "title": "Возражения", "content": "Работа с возражением о цене курса"},
+    {"id": "d4", "entity_type": "faq", "title": "Мозгоритм", "content": "Мозгоритм - упражнение на внимание, мозгоритмы помогают"},
+]
+
+
+def build(documents=DOCUMENTS) -> BM25Index:
+    return BM25Index.build([dict(doc) for doc in documents], fingerprint="test")
+
+
+def reference_scores(documents, query):
+    """BM25 по определению: без инвертированного индекса"""
+    docs_terms = [tokenize(f"{d['title']}\n{d['content']}") for d in documents]
+    avg_length = sum(len(t) for t in docs_terms) / len(docs_terms)
+    count = len(documents)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for terms in docs_terms if term in terms)
+        if not df:
+            continue
+        idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+        for doc_id, terms in enumerate(docs_terms):
+            tf = terms.count(term)
+            if tf:
+                denominator = tf + K1 * (1 - B + B * len(terms) / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / denominator
+    return scores
+
+
+@pytest.mark.parametrize("query", ["мозгоритмы", "оплата курса", "возражение о цене", "курс"])
+def test_scores_match_reference_formula(query):
+    index = build()
+    expected = reference_scores(DOCUMENTS, query)
+    hits = index.search(query, limit=10)
+
+    assert {hit.document["id"] for hit in hits} == {DOCUMENTS[d]["id"] for d in expected}
+    for hit in hits:
+        doc_id = next(i for i, d in enumerate(DOCUMENTS) if d["id"] == hit.document["id"])
+        assert hit.score == pytest.approx(expected[doc_id])
+    assert [hit.score for hit in hits] == sorted((hit.score for hit in hits), reverse=True)
+
+
+def test_stemming_matches_word_forms():
+    hits = build().search("мозгоритмами", limit=10)
+    assert {hit.document["id"] for hit in hits} == {"d1", "d4"}
+
+
+def test_relevance_and_matched_terms():
+    hits = build().search("оплата курса", limit=10)
+    assert hits[0].document["id"] == "d2"
+    assert hits[0].matched_terms == 2
+    for hit in hits:
+        assert 0.0 < hit.relevance <= 1.0
+
+
+def test_limit_and_entity_type_filter():
+    index = build()
+    assert len(index.search("курс мозгоритм", limit=1)) == 1
+    hits = index.search("мозгоритмы курс", limit=10, entity_type="faq")
+    assert hits and all(hit.document["entity_type"] == "faq" for hit in hits)
+    assert index.search("мозгоритмы", entity_type="missing") == []
+
+
+def test_empty_query_and_unknown_terms():
+    index = build()
+    assert index.search("") == []
+    assert index.search("несуществующееслово") == []
+    assert BM25Index.build([]).search("курс") == []
+
+
+def test_search_text_is_indexed_but_not_stored():
+    index = BM25Index.build([
+        {"id": "x", "entity_type": "lesson", "title": "Коротко", "content": "обрезано", "search_text": "полный текст про мозгоритмы"}
+    ])
+    assert [hit.document["id"] for hit in index.search("мозгоритмы")] == ["x"]
+    assert "search_text" not in index.documents[0]
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = build()
+    path = str(tmp_path / "bm25" / "test.json")
+    index.save(path)
+
+    loaded = BM25Index.load(path, fingerprint="test")
+    assert loaded is not None
+    query = "возражение о цене курса"
+    assert [(h.document["id"], round(h.score, 9)) for h in loaded.search(query)] == \
+        [(h.document["id"], round(h.score, 9)) for h in index.search(query)]
+
+    assert BM25Index.load(path, fingerprint="other") is None
+    assert BM25Index.load(str(tmp_path / "missing.json")) is None
@@ -0,0 +1,171 @@
+"""LLMRouter: circuit breaker, failover, таймаут попытки и hedging"""
+
+import asyncio
+
+import pytest
+
+from bot.services import llm_router
+from bot.services.llm_router import CircuitBreaker, LLMProvider, LLMResult, LLMRouter
+
+
+class FakeProvider(LLMProvider):
+    """Провайдер с заданной задержкой и ошибками"""
+
+    def __init__(self, name, delay=0.0, fail=False, failure_threshold=2, cooldown=60.0):
+        super().__init__(client=None, model=f"{name}-model")
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, cooldown_seconds=cooldown)
+
+    async def complete(self, messages, max_completion_tokens, temperature):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return LLMResult(text=f"answer from {self.name}", provider=self.name, model=self.model)
+
+
+MESSAGES = [{"role": "user", "content": "вопрос"}]
+
+
+def complete(router):
+    return asyncio.run(router.complete(MESSAGES))
+
+
+def test_breaker_state_transitions(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(llm_router.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+
+    breaker.on_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.on_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 10
+    assert breaker.state == "half_open" and breaker.allow()
+    breaker.on_start()
+    assert not breaker.allow()  # Только один пробный запрос
+
+    breaker.on_failure()  # Пробный запрос упал - снова open
+    assert breaker.state == "open"
+
+    now[0] += 10
+    breaker.on_start()
+    breaker.on_success()
+    assert breaker.state == "closed" and breaker.consecutive_failures == 0
+
+
+def test_breaker_cancelled_trial_allows_new_trial(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(llm_router.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=1)
+    breaker.on_failure()
+    now[0] += 1
+    breaker.on_start()
+    breaker.on_cancel()
+    assert breaker.allow()
+
+
+def test_failover_to_next_provider():
+    primary = FakeProvider("primary", fail=True)
+    secondary = FakeProvider("secondary")
+    router = LLMRouter([primary, secondary], hedging_enabled=False, timeout=5, attempt_timeout=5)
+
+    assert complete(router).provider == "secondary"
+    assert primary.stats.total_errors == 1
+    assert secondary.stats.total_calls == 1
+
+
+def test_open_breaker_skips_provider():
+    primary = FakeProvider("primary", fail=True, failure_threshold=2)
+    secondary = FakeProvider("secondary")
+    router = LLMRouter([primary, secondary], hedging_enabled=False, timeout=5, attempt_timeout=5)
+
+    complete(router)
+    complete(router)
+    assert primary.breaker.state == "open"
+    complete(router)
+    assert primary.calls == 2
+    assert secondary.calls == 3
+
+
+def test_all_breakers_open_raises():
+    provider = FakeProvider("only", fail=True, failure_threshold=1)
+    router = LLMRouter([provider], hedging_enabled=False, timeout=5, attempt_timeout=5)
+    with pytest.raises(Exception, match="LLM error"):
+        complete(router)
+    with pytest.raises(Exception, match="circuit breaker"):
+        complete(router)
+
+
+def test_attempt_timeout_counts_as_failure():
+    slow = FakeProvider("slow", delay=1.0, failure_threshold=1)
+    fast = FakeProvider("fast")
+    router = LLMRouter([slow, fast], hedging_enabled=False, timeout=5, attempt_timeout=0.05)
+
+    assert complete(router).provider == "fast"
+    assert slow.stats.timeouts == 1
+    assert slow.cancelled == 1
+    assert slow.breaker.state == "open"
+
+
+def test_overall_deadline():
+    router = LLMRouter([FakeProvider("slow", delay=1.0)], hedging_enabled=False, timeout=0.05, attempt_timeout=5)
+    with pytest.raises(Exception, match="LLM timeout"):
+        complete(router)
+
+
+def test_hedge_fires_when_primary_is_slow(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 0.05)
+    primary = FakeProvider("primary", delay=1.0)
+    secondary = FakeProvider("secondary", delay=0.01)
+    router = LLMRouter([primary, secondary], hedging_enabled=True, timeout=5, attempt_timeout=5)
+
+    result = complete(router)
+    assert result.provider == "secondary"
+    assert router.hedged_requests == 1
+    assert secondary.stats.hedge_wins == 1
+    # Проигравший запрос отменён и не считается ошибкой провайдера
+    assert primary.cancelled == 1 and primary.stats.cancelled == 1
+    assert primary.stats.total_errors == 0 and primary.breaker.state == "closed"
+
+
+def test_no_hedge_when_primary_is_fast(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 0.5)
+    primary = FakeProvider("primary", delay=0.01)
+    secondary = FakeProvider("secondary")
+    router = LLMRouter([primary, secondary], hedging_enabled=True, timeout=5, attempt_timeout=5)
+
+    assert complete(router).provider == "primary"
+    assert router.hedged_requests == 0
+    assert secondary.calls == 0
+
+
+def test_hedged_primary_error_switches_immediately(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 0.5)
+    primary = FakeProvider("primary", fail=True)
+    secondary = FakeProvider("secondary")
+    router = LLMRouter([primary, secondary], hedging_enabled=True, timeout=5, attempt_timeout=5)
+
+    assert complete(router).provider == "secondary"
+    assert router.hedged_requests == 0
+
+
+def test_hedge_delay_uses_p95(monkeypatch):
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_MIN_DELAY", 0.1)
+    monkeypatch.setattr(llm_router, "LLM_HEDGE_DEFAULT_DELAY", 20.0)
+    provider = FakeProvider("p")
+    router = LLMRouter([provider], hedging_enabled=True)
+
+    assert router._hedge_delay(provider) == 20.0
+    for latency in range(100, 1100, 100):
+        provider.stats.record_success(latency)
+    assert router._hedge_delay(provider) == pytest.approx(1.0)
@@ -0,0 +1,119 @@
+"""LocalSessionStore: бюджет памяти, вытеснение LRU, выгрузка в SQLite и возврат с диска"""
+
+import asyncio
+
+from bot.services.local_session_store import MAX_EXCHANGES, LocalSessionStore
+
+MESSAGE = "u" * 200
+RESPONSE = "a" * 200
+
+
+def wait_writer(store: LocalSessionStore):
+    """Дождаться всех задач потока writer"""
+    store._writer.submit(lambda: None).result()
+
+
+def make_store(tmp_path, max_bytes=3000) -> LocalSessionStore:
+    store = LocalSessionStore(max_bytes=max_bytes, spill_path=str(tmp_path / "sessions.db"))
+    wait_writer(store)
+    return store
+
+
+def test_history_renders_last_exchanges(tmp_path):
+    store = make_store(tmp_path, max_bytes=10 ** 6)
+    for i in range(MAX_EXCHANGES + 2):
+        store.add("s", f"вопрос {i}", f"ответ {i}")
+
+    history = asyncio.run(store.history("s"))
+    assert history.startswith("Пользователь: вопрос 6\nАссистент: ответ 6")
+    assert history.endswith("Пользователь: вопрос 11\nАссистент: ответ 11")
+    assert len(store._sessions["s"].exchanges) == MAX_EXCHANGES
+    assert asyncio.run(store.history("missing")) == ""
+
+
+def test_eviction_keeps_memory_budget_and_lru_order(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+
+    assert store._total_bytes <= store.max_bytes or len(store) == 1
+    assert "s4" in store._sessions  # Текущая сессия остаётся всегда
+    assert "s0" not in store._sessions
+    assert store.spilled >= 1
+    assert store._total_bytes == sum(s.size_bytes for s in store._sessions.values())
+
+
+def test_spilled_session_returns_from_disk(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+
+    history = asyncio.run(store.history("s0"))
+    assert history == f"Пользователь: {MESSAGE}\nАссистент: {RESPONSE}"
+    assert store.disk_hits == 1
+    assert "s0" in store._sessions
+    wait_writer(store)
+    # Запись с диска удалена - актуальная версия в памяти
+    assert store._take_row("s0") is None
+
+
+def test_add_to_spilled_session_merges_disk_history(tmp_path):
+    store = make_store(tmp_path)
+    store.add("s0", "первый", "ответ 1")
+    for i in range(1, 5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+    assert "s0" not in store._sessions
+
+    # Обмен дописывается без чтения диска, история подмешивается при чтении
+    store.add("s0", "второй", "ответ 2")
+    assert store._sessions["s0"].partial
+    history = asyncio.run(store.history("s0"))
+    assert history == "Пользователь: первый\nАссистент: ответ 1\nПользователь: второй\nАссистент: ответ 2"
+    assert not store._sessions["s0"].partial
+
+
+def test_partial_session_merges_on_spill(tmp_path):
+    store = make_store(tmp_path)
+    store.add("s0", "первый", "ответ 1")
+    for i in range(1, 5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+    store.add("s0", "второй", "ответ 2")  # partial
+    for i in range(5, 10):
+        store.add(f"s{i}", MESSAGE, RESPONSE)  # s0 снова вытеснена
+    wait_writer(store)
+
+    exchanges = store._take_row("s0")
+    assert [e["user"] for e in exchanges] == ["первый", "второй"]
+
+
+def test_sessions_survive_restart(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+    wait_writer(store)
+
+    restarted = make_store(tmp_path)
+    assert asyncio.run(restarted.history("s0")) != ""
+    assert restarted.get_stats()["disk_hits"] == 1
+
+
+def test_clear_removes_memory_and_disk(tmp_path):
+    store = make_store(tmp_path)
+    for i in range(5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+    store.clear()
+    wait_writer(store)
+
+    assert len(store) == 0
+    assert store.get_stats()["sessions_on_disk"] == 0
+    assert asyncio.run(store.history("s0")) == ""
+
+
+def test_without_disk_evicted_sessions_are_dropped():
+    store = LocalSessionStore(max_bytes=3000, spill_path=None)
+    for i in range(5):
+        store.add(f"s{i}", MESSAGE, RESPONSE)
+
+    assert store.dropped >= 1
+    assert asyncio.run(store.history("s0")) == ""
+    assert store.get_stats()["spill_path"] is None
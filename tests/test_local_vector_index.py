@@ -0,0 +1,107 @@
+"""LocalVectorIndex.search_vector: точный top-k, порог и маски entity_type"""
+
+import numpy as np
+import pytest
+
+from bot.services.local_vector_index import LocalVectorIndex, write_index
+
+DIM = 8
+
+
+def make_documents(count, types=("lesson", "faq", "correction")):
+    return [
+        {"id": f"doc{i}", "entity_type": types[i % len(types)], "title": f"T{i}", "content": f"content {i}", "metadata": {"n": i}}
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def index_data(tmp_path):
+    rng = np.random.default_rng(7)
+    documents = make_documents(60)
+    embeddings = rng.normal(size=(len(documents), DIM)).astype(np.float32)
+    write_index(str(tmp_path), documents, embeddings.tolist(), model="test-model")
+
+    index = LocalVectorIndex(index_dir=str(tmp_path))
+    assert index.load()
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return index, documents, normalized, rng
+
+
+def brute_force(documents, normalized, query, limit, entity_type=None):
+    query = query / np.linalg.norm(query)
+    scored = [
+        (float(normalized[i] @ query), doc["id"])
+        for i, doc in enumerate(documents)
+        if entity_type is None or doc["entity_type"] == entity_type
+    ]
+    return sorted(scored, reverse=True)[:limit]
+
+
+def test_top_k_matches_brute_force(index_data):
+    index, documents, normalized, rng = index_data
+    for _ in range(5):
+        query = rng.normal(size=DIM)
+        results = index.search_vector(query.tolist(), limit=7)
+        expected = brute_force(documents, normalized, query, 7)
+        assert [r["id"] for r in results] == [doc_id for _, doc_id in expected]
+        assert [r["score"] for r in results] == pytest.approx([score for score, _ in expected], abs=1e-5)
+
+
+@pytest.mark.parametrize("entity_type", ["lesson", "faq", "correction"])
+def test_entity_type_mask(index_data, entity_type):
+    index, documents, normalized, rng = index_data
+    query = rng.normal(size=DIM)
+    results = index.search_vector(query.tolist(), limit=5, entity_type=entity_type)
+
+    assert all(r["entity_type"] == entity_type for r in results)
+    expected = brute_force(documents, normalized, query, 5, entity_type)
+    assert [r["id"] for r in results] == [doc_id for _, doc_id in expected]
+
+
+def test_result_fields(index_data):
+    index, documents, normalized, _ = index_data
+    result = index.search_vector(normalized[3].tolist(), limit=1)[0]
+    assert result["id"] == "doc3"
+    assert result["score"] == pytest.approx(1.0, abs=1e-5)
+    assert result["title"] == "T3" and result["content"] == "content 3" and result["metadata"] == {"n": 3}
+
+
+def test_score_threshold(index_data):
+    index, _, normalized, _ = index_data
+    results = index.search_vector(normalized[0].tolist(), limit=60, score_threshold=0.5)
+    assert results and all(r["score"] >= 0.5 for r in results)
+    assert len(results) < 60
+
+
+def test_edge_cases(index_data):
+    index, _, normalized, _ = index_data
+    assert index.search_vector(normalized[0].tolist(), limit=0) == []
+    assert index.search_vector([0.0] * DIM, limit=5) == []
+    assert index.search_vector(normalized[0].tolist(), limit=5, entity_type="unknown_type") == []
+    # limit больше размера маски - возвращаются все документы типа
+    assert len(index.search_vector(normalized[0].tolist(), limit=100, entity_type="faq", score_threshold=-1.0)) == 20
+
+
+def test_float16_index(tmp_path):
+    documents = make_documents(10)
+    embeddings = np.eye(10, DIM, dtype=np.float32) + 0.01
+    write_index(str(tmp_path), documents, embeddings.tolist(), model="test-model", dtype="float16")
+
+    index = LocalVectorIndex(index_dir=str(tmp_path))
+    assert index.load()
+    assert index.vectors.dtype == np.float16
+    assert index.search_vector(embeddings[2].tolist(), limit=1)[0]["id"] == "doc2"
+
+
+def test_corrupted_index_is_rejected(tmp_path):
+    write_index(str(tmp_path), make_documents(3), np.ones((3, DIM)).tolist(), model="test-model")
+    (tmp_path / "documents.json").write_text("[]", encoding="utf-8")
+    assert not LocalVectorIndex(index_dir=str(tmp_path)).load()
+
+
+def test_write_index_validates_input(tmp_path):
+    with pytest.raises(ValueError):
+        write_index(str(tmp_path), make_documents(2), [[1.0] * DIM], model="m")
+    with pytest.raises(ValueError):
+        write_index(str(tmp_path), make_documents(1), [[1.0] * DIM], model="m", dtype="int8")
@@ -0,0 +1,76 @@
+"""SimHash сигнатуры и deduplicate почти-дубликатов"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+from bot.services.near_duplicate import deduplicate, hamming_distance, simhash, simhash_hex
+
+LESSON = (
+    "Мозгоритм - это ежедневное упражнение: запишите три мысли о клиенте, "
+    "найдите в каждой возражение и придумайте ответ на него до следующей встречи."
+)
+
+
+@dataclass
+class Result:
+    content: str
+    relevance_score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+def test_simhash_hex_is_stable_64_bit():
+    signature = simhash_hex(LESSON)
+    assert len(signature) == 16
+    assert int(signature, 16) == simhash(LESSON)
+    assert simhash_hex(LESSON) == signature
+
+
+def test_empty_text_has_zero_signature():
+    assert simhash("") == 0
+    assert simhash_hex("!!! ...") == "0" * 16
+
+
+def test_similar_texts_are_close_and_different_are_far():
+    edited = LESSON.replace("три мысли", "три мысли,").replace("встречи.", "встречи!")
+    other = "Оплата курса возможна картой, переводом или в рассрочку через банк-партнёр на двенадцать месяцев."
+    assert hamming_distance(simhash(LESSON), simhash(edited)) <= 6
+    assert hamming_distance(simhash(LESSON), simhash(other)) > 6
+
+
+def test_deduplicate_keeps_most_relevant_of_group():
+    results = [
+        Result(LESSON, 0.7),
+        Result(LESSON.upper(), 0.9),  # Та же последовательность слов
+        Result("Оплата курса картой или переводом на расчётный счёт компании.", 0.8),
+    ]
+    kept = deduplicate(results, max_distance=3)
+    assert [r.relevance_score for r in kept] == [0.9, 0.8]
+
+
+def test_deduplicate_uses_stored_signature():
+    # Сигнатура из metadata важнее текста: два разных текста с одинаковой сигнатурой - дубликаты
+    stored = simhash_hex(LESSON)
+    results = [
+        Result("совсем другой текст", 0.5, {"simhash": stored}),
+        Result("ещё один другой текст", 0.6, {"simhash": stored}),
+    ]
+    assert [r.relevance_score for r in deduplicate(results, max_distance=0)] == [0.6]
+
+
+def test_deduplicate_ignores_invalid_stored_signature():
+    results = [Result(LESSON, 0.5, {"simhash": "not-hex"}), Result(LESSON, 0.4)]
+    assert len(deduplicate(results, max_distance=0)) == 1
+
+
+def test_texts_without_words_compare_exactly():
+    results = [Result("...", 0.9), Result("...", 0.8), Result("!!!", 0.7)]
+    assert [r.content for r in deduplicate(results, max_distance=6)] == ["...", "!!!"]
+
+
+def test_distinct_results_are_kept():
+    results = [
+        Result(LESSON, 0.9),
+        Result("Оплата курса картой или переводом на расчётный счёт компании.", 0.8),
+        Result("Как обработать возражение о высокой цене: сравните стоимость с результатом.", 0.7),
+    ]
+    assert len(deduplicate(results, max_distance=3)) == 3
@@ -0,0 +1,104 @@
+"""PostProcessor: retry не блокирует воркер, порядок операций сессии сохраняется"""
+
+import asyncio
+import time
+
+from bot.monitoring.tracing import finish_trace, start_trace
+from bot.services import post_processing
+from bot.services.post_processing import PostJob, PostProcessor
+
+
+def recorder(log, name, failures=0):
+    """Операция, которая пишет своё имя в log и падает первые failures раз"""
+    left = [failures]
+
+    async def fn():
+        log.append(name)
+        if left[0] > 0:
+            left[0] -= 1
+            raise RuntimeError(f"{name} failed")
+    return fn
+
+
+def test_retry_does_not_block_other_jobs(monkeypatch):
+    monkeypatch.setattr(post_processing, "RETRY_BASE_DELAY", 0.2)
+
+    async def scenario():
+        processor = PostProcessor(enabled=True, workers=1, max_retries=2)
+        log = []
+        start = time.monotonic()
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "a1", failures=1), key="A"))
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "b1"), key="B"))
+        await asyncio.sleep(0.05)
+        # Операция другой сессии выполнена, пока a1 ждёт повтора
+        b_done = "b1" in log and time.monotonic() - start < 0.2
+        await processor.drain(timeout=5)
+        return processor, log, b_done
+
+    processor, log, b_done = asyncio.run(scenario())
+    assert b_done
+    assert log == ["a1", "b1", "a1"]
+    stats = processor.get_stats()["kinds"]["zep_write"]
+    assert stats["completed"] == 2 and stats["retried"] == 1 and stats["failed"] == 0
+
+
+def test_same_key_jobs_wait_for_retry(monkeypatch):
+    monkeypatch.setattr(post_processing, "RETRY_BASE_DELAY", 0.05)
+
+    async def scenario():
+        processor = PostProcessor(enabled=True, workers=1, max_retries=2)
+        log = []
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "a1", failures=1), key="A"))
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "a2"), key="A"))
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "a3", failures=1), key="A"))
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "a4"), key="A"))
+        await processor.drain(timeout=5)
+        return log
+
+    log = asyncio.run(scenario())
+    assert log == ["a1", "a1", "a2", "a3", "a3", "a4"]
+
+
+def test_exhausted_retries_call_on_failure(monkeypatch):
+    monkeypatch.setattr(post_processing, "RETRY_BASE_DELAY", 0.01)
+
+    async def scenario():
+        processor = PostProcessor(enabled=True, workers=1, max_retries=1)
+        log, failed = [], []
+        await processor.submit(PostJob(
+            kind="zep_write", fn=recorder(log, "x", failures=5), key="A", on_failure=lambda: failed.append("x")
+        ))
+        await processor.submit(PostJob(kind="validation", fn=recorder(log, "v", failures=1), max_retries=0))
+        await processor.drain(timeout=5)
+        return processor, log, failed
+
+    processor, log, failed = asyncio.run(scenario())
+    assert log.count("x") == 2 and log.count("v") == 1
+    assert failed == ["x"]
+    kinds = processor.get_stats()["kinds"]
+    assert kinds["zep_write"]["failed"] == 1 and kinds["validation"]["failed"] == 1
+
+
+def test_disabled_queue_runs_inline():
+    async def scenario():
+        processor = PostProcessor(enabled=False)
+        log = []
+        await processor.submit(PostJob(kind="zep_write", fn=recorder(log, "inline"), key="A"))
+        return processor, log
+
+    processor, log = asyncio.run(scenario())
+    assert log == ["inline"]
+    assert processor.get_stats()["inline"] == 1
+
+
+def test_job_span_is_added_to_submitting_trace():
+    async def scenario():
+        processor = PostProcessor(enabled=True, workers=1)
+        trace = start_trace(update_id=1)
+        await processor.submit(PostJob(kind="zep_write", fn=recorder([], "a"), key="A"))
+        await finish_trace(trace, persist=False)
+        await processor.drain(timeout=5)
+        return trace
+
+    trace = asyncio.run(scenario())
+    assert [span.name for span in trace.spans] == ["post:zep_write"]
@@ -0,0 +1,101 @@
+"""KeywordAutomaton / analyze_query: результаты совпадают с прежними any(word in text) проверками"""
+
+import re
+
+import pytest
+
+from bot.services.query_features import (
+    KEYWORD_TABLES, ROUTE_SEMANTIC, ROUTE_GRAPH, SUPPORT_TECHNICAL, SUPPORT_PAYMENT, GREETING, PRICE,
+    KeywordAutomaton, analyze_query, remove_emojis
+)
+
+
+def legacy_route_query(query: str) -> str:
+    """KnowledgeSearchService.route_query до перехода на автомат"""
+    query_lower = query.lower()
+    if re.search(r'урок\s+\d+|lesson\s+\d+', query_lower):
+        return "fulltext"
+    if any(word in query_lower for word in ["что такое", "как понять", "объясни", "в чем смысл"]):
+        return "semantic"
+    if any(word in query_lower for word in ["похожие", "связанные", "смежные", "related"]):
+        return "graph"
+    return "hybrid"
+
+
+def legacy_labels(text: str) -> set:
+    """Прежние проверки: поиск подстроки каждой таблицы в тексте в нижнем регистре"""
+    lower = text.lower()
+    return {label for label, words in KEYWORD_TABLES.items() if any(word in lower for word in words)}
+
+
+QUERIES = [
+    "Что такое мозгоритм?",
+    "Урок 5 - домашнее задание",
+    "lesson 12 notes",
+    "Покажи похожие примеры",
+    "Объясни, пожалуйста, связанные техники",
+    "Как обработать возражение о цене?",
+    "Не могу зайти на платформу, не работает вход",
+    "Сколько стоит курс и какой тариф?",
+    "Привет! 👋",
+    "hi there",
+    "This is unrelated text",
+    "",
+    "В чем смысл урока",
+    "ЦЕНА",
+    "урок5",
+    "shipping",  # "hi" внутри слова - подстрочная семантика сохраняется
+    "Возврат денег за оплату 💸",
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_route_matches_legacy_route_query(query):
+    assert analyze_query(query).route == legacy_route_query(query)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_labels_match_legacy_substring_checks(query):
+    assert set(analyze_query(query).labels) == legacy_labels(query)
+
+
+def test_support_and_fallback_flags():
+    technical = analyze_query("Не открывается урок, технические проблемы")
+    assert technical.is_technical_question and technical.is_support_question
+    assert not technical.is_payment_question
+
+    payment = analyze_query("Как оплатить?")
+    assert payment.is_payment_question and payment.is_support_question
+
+    assert analyze_query("Здравствуйте").is_greeting
+    assert analyze_query("Сколько это?").is_price_question
+    assert not analyze_query("Расскажи про мозгоритмы").is_support_question
+
+
+def test_automaton_overlapping_keywords():
+    automaton = KeywordAutomaton({"a": ["he", "she", "hers"], "b": ["his"], "c": ["ers"]})
+    assert automaton.find_labels("ushers") == {"a", "c"}
+    assert automaton.find_labels("this") == {"b"}
+    assert automaton.find_labels("nothing") == frozenset()
+
+
+def test_automaton_keyword_is_suffix_of_another():
+    automaton = KeywordAutomaton({"long": ["стоимость"], "short": ["мость"]})
+    assert automaton.find_labels("стоимость") == {"long", "short"}
+    assert automaton.find_labels("мост") == frozenset()
+
+
+def test_emojis_and_cleaned_text():
+    features = analyze_query("  Привет 👋 мир 🌍 ")
+    assert features.has_emojis
+    assert features.cleaned == remove_emojis("  Привет 👋 мир 🌍 ")
+    assert "👋" not in features.cleaned and "🌍" not in features.cleaned
+    assert not analyze_query("без эмодзи").has_emojis
+
+
+def test_analyze_query_is_cached():
+    assert analyze_query("одинаковый запрос") is analyze_query("одинаковый запрос")
+
+
+def test_table_labels_are_known():
+    assert set(KEYWORD_TABLES) == {ROUTE_SEMANTIC, ROUTE_GRAPH, SUPPORT_TECHNICAL, SUPPORT_PAYMENT, GREETING, PRICE}
@@ -0,0 +1,67 @@
+"""reciprocal_rank_fusion: формула RRF, веса, дедупликация по content"""
+
+import pytest
+
+from bot.services.rank_fusion import content_key, reciprocal_rank_fusion
+
+
+def doc(text, score=0.0, **fields):
+    return {"content": text, "score": score, **fields}
+
+
+def test_rrf_scores_and_order():
+    vector = [doc("A", 0.9), doc("B", 0.8), doc("C", 0.7)]
+    lexical = [doc("C", 12.0), doc("A", 8.0), doc("D", 3.0)]
+    fused = reciprocal_rank_fusion({"vector": vector, "lexical": lexical}, k=60)
+
+    scores = {entry["content"]: entry["rrf_score"] for entry in fused}
+    assert scores["A"] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores["C"] == pytest.approx(1 / 63 + 1 / 61)
+    assert scores["B"] == pytest.approx(1 / 62)
+    assert scores["D"] == pytest.approx(1 / 63)
+    assert [entry["content"] for entry in fused] == ["A", "C", "B", "D"]
+
+
+def test_ranks_scores_and_relevance():
+    fused = reciprocal_rank_fusion({"vector": [doc("A", 0.9)], "lexical": [doc("A", 5.0), doc("B", 1.0)]}, k=60)
+    top = fused[0]
+    assert top["ranks"] == {"vector": 1, "lexical": 1}
+    assert top["scores"] == {"vector": 0.9, "lexical": 5.0}
+    # Первое место во всех списках - максимальная релевантность
+    assert top["relevance"] == pytest.approx(1.0)
+    assert 0.0 < fused[1]["relevance"] < 1.0
+
+
+def test_weights():
+    vector = [doc("A"), doc("B")]
+    lexical = [doc("B"), doc("A")]
+    fused = reciprocal_rank_fusion({"vector": vector, "lexical": lexical}, k=60, weights={"lexical": 2.0})
+    assert fused[0]["content"] == "B"
+    assert fused[0]["rrf_score"] == pytest.approx(1 / 62 + 2.0 / 61)
+
+
+def test_duplicates_within_list_and_empty_content_are_skipped():
+    fused = reciprocal_rank_fusion({"vector": [doc("A"), doc("  A  "), doc(""), doc("B")]}, k=60)
+    assert [entry["content"] for entry in fused] == ["A", "B"]
+    # Дубликат не сдвигает ранг следующего документа
+    assert fused[1]["ranks"] == {"vector": 2}
+
+
+def test_first_occurrence_fields_are_kept():
+    fused = reciprocal_rank_fusion({
+        "vector": [doc("A", 0.9, id=1, entity_type="lesson")],
+        "lexical": [doc("A", 4.0, id="kb-1", entity_type="faq")]
+    })
+    assert fused[0]["id"] == 1
+    assert fused[0]["entity_type"] == "lesson"
+
+
+def test_content_key_uses_prefix():
+    long_text = "x" * 300
+    assert content_key({"content": long_text}) == "x" * 200
+    assert content_key({"content": None}) == ""
+
+
+def test_empty_input():
+    assert reciprocal_rank_fusion({}) == []
+    assert reciprocal_rank_fusion({"vector": []}) == []
@@ -0,0 +1,131 @@
+"""SingleFlight / wait_shared: общий результат, ошибки, отмена ожидающих"""
+
+import asyncio
+
+import pytest
+
+from bot.services.single_flight import SingleFlight, fingerprint, normalize_query, wait_shared
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results == ["result"] * 5
+    assert flight.get_stats() == {"inflight": 0, "leaders": 1, "shared": 4, "shared_percent": 80.0}
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flight.do("a", lambda: work(1)), flight.do("b", lambda: work(2)))
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_error_is_shared_and_not_cached():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do("k", failing), flight.do("k", failing), return_exceptions=True)
+        # После завершения следующий вызов выполняет работу заново
+        with pytest.raises(ValueError):
+            await flight.do("k", failing)
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert calls == 2
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_cancelled_follower_does_not_cancel_work():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        leader = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        return await leader, follower
+
+    result, follower = asyncio.run(scenario())
+    assert result == "done"
+    assert follower.cancelled()
+
+
+def test_last_cancelled_waiter_cancels_work():
+    async def scenario():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.do("k", work)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        return flight
+
+    flight = asyncio.run(scenario())
+    # Отменённая работа убрана из in-flight - новый вызов запустит её заново
+    assert flight.get_stats()["inflight"] == 0
+
+
+def test_wait_shared_on_abandon():
+    async def scenario():
+        abandoned = []
+        task = asyncio.ensure_future(asyncio.sleep(10))
+        waiter = asyncio.create_task(wait_shared(task, lambda: abandoned.append(True)))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+        return abandoned, task
+
+    abandoned, task = asyncio.run(scenario())
+    assert abandoned == [True]
+    assert task.cancelled()
+
+
+def test_normalize_query_and_fingerprint():
+    assert normalize_query("  Что   такое МОЗГОРИТМ?! ") == "что такое мозгоритм"
+    assert fingerprint("a", [1, 2]) == fingerprint("a", [1, 2])
+    assert fingerprint("a", [1, 2]) != fingerprint("a", [2, 1])
@@ -0,0 +1,93 @@
+"""TelegramStreamWriter: финальная правка с Markdown и fallback на простой текст"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telebot")
+
+from bot.handlers.stream_sender import TelegramStreamWriter  # noqa: E402
+
+PARSE_ERROR = "Error code: 400. Description: Bad Request: can't parse entities: Can't find end of the entity"
+NOT_MODIFIED = "Error code: 400. Description: Bad Request: message is not modified"
+
+
+class FakeBot:
+    """Telegram Bot API: Markdown с непарным * отклоняется, как настоящим Telegram"""
+
+    def __init__(self):
+        self.calls = []
+        self.texts = {}
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        self._check(text, parse_mode)
+        message_id = len(self.texts) + 1
+        self.texts[message_id] = text
+        self.calls.append(("send", text, parse_mode))
+        return SimpleNamespace(message_id=message_id)
+
+    def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        self._check(text, parse_mode)
+        if self.texts.get(message_id) == text and parse_mode is None:
+            raise Exception(NOT_MODIFIED)
+        self.texts[message_id] = text
+        self.calls.append(("edit", text, parse_mode))
+
+    def delete_message(self, chat_id, message_id):
+        self.texts.pop(message_id, None)
+
+    @staticmethod
+    def _check(text, parse_mode):
+        if parse_mode == "Markdown" and (text.count("*") % 2 or text.count("_") % 2):
+            raise Exception(PARSE_ERROR)
+
+
+def split(text, max_length):
+    return [text[i:i + max_length] for i in range(0, len(text), max_length)] or [""]
+
+
+def run(writer, updates, final):
+    async def scenario():
+        for text in updates:
+            await writer.update(text)
+        await writer.finalize(final, parse_mode="Markdown")
+    asyncio.run(scenario())
+
+
+def make_writer(bot):
+    return TelegramStreamWriter(bot, chat_id=1, split_fn=split, edit_interval=0, min_chars=1)
+
+
+def test_unbalanced_markdown_falls_back_to_plain_text():
+    bot = FakeBot()
+    writer = make_writer(bot)
+    run(writer, ["Ответ *важн"], "Ответ *важно")
+
+    assert bot.texts == {1: "Ответ *важно"}
+    assert bot.calls[-1] == ("edit", "Ответ *важно", None)
+    assert writer._modes == [None]
+
+
+def test_frozen_part_is_rerendered_with_markdown():
+    bot = FakeBot()
+    writer = make_writer(bot)
+    run(writer, ["Ответ *важно*"], "Ответ *важно*")
+
+    assert bot.calls == [("send", "Ответ *важно*", None), ("edit", "Ответ *важно*", "Markdown")]
+    assert writer._modes == ["Markdown"]
+
+
+def test_not_modified_is_success():
+    bot = FakeBot()
+    writer = make_writer(bot)
+    run(writer, ["Ответ_"], "Ответ_")
+
+    assert writer._shown == ["Ответ_"]
+    assert writer._modes == [None]
+
+
+def test_finalize_without_updates_sends_message():
+    bot = FakeBot()
+    run(make_writer(bot), [], "Короткий *ответ*")
+    assert bot.calls == [("send", "Короткий *ответ*", "Markdown")]
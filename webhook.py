@@ -48,6 +48,7 @@ except Exception as e:
 
 # === НАСТРОЙКИ ===
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
 WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "QxLZquGScgx1QmwsuUSfJU6HpyTUJoHf2XD4QisrjCk")
 
 if not TELEGRAM_BOT_TOKEN:
@@ -58,6 +59,10 @@ print(f"✅ Токен бота получен: {TELEGRAM_BOT_TOKEN[:20]}...")
 # === СОЗДАНИЕ СИНХРОННОГО БОТА (НЕ ASYNC!) ===
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
 
+# Адрес Bot API (локальная заглушка при TELEGRAM_API_URL)
+telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+telebot.apihelper.FILE_URL = TELEGRAM_API_URL + "/file/bot{0}/{1}"
+
 # === ЛОГИРОВАНИЕ ===
 import logging.handlers
 
@@ -119,6 +124,17 @@ except Exception as e:
     voice_service = None
     logger.error(f"❌ Ошибка инициализации Voice service: {e}")
 
+# === STREAMING ОТВЕТОВ ===
+try:
+    from bot.config import STREAMING_ENABLED
+    from bot.handlers.stream_sender import TelegramStreamWriter
+    from bot.handlers.message_handler import MessageHandler
+    if STREAMING_ENABLED:
+        logger.info("📡 Streaming ответов включен (STREAMING_ENABLED=true)")
+except ImportError as e:
+    STREAMING_ENABLED = False
+    logger.warning(f"⚠️ Streaming ответов не доступен: {e}")
+
 # === ФУНКЦИЯ ДЛЯ ГУМАНИЗАЦИИ ОТВЕТОВ ===
 async def send_human_like_response(chat_id: int, text: str, user_name: str = None, business_connection_id: str = None):
     """
@@ -225,7 +241,7 @@ def send_business_message(chat_id, text, business_connection_id):
     Отправка сообщения через Business API используя прямой HTTP запрос
     (pyTelegramBotAPI не поддерживает business_connection_id)
     """
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
     data = {
         "chat_id": chat_id,
         "text": text,
@@ -559,29 +575,26 @@ async def process_webhook(request: Request):
                 
                 # Флаг для определения AI ответа (для гуманизации)
                 is_ai_response = False
+                stream_writer = None
 
                 # Если есть текст - обрабатываем через AI
                 if text and AI_ENABLED:
                     try:
                         session_id = f"user_{user_id}"
                         # Создаем пользователя в Zep если нужно
-                        # Проверяем актуальность инструкций перед генерацией ответа
-                        try:
-                            fresh_instruction = agent._load_instruction()
-                            if fresh_instruction.get('last_updated') != agent.instruction.get('last_updated'):
-                                logger.info(f"🔄 Обнаружены обновленные инструкции, перезагружаем...")
-                                agent.instruction = fresh_instruction
-                                logger.info(f"✅ Инструкции обновлены с {agent.instruction.get('last_updated')}")
-                        except Exception as refresh_error:
-                            logger.warning(f"⚠️ Ошибка проверки актуальности инструкций: {refresh_error}")
-
+                        # Актуальность инструкций проверяет InstructionStore (os.stat при изменении файла)
                         if agent.zep_client:
                             await agent.ensure_user_exists(f"user_{user_id}", {
                                 'first_name': user_name,
                                 'email': f'{user_id}@telegram.user'
                             })
                             await agent.ensure_session_exists(session_id, f"user_{user_id}")
-                        response = await agent.generate_response(text, session_id, user_name)
+                        if STREAMING_ENABLED:
+                            # Streaming: ответ показывается по мере генерации, без имитации печати
+                            stream_writer = TelegramStreamWriter(bot, chat_id, split_fn=MessageHandler._split_long_message)
+                            response = await agent.generate_response(text, session_id, user_name, on_delta=stream_writer.update)
+                        else:
+                            response = await agent.generate_response(text, session_id, user_name)
                         is_ai_response = True  # Успешный AI ответ - применяем гуманизацию
 
                     except Exception as ai_error:
@@ -598,7 +611,11 @@ async def process_webhook(request: Request):
 
                 # Отправляем ответ (с проверкой на None)
                 if response:
-                    if is_ai_response:
+                    if stream_writer is not None and (is_ai_response or stream_writer.started):
+                        # Streaming ответ - финализируем уже показанное сообщение
+                        await stream_writer.finalize(response, parse_mode='Markdown' if is_ai_response else None)
+                        logger.info(f"✅ Ответ отправлен пользователю {user_name or chat_id} (streaming)")
+                    elif is_ai_response:
                         # AI ответ - с гуманизацией (typing indicator + задержка)
                         await send_human_like_response(chat_id, response, user_name)
                     else:
@@ -717,16 +734,7 @@ async def process_webhook(request: Request):
 
                         # === ОБРАБОТКА ТЕКСТОВЫХ BUSINESS СООБЩЕНИЙ (включая транскрибированные) ===
                         if text:  # Обрабатываем текст (в том числе транскрибированный из голоса)
-                            # Проверяем актуальность инструкций перед генерацией ответа
-                            try:
-                                fresh_instruction = agent._load_instruction()
-                                if fresh_instruction.get('last_updated') != agent.instruction.get('last_updated'):
-                                    logger.info(f"🔄 Business: Обнаружены обновленные инструкции, перезагружаем...")
-                                    agent.instruction = fresh_instruction
-                                    logger.info(f"✅ Business: Инструкции обновлены с {agent.instruction.get('last_updated')}")
-                            except Exception as refresh_error:
-                                logger.warning(f"⚠️ Business: Ошибка проверки актуальности инструкций: {refresh_error}")
-
+                            # Актуальность инструкций проверяет InstructionStore (os.stat при изменении файла)
                             response = await agent.generate_response(text, session_id, user_name)
                             is_ai_response = True  # Успешный AI ответ - применяем гуманизацию
                             logger.info(f"✅ AI ответ сгенерирован: {response[:100]}...")
@@ -962,7 +970,7 @@ async def test_openai():
         
         # Тестируем подключение к OpenAI API
         try:
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
+            client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=os.getenv("OPENAI_BASE_URL") or None)
             
             # Простой тест API - список моделей
             models = client.models.list()
@@ -1007,7 +1015,7 @@ async def webhook_info():
         import requests
         
         # Получаем информацию о webhook
-        webhook_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
+        webhook_url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getWebhookInfo"
         response = requests.get(webhook_url)
         webhook_data = response.json()
         
@@ -1053,9 +1061,9 @@ async def reload_instructions():
     """Перезагрузить инструкции из файла"""
     try:
         if AI_ENABLED and agent:
-            old_updated = agent.instruction.get('last_updated', 'неизвестно')
-            agent.reload_instruction()
-            new_updated = agent.instruction.get('last_updated', 'неизвестно')
+            old, new = agent.reload_instruction()
+            old_updated = old.last_updated
+            new_updated = new.last_updated
             
             changed = old_updated != new_updated
             
@@ -1100,19 +1108,10 @@ async def update_instructions(request: Request):
         # Добавляем время обновления
         instruction_data["last_updated"] = datetime.now().isoformat()
         
-        # Сохраняем в файл
-        import json
-        from bot.config import INSTRUCTION_FILE
-        with open(INSTRUCTION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(instruction_data, f, ensure_ascii=False, indent=2)
-        
-        # Принудительно перезагружаем в агенте
-        old_updated = agent.instruction.get('last_updated', 'неизвестно')
-        
-        # Принудительно очищаем кеш и перезагружаем
-        agent.instruction = agent._load_instruction()
-        
-        new_updated = agent.instruction.get('last_updated', 'неизвестно')
+        # Сохраняем в файл (атомарно) и сразу применяем через InstructionStore
+        old, new = agent.instruction_store.write(instruction_data)
+        old_updated = old.last_updated
+        new_updated = new.last_updated
         
         logger.info(f"✅ Инструкции обновлены через API: {old_updated} -> {new_updated}")
         
@@ -1232,8 +1231,9 @@ async def clear_zep_memory():
                 "error": f"Ошибка очистки: {clear_error}"
             }
         
-        # Также очистим локальную память в агенте
-        agent.user_sessions = {}
+        # Также очистим локальную память и кэш памяти Zep в агенте
+        agent.local_sessions.clear()
+        agent.session_memory.invalidate()
         
         logger.info(f"✅ Память очищена: {cleared_count} сессий")
         return {
@@ -1307,6 +1307,9 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     """Остановка сервера"""
+    # Дописываем логи / Zep из очереди пост-обработки
+    if AI_ENABLED and agent:
+        await agent.post_processor.drain()
     logger.info("🛑 Остановка ignatova-stroinost-bot Bot Webhook Server")
     print("🛑 Сервер остановлен")
 